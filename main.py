@@ -1,35 +1,94 @@
+from ui.startup_profile import startup_profile, DEFAULT_BUDGET_MS
 import tkinter as tk
 import sys
 import os
-from ui.main_window import DNSAnalyzerApp
+import argparse
+
+
+# 无控制台时启动报告的默认文件名（写在程序所在目录）
+STARTUP_REPORT_FILE = 'startup_report.txt'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DNS 解析分析工具")
+    parser.add_argument('--startup-report', nargs='?', const='-', default=None, metavar='PATH',
+                        help="输出启动耗时报告（阶段耗时和最慢的导入），首次显示窗口后退出；"
+                             "指定PATH时写入文件，无控制台时写入程序目录下的" + STARTUP_REPORT_FILE)
+    parser.add_argument('--startup-budget', type=float, default=DEFAULT_BUDGET_MS,
+                        help="首次显示窗口的时间预算（毫秒），与--startup-report一起使用，超出时退出码为1")
+    # 忽略无法识别的参数（如打包环境附加的参数）
+    return parser.parse_known_args()[0]
+
+
+def write_report(text, path='-'):
+    """输出启动报告
+
+    窗口模式的打包程序（PyInstaller的console=False）中sys.stdout为None，此时写入程序所在目录的文件
+
+    :param text: 报告内容
+    :param path: 报告文件路径，-表示标准输出
+    """
+    if path == '-':
+        if sys.stdout is not None:
+            print(text, flush=True)
+            return
+        base_dir = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else os.path.abspath(__file__))
+        path = os.path.join(base_dir, STARTUP_REPORT_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text + '\n')
 
 
 def main():
+    args = parse_args()
+    exit_code = 0
+    if args.startup_report is not None:
+        startup_profile.trace_imports()
+
     try:
+        # 界面模块在计时开始后才导入
+        from ui.main_window import DNSAnalyzerApp
+        startup_profile.mark('import_ui')
+
         # 创建主窗口
         root = tk.Tk()
-        
+        startup_profile.mark('create_tk')
+
         # 设置窗口图标
         current_dir = os.path.dirname(os.path.abspath(__file__))
         icon_path = os.path.join(current_dir, "favicon_logosc", "favicon.ico")
         if os.path.exists(icon_path):
             root.iconbitmap(icon_path)
-        
+
         # 设置应用程序
         app = DNSAnalyzerApp(root)
+        startup_profile.mark('build_ui')
+
+        if args.startup_report is not None:
+            # 处理挂起的显示和绘制事件，窗口第一次显示后输出报告并退出
+            root.update()
+            startup_profile.mark('first_window')
+            startup_profile.stop_tracing()
+            write_report(startup_profile.report(args.startup_budget), args.startup_report)
+            exit_code = 0 if startup_profile.within_budget(args.startup_budget) else 1
+            app.ui_queue.stop()
+            root.destroy()
+            return
 
         # 启动主循环
         root.mainloop()
-        
+
     except Exception as e:
-        print(f"程序运行出错: {e}")
+        message = f"程序运行出错: {e}"
+        if args.startup_report is not None:
+            # 启动报告模式下把错误写到报告的位置，便于无控制台的打包程序排查
+            write_report(message, args.startup_report)
+        elif sys.stdout is not None:
+            print(message)
+        exit_code = 1
     finally:
-        # 确保程序完全退出
-        try:
-            sys.exit(0)
-        except:
-            os._exit(0)
+        # 后台任务在关闭窗口时已取消，残留的工作线程均为守护线程，不会阻止正常退出
+        sys.exit(exit_code)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
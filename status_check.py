@@ -34,7 +34,7 @@ print("\n=== 功能测试 ===")
 # 测试NextTrace集成
 try:
     nexttrace = NextTraceIntegration()
-    available = nexttrace.is_nexttrace_available()
+    available = nexttrace.is_available()
     print(f"✓ NextTrace可用性检查: {'可用' if available else '不可用'}")
 except Exception as e:
     print(f"✗ NextTrace测试失败: {e}")
@@ -0,0 +1,294 @@
+# -- coding: utf-8 --
+"""测试用的本地DNS桩服务器
+
+对A查询返回固定地址，不依赖网络：
+    - StubDNSServer：UDP，可设置响应延迟，子类覆盖_handle模拟不同的服务器行为
+    - StubStreamDNSServer：TCP/DoT（报文前带2字节长度）
+    - StubDoHServer：DoH（HTTP/1.1长连接，RFC 8484 POST）
+    - StubRecursiveDNSServer：模拟递归服务器的UDP缓存行为（缓存未命中时模拟上游延迟）
+服务器统计接受的连接数和同时打开的连接数峰值，用于验证客户端的连接复用和连接池上限
+"""
+
+import os
+import ssl
+import time
+import socket
+import struct
+import threading
+import http.server
+from typing import Optional
+
+import dns.inet
+import dns.message
+import dns.rdatatype
+import dns.rrset
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def server_ssl_context() -> ssl.SSLContext:
+    """加载tests/data中localhost自签名证书的服务端SSL上下文"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(os.path.join(DATA_DIR, 'localhost-cert.pem'), os.path.join(DATA_DIR, 'localhost-key.pem'))
+    return context
+
+
+def client_ssl_context() -> ssl.SSLContext:
+    """信任测试证书的客户端SSL上下文"""
+    return ssl.create_default_context(cafile=os.path.join(DATA_DIR, 'localhost-cert.pem'))
+
+
+def build_stub_response(data: bytes, answer: str = '192.0.2.1', ttl: int = 60) -> Optional[bytes]:
+    """桩服务器的应答：A查询返回固定地址，其他类型返回空应答，无法解析的报文返回None"""
+    try:
+        query = dns.message.from_wire(data)
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        if question.rdtype == dns.rdatatype.A:
+            response.answer.append(dns.rrset.from_text(question.name, ttl, 'IN', 'A', answer))
+        return response.to_wire()
+    except Exception:
+        return None
+
+
+class StubDNSServer:
+    """本地DNS桩服务器，对所有A查询返回固定地址，用于不依赖网络的基准测试"""
+
+    def __init__(self, address: str = '127.0.0.1', port: int = 0, answer: str = '192.0.2.1', delay: float = 0):
+        """初始化桩服务器
+
+        :param address: 监听地址
+        :param port: 监听端口，0表示自动分配
+        :param answer: A记录应答地址
+        :param delay: 每个响应的人为延迟（秒）
+        """
+        self.sock = socket.socket(dns.inet.af_for_address(address), socket.SOCK_DGRAM)
+        self.sock.bind((address, port))
+        self.address, self.port = self.sock.getsockname()[:2]
+        self.answer = answer
+        self.delay = delay
+        self.running = False
+        self.thread = None
+
+    def _serve(self):
+        self.sock.settimeout(0.2)
+        while self.running:
+            try:
+                data, peer = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            wire, delay = self._handle(data)
+            if wire is None:
+                continue
+            if delay:
+                threading.Timer(delay, self.sock.sendto, (wire, peer)).start()
+            else:
+                self.sock.sendto(wire, peer)
+
+    def _handle(self, data: bytes):
+        """生成应答报文及发送前的延迟（秒），子类可覆盖以模拟不同的服务器行为"""
+        return build_stub_response(data, self.answer), self.delay
+
+    def start(self) -> 'StubDNSServer':
+        """在后台线程中启动服务"""
+        self.running = True
+        self.thread = threading.Thread(target=self._serve, daemon=True, name="StubDNSServer")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+        self.sock.close()
+
+
+class ConnectionCounter:
+    """连接计数：累计接受数、当前打开数和打开数峰值"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.active = 0
+        self.peak = 0
+
+    def opened(self):
+        with self.lock:
+            self.accepted += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def closed(self):
+        with self.lock:
+            self.active -= 1
+
+
+class StubStreamDNSServer(ConnectionCounter):
+    """本地TCP/DoT桩服务器"""
+
+    def __init__(self, address: str = '127.0.0.1', port: int = 0, answer: str = '192.0.2.1',
+                 ssl_context: Optional[ssl.SSLContext] = None, delay: float = 0):
+        """
+        :param ssl_context: 服务端SSL上下文（已加载证书），提供时作为DoT服务器
+        :param delay: 每个响应的人为延迟（秒）
+        """
+        super().__init__()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((address, port))
+        self.listener.listen(16)
+        self.address, self.port = self.listener.getsockname()[:2]
+        self.answer = answer
+        self.ssl_context = ssl_context
+        self.delay = delay
+        self.connections = set()
+        self.running = False
+
+    def _handle(self, conn):
+        self.opened()
+        try:
+            if self.ssl_context:
+                conn = self.ssl_context.wrap_socket(conn, server_side=True)
+            self.connections.add(conn)
+            while self.running:
+                header = conn.recv(2)
+                if len(header) < 2:
+                    return
+                length = struct.unpack('!H', header)[0]
+                data = b''
+                while len(data) < length:
+                    chunk = conn.recv(length - len(data))
+                    if not chunk:
+                        return
+                    data += chunk
+                if self.delay:
+                    time.sleep(self.delay)
+                wire = build_stub_response(data, self.answer)
+                if wire:
+                    conn.sendall(struct.pack('!H', len(wire)) + wire)
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            self.connections.discard(conn)
+            conn.close()
+            self.closed()
+
+    def _serve(self):
+        self.listener.settimeout(0.2)
+        while self.running:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            conn.settimeout(None)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def drop_connections(self):
+        """关闭所有已建立的连接，模拟服务器回收空闲长连接"""
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self) -> 'StubStreamDNSServer':
+        self.running = True
+        threading.Thread(target=self._serve, daemon=True, name="StubStreamDNSServer").start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.drop_connections()
+        self.listener.close()
+
+
+class StubDoHServer(ConnectionCounter):
+    """本地DoH桩服务器（HTTP/1.1长连接）"""
+
+    def __init__(self, ssl_context: ssl.SSLContext, address: str = '127.0.0.1', port: int = 0,
+                 answer: str = '192.0.2.1', close_connections: bool = False):
+        """
+        :param close_connections: 每个响应都带Connection: close，要求客户端关闭连接
+        """
+        super().__init__()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                server.opened()
+
+            def finish(self):
+                try:
+                    super().finish()
+                finally:
+                    server.closed()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                wire = build_stub_response(body, answer) or b''
+                self.send_response(200 if wire else 400)
+                self.send_header('Content-Type', 'application/dns-message')
+                self.send_header('Content-Length', str(len(wire)))
+                if close_connections:
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.write(wire)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((address, port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.socket = ssl_context.wrap_socket(self.httpd.socket, server_side=True)
+        self.address, self.port = self.httpd.server_address[:2]
+
+    def start(self) -> 'StubDoHServer':
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name="StubDoHServer").start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StubRecursiveDNSServer(StubDNSServer):
+    """模拟递归服务器的本地桩服务器：名称首次查询或缓存过期时模拟上游查询延迟，缓存期内立即应答
+
+    对所有名称的A查询都返回固定地址（相当于泛解析），应答TTL为缓存剩余时间
+    """
+
+    def __init__(self, address: str = '127.0.0.1', port: int = 0, answer: str = '192.0.2.1',
+                 upstream_delay: float = 0.05, ttl: int = 30):
+        """
+        :param upstream_delay: 缓存未命中时的模拟上游延迟（秒）
+        :param ttl: 缓存时间（秒）
+        """
+        super().__init__(address, port, answer)
+        self.upstream_delay = upstream_delay
+        self.ttl = ttl
+        self.cache = {}     # 名称 -> 过期时间
+        self.hits = 0
+        self.misses = 0
+
+    def _handle(self, data: bytes):
+        try:
+            name = dns.message.from_wire(data).question[0].name.to_text().lower()
+        except Exception:
+            return None, 0
+        now = time.monotonic()
+        expires = self.cache.get(name)
+        if expires is not None and expires > now:
+            self.hits += 1
+            return build_stub_response(data, self.answer, max(0, int(expires - now))), 0
+        self.misses += 1
+        self.cache[name] = now + self.ttl
+        return build_stub_response(data, self.answer, self.ttl), self.upstream_delay
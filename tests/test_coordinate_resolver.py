@@ -0,0 +1,41 @@
+# -- coding: utf-8 --
+"""坐标解析测试：已保存的兜底坐标不应阻止之后的地名索引匹配"""
+
+import threading
+
+from ui.coordinate_resolver import CoordinateResolver, CITY_CENTROIDS
+
+
+class FakeUtils:
+    """只提供坐标解析用到的geoip缓存，不访问网络"""
+
+    def __init__(self, cache=None):
+        self.geoip_cache = cache or {}
+        self.lock = threading.Lock()
+
+    def get_ip_location(self, ip):
+        return self.geoip_cache.get(ip)
+
+
+def test_saved_fallback_retries_gazetteer():
+    utils = FakeUtils({'203.0.113.9': {'country': '', 'region': '', 'city': ''}})
+    resolver = CoordinateResolver(utils)
+
+    coords, source = resolver._resolve('203.0.113.9')
+    assert source == 'fallback'
+    assert utils.geoip_cache['203.0.113.9']['coords_source'] == 'fallback'
+
+    # 之后的调用带有可匹配的位置信息时使用地名索引，并覆盖保存的兜底坐标
+    coords, source = resolver._resolve('203.0.113.9', '中国 上海')
+    assert source == 'gazetteer' and coords == CITY_CENTROIDS['上海']
+    assert utils.geoip_cache['203.0.113.9']['coords_source'] == 'gazetteer'
+    assert resolver._resolve('203.0.113.9') == (CITY_CENTROIDS['上海'], 'gazetteer')
+
+
+def test_local_fallback_retries_gazetteer():
+    resolver = CoordinateResolver(FakeUtils())
+
+    assert resolver._resolve('198.51.100.7', lookup=True)[1] == 'fallback'
+    coords, source = resolver._resolve('198.51.100.7', '北京')
+    assert source == 'gazetteer' and coords == CITY_CENTROIDS['北京']
+    assert resolver.cache['198.51.100.7'] == (CITY_CENTROIDS['北京'], 'gazetteer')
@@ -0,0 +1,79 @@
+# -- coding: utf-8 --
+"""冷/热缓存测量测试：对本地模拟递归服务器（缓存未命中时延迟50ms）测量"""
+
+import time
+
+import pytest
+
+from ui.dns_cache_probe import CacheProbe
+from tests.dns_stubs import StubRecursiveDNSServer
+
+UPSTREAM_DELAY = 0.05
+
+
+@pytest.fixture
+def stub():
+    server = StubRecursiveDNSServer(upstream_delay=UPSTREAM_DELAY, ttl=1).start()
+    yield server
+    server.stop()
+
+
+def make_probe(stub):
+    return CacheProbe(stub.address, port=stub.port, timeout=2)
+
+
+def test_measure_separates_cold_and_warm(stub):
+    samples = []
+    summary = make_probe(stub).measure('example.com', iterations=5,
+                                       on_sample=lambda kind, name, result: samples.append((kind, name)))
+
+    assert summary['cold'].count == 5 and summary['warm'].count == 5
+    assert summary['cold_p50'] >= UPSTREAM_DELAY * 1000 * 0.9
+    assert summary['warm_p50'] < UPSTREAM_DELAY * 1000 / 2
+    assert summary['cache_miss_ms'] > UPSTREAM_DELAY * 1000 / 2
+    # 预热1次和5个随机标签未命中，5个热样本命中
+    assert stub.misses == 6 and stub.hits == 5
+    cold_names = [name for kind, name in samples if kind == 'cold']
+    assert len(set(cold_names)) == 5 and all(name.endswith('.example.com') for name in cold_names)
+    assert [name for kind, name in samples if kind == 'warm'] == ['example.com'] * 5
+
+
+def test_measure_stops_when_cancelled(stub):
+    samples = []
+    summary = make_probe(stub).measure('example.com', iterations=10,
+                                       on_sample=lambda kind, name, result: samples.append(kind),
+                                       should_continue=lambda: len(samples) < 2)
+
+    assert samples == ['cold', 'warm']
+    assert summary['cold'].count == 1 and summary['warm'].count == 1
+
+
+def test_measure_ttl_waits_for_expiry(stub):
+    summary = make_probe(stub).measure_ttl('example.com', iterations=1, max_wait=5)
+
+    assert summary['reason'] is None
+    assert summary['cold'].count == 1 and summary['warm'].count == 1
+    assert summary['cold_p50'] >= UPSTREAM_DELAY * 1000 * 0.9
+    assert summary['warm_p50'] < UPSTREAM_DELAY * 1000 / 2
+    # 首次查询和过期后的查询未命中
+    assert stub.misses == 2 and stub.hits == 1
+
+
+def test_measure_ttl_cancelled_while_waiting(stub):
+    start = time.monotonic()
+    summary = make_probe(stub).measure_ttl('example.com', iterations=3, max_wait=5,
+                                           should_continue=lambda: time.monotonic() - start < 0.2)
+
+    assert summary['reason'] == "已取消"
+    assert summary['cold'].count == 0
+    assert time.monotonic() - start < 1
+
+
+def test_measure_ttl_ttl_longer_than_max_wait():
+    server = StubRecursiveDNSServer(upstream_delay=0, ttl=60).start()
+    try:
+        summary = make_probe(server).measure_ttl('example.com', iterations=2, max_wait=5)
+    finally:
+        server.stop()
+    assert summary['cold'].count == 0
+    assert '超过最长等待时间' in summary['reason']
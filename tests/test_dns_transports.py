@@ -0,0 +1,159 @@
+# -- coding: utf-8 --
+"""TCP/DoT/DoH传输测试：长连接复用、握手统计、连接池上限和失效连接的重连
+
+使用tests/dns_stubs.py中的本地桩服务器和tests/data中的localhost自签名证书
+"""
+
+import time
+import threading
+
+import pytest
+
+from ui.dns_transports import TCPTransport, TLSTransport, HTTPSTransport, TransportPool
+from tests.dns_stubs import StubStreamDNSServer, StubDoHServer, server_ssl_context, client_ssl_context
+
+
+def start_server(kind, **kwargs):
+    if kind == 'TCP':
+        return StubStreamDNSServer(**kwargs).start()
+    if kind == 'DoT':
+        return StubStreamDNSServer(ssl_context=server_ssl_context(), **kwargs).start()
+    return StubDoHServer(server_ssl_context(), **kwargs).start()
+
+
+def make_transport(kind, server, **kwargs):
+    if kind == 'TCP':
+        return TCPTransport(server.address, port=server.port, **kwargs)
+    if kind == 'DoT':
+        return TLSTransport(server.address, port=server.port, server_hostname='localhost',
+                            ssl_context=client_ssl_context(), **kwargs)
+    return HTTPSTransport(server.address, url=f"https://localhost:{server.port}/dns-query",
+                          ssl_context=client_ssl_context(), **kwargs)
+
+
+@pytest.fixture(params=['TCP', 'DoT', 'DoH'])
+def kind(request):
+    return request.param
+
+
+@pytest.fixture
+def server(kind):
+    server = start_server(kind)
+    yield server
+    server.stop()
+
+
+def test_handshake_only_on_first_query(kind, server):
+    transport = make_transport(kind, server)
+    first = transport.query('example.com')
+    second = transport.query('example.com')
+    transport.close()
+
+    assert first['success'] and first['answers'] == ['192.0.2.1']
+    assert first['handshake_ms'] > 0 and not first['reused']
+    assert second['success'] and second['handshake_ms'] == 0 and second['reused']
+    assert server.accepted == 1
+    stats = transport.stats()
+    assert stats['queries'] == 2 and stats['handshakes'] == 1
+
+
+def test_reconnect_after_close_servers(kind, server):
+    pool = TransportPool()
+    transport = make_transport(kind, server)
+    pool.transports[(kind, server.address)] = transport
+
+    assert pool.get(kind, server.address).query('example.com')['handshake_ms'] > 0
+    assert pool.get(kind, server.address).query('example.com')['reused']
+    pool.close_servers([server.address])
+    result = pool.get(kind, server.address).query('example.com')
+    pool.close_all()
+
+    assert result['success'] and result['handshake_ms'] > 0 and not result['reused']
+    assert server.accepted == 2
+
+
+def test_concurrent_queries_bounded_by_max_connections(kind):
+    if kind == 'DoH':
+        server = start_server(kind)
+    else:
+        server = start_server(kind, delay=0.1)
+    transport = make_transport(kind, server, max_connections=2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(transport.query('example.com'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    transport.close()
+    server.stop()
+
+    assert len(results) == 8 and all(r['success'] for r in results)
+    assert server.peak <= 2
+    assert transport.stats()['handshakes'] <= 2
+    assert len(transport.idle) == 0
+
+
+def test_stream_queries_overlap_across_connections():
+    server = start_server('TCP', delay=0.2)
+    transport = make_transport('TCP', server, max_connections=4)
+    threads = [threading.Thread(target=transport.query, args=('example.com',)) for _ in range(4)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    elapsed = time.perf_counter() - start
+    transport.close()
+    server.stop()
+
+    # 串行需要0.8秒，4个连接并行约0.2秒
+    assert elapsed < 0.6
+    assert server.peak == 4
+
+
+def test_close_discards_connection_in_use():
+    server = start_server('TCP', delay=0.3)
+    transport = make_transport('TCP', server)
+    thread = threading.Thread(target=transport.query, args=('example.com',))
+    thread.start()
+    time.sleep(0.1)
+    # 查询进行中关闭：使用中的连接属于旧的一代，归还时直接关闭而不放回空闲列表
+    transport.close()
+    thread.join(5)
+    assert transport.idle == []
+
+    server.delay = 0
+    result = transport.query('example.com')
+    transport.close()
+    server.stop()
+    assert result['success'] and result['handshake_ms'] > 0
+    assert server.accepted == 2
+
+
+@pytest.mark.parametrize('kind', ['TCP', 'DoT'])
+def test_retry_after_stale_reused_connection(kind, server):
+    transport = make_transport(kind, server)
+    assert transport.query('example.com')['success']
+    # 服务器回收了空闲连接，复用时失败，重连后重试一次
+    server.drop_connections()
+    time.sleep(0.05)
+    result = transport.query('example.com')
+    transport.close()
+
+    assert result['success'] and result['answers'] == ['192.0.2.1']
+    assert result['handshake_ms'] > 0 and not result['reused']
+    assert server.accepted == 2
+
+
+def test_doh_connection_close_not_reused():
+    server = start_server('DoH', close_connections=True)
+    transport = make_transport('DoH', server)
+    first = transport.query('example.com')
+    assert transport.idle == []
+    second = transport.query('example.com')
+    transport.close()
+    server.stop()
+
+    assert first['success'] and second['success']
+    assert first['handshake_ms'] > 0 and second['handshake_ms'] > 0
+    assert server.accepted == 2
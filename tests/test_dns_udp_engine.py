@@ -0,0 +1,139 @@
+# -- coding: utf-8 --
+"""流水线UDP查询引擎测试：响应匹配、超时、发送速率、取消和报文ID复用后的迟到响应"""
+
+import time
+import itertools
+
+import dns.message
+import pytest
+
+from ui.dns_udp_engine import UDPQueryEngine, DEFAULT_MAX_IN_FLIGHT, summarize
+from tests.dns_stubs import StubDNSServer, build_stub_response
+
+
+class ScriptedStub(StubDNSServer):
+    """按查询名称决定行为的桩服务器
+
+    behaviours: 名称 -> 响应延迟（秒），或'drop'（不应答）、'wrong_id'（应答ID不同）、'wrong_question'（问题段不同）
+    """
+
+    def __init__(self, behaviours=None):
+        super().__init__()
+        self.behaviours = behaviours or {}
+        self.received = []
+
+    def _handle(self, data):
+        query = dns.message.from_wire(data)
+        name = query.question[0].name.to_text().rstrip('.')
+        self.received.append(name)
+        behaviour = self.behaviours.get(name, 0)
+        if behaviour == 'drop':
+            return None, 0
+        if behaviour == 'wrong_id':
+            wire = bytearray(build_stub_response(data, self.answer))
+            wire[0:2] = ((query.id + 1) % 65536).to_bytes(2, 'big')
+            return bytes(wire), 0
+        if behaviour == 'wrong_question':
+            other = dns.message.make_query('other.example', 'A', use_edns=False)
+            other.id = query.id
+            return build_stub_response(other.to_wire(), self.answer), 0
+        return build_stub_response(data, self.answer), behaviour
+
+
+@pytest.fixture
+def stub_factory():
+    stubs = []
+
+    def start(behaviours=None):
+        stub = ScriptedStub(behaviours).start()
+        stubs.append(stub)
+        return stub
+
+    yield start
+    for stub in stubs:
+        stub.stop()
+
+
+def make_engine(stub, **kwargs):
+    return UDPQueryEngine(stub.address, stub.port, **kwargs)
+
+
+def by_domain(results):
+    return {r['domain']: r for r in results}
+
+
+def test_answers_matched(stub_factory):
+    stub = stub_factory()
+    results = make_engine(stub, verify_answers=True).run(['a.example', 'b.example'], count=20)
+
+    assert len(results) == 20
+    assert all(r['error'] is None and r['rcode'] == 0 and r['answer_count'] == 1 for r in results)
+    assert all(r['answers'] == ['192.0.2.1'] for r in results)
+    assert sorted(r['domain'] for r in results) == ['a.example'] * 10 + ['b.example'] * 10
+    assert summarize(results)['answered'] == 20
+
+
+def test_mismatched_id_or_question_not_accepted(stub_factory):
+    stub = stub_factory({'id.example': 'wrong_id', 'question.example': 'wrong_question'})
+    results = by_domain(make_engine(stub, timeout=0.2).run(['id.example', 'question.example', 'ok.example']))
+
+    assert results['id.example']['error'] == 'timeout'
+    assert results['question.example']['error'] == 'timeout'
+    assert results['ok.example']['error'] is None
+
+
+def test_timeout_expiry(stub_factory):
+    stub = stub_factory({'drop.example': 'drop'})
+    start = time.perf_counter()
+    results = make_engine(stub, timeout=0.2).run(['drop.example'], count=3)
+    elapsed = time.perf_counter() - start
+
+    assert [r['error'] for r in results] == ['timeout'] * 3
+    assert all(r['rtt_ms'] is None for r in results)
+    assert 0.2 <= elapsed < 1
+    assert summarize(results)['timeouts'] == 3
+
+
+def test_qps_pacing(stub_factory):
+    stub = stub_factory()
+    start = time.perf_counter()
+    results = make_engine(stub).run(['a.example'], count=20, qps=100)
+    elapsed = time.perf_counter() - start
+
+    # 20个查询间隔10ms，最后一个在约190ms时发出
+    assert len(results) == 20
+    assert elapsed >= 0.18
+
+
+def test_should_continue_stops_early(stub_factory):
+    stub = stub_factory()
+    results = []
+    start = time.perf_counter()
+    make_engine(stub).run(['a.example'], count=1000, qps=200, on_result=results.append,
+                          should_continue=lambda: len(results) < 5)
+
+    assert 5 <= len(results) < 20
+    assert len(stub.received) < 20
+    assert time.perf_counter() - start < 1
+
+
+def test_late_reply_to_recycled_id_ignored(stub_factory):
+    # late.example的响应在超时之后才到达，此时同一报文ID已分配给b.example
+    stub = stub_factory({'late.example': 0.3, 'b.example': 0.15})
+    engine = make_engine(stub, timeout=0.2, max_in_flight=1)
+    engine._id_source = lambda: itertools.repeat(7)
+    results = by_domain(engine.run(['late.example', 'b.example']))
+
+    assert results['late.example']['error'] == 'timeout'
+    assert results['b.example']['error'] is None
+    # 迟到的旧响应（约0.1秒时到达）不能算作b.example的响应
+    assert results['b.example']['rtt_ms'] >= 140
+
+
+def test_default_in_flight_keeps_stub_unsaturated(stub_factory):
+    stub = stub_factory()
+    engine = make_engine(stub)
+    assert engine.max_in_flight == DEFAULT_MAX_IN_FLIGHT
+    results = engine.run(['a.example'], count=2000)
+
+    assert summarize(results)['timeouts'] == 0
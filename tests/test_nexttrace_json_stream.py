@@ -0,0 +1,183 @@
+# -- coding: utf-8 --
+"""NextTrace JSON输出（-j）流式解码测试
+
+使用录制的NextTrace会话（tests/data/nexttrace_json_session.jsonl）：
+    - 通过session_replay的回放工厂按录制的分块（在键名、元素和数字中间断开）回放
+    - 通过假的nexttrace可执行文件按固定字节数输出，分块会切断多字节UTF-8字符
+    - 截断的输出和文档之后的非JSON内容
+"""
+
+import os
+import sys
+import json
+import stat
+
+import pytest
+
+from ui.nexttrace_integration import NextTraceIntegration, NextTraceJsonStream
+from ui.session_replay import SessionRecording, ReplayProcessFactory
+
+RECORDING_PATH = os.path.join(os.path.dirname(__file__), 'data', 'nexttrace_json_session.jsonl')
+
+FAKE_NEXTTRACE = """#!{python}
+import sys, time
+data = open({path!r}, 'rb').read()
+for i in range(0, len(data), {chunk}):
+    sys.stdout.buffer.write(data[i:i + {chunk}])
+    sys.stdout.buffer.flush()
+    time.sleep(0.001)
+sys.exit({returncode})
+"""
+
+
+@pytest.fixture
+def recording():
+    return SessionRecording.load(RECORDING_PATH)
+
+
+def expected_records(output):
+    """用完整解析录制文档的方式得到期望的跳数记录"""
+    document = json.loads(output[output.index('{'):])
+    return [NextTraceJsonStream.to_hop_record(attempts, index) for index, attempts in enumerate(document['Hops'])]
+
+
+def make_integration(process_factory=None, path='nexttrace'):
+    integration = NextTraceIntegration(cache_file=os.devnull)
+    integration.nexttrace_path = path
+    if process_factory:
+        integration.process_factory = process_factory
+    return integration
+
+
+def make_fake_nexttrace(tmp_path, output, chunk=7, returncode=0):
+    """生成按固定字节数分块输出录制内容的假nexttrace可执行文件"""
+    data_path = tmp_path / 'output.bin'
+    data_path.write_bytes(output.encode('utf-8'))
+    exe_path = tmp_path / 'nexttrace'
+    exe_path.write_text(FAKE_NEXTTRACE.format(python=sys.executable, path=str(data_path), chunk=chunk,
+                                              returncode=returncode), encoding='utf-8')
+    exe_path.chmod(exe_path.stat().st_mode | stat.S_IXUSR)
+    return str(exe_path)
+
+
+def run_json(integration):
+    hops = []
+    result = integration.run_traceroute('8.8.8.8', callback=lambda *hop: hops.append(hop),
+                                        format='json', pre_resolve=False, max_hops=30, timeout=300)
+    return result, hops
+
+
+def test_decoder_char_by_char(recording):
+    output = recording.output()
+    stream = NextTraceJsonStream()
+    elements = []
+    for char in output:
+        elements.extend(stream.feed(char))
+
+    assert stream.finished
+    assert [NextTraceJsonStream.to_hop_record(e, i) for i, e in enumerate(elements)] == expected_records(output)
+    assert stream.maptrace_url() == 'https://assets.nxtrace.org/tracemap/0f1e2d3c-4b5a.html'
+
+
+def test_replay_recorded_chunks(recording):
+    factory = ReplayProcessFactory(recording, speed=0)
+    result, callbacks = run_json(make_integration(factory))
+
+    records = result['hops']
+    assert records == expected_records(recording.output())
+    assert [r['hop'] for r in records] == [1, 2, 3, 4]
+    assert records[0]['ip'] == '192.168.1.1'
+    assert records[0]['rtts'] == [1.234, 1.1, 1.3]
+    assert records[1]['ip'] == '' and records[1]['delay'] == [-1]
+    assert records[3]['geo']['city'] == '山景城'
+    assert records[3]['geo']['lat'] == pytest.approx(37.386)
+    assert records[3]['asn']['as'] == 'AS15169'
+    assert result['maptrace_url'] == 'https://assets.nxtrace.org/tracemap/0f1e2d3c-4b5a.html'
+
+    # 每解出一跳回调一次，位置文本来自中文地理信息
+    assert [hop[0] for hop in callbacks] == [1, 2, 3, 4]
+    assert callbacks[3][1] == '8.8.8.8'
+    assert '山景城' in callbacks[3][3]
+    assert '-j' in factory.processes[0].args
+    # JSON中的经纬度和ASN随回调传出，超时跳点没有经纬度
+    assert callbacks[3][4].startswith('AS15169')
+    assert callbacks[3][5] == (pytest.approx(37.386), pytest.approx(records[3]['geo']['lng']))
+    assert callbacks[1][5] is None
+
+
+def test_json_is_default_format(recording):
+    factory = ReplayProcessFactory(recording, speed=0)
+    integration = make_integration(factory)
+    result = integration.run_traceroute('8.8.8.8', pre_resolve=False)
+
+    assert '-j' in factory.processes[0].args
+    assert result['hops'] == expected_records(recording.output())
+
+
+class SequenceFactory:
+    """依次回放多个录制，每启动一个进程使用下一个录制"""
+
+    def __init__(self, *recordings):
+        self.factories = [ReplayProcessFactory(r, speed=0) for r in recordings]
+        self.processes = []
+
+    def __call__(self, cmd, **popen_kwargs):
+        process = self.factories[len(self.processes)](cmd, **popen_kwargs)
+        self.processes.append(process)
+        return process
+
+
+def test_old_version_falls_back_to_text():
+    unsupported = SessionRecording(events=[[0.0, 'e', "Error: unknown shorthand flag: 'j' in -j\n"]], returncode=1)
+    text = SessionRecording(events=[[0.0, 'o', 'traceroute to 8.8.8.8, 30 hops max\n']])
+    factory = SequenceFactory(unsupported, text, text)
+    integration = make_integration(factory)
+
+    run_json(integration)
+    assert '-j' in factory.processes[0].args
+    assert '-j' not in factory.processes[1].args
+    assert not integration.json_supported
+
+    # 之后的运行直接使用文本输出
+    run_json(integration)
+    assert len(factory.processes) == 3 and '-j' not in factory.processes[2].args
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="假的可执行文件依赖shebang")
+@pytest.mark.parametrize('chunk', [5, 7, 4096])
+def test_fake_executable_split_bytes(tmp_path, recording, chunk):
+    output = recording.output()
+    result, callbacks = run_json(make_integration(path=make_fake_nexttrace(tmp_path, output, chunk)))
+
+    # 分块切断多字节字符时，增量解码器不应产生替换字符
+    assert result['hops'] == expected_records(output)
+    assert all('�' not in hop[3] for hop in callbacks)
+    assert result['maptrace_url'] == 'https://assets.nxtrace.org/tracemap/0f1e2d3c-4b5a.html'
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="假的可执行文件依赖shebang")
+def test_truncated_output_keeps_complete_hops(tmp_path, recording):
+    output = recording.output()
+    # 在第4跳中间截断，后面跟着非JSON的错误输出，进程以非零退出码结束
+    cut = output.index('"8.8.8.8"')
+    truncated = output[:cut] + '\npanic: runtime error: invalid memory address\n'
+    result, callbacks = run_json(make_integration(path=make_fake_nexttrace(tmp_path, truncated, returncode=2)))
+
+    assert result['hops'] == expected_records(output)[:3]
+    assert [hop[0] for hop in callbacks] == [1, 2, 3]
+    assert result['maptrace_url'] is None
+
+
+def test_non_json_tail_after_document(recording):
+    output = recording.output() + '\x1b[0m\nMapTrace URL: not json at all {\n'
+    tailed = SessionRecording(events=[[0.0, 'o', output]])
+    result, _ = run_json(make_integration(ReplayProcessFactory(tailed, speed=0)))
+
+    assert result['hops'] == expected_records(recording.output())
+    assert result['maptrace_url'] == 'https://assets.nxtrace.org/tracemap/0f1e2d3c-4b5a.html'
+
+
+def test_failure_before_any_hops_raises():
+    failed = SessionRecording(events=[[0.0, 'e', 'error: permission denied\n']], returncode=1)
+    with pytest.raises(RuntimeError, match='permission denied'):
+        run_json(make_integration(ReplayProcessFactory(failed, speed=0)))
@@ -0,0 +1,57 @@
+# -- coding: utf-8 --
+"""任务执行器工作池测试：并发提交的阻塞任务应同时执行，线程数不超过上限"""
+
+import threading
+
+from ui.task_executor import TaskExecutor
+
+
+def test_blocking_tasks_overlap():
+    executor = TaskExecutor({'dns': 4})
+    # 先执行一个任务，让工作池留下一个空闲线程
+    executor.submit('dns', lambda task: None).result(timeout=5)
+
+    barrier = threading.Barrier(4, timeout=5)
+    tasks = [executor.submit('dns', lambda task: barrier.wait()) for _ in range(4)]
+
+    # 任务串行执行时栅栏等待超时，result抛出BrokenBarrierError
+    assert sorted(task.result(timeout=10) for task in tasks) == [0, 1, 2, 3]
+    assert executor.stats()['dns']['threads'] == 4
+    executor.shutdown(timeout=1)
+
+
+def test_threads_bounded_and_reused():
+    executor = TaskExecutor({'geoip': 2})
+    release = threading.Event()
+    running = []
+    lock = threading.Lock()
+
+    def work(task, index):
+        with lock:
+            running.append(index)
+        release.wait(5)
+        return index
+
+    tasks = [executor.submit('geoip', work, i) for i in range(6)]
+    release.set()
+    assert [task.result(timeout=5) for task in tasks] == list(range(6))
+    assert executor.stats()['geoip']['threads'] == 2
+
+    # 空闲线程足够时不再创建新线程
+    executor.submit('geoip', lambda task: None).result(timeout=5)
+    assert executor.stats()['geoip']['threads'] == 2
+    executor.shutdown(timeout=1)
+
+
+def test_submit_to_closed_pool_not_tracked():
+    executor = TaskExecutor({'dns': 1})
+    # 执行器关闭过程中工作池先于提交关闭：提交失败的任务不应留在任务集合中
+    executor.pools['dns'].shutdown()
+    try:
+        executor.submit('dns', lambda task: None)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("提交到已关闭的工作池应抛出RuntimeError")
+    assert executor.active() == []
+    assert executor.shutdown(timeout=1) == []
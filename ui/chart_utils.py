@@ -0,0 +1,267 @@
+# -- coding: utf-8 --
+"""增量绘制的实时图表模块
+
+实时图表不再每次清空坐标轴（ax.clear）后重建所有对象并完整重绘：
+    - 曲线、条形和文本是持久对象，新数据只通过set_data/set_width/set_text更新
+    - 这些动态对象标记为animated，完整绘制时不画；完整绘制后保存背景，
+      之后每次更新只恢复背景、重画动态对象并blit，开销与坐标轴、刻度和布局无关
+    - 只有坐标范围或刻度变化（数据超出当前范围、跳点数超出预留的位置）时才重新计算布局并用draw_idle完整重绘，
+      坐标范围按倍数扩展，完整重绘的次数随数据量对数增长
+
+本模块导入matplotlib，界面只在第一个图表创建时才导入本模块
+"""
+
+import math
+from typing import List, Optional, Sequence, Tuple
+
+from matplotlib.patches import Rectangle
+
+
+def create_figure(parent, nrows: int = 1, ncols: int = 1, figsize: Optional[Tuple[float, float]] = None):
+    """在Tk容器中创建图表并铺满容器
+
+    :return: (fig, axes, canvas)
+    """
+    import matplotlib
+    matplotlib.use('TkAgg')
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+    fig, axes = plt.subplots(nrows, ncols, figsize=figsize)
+    canvas = FigureCanvasTkAgg(fig, parent)
+    canvas.get_tk_widget().pack(fill='both', expand=True)
+    return fig, axes, canvas
+
+
+class BlitManager:
+    """管理一组动态对象的blit绘制"""
+
+    def __init__(self, canvas, artists: Sequence = ()):
+        """
+        :param canvas: FigureCanvas（需支持copy_from_bbox/restore_region/blit，如TkAgg）
+        :param artists: 动态对象
+        """
+        self.canvas = canvas
+        self.background = None
+        self.artists = []
+        self.full_draws = 0
+        self.blits = 0
+        for artist in artists:
+            self.add_artist(artist)
+        self.cid = canvas.mpl_connect('draw_event', self._on_draw)
+
+    def add_artist(self, artist):
+        artist.set_animated(True)
+        self.artists.append(artist)
+
+    def remove_artist(self, artist):
+        if artist in self.artists:
+            self.artists.remove(artist)
+        artist.remove()
+
+    def _on_draw(self, event):
+        """完整绘制（包括窗口缩放引起的）完成后保存不含动态对象的背景，再把动态对象画上去"""
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.full_draws += 1
+        self._draw_artists()
+
+    def _draw_artists(self):
+        figure = self.canvas.figure
+        for artist in self.artists:
+            figure.draw_artist(artist)
+
+    def redraw(self):
+        """请求完整重绘（合并到Tk空闲时执行）"""
+        self.canvas.draw_idle()
+
+    def update(self):
+        """只重画动态对象；尚未完整绘制过时改为请求完整重绘"""
+        if self.background is None:
+            self.redraw()
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+        self.blits += 1
+
+
+class LiveLineChart:
+    """实时曲线图：一条持久的曲线和一个左上角的说明文本"""
+
+    def __init__(self, ax, canvas, headroom: float = 1.2, **line_kwargs):
+        """
+        :param ax: 坐标轴
+        :param canvas: 画布
+        :param headroom: 纵轴上限相对最大值的余量
+        :param line_kwargs: 传给ax.plot的曲线样式
+        """
+        self.ax = ax
+        self.headroom = headroom
+        self.line, = ax.plot([], [], **line_kwargs)
+        self.text = ax.text(0.02, 0.98, '', transform=ax.transAxes, ha='left', va='top',
+                            fontsize=8, bbox=dict(facecolor='white', alpha=0.8), visible=False)
+        ax.set_autoscale_on(False)
+        self.blit = BlitManager(canvas, [self.line, self.text])
+
+    def update(self, xs: List[float], ys: List[float], text: Optional[str] = None):
+        """更新曲线数据和说明文本；数据在当前坐标范围内时只blit"""
+        self.line.set_data(xs, ys)
+        self.text.set_text(text or '')
+        self.text.set_visible(bool(text))
+        if self._fit(xs, ys):
+            self.ax.figure.tight_layout()
+            self.blit.redraw()
+        else:
+            self.blit.update()
+
+    def _fit(self, xs: List[float], ys: List[float]) -> bool:
+        """数据超出坐标范围时扩展范围，返回范围是否变化"""
+        if not xs:
+            return False
+        changed = False
+        x0, x1 = self.ax.get_xlim()
+        first, last = xs[0], xs[-1]
+        if first < x0 or last > x1:
+            # 横轴按倍数扩展，持续追加数据时完整重绘的次数只随时长对数增长
+            span = max(last - first, 1e-3)
+            self.ax.set_xlim(first, first + span * 2)
+            changed = True
+        y0, y1 = self.ax.get_ylim()
+        low, high = min(ys), max(ys)
+        if low < y0 or high > y1:
+            self.ax.set_ylim(min(0, low), max(high * self.headroom, 1e-3))
+            changed = True
+        return changed
+
+    def clear(self):
+        self.line.set_data([], [])
+        self.text.set_visible(False)
+        self.ax.set_xlim(0, 1)
+        self.ax.set_ylim(0, 1)
+        self.blit.redraw()
+
+
+class HopBarChart:
+    """路由跟踪条形图：每个跳点一组持久的条形、延迟标签和位置标签
+
+    纵轴按capacity_step预留跳点位置，并按跳数连续的假设预先生成刻度标签，
+    因此逐跳追加时通常只需blit；跳数超出预留位置、跳数不连续或延迟超出横轴范围时才完整重绘
+    """
+
+    def __init__(self, ax, canvas, capacity_step: int = 8, headroom: float = 1.3, location_every: int = 3):
+        """
+        :param ax: 坐标轴
+        :param canvas: 画布
+        :param capacity_step: 纵轴预留位置的增量
+        :param headroom: 横轴上限相对最大延迟的余量
+        :param location_every: 每隔几个跳点显示一个位置标签
+        """
+        self.ax = ax
+        self.capacity_step = max(1, capacity_step)
+        self.headroom = headroom
+        self.location_every = max(1, location_every)
+        self.blit = BlitManager(canvas)
+        self.hops = []              # 每个位置的(跳数, 延迟, 位置)
+        self.bars = []
+        self.value_labels = []
+        self.location_labels = {}   # 位置序号 -> 位置标签
+        self.tick_labels = []
+        self.capacity = 0
+        self.layout_dirty = True
+        ax.set_autoscale_on(False)
+
+    def set_hops(self, hops: Sequence[Tuple[int, float, str]], final: bool = False):
+        """用完整的跳点列表同步图表（已有的对象就地更新）
+
+        :param final: 跟踪已结束，纵轴收缩到实际跳数，不再预留位置
+        """
+        for index, (hop, delay, location) in enumerate(hops):
+            self._place(index, hop, delay, location)
+        while len(self.hops) > len(hops):
+            self._remove_last()
+        if final and self.capacity != len(self.hops):
+            self.capacity = len(self.hops)
+            self.layout_dirty = True
+
+    def append(self, hop: int, delay: float, location: str = ''):
+        """追加一个跳点"""
+        self._place(len(self.hops), hop, delay, location)
+
+    def _place(self, index: int, hop: int, delay: float, location: str):
+        point = (hop, delay, location)
+        if index < len(self.hops):
+            if self.hops[index] == point:
+                return
+            self.hops[index] = point
+            self.bars[index].set_width(delay)
+            self.value_labels[index].set_position((delay + 0.1, index))
+            self.value_labels[index].set_text(f'{delay:.1f}ms')
+            if index in self.location_labels:
+                self.location_labels[index].set_text(location)
+        else:
+            self.hops.append(point)
+            bar = Rectangle((0, index - 0.4), delay, 0.8, facecolor='lightblue', alpha=0.7)
+            self.ax.add_patch(bar)
+            self.blit.add_artist(bar)
+            self.bars.append(bar)
+            label = self.ax.text(delay + 0.1, index, f'{delay:.1f}ms', ha='left', va='center', fontsize=8)
+            self.blit.add_artist(label)
+            self.value_labels.append(label)
+            if index % self.location_every == 0:
+                location_label = self.ax.text(0.1, index, location, ha='left', va='center', fontsize=7,
+                                              bbox=dict(boxstyle="round,pad=0.3", facecolor="yellow", alpha=0.7))
+                self.blit.add_artist(location_label)
+                self.location_labels[index] = location_label
+
+        if index >= self.capacity:
+            self.capacity = math.ceil((index + 1) / self.capacity_step) * self.capacity_step
+            self.layout_dirty = True
+        elif index >= len(self.tick_labels) or self.tick_labels[index] != f'跳点 {hop}':
+            self.layout_dirty = True
+        if delay + 0.1 > self.ax.get_xlim()[1]:
+            self.layout_dirty = True
+
+    def _remove_last(self):
+        index = len(self.hops) - 1
+        self.hops.pop()
+        self.blit.remove_artist(self.bars.pop())
+        self.blit.remove_artist(self.value_labels.pop())
+        if index in self.location_labels:
+            self.blit.remove_artist(self.location_labels.pop(index))
+        self.layout_dirty = True
+
+    def _layout(self):
+        """重新设置坐标范围和刻度（只在坐标轴变化时调用）"""
+        capacity = max(1, self.capacity)
+        self.ax.set_ylim(-0.6, capacity - 0.4)
+        # 未到达的位置按跳数连续的假设预先生成标签
+        last_hop = self.hops[-1][0] if self.hops else 0
+        self.tick_labels = [f'跳点 {hop}' for hop, _, _ in self.hops]
+        self.tick_labels += [f'跳点 {last_hop + i}' for i in range(1, capacity - len(self.hops) + 1)]
+        self.ax.set_yticks(range(capacity))
+        self.ax.set_yticklabels(self.tick_labels)
+        max_delay = max((delay for _, delay, _ in self.hops), default=0)
+        self.ax.set_xlim(0, max(max_delay * self.headroom, 1))
+        self.ax.figure.tight_layout()
+
+    def refresh(self):
+        """把数据变化画到画布上：坐标轴变化时完整重绘，否则只blit"""
+        if self.layout_dirty:
+            self.layout_dirty = False
+            self._layout()
+            self.blit.redraw()
+        else:
+            self.blit.update()
+
+    def clear(self):
+        while self.hops:
+            self._remove_last()
+        self.capacity = 0
+        self.tick_labels = []
+        self.ax.set_yticks([])
+        self.ax.set_xlim(0, 1)
+        self.layout_dirty = False
+        self.blit.redraw()
+
+    def __len__(self) -> int:
+        return len(self.hops)
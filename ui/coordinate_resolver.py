@@ -0,0 +1,295 @@
+# -- coding: utf-8 --
+"""跳点坐标解析模块
+
+为路由跳点确定经纬度，替代基于hash(ip)生成的伪坐标。按以下顺序取值：
+    1. 路由工具直接提供的经纬度（NextTrace JSON输出）
+    2. 地理位置缓存记录中的经纬度（GeoIP API返回的lat/lon）
+    3. 本地城市中心点地名索引（按城市、省份、国家名称匹配）
+    4. 基于IP的MD5确定性坐标（跨进程稳定）
+解析结果与地理位置记录一起保存在geoip缓存中，生成地图时无需再次查询
+"""
+
+import re
+import hashlib
+import threading
+from typing import Optional, Tuple, Dict, Any, List
+
+from .network_utils import network_utils
+
+# 城市/省份/国家中心点，键为中文或英文名称（小写、去空格）
+CITY_CENTROIDS = {
+    # 中国直辖市和主要城市
+    '北京': (39.9042, 116.4074), 'beijing': (39.9042, 116.4074),
+    '上海': (31.2304, 121.4737), 'shanghai': (31.2304, 121.4737),
+    '天津': (39.3434, 117.3616), 'tianjin': (39.3434, 117.3616),
+    '重庆': (29.5630, 106.5516), 'chongqing': (29.5630, 106.5516),
+    '广州': (23.1291, 113.2644), 'guangzhou': (23.1291, 113.2644),
+    '深圳': (22.5431, 114.0579), 'shenzhen': (22.5431, 114.0579),
+    '杭州': (30.2741, 120.1551), 'hangzhou': (30.2741, 120.1551),
+    '南京': (32.0603, 118.7969), 'nanjing': (32.0603, 118.7969),
+    '苏州': (31.2989, 120.5853), 'suzhou': (31.2989, 120.5853),
+    '成都': (30.5728, 104.0668), 'chengdu': (30.5728, 104.0668),
+    '武汉': (30.5928, 114.3055), 'wuhan': (30.5928, 114.3055),
+    '西安': (34.3416, 108.9398), "xi'an": (34.3416, 108.9398), 'xian': (34.3416, 108.9398),
+    '厦门': (24.4798, 118.0894), 'xiamen': (24.4798, 118.0894),
+    '福州': (26.0745, 119.2965), 'fuzhou': (26.0745, 119.2965),
+    '青岛': (36.0671, 120.3826), 'qingdao': (36.0671, 120.3826),
+    '济南': (36.6512, 117.1201), 'jinan': (36.6512, 117.1201),
+    '郑州': (34.7466, 113.6254), 'zhengzhou': (34.7466, 113.6254),
+    '长沙': (28.2282, 112.9388), 'changsha': (28.2282, 112.9388),
+    '沈阳': (41.8057, 123.4315), 'shenyang': (41.8057, 123.4315),
+    '大连': (38.9140, 121.6147), 'dalian': (38.9140, 121.6147),
+    '哈尔滨': (45.8038, 126.5349), 'harbin': (45.8038, 126.5349),
+    '长春': (43.8171, 125.3235), 'changchun': (43.8171, 125.3235),
+    '石家庄': (38.0428, 114.5149), 'shijiazhuang': (38.0428, 114.5149),
+    '太原': (37.8706, 112.5489), 'taiyuan': (37.8706, 112.5489),
+    '合肥': (31.8206, 117.2272), 'hefei': (31.8206, 117.2272),
+    '南昌': (28.6820, 115.8579), 'nanchang': (28.6820, 115.8579),
+    '昆明': (25.0389, 102.7183), 'kunming': (25.0389, 102.7183),
+    '贵阳': (26.6470, 106.6302), 'guiyang': (26.6470, 106.6302),
+    '南宁': (22.8170, 108.3665), 'nanning': (22.8170, 108.3665),
+    '海口': (20.0440, 110.1999), 'haikou': (20.0440, 110.1999),
+    '兰州': (36.0611, 103.8343), 'lanzhou': (36.0611, 103.8343),
+    '西宁': (36.6171, 101.7782), 'xining': (36.6171, 101.7782),
+    '银川': (38.4872, 106.2309), 'yinchuan': (38.4872, 106.2309),
+    '乌鲁木齐': (43.8256, 87.6168), 'urumqi': (43.8256, 87.6168),
+    '拉萨': (29.6520, 91.1721), 'lhasa': (29.6520, 91.1721),
+    '呼和浩特': (40.8414, 111.7519), 'hohhot': (40.8414, 111.7519),
+    '宁波': (29.8683, 121.5440), 'ningbo': (29.8683, 121.5440),
+    '无锡': (31.4912, 120.3119), 'wuxi': (31.4912, 120.3119),
+    '东莞': (23.0207, 113.7518), 'dongguan': (23.0207, 113.7518),
+    '佛山': (23.0215, 113.1214), 'foshan': (23.0215, 113.1214),
+    '香港': (22.3193, 114.1694), '中国香港': (22.3193, 114.1694), 'hongkong': (22.3193, 114.1694),
+    '澳门': (22.1987, 113.5439), '中国澳门': (22.1987, 113.5439), 'macau': (22.1987, 113.5439),
+    '台北': (25.0330, 121.5654), 'taipei': (25.0330, 121.5654),
+    # 海外常见节点城市
+    '东京': (35.6762, 139.6503), 'tokyo': (35.6762, 139.6503),
+    '大阪': (34.6937, 135.5023), 'osaka': (34.6937, 135.5023),
+    '首尔': (37.5665, 126.9780), 'seoul': (37.5665, 126.9780),
+    '新加坡': (1.3521, 103.8198), 'singapore': (1.3521, 103.8198),
+    '法兰克福': (50.1109, 8.6821), 'frankfurt': (50.1109, 8.6821),
+    '伦敦': (51.5074, -0.1278), 'london': (51.5074, -0.1278),
+    '阿姆斯特丹': (52.3676, 4.9041), 'amsterdam': (52.3676, 4.9041),
+    '巴黎': (48.8566, 2.3522), 'paris': (48.8566, 2.3522),
+    '洛杉矶': (34.0522, -118.2437), 'losangeles': (34.0522, -118.2437),
+    '圣何塞': (37.3382, -121.8863), 'sanjose': (37.3382, -121.8863),
+    '山景城': (37.3861, -122.0839), 'mountainview': (37.3861, -122.0839),
+    '旧金山': (37.7749, -122.4194), 'sanfrancisco': (37.7749, -122.4194),
+    '西雅图': (47.6062, -122.3321), 'seattle': (47.6062, -122.3321),
+    '纽约': (40.7128, -74.0060), 'newyork': (40.7128, -74.0060),
+    '阿什本': (39.0438, -77.4874), 'ashburn': (39.0438, -77.4874),
+    '芝加哥': (41.8781, -87.6298), 'chicago': (41.8781, -87.6298),
+    '达拉斯': (32.7767, -96.7970), 'dallas': (32.7767, -96.7970),
+    '悉尼': (-33.8688, 151.2093), 'sydney': (-33.8688, 151.2093),
+}
+
+# 省份中心点（省会附近），城市无法匹配时使用
+REGION_CENTROIDS = {
+    '广东': (23.1291, 113.2644), 'guangdong': (23.1291, 113.2644),
+    '浙江': (30.2741, 120.1551), 'zhejiang': (30.2741, 120.1551),
+    '江苏': (32.0603, 118.7969), 'jiangsu': (32.0603, 118.7969),
+    '福建': (26.0745, 119.2965), 'fujian': (26.0745, 119.2965),
+    '山东': (36.6512, 117.1201), 'shandong': (36.6512, 117.1201),
+    '河南': (34.7466, 113.6254), 'henan': (34.7466, 113.6254),
+    '河北': (38.0428, 114.5149), 'hebei': (38.0428, 114.5149),
+    '四川': (30.5728, 104.0668), 'sichuan': (30.5728, 104.0668),
+    '湖北': (30.5928, 114.3055), 'hubei': (30.5928, 114.3055),
+    '湖南': (28.2282, 112.9388), 'hunan': (28.2282, 112.9388),
+    '辽宁': (41.8057, 123.4315), 'liaoning': (41.8057, 123.4315),
+    '陕西': (34.3416, 108.9398), 'shaanxi': (34.3416, 108.9398),
+    '山西': (37.8706, 112.5489), 'shanxi': (37.8706, 112.5489),
+    '安徽': (31.8206, 117.2272), 'anhui': (31.8206, 117.2272),
+    '江西': (28.6820, 115.8579), 'jiangxi': (28.6820, 115.8579),
+    '云南': (25.0389, 102.7183), 'yunnan': (25.0389, 102.7183),
+    '贵州': (26.6470, 106.6302), 'guizhou': (26.6470, 106.6302),
+    '广西': (22.8170, 108.3665), 'guangxi': (22.8170, 108.3665),
+    '海南': (20.0440, 110.1999), 'hainan': (20.0440, 110.1999),
+    '甘肃': (36.0611, 103.8343), 'gansu': (36.0611, 103.8343),
+    '黑龙江': (45.8038, 126.5349), 'heilongjiang': (45.8038, 126.5349),
+    '吉林': (43.8171, 125.3235), 'jilin': (43.8171, 125.3235),
+    '新疆': (43.8256, 87.6168), 'xinjiang': (43.8256, 87.6168),
+    '西藏': (29.6520, 91.1721), 'tibet': (29.6520, 91.1721),
+    '内蒙古': (40.8414, 111.7519), 'innermongolia': (40.8414, 111.7519),
+    '加州': (36.7783, -119.4179), '加利福尼亚': (36.7783, -119.4179), 'california': (36.7783, -119.4179),
+    '弗吉尼亚': (37.4316, -78.6569), 'virginia': (37.4316, -78.6569),
+}
+
+# 国家中心点，只知道国家时使用
+COUNTRY_CENTROIDS = {
+    '中国': (35.8617, 104.1954), 'china': (35.8617, 104.1954),
+    '美国': (39.8283, -98.5795), 'unitedstates': (39.8283, -98.5795), 'usa': (39.8283, -98.5795),
+    '日本': (36.2048, 138.2529), 'japan': (36.2048, 138.2529),
+    '韩国': (35.9078, 127.7669), 'korea': (35.9078, 127.7669),
+    '德国': (51.1657, 10.4515), 'germany': (51.1657, 10.4515),
+    '法国': (46.2276, 2.2137), 'france': (46.2276, 2.2137),
+    '英国': (55.3781, -3.4360), 'unitedkingdom': (55.3781, -3.4360),
+    '荷兰': (52.1326, 5.2913), 'netherlands': (52.1326, 5.2913),
+    '俄罗斯': (61.5240, 105.3188), 'russia': (61.5240, 105.3188),
+    '澳大利亚': (-25.2744, 133.7751), 'australia': (-25.2744, 133.7751),
+    '加拿大': (56.1304, -106.3468), 'canada': (56.1304, -106.3468),
+    '印度': (20.5937, 78.9629), 'india': (20.5937, 78.9629),
+    '中国台湾': (23.6978, 120.9605), 'taiwan': (23.6978, 120.9605),
+    '新加坡': (1.3521, 103.8198),
+    '中国香港': (22.3193, 114.1694),
+}
+
+# 按ISO 3166国家代码索引的国家中心点，只用于地理位置记录的country_code字段，
+# 不参与自由文本位置字符串的匹配（"in"、"de"等是常见单词）
+COUNTRY_CODE_CENTROIDS = {
+    'CN': COUNTRY_CENTROIDS['中国'], 'US': COUNTRY_CENTROIDS['美国'], 'JP': COUNTRY_CENTROIDS['日本'],
+    'KR': COUNTRY_CENTROIDS['韩国'], 'DE': COUNTRY_CENTROIDS['德国'], 'FR': COUNTRY_CENTROIDS['法国'],
+    'GB': COUNTRY_CENTROIDS['英国'], 'NL': COUNTRY_CENTROIDS['荷兰'], 'RU': COUNTRY_CENTROIDS['俄罗斯'],
+    'AU': COUNTRY_CENTROIDS['澳大利亚'], 'CA': COUNTRY_CENTROIDS['加拿大'], 'IN': COUNTRY_CENTROIDS['印度'],
+    'TW': COUNTRY_CENTROIDS['中国台湾'], 'SG': COUNTRY_CENTROIDS['新加坡'], 'HK': COUNTRY_CENTROIDS['中国香港'],
+}
+
+# 位置字符串的分隔符：空白、连字符、逗号、斜杠和括号
+_SEPARATORS = re.compile(r'[\s,，/()（）\-]+')
+
+
+def _normalize(name: str) -> str:
+    """规范化地名：小写、去空格、去掉行政区后缀"""
+    name = name.strip().lower().replace(' ', '')
+    for suffix in ('特别行政区', '维吾尔自治区', '壮族自治区', '回族自治区', '自治区', '省', '市'):
+        if len(name) > len(suffix) and name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+class CoordinateResolver:
+    """跳点坐标解析器"""
+
+    def __init__(self, utils=None):
+        """初始化坐标解析器
+
+        :param utils: NetworkUtils实例，坐标与其geoip缓存记录一起保存，默认使用全局实例
+        """
+        self.utils = utils or network_utils
+        # 没有地理位置记录的IP（如只有NextTrace文本输出）的坐标缓存
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _valid_coords(lat, lng) -> Optional[Tuple[float, float]]:
+        """检查并转换经纬度，空值、越界和(0, 0)视为无效"""
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            return None
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (lat == 0 and lng == 0):
+            return None
+        return lat, lng
+
+    @staticmethod
+    def lookup_place(*names: str, country_code: str = '') -> Optional[Tuple[float, float]]:
+        """在本地地名索引中查找坐标
+
+        依次尝试城市、省份、国家索引，每个索引中越靠后的名称越具体、越优先；
+        名称都无法匹配时再使用国家代码
+
+        :param names: 地名或位置字符串（如"中国 广东 深圳"）
+        :param country_code: 地理位置记录中的ISO国家代码（如"US"），不从位置字符串中提取
+        :return: (纬度, 经度)，找不到时返回None
+        """
+        tokens = []
+        for name in names:
+            if not name:
+                continue
+            tokens.append(_normalize(name))
+            tokens.extend(_normalize(part) for part in _SEPARATORS.split(name) if part)
+
+        for index in (CITY_CENTROIDS, REGION_CENTROIDS, COUNTRY_CENTROIDS):
+            for token in reversed(tokens):
+                if token in index:
+                    return index[token]
+        return COUNTRY_CODE_CENTROIDS.get((country_code or '').strip().upper())
+
+    @staticmethod
+    def fallback_coords(ip: str) -> Tuple[float, float]:
+        """基于IP的确定性坐标（MD5，不受进程哈希随机化影响），落在中国范围内"""
+        hash_val = int(hashlib.md5(ip.encode('utf-8')).hexdigest()[:8], 16)
+        lat = 18.0 + (hash_val % 3500) / 100.0
+        lng = 73.0 + ((hash_val // 3500) % 6200) / 100.0
+        return lat, lng
+
+    def resolve(self, ip: str, location: str = '', geo: Optional[Dict[str, Any]] = None,
+                lookup: bool = False) -> Tuple[float, float]:
+        """解析单个跳点的坐标
+
+        :param ip: 跳点IP
+        :param location: 位置字符串，地名索引匹配时使用
+        :param geo: 路由工具提供的地理信息（可含lat/lng及country/region/city）
+        :param lookup: 缓存中没有地理位置记录时是否调用GeoIP API查询
+        :return: (纬度, 经度)
+        """
+        return self._resolve(ip, location, geo, lookup)[0]
+
+    def _resolve(self, ip: str, location: str = '', geo: Optional[Dict[str, Any]] = None,
+                 lookup: bool = False) -> Tuple[Tuple[float, float], str]:
+        """解析坐标并返回来源（tool/geoip/gazetteer/fallback）"""
+        geo = geo or {}
+        coords = self._valid_coords(geo.get('lat'), geo.get('lng', geo.get('lon')))
+        if coords:
+            return self._store(ip, coords, 'tool')
+
+        # 已保存的坐标直接使用；兜底坐标除外，之后的调用可能带有能匹配地名索引的位置信息，需要重新尝试
+        record = self.utils.geoip_cache.get(ip) if ip else None
+        if record and record.get('coords') and record.get('coords_source', 'geoip') != 'fallback':
+            return tuple(record['coords']), record.get('coords_source', 'geoip')
+        if not record:
+            with self.lock:
+                cached = self.cache.get(ip)
+            if cached and cached[1] != 'fallback':
+                return cached
+            # 本地缓存中的兜底坐标说明已查询过，不再重复调用GeoIP API
+            if lookup and ip and not cached:
+                record = self.utils.get_ip_location(ip)
+
+        if record:
+            coords = self._valid_coords(record.get('lat'), record.get('lon'))
+            if coords:
+                return self._store(ip, coords, 'geoip')
+            coords = self.lookup_place(record.get('city', ''), record.get('region', ''), record.get('country', ''),
+                                       country_code=record.get('country_code', ''))
+            if coords:
+                return self._store(ip, coords, 'gazetteer')
+
+        coords = self.lookup_place(location, geo.get('city', ''), geo.get('region', ''), geo.get('country', ''))
+        if coords:
+            return self._store(ip, coords, 'gazetteer')
+        return self._store(ip, self.fallback_coords(ip or location), 'fallback')
+
+    def _store(self, ip: str, coords: Tuple[float, float], source: str) -> Tuple[Tuple[float, float], str]:
+        """将坐标保存到地理位置记录（没有记录时保存到本地缓存）"""
+        if ip:
+            record = self.utils.geoip_cache.get(ip)
+            if record is not None:
+                with self.utils.lock:
+                    record['coords'] = [coords[0], coords[1]]
+                    record['coords_source'] = source
+            else:
+                with self.lock:
+                    self.cache[ip] = (coords, source)
+        return coords, source
+
+    def resolve_path(self, hops: List[tuple]) -> List[Tuple[float, float]]:
+        """解析一条路径上所有跳点的坐标
+
+        无法定位的跳点（只能使用确定性兜底坐标的，如内网地址）沿用前一个已定位跳点的坐标，
+        路径开头的此类跳点使用第一个已定位跳点的坐标，避免地图上出现随机散落的点
+
+        :param hops: [(ip, location), ...]，也可以是(ip, location, geo)，geo同resolve
+        :return: 与hops等长的坐标列表
+        """
+        resolved = [self._resolve(*hop) for hop in hops]
+        anchor = next((coords for coords, source in resolved if source != 'fallback'), None)
+        result = []
+        for coords, source in resolved:
+            if source != 'fallback':
+                anchor = coords
+            result.append(anchor if source == 'fallback' and anchor is not None else coords)
+        return result
+
+
+# 创建全局实例
+coordinate_resolver = CoordinateResolver()
@@ -0,0 +1,301 @@
+# -- coding: utf-8 --
+"""大规模域名列表的流式批量测试模块
+
+域名列表很大（几十万条）时不能整体读入界面或内存：
+    - 从文件或标准输入逐行读取域名，按块（默认1000个）交给BatchDNSEngine并发测试
+    - 结果逐条追加写入CSV或JSONL文件，界面只显示最近的若干条和汇总统计
+    - 每完成一块写一次断点文件（输出文件名加.checkpoint），记录已处理的输入行数、
+      输出文件的字节位置和汇总直方图；中断后续传时输出文件截断到断点位置，从下一块开始，不会产生重复行
+
+命令行用法：
+    python -m ui.dns_bulk domains.txt -s 8.8.8.8 -o results.csv
+    python -m ui.dns_bulk domains.txt -s 8.8.8.8 1.1.1.1 -o results.jsonl --qps 200 --resume
+    cat domains.txt | python -m ui.dns_bulk - -s 223.5.5.5 -o results.csv
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from itertools import islice
+from typing import List, Dict, Any, Optional, Callable, Iterator, Iterable
+
+from .dns_engine import BatchDNSEngine
+from .latency_histogram import LatencyHistogram, format_percentiles
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# 结果文件的字段
+RESULT_FIELDS = ('domain', 'server', 'record_type', 'avg_time', 'min_time', 'max_time', 'p50_time',
+                 'p90_time', 'p99_time', 'success_rate', 'queries', 'error')
+
+# 断点文件格式版本
+CHECKPOINT_VERSION = 1
+
+
+def iter_domains(source: str) -> Iterator[str]:
+    """逐行读取域名
+
+    :param source: 文件路径，"-"表示标准输入；每行取第一个字段（逗号或空白分隔），跳过空行和#注释
+    """
+    stream = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8', errors='replace')
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            domain = line.replace(',', ' ').split()[0]
+            if domain:
+                yield domain
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def count_domains(source: str) -> Optional[int]:
+    """统计文件中的域名数（用于进度显示），标准输入返回None"""
+    if source == '-':
+        return None
+    return sum(1 for _ in iter_domains(source))
+
+
+def chunked(iterable: Iterable[str], size: int) -> Iterator[List[str]]:
+    """按固定大小分块"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def checkpoint_path(output: str) -> str:
+    return output + '.checkpoint'
+
+
+def load_checkpoint(output: str) -> Optional[Dict[str, Any]]:
+    """读取断点，不存在或格式不符时返回None"""
+    path = checkpoint_path(output)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if data.get('version') == CHECKPOINT_VERSION else None
+    except (OSError, ValueError) as e:
+        logger.warning("读取断点文件失败: %s", e)
+        return None
+
+
+def save_checkpoint(output: str, data: Dict[str, Any]):
+    """原子地写入断点（先写临时文件再替换）"""
+    path = checkpoint_path(output)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+class ResultWriter:
+    """增量写入测试结果，按扩展名选择JSONL或CSV格式"""
+
+    def __init__(self, path: str, offset: Optional[int] = None):
+        """
+        :param path: 输出文件路径
+        :param offset: 续传时的断点字节位置，文件截断到该位置后继续追加；None表示新建文件
+        """
+        self.path = path
+        self.jsonl = path.lower().endswith(('.jsonl', '.json'))
+        if offset is None:
+            self.file = open(path, 'w', encoding='utf-8', newline='')
+        else:
+            self.file = open(path, 'r+', encoding='utf-8', newline='')
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        self.csv_writer = None if self.jsonl else csv.DictWriter(self.file, fieldnames=RESULT_FIELDS,
+                                                                 extrasaction='ignore')
+        if self.csv_writer and offset in (None, 0):
+            self.csv_writer.writeheader()
+
+    def write(self, summary: Dict[str, Any]):
+        row = {field: summary.get(field) for field in RESULT_FIELDS}
+        if self.jsonl:
+            self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        else:
+            self.csv_writer.writerow(row)
+
+    def flush(self) -> int:
+        """刷新到磁盘，返回当前字节位置"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class BulkRunner:
+    """流式批量测试"""
+
+    def __init__(self, servers: List[str], record_type: str = 'A', iterations: int = 3, engine=None,
+                 chunk_size: int = 1000, window: int = 200):
+        """初始化
+
+        :param servers: DNS服务器列表
+        :param record_type: 记录类型
+        :param iterations: 每个(域名, 服务器)的查询次数
+        :param engine: BatchDNSEngine实例，默认按默认参数新建
+        :param chunk_size: 每块的域名数（也是断点的粒度）
+        :param window: 保留用于显示的最近结果数
+        """
+        self.servers = list(servers)
+        self.record_type = record_type
+        self.iterations = iterations
+        self.engine = engine or BatchDNSEngine()
+        self.chunk_size = max(1, chunk_size)
+        self.window = deque(maxlen=window)
+        self.histogram = LatencyHistogram()
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def recent(self) -> List[Dict[str, Any]]:
+        """最近完成的结果（较早的在前）"""
+        with self.lock:
+            return list(self.window)
+
+    def stats(self) -> Dict[str, Any]:
+        """汇总统计：已完成的(域名, 服务器)任务数及全部查询的延迟分布"""
+        with self.lock:
+            completed = self.completed
+        summary = self.histogram.summary()
+        summary['completed'] = completed
+        return summary
+
+    def run(self, source: str, output: str, resume: bool = False,
+            on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+            on_chunk: Optional[Callable[[Dict[str, Any]], None]] = None,
+            should_continue: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        """执行流式批量测试（阻塞直到完成或取消）
+
+        :param source: 域名列表文件，"-"表示标准输入（标准输入不支持续传）
+        :param output: 结果文件（.csv或.jsonl）
+        :param resume: 存在匹配的断点时从断点继续
+        :param on_result: 每个任务完成时在工作线程中调用
+        :param on_chunk: 每块完成并写入断点后调用，参数为断点内容
+        :param should_continue: 取消检查函数，返回False时在当前块的在途任务结束后停止
+        :return: {'status'（'completed'或'cancelled'）, 'position'（已处理的域名数）, 'stats'}
+        """
+        checkpoint = load_checkpoint(output) if resume else None
+        if checkpoint and (checkpoint['source'] != os.path.abspath(source) or source == '-'
+                           or checkpoint['servers'] != self.servers or checkpoint['record_type'] != self.record_type):
+            logger.warning("断点与当前参数不一致，重新开始")
+            checkpoint = None
+
+        position = 0
+        offset = None
+        if checkpoint:
+            position = checkpoint['position']
+            offset = checkpoint['output_offset']
+            self.histogram = LatencyHistogram.from_dict(checkpoint['histogram'])
+            self.completed = checkpoint['completed']
+            logger.info("从断点继续: 已处理 %d 个域名", position)
+
+        writer = ResultWriter(output, offset)
+        write_lock = threading.Lock()
+
+        def handle(summary):
+            with write_lock:
+                # 中断后仍可能有在途任务完成，文件已关闭时丢弃（续传时会重新测试）
+                if writer.file.closed:
+                    return
+                writer.write(summary)
+            self.histogram.merge(summary['histogram'])
+            with self.lock:
+                self.completed += 1
+                self.window.append(summary)
+            if on_result:
+                on_result(summary)
+
+        status = 'completed'
+        try:
+            domains = islice(iter_domains(source), position, None)
+            for chunk in chunked(domains, self.chunk_size):
+                self.engine.run(chunk, self.servers, self.record_type, self.iterations,
+                                on_result=handle, should_continue=should_continue)
+                if should_continue and not should_continue():
+                    # 未完成的块不写断点，续传时从块首重新测试（已写入的行会被截断）
+                    status = 'cancelled'
+                    break
+                position += len(chunk)
+                data = {
+                    'version': CHECKPOINT_VERSION,
+                    'source': os.path.abspath(source) if source != '-' else '-',
+                    'servers': self.servers,
+                    'record_type': self.record_type,
+                    'position': position,
+                    'output_offset': writer.flush(),
+                    'completed': self.completed,
+                    'histogram': self.histogram.to_dict(),
+                    'updated': time.strftime('%Y-%m-%d %H:%M:%S')
+                }
+                save_checkpoint(output, data)
+                if on_chunk:
+                    on_chunk(data)
+        finally:
+            with write_lock:
+                writer.flush()
+                writer.close()
+
+        if status == 'completed' and os.path.exists(checkpoint_path(output)):
+            os.remove(checkpoint_path(output))
+        return {'status': status, 'position': position, 'stats': self.stats()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="大规模域名列表的流式批量DNS测试")
+    parser.add_argument('source', help="域名列表文件，-表示标准输入")
+    parser.add_argument('-s', '--servers', nargs='+', required=True, help="DNS服务器IP")
+    parser.add_argument('-o', '--output', required=True, help="结果文件（.csv或.jsonl）")
+    parser.add_argument('-t', '--type', default='A', help="记录类型")
+    parser.add_argument('-n', '--iterations', type=int, default=1, help="每个(域名, 服务器)的查询次数")
+    parser.add_argument('-w', '--workers', type=int, default=32, help="并发工作线程数")
+    parser.add_argument('--per-server', type=int, default=None,
+                        help="每个DNS服务器同时在途的最大查询数，默认按服务器数平分工作线程")
+    parser.add_argument('--qps', type=float, default=100, help="每秒查询数上限，0表示不限")
+    parser.add_argument('--chunk', type=int, default=1000, help="每块的域名数（断点粒度）")
+    parser.add_argument('--transport', default='UDP', help="传输方式（UDP/TCP/DoT/DoH）")
+    parser.add_argument('--resume', action='store_true', help="从断点继续")
+    args = parser.parse_args(argv)
+
+    engine = BatchDNSEngine(max_workers=args.workers, qps=args.qps, per_server=args.per_server,
+                            transport=args.transport)
+    runner = BulkRunner(args.servers, args.type, args.iterations, engine, chunk_size=args.chunk)
+    total = count_domains(args.source)
+    start = time.perf_counter()
+    stop = threading.Event()
+
+    def on_chunk(data):
+        elapsed = time.perf_counter() - start
+        progress = f"{data['position']}/{total}" if total else str(data['position'])
+        print(f"已处理 {progress} 个域名，{runner.completed} 个任务，{elapsed:.1f}秒 "
+              f"{format_percentiles(runner.histogram)}", file=sys.stderr)
+
+    try:
+        result = runner.run(args.source, args.output, args.resume, on_chunk=on_chunk,
+                            should_continue=lambda: not stop.is_set())
+    except KeyboardInterrupt:
+        stop.set()
+        print("已中断，可使用--resume从最后一个断点继续", file=sys.stderr)
+        return
+    stats = result['stats']
+    print(f"{result['status']}: {stats['completed']} 个任务，成功率 {stats['success_rate']:.1%}，"
+          f"{format_percentiles(runner.histogram, (50, 90, 99, 99.9))}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
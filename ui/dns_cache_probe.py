@@ -0,0 +1,216 @@
+# -- coding: utf-8 --
+"""冷/热缓存DNS延迟测量模块
+
+对同一名称重复查询，测到的基本是递归服务器的缓存命中延迟（热缓存）。冷缓存延迟
+（递归服务器需要向权威服务器查询）用以下两种方式测量：
+    - 随机标签：每次查询"<随机标签>.<区域>"，名称从未被查询过，必然缓存未命中。区域是泛解析域时得到正常应答，
+      否则得到NXDOMAIN，同样需要一次到权威服务器的查询（启用RFC 8198激进NSEC缓存的服务器除外），
+      因此NXDOMAIN也计为有效样本
+    - 按TTL间隔：读取应答中的剩余TTL，等待缓存过期后再查询，只适用于TTL较短的名称
+热缓存样本在预热查询之后重复查询同一名称得到；冷热查询交替进行，网络波动对两者的影响相同
+
+命令行用法：
+    python -m ui.dns_cache_probe 8.8.8.8 example.com -n 10
+    python -m ui.dns_cache_probe 8.8.8.8 www.example.com --zone wildcard.example.net
+    python -m ui.dns_cache_probe --stub --upstream-delay 0.08 -n 20     # 对本地模拟递归服务器测试（需在源码目录运行）
+"""
+
+import time
+import random
+import string
+import argparse
+from typing import Dict, Any, Optional, Callable
+
+from .dns_resolver_pool import dns_resolver_pool, SYSTEM_DEFAULT
+from .dns_transports import transport_pool, create_transport
+from .latency_histogram import LatencyHistogram
+
+# 计为有效测量的响应码（SERVFAIL、REFUSED等按失败计）
+VALID_RCODES = ('NOERROR', 'NXDOMAIN')
+
+
+def random_label(length: int = 12) -> str:
+    """生成随机DNS标签"""
+    return ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(length))
+
+
+def cache_busting_name(zone: str) -> str:
+    """生成区域下从未查询过的名称"""
+    return f"{random_label()}.{zone.strip('.')}"
+
+
+class CacheProbe:
+    """对单个DNS服务器分别测量冷缓存和热缓存延迟"""
+
+    def __init__(self, server: str, port: int = 53, transport: str = 'UDP', timeout: float = 5):
+        """初始化测量器
+
+        :param server: DNS服务器IP，"系统默认"表示系统配置的第一个DNS服务器
+        :param port: 服务器端口，非53端口时使用独立的传输对象（用于本地桩服务器）
+        :param transport: 传输方式（UDP/TCP/DoT/DoH）
+        :param timeout: 查询超时时间（秒）
+        """
+        if server in (None, '', SYSTEM_DEFAULT):
+            server = dns_resolver_pool.get_resolver().nameservers[0]
+        self.server = server
+        if port == 53:
+            self.transport = transport_pool.get(transport, server)
+        else:
+            self.transport = create_transport(transport, server, port=port, timeout=timeout)
+
+    def query(self, name: str, record_type: str = 'A') -> Dict[str, Any]:
+        """执行一次查询，响应码不在VALID_RCODES中时按失败处理"""
+        result = self.transport.query(name, record_type)
+        if result['success'] and result.get('rcode') not in VALID_RCODES:
+            result = dict(result, success=False, error=f"响应码 {result.get('rcode')}")
+        return result
+
+    def measure(self, domain: str, iterations: int = 5, record_type: str = 'A', zone: Optional[str] = None,
+                on_sample: Optional[Callable[[str, str, Dict[str, Any]], None]] = None,
+                should_continue: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        """随机标签方式测量
+
+        :param domain: 热缓存测量使用的名称
+        :param iterations: 冷、热样本各自的数量
+        :param zone: 随机标签所在的区域（最好是泛解析域），默认为domain本身
+        :param on_sample: 每个样本完成时调用，参数为('cold'或'warm', 查询的名称, 查询结果)
+        :param should_continue: 取消检查函数，返回False时停止
+        :return: 见summarize
+        """
+        cold, warm = LatencyHistogram(), LatencyHistogram()
+        zone = zone or domain
+
+        # 预热：确保热缓存样本命中缓存，本次结果不计入
+        self.query(domain, record_type)
+
+        for _ in range(iterations):
+            if should_continue and not should_continue():
+                break
+            name = cache_busting_name(zone)
+            result = self.query(name, record_type)
+            cold.record_result(result)
+            if on_sample:
+                on_sample('cold', name, result)
+
+            result = self.query(domain, record_type)
+            warm.record_result(result)
+            if on_sample:
+                on_sample('warm', domain, result)
+        return self.summarize(cold, warm)
+
+    def measure_ttl(self, domain: str, iterations: int = 3, record_type: str = 'A', max_wait: float = 30,
+                    on_sample: Optional[Callable[[str, str, Dict[str, Any]], None]] = None,
+                    should_continue: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        """按TTL间隔方式测量：等待缓存过期后的第一次查询为冷样本，紧接着的查询为热样本
+
+        :param max_wait: 最长等待时间（秒），剩余TTL超过该值时停止并在结果的reason中说明
+        :return: 见summarize，另含'reason'（提前结束的原因，正常完成为None）
+        """
+        cold, warm = LatencyHistogram(), LatencyHistogram()
+        reason = None
+        result = self.query(domain, record_type)
+
+        for _ in range(iterations):
+            ttl = result.get('ttl')
+            if not result['success'] or ttl is None:
+                reason = result.get('error') or "应答中没有记录，无法获取TTL"
+                break
+            if ttl + 1 > max_wait:
+                reason = f"剩余TTL {ttl}秒超过最长等待时间"
+                break
+
+            # 等待缓存过期，但允许及时停止
+            deadline = time.monotonic() + ttl + 1
+            while time.monotonic() < deadline:
+                if should_continue and not should_continue():
+                    return dict(self.summarize(cold, warm), reason="已取消")
+                time.sleep(min(0.1, max(0.0, deadline - time.monotonic())))
+
+            result = self.query(domain, record_type)
+            cold.record_result(result)
+            if on_sample:
+                on_sample('cold', domain, result)
+
+            result = self.query(domain, record_type)
+            warm.record_result(result)
+            if on_sample:
+                on_sample('warm', domain, result)
+        return dict(self.summarize(cold, warm), reason=reason)
+
+    @staticmethod
+    def summarize(cold: LatencyHistogram, warm: LatencyHistogram) -> Dict[str, Any]:
+        """汇总冷热两组样本
+
+        :return: {'cold', 'warm'（LatencyHistogram）, 'cold_p50', 'warm_p50',
+                  'cache_miss_ms'（冷热中位数之差，即一次缓存未命中的额外耗时）}
+        """
+        cold_p50 = cold.percentile(50)
+        warm_p50 = warm.percentile(50)
+        return {
+            'cold': cold,
+            'warm': warm,
+            'cold_p50': cold_p50,
+            'warm_p50': warm_p50,
+            'cache_miss_ms': cold_p50 - warm_p50 if cold_p50 is not None and warm_p50 is not None else None
+        }
+
+
+def _format_ms(value: Optional[float]) -> str:
+    return f"{value:.2f}ms" if value is not None else "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷/热缓存DNS延迟测量")
+    parser.add_argument('server', nargs='?', help="DNS服务器IP（使用--stub时可省略）")
+    parser.add_argument('domain', nargs='?', default='example.com', help="测试域名")
+    parser.add_argument('-n', '--iterations', type=int, default=10, help="冷、热样本各自的数量")
+    parser.add_argument('-t', '--type', default='A', help="记录类型")
+    parser.add_argument('--transport', default='UDP', help="传输方式（UDP/TCP/DoT/DoH）")
+    parser.add_argument('--zone', help="随机标签所在的区域（泛解析域），默认为测试域名")
+    parser.add_argument('--ttl-mode', action='store_true', help="按TTL间隔测量，代替随机标签")
+    parser.add_argument('--max-wait', type=float, default=30, help="TTL模式的最长等待时间（秒）")
+    parser.add_argument('--stub', action='store_true', help="启动本地模拟递归服务器并对其测试")
+    parser.add_argument('--upstream-delay', type=float, default=0.05, help="模拟的上游延迟（秒）")
+    args = parser.parse_args(argv)
+
+    stub = None
+    domain = args.domain
+    if args.stub:
+        if args.server and args.domain == parser.get_default('domain'):
+            # 使用桩服务器时第一个位置参数是域名
+            domain = args.server
+        try:
+            from tests.dns_stubs import StubRecursiveDNSServer
+        except ImportError:
+            parser.error("--stub需要在源码目录中运行（模拟递归服务器位于tests/dns_stubs.py）")
+        stub = StubRecursiveDNSServer(upstream_delay=args.upstream_delay, ttl=max(2, int(args.max_wait) // 2)).start()
+        probe = CacheProbe(stub.address, port=stub.port)
+    elif not args.server:
+        parser.error("需要指定DNS服务器或使用--stub")
+    else:
+        probe = CacheProbe(args.server, transport=args.transport)
+
+    def on_sample(kind, name, result):
+        status = result.get('rcode') if result['success'] else result['error']
+        print(f"{'冷' if kind == 'cold' else '热'} {name:<40} {_format_ms(result['time_ms'])} {status}")
+
+    try:
+        if args.ttl_mode:
+            summary = probe.measure_ttl(domain, args.iterations, args.type, args.max_wait, on_sample)
+        else:
+            summary = probe.measure(domain, args.iterations, args.type, args.zone, on_sample)
+    finally:
+        if stub:
+            stub.stop()
+
+    for kind, label in (('cold', '冷缓存'), ('warm', '热缓存')):
+        stats = summary[kind].summary()
+        print(f"{label}: 样本 {stats['count']}, 平均 {_format_ms(stats['mean'])}, P50 {_format_ms(stats['p50'])}, "
+              f"P90 {_format_ms(stats['p90'])}, 成功率 {stats['success_rate']:.1%}")
+    print(f"缓存未命中额外耗时: {_format_ms(summary['cache_miss_ms'])}")
+    if summary.get('reason'):
+        print(f"提前结束: {summary['reason']}")
+
+
+if __name__ == '__main__':
+    main()
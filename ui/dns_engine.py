@@ -0,0 +1,288 @@
+# -- coding: utf-8 --
+"""并发批量DNS测试引擎
+
+批量测试按(域名, DNS服务器)划分任务，由固定数量的工作者并发执行：
+    - 工作者提交到应用任务执行器的query工作池，批量导入的每个分块复用同一组线程，
+      并发数同时受max_workers和query工作池线程数上限约束
+    - 全局令牌桶限制每秒查询数，避免触发服务器限速或被当作攻击
+    - 每个DNS服务器的同时在途查询数有上限，工作线程在服务器之间轮转取任务，保证各服务器公平推进
+    - 每个任务完成即通过回调输出结果，界面不需要等待整批结束
+    - 取消检查函数返回False时尽快停止（等待令牌和取任务时都会检查）
+
+服务器比较和多记录类型查询按轮进行：每轮同时向所有目标各发一次查询，网络的瞬时波动对各目标影响相同，
+一轮的耗时约等于最慢目标的响应时间
+
+UDP查询使用共享解析器池，TCP/DoT/DoH查询使用共享的长连接传输对象（见dns_transports）
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+from .dns_resolver_pool import dns_resolver_pool, SYSTEM_DEFAULT
+from .dns_transports import transport_pool
+from .latency_histogram import LatencyHistogram
+from .task_executor import task_executor
+
+
+class TokenBucket:
+    """令牌桶限速器"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """初始化令牌桶
+
+        :param rate: 每秒补充的令牌数，<=0表示不限速
+        :param burst: 桶容量（允许的突发数），默认等于rate且至少为1
+        """
+        self.rate = rate
+        self.capacity = max(1.0, burst if burst is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, should_continue: Optional[Callable[[], bool]] = None) -> bool:
+        """获取一个令牌，必要时等待
+
+        :param should_continue: 取消检查函数，返回False时放弃等待
+        :return: 获取成功返回True，被取消返回False
+        """
+        if self.rate <= 0:
+            return True
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if should_continue and not should_continue():
+                return False
+            time.sleep(min(wait, 0.1))
+
+
+class BatchDNSEngine:
+    """并发批量DNS测试引擎"""
+
+    def __init__(self, pool=None, max_workers: int = 16, qps: float = 50, per_server: Optional[int] = None,
+                 transport: str = 'UDP'):
+        """初始化批量测试引擎
+
+        :param pool: DNSResolverPool实例，默认使用共享的全局解析器池
+        :param max_workers: 并发工作者数（实际并发数不超过query工作池的线程数上限）
+        :param qps: 全局每秒查询数上限，<=0表示不限速
+        :param per_server: 每个DNS服务器同时在途的最大任务数，默认按本次测试的服务器数平分工作线程
+        :param transport: 传输方式（UDP/TCP/DoT/DoH）
+        """
+        self.pool = pool or dns_resolver_pool
+        self.max_workers = max(1, max_workers)
+        self.per_server = max(1, per_server) if per_server else None
+        self.limiter = TokenBucket(qps)
+        self.transport = transport
+
+    def query(self, domain: str, server: str, record_type: str = 'A', transport: Optional[str] = None) -> Dict[str, Any]:
+        """按指定传输方式执行一次查询
+
+        系统默认服务器只支持UDP；结果中的handshake_ms为本次查询新建连接的耗时（UDP为0）
+        """
+        transport = transport or self.transport
+        if transport == 'UDP' or server in (None, '', SYSTEM_DEFAULT):
+            result = self.pool.resolve(domain, server, record_type)
+            result.setdefault('handshake_ms', 0.0)
+            return result
+        return transport_pool.get(transport, server).query(domain, record_type)
+
+    def measure(self, domain: str, server: str, record_type: str = 'A', iterations: int = 3,
+                should_continue: Optional[Callable[[], bool]] = None) -> Optional[Dict[str, Any]]:
+        """对单个(域名, 服务器)执行多次查询并汇总
+
+        :return: {'domain', 'server', 'record_type', 'avg_time', 'min_time', 'max_time', 'p50_time',
+                  'p90_time', 'p99_time', 'success_rate', 'queries', 'error', 'histogram'}，被取消时返回None
+        """
+        histogram = LatencyHistogram()
+        error = None
+        for _ in range(iterations):
+            if not self.limiter.acquire(should_continue):
+                return None
+            result = self.query(domain, server, record_type)
+            histogram.record_result(result)
+            if not result['success']:
+                error = result['error']
+
+        percentiles = histogram.percentiles((50, 90, 99))
+        return {
+            'domain': domain,
+            'server': server,
+            'record_type': record_type,
+            'avg_time': histogram.mean or 0,
+            'min_time': histogram.min or 0,
+            'max_time': histogram.max or 0,
+            'p50_time': percentiles[50] or 0,
+            'p90_time': percentiles[90] or 0,
+            'p99_time': percentiles[99] or 0,
+            'success_rate': histogram.success_rate,
+            'queries': iterations,
+            'error': None if histogram.count else error,
+            # 可与其他任务的直方图合并，得到整批的延迟分布
+            'histogram': histogram
+        }
+
+    def run(self, domains: List[str], servers: List[str], record_type: str = 'A', iterations: int = 3,
+            on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+            should_continue: Optional[Callable[[], bool]] = None) -> List[Dict[str, Any]]:
+        """执行批量测试（阻塞直到完成或取消）
+
+        :param domains: 域名列表
+        :param servers: DNS服务器列表
+        :param record_type: 记录类型
+        :param iterations: 每个(域名, 服务器)的查询次数
+        :param on_result: 每个任务完成时在工作线程中调用，参数为measure的返回值
+        :param should_continue: 取消检查函数，返回False时停止
+        :return: 已完成任务的结果列表（按完成顺序）
+        """
+        queues = {server: deque(domains) for server in servers}
+        in_flight = {server: 0 for server in servers}
+        # 未指定时每个服务器可使用的在途任务数为工作线程数按服务器平分，单个服务器时可用满全部线程
+        per_server = self.per_server or max(1, self.max_workers // max(1, len(servers)))
+        order = list(queues)
+        condition = threading.Condition()
+        results = []
+        state = {'next': 0}
+
+        def cancelled():
+            return should_continue is not None and not should_continue()
+
+        def next_task():
+            # 从上次位置开始轮转，选出第一个有待测域名且未达在途上限的服务器
+            with condition:
+                while not cancelled():
+                    pending = False
+                    for offset in range(len(order)):
+                        index = (state['next'] + offset) % len(order)
+                        server = order[index]
+                        if not queues[server]:
+                            continue
+                        pending = True
+                        if in_flight[server] < per_server:
+                            in_flight[server] += 1
+                            state['next'] = index + 1
+                            return server, queues[server].popleft()
+                    if not pending:
+                        return None
+                    condition.wait(0.2)
+                return None
+
+        def worker(task):
+            while not task.cancelled:
+                item = next_task()
+                if item is None:
+                    return
+                server, domain = item
+                try:
+                    summary = self.measure(domain, server, record_type, iterations, should_continue)
+                finally:
+                    with condition:
+                        in_flight[server] -= 1
+                        condition.notify_all()
+                if summary is None:
+                    return
+                with condition:
+                    results.append(summary)
+                if on_result:
+                    on_result(summary)
+
+        total = len(domains) * len(servers)
+        workers = [task_executor.submit('query', worker, name="BatchDNS")
+                   for _ in range(min(self.max_workers, total))]
+        wait([task.future for task in workers])
+        # 执行器关闭时排队中的工作者被取消，其余工作者的异常向调用方抛出
+        for task in workers:
+            if not task.future.cancelled() and task.future.exception() is not None:
+                raise task.future.exception()
+        return results
+
+    def _rounds(self, domain: str, targets: List[Tuple[str, str, str]], iterations: int,
+                on_round: Optional[Callable[[int, Dict[Tuple[str, str, str], Dict[str, Any]], float], None]] = None,
+                should_continue: Optional[Callable[[], bool]] = None) -> Dict[Tuple[str, str, str], List[Dict[str, Any]]]:
+        """按轮并发查询多个(服务器, 记录类型, 传输方式)目标
+
+        每轮向所有目标同时发送一次查询，且每轮轮换发送顺序，避免某个目标总是最先发出
+
+        :param on_round: 每轮结束时调用，参数为(已完成轮数, 本轮各目标的结果, 本轮耗时ms)
+        :return: 目标到各轮查询结果列表的字典
+        """
+        samples = {target: [] for target in targets}
+        if not targets:
+            return samples
+
+        # 每轮的查询必须同时发出才能公平比较，因此使用按目标数创建的独立线程池，
+        # 不使用应用的有界工作池（排队会把等待时间计入部分目标的延迟）
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            for round_index in range(iterations):
+                if should_continue and not should_continue():
+                    break
+                shift = round_index % len(targets)
+                order = targets[shift:] + targets[:shift]
+                start = time.perf_counter()
+                futures = [(target, executor.submit(self.query, domain, target[0], target[1], target[2]))
+                           for target in order]
+                round_results = {target: future.result() for target, future in futures}
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                for target, result in round_results.items():
+                    samples[target].append(result)
+                if on_round:
+                    on_round(round_index + 1, round_results, elapsed_ms)
+        return samples
+
+    def compare(self, domain: str, servers: List[str], record_type: str = 'A', iterations: int = 3,
+                on_round: Optional[Callable[[int, int], None]] = None,
+                should_continue: Optional[Callable[[], bool]] = None,
+                transports: Optional[List[str]] = None) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+        """并发比较多个DNS服务器（可同时比较多种传输方式）
+
+        :param domain: 测试域名
+        :param servers: DNS服务器列表
+        :param record_type: 记录类型
+        :param iterations: 轮数（每个目标的查询次数）
+        :param on_round: 每轮结束时调用，参数为(已完成轮数, 总轮数)
+        :param should_continue: 取消检查函数，返回False时在下一轮开始前停止
+        :param transports: 传输方式列表，默认只使用引擎的传输方式
+        :return: (服务器, 传输方式)到各轮查询结果列表的字典
+        """
+        targets = [(server, record_type, transport)
+                   for server in servers for transport in (transports or [self.transport])]
+        samples = self._rounds(domain, targets, iterations,
+                               lambda done, results, elapsed: on_round and on_round(done, iterations),
+                               should_continue)
+        return {(server, transport): results for (server, _, transport), results in samples.items()}
+
+    def resolve_types(self, domain: str, servers: List[str], record_types: List[str], iterations: int = 1,
+                      on_round: Optional[Callable[[int, Dict[Tuple[str, str], Dict[str, Any]], float], None]] = None,
+                      should_continue: Optional[Callable[[], bool]] = None,
+                      transport: Optional[str] = None) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+        """并发查询一个域名的多种记录类型（可同时查询多个服务器）
+
+        每轮所有(服务器, 记录类型)同时发出，一轮的耗时约等于最慢的一个查询，而不是各查询耗时之和
+
+        :param domain: 查询的域名
+        :param servers: DNS服务器列表
+        :param record_types: 记录类型列表
+        :param iterations: 轮数
+        :param on_round: 每轮结束时在调用线程中调用，参数为(已完成轮数, {(服务器, 记录类型): 结果}, 本轮耗时ms)
+        :param should_continue: 取消检查函数，返回False时在下一轮开始前停止
+        :param transport: 传输方式，默认使用引擎的传输方式
+        :return: (服务器, 记录类型)到各轮查询结果列表的字典
+        """
+        transport = transport or self.transport
+        targets = [(server, record_type, transport) for server in servers for record_type in record_types]
+
+        def round_done(done, results, elapsed):
+            if on_round:
+                on_round(done, {(server, record_type): result
+                                for (server, record_type, _), result in results.items()}, elapsed)
+
+        samples = self._rounds(domain, targets, iterations, round_done, should_continue)
+        return {(server, record_type): results for (server, record_type, _), results in samples.items()}
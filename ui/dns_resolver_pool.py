@@ -0,0 +1,134 @@
+# -- coding: utf-8 --
+"""DNS解析器池模块
+
+按(DNS服务器, 超时参数)缓存dnspython解析器，快速测试、批量测试、实时监控和服务器比较共用，
+避免每次查询都重新读取系统解析配置。计时只取报文往返时间（answer.response.time），
+解析器构建、报文编解码等本地开销单独统计，用于确认测量结果未被污染
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
+
+import dns.resolver
+
+# 表示使用系统默认DNS服务器的名称（与界面下拉框一致）
+SYSTEM_DEFAULT = "系统默认"
+
+
+class DNSResolverPool:
+    """共享的DNS解析器池"""
+
+    def __init__(self, timeout: float = 5, lifetime: float = 5, overhead_window: int = 1000):
+        """初始化解析器池
+
+        :param timeout: 单次查询超时时间（秒）
+        :param lifetime: 整个解析过程（含重试）的最长时间（秒）
+        :param overhead_window: 本地开销统计保留的最近查询数
+        """
+        self.timeout = timeout
+        self.lifetime = lifetime
+        self.resolvers = {}
+        self.lock = threading.Lock()
+        self.overheads = deque(maxlen=overhead_window)
+
+    @staticmethod
+    def make_key(nameserver: Optional[str], timeout: float, lifetime: float, port: int = 53) -> Tuple:
+        """生成解析器缓存键，系统默认服务器统一为None"""
+        if nameserver in (None, '', SYSTEM_DEFAULT):
+            nameserver = None
+        return nameserver, float(timeout), float(lifetime), port
+
+    def get_resolver(self, nameserver: Optional[str] = None, timeout: Optional[float] = None,
+                     lifetime: Optional[float] = None, port: int = 53) -> dns.resolver.Resolver:
+        """获取（必要时创建）指定服务器和参数的解析器
+
+        :param nameserver: DNS服务器IP，None或"系统默认"表示使用系统配置
+        :param timeout: 单次查询超时，默认使用池的设置
+        :param lifetime: 解析总时长上限，默认使用池的设置
+        :param port: DNS服务器端口
+        """
+        key = self.make_key(nameserver, self.timeout if timeout is None else timeout,
+                            self.lifetime if lifetime is None else lifetime, port)
+        resolver = self.resolvers.get(key)
+        if resolver is not None:
+            return resolver
+
+        with self.lock:
+            resolver = self.resolvers.get(key)
+            if resolver is None:
+                # 指定服务器时不读取系统配置
+                resolver = dns.resolver.Resolver(configure=key[0] is None)
+                if key[0] is not None:
+                    resolver.nameservers = [key[0]]
+                resolver.timeout = key[1]
+                resolver.lifetime = key[2]
+                resolver.port = port
+                self.resolvers[key] = resolver
+        return resolver
+
+    def resolve(self, hostname: str, nameserver: Optional[str] = None, record_type: str = 'A',
+                timeout: Optional[float] = None, lifetime: Optional[float] = None) -> Dict[str, Any]:
+        """执行一次DNS查询并计时
+
+        :param hostname: 查询的域名
+        :param nameserver: DNS服务器IP，None或"系统默认"表示使用系统配置
+        :param record_type: 记录类型
+        :return: {'success', 'time_ms'（报文往返时间）, 'total_ms'（含本地开销）,
+                  'overhead_ms', 'answers'（结果列表）, 'error'}
+        """
+        resolver = self.get_resolver(nameserver, timeout, lifetime)
+        start = time.perf_counter()
+        try:
+            answer = resolver.resolve(hostname, record_type)
+        except Exception as e:
+            return {
+                'success': False,
+                'time_ms': None,
+                'total_ms': (time.perf_counter() - start) * 1000,
+                'overhead_ms': None,
+                'answers': [],
+                'error': str(e)
+            }
+        total_ms = (time.perf_counter() - start) * 1000
+
+        # response.time为最后一次成功查询的报文往返时间，不含解析器内部的编解码和重试开销
+        wire_time = getattr(answer.response, 'time', None)
+        time_ms = wire_time * 1000 if wire_time is not None else total_ms
+        overhead_ms = max(0.0, total_ms - time_ms)
+        self.overheads.append(overhead_ms)
+
+        return {
+            'success': True,
+            'time_ms': time_ms,
+            'total_ms': total_ms,
+            'overhead_ms': overhead_ms,
+            'answers': [str(rdata) for rdata in answer],
+            'error': None
+        }
+
+    def overhead_stats(self) -> Dict[str, Any]:
+        """最近查询的本地开销统计（毫秒）
+
+        :return: {'count', 'mean', 'p95', 'max'}，没有数据时数值为None
+        """
+        samples = sorted(self.overheads)
+        if not samples:
+            return {'count': 0, 'mean': None, 'p95': None, 'max': None}
+        return {
+            'count': len(samples),
+            'mean': sum(samples) / len(samples),
+            'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            'max': samples[-1]
+        }
+
+    def clear(self):
+        """清空解析器和开销统计（系统DNS配置变化后调用）"""
+        with self.lock:
+            self.resolvers.clear()
+        self.overheads.clear()
+
+
+# 创建全局实例
+dns_resolver_pool = DNSResolverPool()
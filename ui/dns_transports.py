@@ -0,0 +1,400 @@
+# -- coding: utf-8 --
+"""DNS传输协议模块
+
+支持UDP、TCP、DNS over TLS（DoT）和DNS over HTTPS（DoH）四种传输方式：
+    - TCP/DoT/DoH保持长连接，多次查询复用连接；每个服务器有一个小连接池，并发查询各用一个连接，互不排队
+    - 建立连接的耗时（TCP握手、TLS握手）单独统计，不计入单次查询延迟
+    - 根据握手和查询的累计耗时计算摊销延迟和吞吐量，便于比较加密DNS的实际开销
+
+DoH基于标准库http.client实现（RFC 8484 POST方式），不需要额外依赖
+"""
+
+import ssl
+import time
+import socket
+import struct
+import threading
+import http.client
+from contextlib import nullcontext
+from typing import Dict, Any, Optional, Tuple
+
+import dns.query
+import dns.message
+import dns.exception
+import dns.rcode
+import dns.rdatatype
+
+# 支持的传输方式
+TRANSPORTS = ('UDP', 'TCP', 'DoT', 'DoH')
+
+# 每个(传输方式, 服务器)同时使用的长连接数上限
+DEFAULT_MAX_CONNECTIONS = 4
+
+# 公共DNS服务器的TLS主机名（DoT的SNI和证书校验）与DoH地址
+ENCRYPTED_ENDPOINTS = {
+    '8.8.8.8': ('dns.google', 'https://dns.google/dns-query'),
+    '8.8.4.4': ('dns.google', 'https://dns.google/dns-query'),
+    '1.1.1.1': ('one.one.one.one', 'https://cloudflare-dns.com/dns-query'),
+    '1.0.0.1': ('one.one.one.one', 'https://cloudflare-dns.com/dns-query'),
+    '9.9.9.9': ('dns.quad9.net', 'https://dns.quad9.net/dns-query'),
+    '223.5.5.5': ('dns.alidns.com', 'https://dns.alidns.com/dns-query'),
+    '223.6.6.6': ('dns.alidns.com', 'https://dns.alidns.com/dns-query'),
+    '119.29.29.29': ('dot.pub', 'https://doh.pub/dns-query'),
+    '208.67.222.222': ('dns.opendns.com', 'https://doh.opendns.com/dns-query'),
+    '1.12.12.12': ('dns.pub', 'https://doh.pub/dns-query'),
+}
+
+
+def _parse_url(url: str) -> Tuple[str, int, str]:
+    """拆分https地址为(主机名, 端口, 路径)"""
+    rest = url.split('://', 1)[-1]
+    host_port, _, path = rest.partition('/')
+    host, _, port = host_port.partition(':')
+    return host, int(port) if port else 443, '/' + path
+
+
+def _create_connection(address: str, port: int, timeout: float) -> socket.socket:
+    """建立TCP连接并关闭Nagle算法，避免小报文被延迟确认拖慢"""
+    sock = socket.create_connection((address, port), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class DNSTransport:
+    """传输方式基类，管理长连接池并统计握手和查询耗时"""
+
+    name = 'UDP'
+    # 是否基于连接（TCP/DoT/DoH），基于连接的传输限制同时使用的连接数
+    connection_oriented = False
+
+    def __init__(self, server: str, port: int = 53, timeout: float = 5,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        """初始化传输
+
+        :param server: DNS服务器IP
+        :param port: 服务器端口
+        :param timeout: 连接和查询超时时间（秒）
+        :param max_connections: 同时使用的长连接数上限，超出的查询等待空闲连接
+        """
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.max_connections = max(1, max_connections)
+        self.slots = threading.BoundedSemaphore(self.max_connections) if self.connection_oriented else None
+        self.lock = threading.Lock()
+        self.idle = []
+        # close后递增，使用中的旧连接归还时直接关闭
+        self.generation = 0
+        self.handshakes = 0
+        self.handshake_ms = 0.0
+        self.queries = 0
+        self.query_ms = 0.0
+
+    def _open(self):
+        """建立新连接，无连接的传输返回None"""
+        return None
+
+    def _close_connection(self, conn):
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _reusable(self, conn) -> bool:
+        """查询结束后连接是否仍可复用"""
+        return True
+
+    def _exchange(self, conn, message: dns.message.Message) -> dns.message.Message:
+        """在连接上发送查询并接收响应"""
+        return dns.query.udp(message, self.server, timeout=self.timeout, port=self.port)
+
+    def _open_connection(self) -> Tuple[Any, float, int]:
+        """新建连接，返回(连接, 握手耗时, 连接所属的代)"""
+        with self.lock:
+            generation = self.generation
+        start = time.perf_counter()
+        conn = self._open()
+        if conn is None:
+            return None, 0.0, generation
+        with self.lock:
+            return conn, self._record_handshake(start), generation
+
+    def _acquire(self) -> Tuple[Any, float, int]:
+        """取一个空闲连接，没有时新建"""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), 0.0, self.generation
+        return self._open_connection()
+
+    def _release(self, conn, generation: int):
+        """归还连接，已关闭、不可复用或空闲连接已满时关闭"""
+        if conn is None:
+            return
+        with self.lock:
+            if generation == self.generation and self._reusable(conn) and len(self.idle) < self.max_connections:
+                self.idle.append(conn)
+                return
+        self._close_connection(conn)
+
+    def connect(self) -> float:
+        """预先建立一个连接，返回握手耗时（毫秒）；已有空闲连接或无连接的传输返回0"""
+        with self.slots or nullcontext():
+            conn, handshake_ms, generation = self._acquire()
+            self._release(conn, generation)
+        return handshake_ms
+
+    def close(self):
+        """关闭空闲连接，使用中的连接在其查询结束后关闭，之后的查询重新建立连接"""
+        with self.lock:
+            self.generation += 1
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            self._close_connection(conn)
+
+    def query(self, hostname: str, record_type: str = 'A') -> Dict[str, Any]:
+        """执行一次查询
+
+        :return: {'success', 'time_ms'（查询延迟，不含握手）, 'handshake_ms'（本次新建连接的耗时）,
+                  'reused'（是否复用已有连接）, 'answers', 'rcode'（响应码文本，如NOERROR、NXDOMAIN）,
+                  'ttl'（应答记录的最小TTL，没有应答记录时为None）, 'error'}
+        """
+        message = dns.message.make_query(hostname, dns.rdatatype.from_text(record_type))
+        with self.slots or nullcontext():
+            conn = None
+            handshake_ms = 0.0
+            try:
+                conn, handshake_ms, generation = self._acquire()
+                start = time.perf_counter()
+                try:
+                    response = self._exchange(conn, message)
+                except (OSError, EOFError, http.client.HTTPException, dns.exception.DNSException):
+                    # 复用的长连接可能已被服务器关闭，重连后重试一次
+                    if not self.connection_oriented or handshake_ms:
+                        raise
+                    self._close_connection(conn)
+                    conn = None
+                    conn, handshake_ms, generation = self._open_connection()
+                    start = time.perf_counter()
+                    response = self._exchange(conn, message)
+                time_ms = (time.perf_counter() - start) * 1000
+            except Exception as e:
+                if conn is not None:
+                    self._close_connection(conn)
+                return {'success': False, 'time_ms': None, 'handshake_ms': handshake_ms,
+                        'reused': False, 'answers': [], 'rcode': None, 'ttl': None, 'error': str(e)}
+            self._release(conn, generation)
+
+        with self.lock:
+            self.queries += 1
+            self.query_ms += time_ms
+
+        rrsets = [rrset for rrset in response.answer if rrset.rdtype == message.question[0].rdtype]
+        return {
+            'success': True,
+            'time_ms': time_ms,
+            'handshake_ms': handshake_ms,
+            'reused': handshake_ms == 0 and self.connection_oriented,
+            'answers': [str(rdata) for rrset in rrsets for rdata in rrset],
+            'rcode': dns.rcode.to_text(response.rcode()),
+            'ttl': min(rrset.ttl for rrset in rrsets) if rrsets else None,
+            'error': None
+        }
+
+    def _record_handshake(self, start: float) -> float:
+        """记录一次握手（需持有锁）"""
+        elapsed = (time.perf_counter() - start) * 1000
+        self.handshakes += 1
+        self.handshake_ms += elapsed
+        return elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        """累计统计
+
+        :return: {'transport', 'queries', 'handshakes', 'avg_handshake_ms', 'avg_query_ms',
+                  'amortized_ms'（(握手总耗时+查询总耗时)/查询数）, 'throughput_qps'（串行查询的摊销吞吐量）}
+        """
+        with self.lock:
+            queries, handshakes = self.queries, self.handshakes
+            total_ms = self.handshake_ms + self.query_ms
+            return {
+                'transport': self.name,
+                'queries': queries,
+                'handshakes': handshakes,
+                'avg_handshake_ms': self.handshake_ms / handshakes if handshakes else 0.0,
+                'avg_query_ms': self.query_ms / queries if queries else 0.0,
+                'amortized_ms': total_ms / queries if queries else 0.0,
+                'throughput_qps': queries / (total_ms / 1000) if total_ms else 0.0
+            }
+
+    def reset_stats(self):
+        """清空统计（连接保持不变）"""
+        with self.lock:
+            self.handshakes = self.queries = 0
+            self.handshake_ms = self.query_ms = 0.0
+
+
+class UDPTransport(DNSTransport):
+    """经典UDP传输，无连接和握手"""
+
+    name = 'UDP'
+
+
+class TCPTransport(DNSTransport):
+    """DNS over TCP，长连接，报文前带2字节长度"""
+
+    name = 'TCP'
+    connection_oriented = True
+
+    def _open(self) -> socket.socket:
+        return _create_connection(self.server, self.port, self.timeout)
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError("连接已被服务器关闭")
+            data += chunk
+        return data
+
+    def _exchange(self, conn, message):
+        wire = message.to_wire()
+        conn.sendall(struct.pack('!H', len(wire)) + wire)
+        length = struct.unpack('!H', self._recv_exactly(conn, 2))[0]
+        response = dns.message.from_wire(self._recv_exactly(conn, length))
+        if response.id != message.id:
+            raise dns.exception.DNSException("响应ID不匹配")
+        return response
+
+
+class TLSTransport(TCPTransport):
+    """DNS over TLS（RFC 7858），握手耗时包含TCP连接和TLS握手"""
+
+    name = 'DoT'
+
+    def __init__(self, server: str, port: int = 853, timeout: float = 5, server_hostname: Optional[str] = None,
+                 ssl_context: Optional[ssl.SSLContext] = None, max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        """
+        :param server_hostname: TLS的SNI和证书校验主机名，默认按公共DNS列表查找
+        :param ssl_context: 自定义SSL上下文（如测试用的自签名证书）
+        """
+        super().__init__(server, port, timeout, max_connections)
+        self.server_hostname = server_hostname or ENCRYPTED_ENDPOINTS.get(server, (server, None))[0]
+        self.ssl_context = ssl_context or ssl.create_default_context()
+
+    def _open(self):
+        sock = _create_connection(self.server, self.port, self.timeout)
+        try:
+            return self.ssl_context.wrap_socket(sock, server_hostname=self.server_hostname)
+        except Exception:
+            sock.close()
+            raise
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """连接到指定IP的HTTPS连接，SNI和Host头仍使用主机名，避免测量中混入系统DNS解析"""
+
+    def __init__(self, host, address, port, timeout, ssl_context):
+        super().__init__(host, port, timeout=timeout, context=ssl_context)
+        self.address = address
+        self.ssl_context = ssl_context
+
+    def connect(self):
+        sock = _create_connection(self.address, self.port, self.timeout)
+        self.sock = self.ssl_context.wrap_socket(sock, server_hostname=self.host)
+
+
+class HTTPSTransport(DNSTransport):
+    """DNS over HTTPS（RFC 8484 POST），HTTP/1.1长连接"""
+
+    name = 'DoH'
+    connection_oriented = True
+
+    def __init__(self, server: str, port: Optional[int] = None, timeout: float = 5, url: Optional[str] = None,
+                 ssl_context: Optional[ssl.SSLContext] = None, max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        """
+        :param server: DNS服务器IP，直接连接该地址
+        :param url: DoH地址，默认按公共DNS列表查找，找不到时使用https://<server>/dns-query
+        :param ssl_context: 自定义SSL上下文
+        """
+        url = url or ENCRYPTED_ENDPOINTS.get(server, (None, f"https://{server}/dns-query"))[1]
+        self.host, default_port, self.path = _parse_url(url)
+        super().__init__(server, port or default_port, timeout, max_connections)
+        self.ssl_context = ssl_context or ssl.create_default_context()
+
+    def _open(self):
+        connection = _PinnedHTTPSConnection(self.host, self.server, self.port, self.timeout, self.ssl_context)
+        connection.connect()
+        return connection
+
+    def _reusable(self, conn) -> bool:
+        # 服务器要求关闭连接时_exchange已关闭，sock为None
+        return conn.sock is not None
+
+    def _exchange(self, conn, message):
+        # RFC 8484建议DoH查询ID为0，便于HTTP缓存
+        message.id = 0
+        conn.request('POST', self.path, body=message.to_wire(), headers={
+            'Content-Type': 'application/dns-message',
+            'Accept': 'application/dns-message'
+        })
+        response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise dns.exception.DNSException(f"DoH服务器返回HTTP {response.status}")
+        if response.getheader('Connection', '').lower() == 'close':
+            conn.close()
+        return dns.message.from_wire(body)
+
+
+_TRANSPORT_CLASSES = {'UDP': UDPTransport, 'TCP': TCPTransport, 'DoT': TLSTransport, 'DoH': HTTPSTransport}
+
+
+def create_transport(kind: str, server: str, **kwargs) -> DNSTransport:
+    """创建传输对象
+
+    :param kind: 传输方式，取值见TRANSPORTS
+    :param server: DNS服务器IP
+    :param kwargs: 传给具体传输类的参数
+    """
+    if kind not in _TRANSPORT_CLASSES:
+        raise ValueError(f"不支持的传输方式: {kind}")
+    return _TRANSPORT_CLASSES[kind](server, **kwargs)
+
+
+class TransportPool:
+    """按(传输方式, 服务器)共享的传输对象，保证各标签页复用同一长连接"""
+
+    def __init__(self):
+        self.transports = {}
+        self.lock = threading.Lock()
+
+    def get(self, kind: str, server: str) -> DNSTransport:
+        key = (kind, server)
+        with self.lock:
+            transport = self.transports.get(key)
+            if transport is None:
+                transport = create_transport(kind, server)
+                self.transports[key] = transport
+            return transport
+
+    def close_servers(self, servers):
+        """关闭指定服务器各传输方式的长连接（保留传输对象和统计），之后的查询重新握手"""
+        servers = set(servers)
+        with self.lock:
+            transports = [t for (_, server), t in self.transports.items() if server in servers]
+        for transport in transports:
+            transport.close()
+
+    def close_all(self):
+        """关闭所有长连接"""
+        with self.lock:
+            transports = list(self.transports.values())
+            self.transports.clear()
+        for transport in transports:
+            transport.close()
+
+
+# 创建全局实例
+transport_pool = TransportPool()
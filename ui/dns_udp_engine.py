@@ -0,0 +1,285 @@
+# -- coding: utf-8 --
+"""流水线式UDP DNS测量引擎
+
+用于纯粹的解析器延迟基准测试，绕过dns.resolver的高层逻辑：
+    - 查询报文用dns.message预先构建为wire格式，发送时只改写2字节的报文ID
+    - 单个UDP套接字上同时保持大量在途查询，按报文ID和问题段匹配响应
+    - 使用perf_counter_ns计时，单线程即可对一个服务器维持每秒数千次查询
+
+命令行用法：
+    python -m ui.dns_udp_engine 8.8.8.8 google.com baidu.com -n 1000 --qps 500
+    python -m ui.dns_udp_engine --stub example.com -n 5000     # 对本地桩服务器测试（需在源码目录运行）
+"""
+
+import time
+import struct
+import random
+import socket
+import argparse
+import selectors
+from collections import deque
+from typing import List, Dict, Any, Optional, Callable
+
+import dns.inet
+import dns.message
+import dns.rdatatype
+
+from .latency_histogram import LatencyHistogram
+
+# DNS报文头长度
+HEADER_SIZE = 12
+
+# 默认最大在途查询数：在途数超过服务器的处理能力时，多出的查询在服务器端排队，
+# 测到的延迟主要是排队时间（延迟约等于在途数/吞吐量），因此默认值取得较小
+DEFAULT_MAX_IN_FLIGHT = 16
+
+
+class UDPQueryEngine:
+    """单套接字流水线DNS查询引擎"""
+
+    def __init__(self, server: str, port: int = 53, timeout: float = 2.0, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 verify_answers: bool = False):
+        """初始化查询引擎
+
+        :param server: DNS服务器IP
+        :param port: DNS服务器端口
+        :param timeout: 单次查询超时时间（秒）
+        :param max_in_flight: 同时在途的最大查询数，过大时测到的延迟包含服务器端的排队时间
+        :param verify_answers: 是否完整解析每个响应并返回应答记录（会增加每次响应的处理开销）
+        """
+        self.server = server
+        self.port = port
+        self.timeout_ns = int(timeout * 1e9)
+        self.max_in_flight = max(1, min(max_in_flight, 65535))
+        self.verify_answers = verify_answers
+        self.family = dns.inet.af_for_address(server)
+
+    @staticmethod
+    def build_query(domain: str, record_type: str = 'A') -> Dict[str, Any]:
+        """预构建查询报文
+
+        :return: {'domain', 'wire'（ID为0的报文）, 'question'（问题段字节，用于匹配响应）}
+        """
+        # 不带EDNS，报文头之后只有问题段
+        message = dns.message.make_query(domain, dns.rdatatype.from_text(record_type), use_edns=False)
+        message.id = 0
+        wire = message.to_wire()
+        return {'domain': domain, 'wire': wire[2:], 'question': wire[HEADER_SIZE:]}
+
+    def _id_source(self):
+        """随机顺序循环产生报文ID"""
+        ids = list(range(65536))
+        while True:
+            random.shuffle(ids)
+            yield from ids
+
+    def run(self, domains: List[str], record_type: str = 'A', count: Optional[int] = None,
+            qps: float = 0, on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+            should_continue: Optional[Callable[[], bool]] = None) -> List[Dict[str, Any]]:
+        """发送查询并收集结果（在调用线程中运行）
+
+        :param domains: 域名列表，按顺序循环使用
+        :param record_type: 记录类型
+        :param count: 总查询数，默认每个域名一次
+        :param qps: 发送速率上限（每秒查询数），<=0表示只受在途数限制
+        :param on_result: 每个查询完成（收到响应或超时）时调用
+        :param should_continue: 取消检查函数，返回False时停止发送新查询并立即返回
+        :return: 结果列表，每项为{'domain', 'rtt_ms', 'rcode', 'answer_count', 'answers', 'error'}
+        """
+        queries = [self.build_query(domain, record_type) for domain in domains]
+        if not queries:
+            return []
+        total = len(queries) if count is None else count
+        interval_ns = int(1e9 / qps) if qps > 0 else 0
+
+        sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.connect((self.server, self.port))
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        except OSError:
+            pass
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+
+        ids = self._id_source()
+        in_flight = {}          # 报文ID -> (发送时间, 查询)
+        send_order = deque()    # (截止时间, 报文ID, 发送时间)，超时时间相同，按发送顺序即按截止时间
+        results = []
+        sent = 0
+        next_send_ns = time.perf_counter_ns()
+
+        def finish(result):
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+        try:
+            while sent < total or in_flight:
+                if should_continue and not should_continue():
+                    break
+                now = time.perf_counter_ns()
+
+                # 发送：在途数和速率允许时尽量多发
+                while sent < total and len(in_flight) < self.max_in_flight and now >= next_send_ns:
+                    qid = next(ids)
+                    while qid in in_flight:
+                        qid = next(ids)
+                    query = queries[sent % len(queries)]
+                    try:
+                        sock.send(struct.pack('!H', qid) + query['wire'])
+                    except BlockingIOError:
+                        break
+                    except OSError as e:
+                        sent += 1
+                        finish({'domain': query['domain'], 'rtt_ms': None, 'rcode': None,
+                                'answer_count': 0, 'answers': [], 'error': str(e)})
+                        continue
+                    sent_ns = time.perf_counter_ns()
+                    in_flight[qid] = (sent_ns, query)
+                    send_order.append((sent_ns + self.timeout_ns, qid, sent_ns))
+                    sent += 1
+                    if interval_ns:
+                        next_send_ns += interval_ns
+                        # 落后太多时不补发突发流量
+                        next_send_ns = max(next_send_ns, sent_ns - interval_ns)
+                    now = sent_ns
+
+                # 等待响应，最长等到下一次发送或最早的超时
+                wait_ns = self.timeout_ns
+                if send_order:
+                    wait_ns = min(wait_ns, send_order[0][0] - now)
+                if sent < total and len(in_flight) < self.max_in_flight:
+                    wait_ns = min(wait_ns, next_send_ns - now)
+                if selector.select(max(0, wait_ns) / 1e9):
+                    self._drain(sock, in_flight, finish)
+
+                # 处理超时
+                now = time.perf_counter_ns()
+                while send_order and send_order[0][0] <= now:
+                    _, qid, sent_ns = send_order.popleft()
+                    entry = in_flight.get(qid)
+                    if entry is not None and entry[0] == sent_ns:
+                        del in_flight[qid]
+                        finish({'domain': entry[1]['domain'], 'rtt_ms': None, 'rcode': None,
+                                'answer_count': 0, 'answers': [], 'error': 'timeout'})
+        finally:
+            selector.close()
+            sock.close()
+        return results
+
+    def _drain(self, sock, in_flight, finish):
+        """读取套接字中所有已到达的响应"""
+        while True:
+            try:
+                data = sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # ICMP端口不可达等错误由超时处理
+                return
+            received_ns = time.perf_counter_ns()
+            if len(data) < HEADER_SIZE:
+                continue
+
+            qid = struct.unpack_from('!H', data)[0]
+            entry = in_flight.get(qid)
+            if entry is None:
+                continue
+            sent_ns, query = entry
+            # 问题段一致才认为是该查询的响应，避免迟到的旧响应被误配
+            if data[HEADER_SIZE:HEADER_SIZE + len(query['question'])].lower() != query['question'].lower():
+                continue
+            del in_flight[qid]
+
+            answers = []
+            if self.verify_answers:
+                try:
+                    response = dns.message.from_wire(data)
+                    answers = [str(rdata) for rrset in response.answer for rdata in rrset]
+                except Exception:
+                    pass
+            finish({
+                'domain': query['domain'],
+                'rtt_ms': (received_ns - sent_ns) / 1e6,
+                'rcode': data[3] & 0x0F,
+                'answer_count': struct.unpack_from('!H', data, 6)[0],
+                'answers': answers,
+                'error': None
+            })
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: Optional[float] = None) -> Dict[str, Any]:
+    """汇总测量结果
+
+    :param results: UDPQueryEngine.run的返回值
+    :param elapsed: 实际耗时（秒），提供时计算达到的QPS
+    :return: {'queries', 'answered', 'timeouts', 'errors', 'min_ms', 'avg_ms', 'p50_ms', 'p90_ms', 'p95_ms',
+              'p99_ms', 'p999_ms', 'max_ms', 'qps'}
+    """
+    histogram = LatencyHistogram()
+    for r in results:
+        histogram.record(r['rtt_ms'])
+    percentiles = histogram.percentiles((50, 90, 95, 99, 99.9))
+    return {
+        'queries': len(results),
+        'answered': histogram.count,
+        'timeouts': sum(1 for r in results if r['error'] == 'timeout'),
+        'errors': sum(1 for r in results if r['error'] not in (None, 'timeout')),
+        'min_ms': histogram.min,
+        'avg_ms': histogram.mean,
+        'p50_ms': percentiles[50],
+        'p90_ms': percentiles[90],
+        'p95_ms': percentiles[95],
+        'p99_ms': percentiles[99],
+        'p999_ms': percentiles[99.9],
+        'max_ms': histogram.max,
+        'qps': len(results) / elapsed if elapsed else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="流水线UDP DNS延迟基准测试")
+    parser.add_argument('server', nargs='?', help="DNS服务器IP（使用--stub时可省略）")
+    parser.add_argument('domains', nargs='*', help="查询的域名，默认example.com")
+    parser.add_argument('-t', '--type', default='A', help="记录类型")
+    parser.add_argument('-n', '--count', type=int, default=1000, help="总查询数")
+    parser.add_argument('--qps', type=float, default=0, help="发送速率上限，0表示不限")
+    parser.add_argument('--in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="最大在途查询数，过大时延迟主要是服务器端的排队时间")
+    parser.add_argument('--timeout', type=float, default=2.0, help="单次查询超时（秒）")
+    parser.add_argument('--stub', action='store_true', help="启动本地桩服务器并对其测试")
+    args = parser.parse_args(argv)
+
+    stub = None
+    port = 53
+    domains = args.domains
+    if args.stub:
+        if args.server:
+            # 使用桩服务器时第一个位置参数也是域名
+            domains = [args.server] + domains
+        try:
+            from tests.dns_stubs import StubDNSServer
+        except ImportError:
+            parser.error("--stub需要在源码目录中运行（桩服务器位于tests/dns_stubs.py）")
+        stub = StubDNSServer().start()
+        server, port = stub.address, stub.port
+    elif not args.server:
+        parser.error("需要指定DNS服务器或使用--stub")
+    else:
+        server = args.server
+
+    domains = domains or ['example.com']
+    engine = UDPQueryEngine(server, port, timeout=args.timeout, max_in_flight=args.in_flight)
+    start = time.perf_counter()
+    results = engine.run(domains, args.type, count=args.count, qps=args.qps)
+    elapsed = time.perf_counter() - start
+    if stub:
+        stub.stop()
+
+    for key, value in summarize(results, elapsed).items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
-import matplotlib.pyplot as plt
-import matplotlib.font_manager as fm
 import platform
+from functools import lru_cache
 
 
+@lru_cache(maxsize=None)
 def setup_chinese_font():
-    """设置中文字体支持"""
+    """设置中文字体支持
+
+    扫描字体列表较慢，结果在进程内记忆，只在第一次调用时执行（matplotlib此时才导入）
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.font_manager as fm
+
     system = platform.system()
 
     # 常见的中文字体列表，按优先级排序
@@ -59,8 +65,11 @@ def setup_chinese_font():
         return None
 
 
-def set_plot_chinese_font(ax, title=None, xlabel=None, ylabel=None):
-    """为图表设置中文字体"""
+@lru_cache(maxsize=None)
+def chinese_font_properties():
+    """当前平台的中文字体属性（记忆，所有图表共用）"""
+    import matplotlib.font_manager as fm
+
     font_prop = fm.FontProperties()
     system = platform.system()
 
@@ -70,6 +79,12 @@ def set_plot_chinese_font(ax, title=None, xlabel=None, ylabel=None):
         font_prop.set_family('PingFang SC')
     else:
         font_prop.set_family('WenQuanYi Micro Hei')
+    return font_prop
+
+
+def set_plot_chinese_font(ax, title=None, xlabel=None, ylabel=None):
+    """为图表设置中文字体"""
+    font_prop = chinese_font_properties()
 
     if title:
         ax.set_title(title, fontproperties=font_prop)
@@ -0,0 +1,235 @@
+# -- coding: utf-8 --
+"""流式延迟直方图模块
+
+仿HDR Histogram的对数-线性分桶：数值按resolution（默认1微秒）取整后，
+小于sub_bucket_count的值每个整数一个桶；更大的值按2的幂分段，每段再线性分为sub_bucket_count/2个子桶，
+因此任意数值的相对误差不超过2/sub_bucket_count（默认256个子桶，约0.8%）。
+
+    - 内存只与桶数有关（稀疏存储，1微秒到1小时最多约3000个桶），与样本数无关
+    - 计数可以直接相加，不同线程、不同服务器或不同轮次的直方图可以合并
+    - 最小值、最大值、总和精确记录，分位数由桶计算（并限制在[最小值, 最大值]内）
+    - 失败次数单独计数，用于成功率
+"""
+
+import math
+import threading
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+# 报告中使用的标准分位数
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """可合并的对数-线性延迟直方图（单位：毫秒）"""
+
+    def __init__(self, resolution: float = 0.001, sub_bucket_bits: int = 8, highest: float = 3600000.0):
+        """初始化直方图
+
+        :param resolution: 最小分辨率（毫秒），默认1微秒
+        :param sub_bucket_bits: 每段子桶数的二进制位数，决定精度
+        :param highest: 可记录的最大值（毫秒），更大的值按最大值计
+        """
+        self.resolution = resolution
+        self.sub_bucket_bits = max(2, sub_bucket_bits)
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.highest_units = max(1, int(highest / resolution))
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counts = {}
+            self.count = 0
+            self.failures = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def _index(self, units: int) -> int:
+        """数值（分辨率单位）对应的桶编号"""
+        if units < self.sub_bucket_count:
+            return units
+        shift = units.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + ((units >> shift) - self.half_count)
+
+    def _bucket_range(self, index: int) -> Tuple[float, float]:
+        """桶编号对应的数值范围[下界, 上界)（毫秒）"""
+        if index < self.sub_bucket_count:
+            return index * self.resolution, (index + 1) * self.resolution
+        shift = (index - self.sub_bucket_count) // self.half_count + 1
+        top = (index - self.sub_bucket_count) % self.half_count + self.half_count
+        return (top << shift) * self.resolution, ((top + 1) << shift) * self.resolution
+
+    def _compatible(self, other: 'LatencyHistogram') -> bool:
+        return (self.resolution == other.resolution and self.sub_bucket_bits == other.sub_bucket_bits)
+
+    def record(self, value_ms: float, count: int = 1):
+        """记录一个延迟值（毫秒）"""
+        if value_ms is None:
+            return
+        value_ms = max(0.0, value_ms)
+        units = min(self.highest_units, int(value_ms / self.resolution))
+        index = self._index(units)
+        with self.lock:
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.count += count
+            self.total += value_ms * count
+            if self.min is None or value_ms < self.min:
+                self.min = value_ms
+            if self.max is None or value_ms > self.max:
+                self.max = value_ms
+
+    def record_failure(self, count: int = 1):
+        """记录失败（不计入延迟分布）"""
+        with self.lock:
+            self.failures += count
+
+    def record_result(self, result: Dict[str, Any], key: str = 'time_ms'):
+        """按查询结果字典（含success和time_ms）记录成功或失败"""
+        if result.get('success') and result.get(key) is not None:
+            self.record(result[key])
+        else:
+            self.record_failure()
+
+    def snapshot(self) -> 'LatencyHistogram':
+        """返回当前数据的副本"""
+        copy = LatencyHistogram(self.resolution, self.sub_bucket_bits, self.highest_units * self.resolution)
+        with self.lock:
+            copy.counts = dict(self.counts)
+            copy.count, copy.failures, copy.total = self.count, self.failures, self.total
+            copy.min, copy.max = self.min, self.max
+        return copy
+
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        """把另一个直方图的数据加到本直方图（分桶参数必须相同）
+
+        :return: self，便于链式调用
+        """
+        if not self._compatible(other):
+            raise ValueError("直方图分桶参数不同，无法合并")
+        other = other.snapshot()
+        with self.lock:
+            for index, count in other.counts.items():
+                self.counts[index] = self.counts.get(index, 0) + count
+            self.count += other.count
+            self.failures += other.failures
+            self.total += other.total
+            if other.min is not None and (self.min is None or other.min < self.min):
+                self.min = other.min
+            if other.max is not None and (self.max is None or other.max > self.max):
+                self.max = other.max
+        return self
+
+    @classmethod
+    def merged(cls, histograms: Iterable['LatencyHistogram']) -> 'LatencyHistogram':
+        """合并多个直方图为一个新直方图"""
+        result = None
+        for histogram in histograms:
+            if result is None:
+                result = histogram.snapshot()
+            else:
+                result.merge(histogram)
+        return result if result is not None else cls()
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    @property
+    def attempts(self) -> int:
+        return self.count + self.failures
+
+    @property
+    def success_rate(self) -> float:
+        return self.count / self.attempts if self.attempts else 0.0
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """分位数（毫秒），percentile取0~100；没有数据时返回None"""
+        percentiles = self.percentiles((percentile,))
+        return percentiles[percentile]
+
+    def percentiles(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[float, Optional[float]]:
+        """一次遍历计算多个分位数
+
+        :return: 分位数到数值（毫秒）的字典
+        """
+        with self.lock:
+            items = sorted(self.counts.items())
+            count, low, high = self.count, self.min, self.max
+        wanted = sorted(percentiles)
+        result = {p: None for p in wanted}
+        if not count:
+            return result
+
+        position = 0
+        cumulative = 0
+        for p in wanted:
+            # 第rank个样本（从1开始）所在的桶
+            rank = max(1, math.ceil(min(100.0, max(0.0, p)) / 100 * count))
+            while cumulative + items[position][1] < rank:
+                cumulative += items[position][1]
+                position += 1
+            lower, upper = self._bucket_range(items[position][0])
+            result[p] = min(high, max(low, (lower + upper) / 2))
+        return result
+
+    def summary(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+        """统计摘要
+
+        :return: {'count', 'failures', 'success_rate', 'mean', 'min', 'max', 'p50', 'p90', 'p99', 'p999', ...}，
+                 分位数键名为'p'加去掉小数点的分位数
+        """
+        values = self.percentiles(percentiles)
+        summary = {
+            'count': self.count,
+            'failures': self.failures,
+            'success_rate': self.success_rate,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max
+        }
+        for p, value in values.items():
+            summary[percentile_key(p)] = value
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为可JSON保存的字典（用于断点续传等场景）"""
+        with self.lock:
+            return {
+                'resolution': self.resolution,
+                'sub_bucket_bits': self.sub_bucket_bits,
+                'highest': self.highest_units * self.resolution,
+                'counts': {str(index): count for index, count in self.counts.items()},
+                'count': self.count,
+                'failures': self.failures,
+                'total': self.total,
+                'min': self.min,
+                'max': self.max
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LatencyHistogram':
+        """从to_dict的结果恢复直方图"""
+        histogram = cls(data['resolution'], data['sub_bucket_bits'], data['highest'])
+        histogram.counts = {int(index): count for index, count in data['counts'].items()}
+        histogram.count = data['count']
+        histogram.failures = data['failures']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def percentile_key(percentile: float) -> str:
+    """分位数在摘要字典中的键名：50 -> 'p50'，99.9 -> 'p999'"""
+    return 'p' + f"{percentile:g}".replace('.', '')
+
+
+def format_percentiles(histogram: LatencyHistogram, percentiles: Iterable[float] = (50, 90, 99)) -> str:
+    """格式化分位数，用于状态栏和报告，例如：P50 12.30ms, P90 20.10ms, P99 45.00ms"""
+    values = histogram.percentiles(percentiles)
+    return ", ".join(f"P{p:g} {value:.2f}ms" for p, value in values.items() if value is not None)
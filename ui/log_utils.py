@@ -0,0 +1,110 @@
+# -- coding: utf-8 --
+"""日志工具模块
+
+基于标准库logging的分级日志，替代热路径上的print：
+    - 日志消息使用%s占位符延迟格式化，级别未启用时不会拼接字符串
+    - 路由工具的原始输出行写入内存环形缓冲区（只保存引用，不格式化、不写控制台），供诊断时查看
+    - 无控制台的打包程序（PyInstaller窗口模式下sys.stderr为None）不创建控制台输出
+
+日志级别可通过环境变量ROUTETRACER_LOG_LEVEL设置（DEBUG/INFO/WARNING/ERROR），默认INFO
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+from collections import deque
+from typing import List, Tuple, Optional
+
+# 所有模块日志器的根名称
+ROOT_LOGGER_NAME = 'routetracer'
+DEFAULT_LEVEL = 'INFO'
+
+
+class RawOutputBuffer:
+    """最近原始输出行的环形缓冲区"""
+
+    def __init__(self, capacity: int = 2000):
+        """初始化缓冲区
+
+        :param capacity: 最多保留的行数，超出后丢弃最早的行
+        """
+        self.lines = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+
+    def append(self, source: str, line: str):
+        """记录一行原始输出（deque.append是原子操作，热路径无需加锁）
+
+        :param source: 输出来源，如traceroute、nexttrace
+        :param line: 原始输出行
+        """
+        self.lines.append((time.time(), source, line))
+
+    def recent(self, count: Optional[int] = None, source: Optional[str] = None) -> List[Tuple[float, str, str]]:
+        """获取最近的原始输出
+
+        :param count: 返回的最大行数，None表示全部
+        :param source: 只返回指定来源的行
+        :return: [(时间戳, 来源, 行内容), ...]，按时间先后排列
+        """
+        with self.lock:
+            lines = list(self.lines)
+        if source:
+            lines = [item for item in lines if item[1] == source]
+        return lines[-count:] if count else lines
+
+    def dump(self, count: Optional[int] = None, source: Optional[str] = None) -> str:
+        """将最近的原始输出格式化为文本，便于复制到问题报告中"""
+        return '\n'.join(
+            f"{time.strftime('%H:%M:%S', time.localtime(ts))}.{int(ts * 1000) % 1000:03d} [{src}] {line}"
+            for ts, src, line in self.recent(count, source)
+        )
+
+    def clear(self):
+        """清空缓冲区"""
+        with self.lock:
+            self.lines.clear()
+
+
+_configured = False
+_config_lock = threading.Lock()
+
+
+def setup_logging(level: Optional[str] = None):
+    """配置根日志器（重复调用只更新级别）
+
+    :param level: 日志级别名称，默认读取环境变量ROUTETRACER_LOG_LEVEL
+    """
+    global _configured
+    level = (level or os.environ.get('ROUTETRACER_LOG_LEVEL') or DEFAULT_LEVEL).upper()
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    root.setLevel(getattr(logging, level, logging.INFO))
+
+    with _config_lock:
+        if _configured:
+            return
+        _configured = True
+        root.propagate = False
+        # 窗口模式的打包程序没有控制台，不创建输出处理器，日志调用只剩级别判断的开销
+        if sys.stderr is not None:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s', '%H:%M:%S'))
+            root.addHandler(handler)
+        else:
+            root.addHandler(logging.NullHandler())
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取模块日志器
+
+    :param name: 模块名，通常传入__name__
+    """
+    if not _configured:
+        setup_logging()
+    short_name = name.rsplit('.', 1)[-1]
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{short_name}")
+
+
+# 创建全局实例
+raw_output = RawOutputBuffer()
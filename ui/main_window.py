@@ -1,38 +1,49 @@
 import platform
-import subprocess
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import threading
 import time
-import dns.resolver
-import pandas as pd
+from concurrent.futures import wait
 from datetime import datetime
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib
-import matplotlib.pyplot as plt
-from .font_utils import setup_chinese_font, set_plot_chinese_font
-from .network_utils import network_utils
+from .font_utils import set_plot_chinese_font
+from .network_utils import network_utils, LOCATION_PENDING
+from .path_cache import path_cache
+from .target_resolver import target_resolver
+from .dns_resolver_pool import dns_resolver_pool
+from .dns_engine import BatchDNSEngine
+from .dns_transports import TRANSPORTS, transport_pool
+from .monitor_buffers import MonitorSeries
+from .monitor_scheduler import MonitorScheduler
+from .latency_histogram import LatencyHistogram, format_percentiles
+from .dns_cache_probe import CacheProbe
+from .dns_bulk import BulkRunner, count_domains, load_checkpoint
+from .ui_update_queue import UIUpdateQueue
+from .task_executor import task_executor
+from .log_utils import get_logger, raw_output
 import csv
-from scapy.layers.inet import traceroute
 import os
 
+logger = get_logger(__name__)
+
+# 超过该大小的域名列表文件建议使用文件流式批量测试，而不是载入文本框
+LARGE_DOMAIN_FILE_BYTES = 1024 * 1024
+
 # 导入traceMap集成模块
 try:
     from .tracemap_integration import generate_and_open_tracemap, TRACEMAP_AVAILABLE
 except ImportError:
-    print("traceMap集成模块导入失败")
+    logger.warning("traceMap集成模块导入失败")
     TRACEMAP_AVAILABLE = False
 
-# 导入NextTrace集成模块
+# 导入NextTrace集成模块（可执行文件的查找在主窗口显示后于后台进行，见detect_nexttrace）
 try:
-    from .nexttrace_integration import NextTraceIntegration, is_nexttrace_available
-    NEXTTRACE_AVAILABLE = is_nexttrace_available()
+    from .nexttrace_integration import nexttrace_integration, is_nexttrace_available
+    from .nexttrace_pool import nexttrace_pool
+    NEXTTRACE_IMPORTED = True
 except ImportError as e:
-    print(f"NextTrace集成模块导入失败: {e}")
-    NEXTTRACE_AVAILABLE = False
-
+    logger.warning("NextTrace集成模块导入失败: %s", e)
+    NEXTTRACE_IMPORTED = False
 
-matplotlib.use('TkAgg')
 import socket
 
 
@@ -47,23 +58,36 @@ class DNSAnalyzerApp:
         # 设置窗口关闭事件处理
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        # 初始化中文字体
-        self.setup_chinese_font()
+        # 中文字体在第一个图表创建时才设置（matplotlib此时才导入）
+        self.chinese_font = None
+        self.nexttrace_available = False
 
         # 存储测试结果
         self.results = []
         self.is_monitoring = False
-        self.monitor_thread = None
+        # 监控任务由调度器的工作线程执行，不再为每次监控单独创建线程
+        self.monitor_scheduler = MonitorScheduler(max_workers=2, on_sample=self.on_monitor_sample)
+        self.monitor_key = None
+        self.monitor_stop_timer = None
+        self.is_batch_testing = False
+        self.batch_histogram = LatencyHistogram()  # 最近一次批量测试的整体延迟分布
         self.comparison_data = []
         self.trace_data = []  # 添加traceroute数据存储
 
-        # 初始化线程控制变量
-        self.running_threads = []
+        # 后台工作提交到task_executor，这里只保存需要取消的任务
+        self.batch_task = None
         self.is_closing = False
 
+        # 工作线程产生的结果行、进度等界面更新经由该队列按固定帧率批量执行
+        self.ui_queue = UIUpdateQueue(self.root, fps=30)
+        self.ui_queue.start()
+
         self.setup_ui()
         self.setup_about_info()
 
+        # 主窗口显示后再在后台查找NextTrace，不占用启动时间
+        self.root.after_idle(self.detect_nexttrace)
+
     def setup_ui(self):
         """设置用户界面"""
         # 创建笔记本（选项卡）
@@ -110,7 +134,7 @@ class DNSAnalyzerApp:
 
         ttk.Label(input_frame, text="超时时间(毫秒):").grid(row=0, column=4, sticky='w', padx=5, pady=5)
         self.timeout_entry = ttk.Spinbox(input_frame, from_=100, to=5000, width=10)
-        self.timeout_entry.set("300" if NEXTTRACE_AVAILABLE else "1000")  # NextTrace使用300ms超时
+        self.timeout_entry.set("1000")  # 检测到NextTrace后改为300ms
         self.timeout_entry.grid(row=0, column=5, padx=5, pady=5)
 
         # 第二行：方法选择
@@ -119,19 +143,22 @@ class DNSAnalyzerApp:
 
         ttk.Label(method_frame, text="跟踪方法:").pack(side='left', padx=5)
 
-        self.trace_method = tk.StringVar(value="nexttrace" if NEXTTRACE_AVAILABLE else "system")
-        methods = [
-            ("NextTrace (推荐)", "nexttrace"),
-            ("系统命令", "system")
-        ]
-        
-        # 如果NextTrace不可用，从方法列表中移除
-        if not NEXTTRACE_AVAILABLE:
-            methods = [method for method in methods if method[1] != "nexttrace"]
+        self.trace_method = tk.StringVar(value="system")
+
+        # NextTrace选项在检测到可执行文件后才显示（见on_nexttrace_detected）
+        self.nexttrace_radio = ttk.Radiobutton(method_frame, text="NextTrace (推荐)", variable=self.trace_method,
+                                               value="nexttrace")
+        self.system_trace_radio = ttk.Radiobutton(method_frame, text="系统命令", variable=self.trace_method,
+                                                  value="system")
+        self.system_trace_radio.pack(side='left', padx=5)
+
+        # 探测始终使用数字模式，主机名由后台PTR解析补充
+        self.resolve_ptr_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(method_frame, text="反向解析主机名", variable=self.resolve_ptr_var).pack(side='left', padx=15)
 
-        for text, value in methods:
-            ttk.Radiobutton(method_frame, text=text, variable=self.trace_method,
-                            value=value).pack(side='left', padx=5)
+        # 已有缓存路径时先抽样验证，未变化则直接使用缓存结果
+        self.path_verify_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(method_frame, text="缓存路径快速验证", variable=self.path_verify_var).pack(side='left', padx=5)
 
         # 按钮区域
         button_frame = ttk.Frame(trace_frame)
@@ -181,7 +208,7 @@ class DNSAnalyzerApp:
         result_notebook.add(table_frame, text="路由详情")
 
         # 创建树形视图
-        columns = ("跳数", "IP地址", "延迟(ms)", "地理位置", "运营商", "状态")
+        columns = ("跳数", "IP地址", "延迟(ms)", "地理位置", "运营商", "状态", "主机名")
         self.trace_tree = ttk.Treeview(table_frame, columns=columns, show='headings', height=15)
 
         column_widths = {
@@ -190,7 +217,8 @@ class DNSAnalyzerApp:
             "延迟(ms)": 80,
             "地理位置": 200,
             "运营商": 150,
-            "状态": 80
+            "状态": 80,
+            "主机名": 180
         }
 
         for col in columns:
@@ -211,8 +239,10 @@ class DNSAnalyzerApp:
         self.trace_chart_frame = ttk.Frame(result_notebook)
         result_notebook.add(self.trace_chart_frame, text="路由图")
 
-        # 初始化路由图
-        self.setup_traceroute_chart()
+        # 路由图在该标签页第一次显示时才创建
+        self.trace_chart = None
+        self.trace_chart_points = []  # 图表数据(跳数, 延迟, 位置)，图表创建前也持续记录
+        self.defer_until_shown(self.trace_chart_frame, self.setup_traceroute_chart)
 
         # 统计信息标签页
         stats_frame = ttk.Frame(result_notebook)
@@ -232,8 +262,7 @@ class DNSAnalyzerApp:
 
         # 初始化跟踪控制变量
         self.is_tracing = False
-        self.trace_process = None
-        self.trace_thread = None
+        self.trace_task = None
 
     def setup_traceroute_context_menu(self):
         """设置路由跟踪的右键菜单"""
@@ -337,11 +366,9 @@ class DNSAnalyzerApp:
     def cancel_traceroute(self):
         """取消路由跟踪"""
         if self.is_tracing:
-            if self.trace_process:
-                try:
-                    self.trace_process.terminate()
-                except:
-                    pass
+            # 取消任务时令牌会终止跟踪子进程
+            if self.trace_task:
+                self.trace_task.cancel("用户取消")
 
             self.is_tracing = False
             self.trace_button.config(state='normal')
@@ -361,13 +388,53 @@ class DNSAnalyzerApp:
     def setup_chinese_font(self):
         """设置中文字体支持"""
         try:
-            import matplotlib.pyplot as plt
-            plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
-            plt.rcParams['axes.unicode_minus'] = False
+            import matplotlib
+            matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+            matplotlib.rcParams['axes.unicode_minus'] = False
             self.chinese_font = True
         except:
             self.chinese_font = False
-            print("警告: 中文字体设置失败")
+            logger.warning("中文字体设置失败")
+
+    def create_figure(self, parent, figsize, ncols=1):
+        """在parent中创建图表，第一个图表创建时才导入matplotlib并设置中文字体
+
+        :return: (fig, axes, canvas)
+        """
+        from .chart_utils import create_figure
+        if self.chinese_font is None:
+            self.setup_chinese_font()
+        return create_figure(parent, ncols=ncols, figsize=figsize)
+
+    def defer_until_shown(self, frame, setup):
+        """frame第一次显示（所在标签页第一次被选中）时才调用setup，用于延迟创建图表"""
+        def on_map(event):
+            frame.unbind('<Map>')
+            setup()
+
+        frame.bind('<Map>', on_map)
+
+    def detect_nexttrace(self):
+        """在后台查找NextTrace可执行文件，找到后在界面中启用NextTrace方法"""
+        if not NEXTTRACE_IMPORTED:
+            return
+
+        def detect(task):
+            available = is_nexttrace_available()
+            if not task.cancelled:
+                self.ui_queue.post(self.on_nexttrace_detected, available)
+
+        task_executor.submit('trace', detect, name='detect_nexttrace')
+
+    def on_nexttrace_detected(self, available):
+        """NextTrace检测完成回调（界面线程）"""
+        self.nexttrace_available = available
+        if not available:
+            return
+        self.nexttrace_radio.pack(side='left', padx=5, before=self.system_trace_radio)
+        if not self.is_tracing:
+            self.trace_method.set("nexttrace")
+            self.timeout_entry.set("300")  # NextTrace使用300ms超时
 
     def setup_about_info(self):
         """设置关于信息"""
@@ -381,8 +448,33 @@ class DNSAnalyzerApp:
 
         help_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="帮助", menu=help_menu)
+        help_menu.add_command(label="诊断输出", command=self.show_diagnostics)
         help_menu.add_command(label="关于", command=self.show_about)
 
+    def show_diagnostics(self):
+        """显示最近的路由工具原始输出，便于排查解析问题"""
+        diag_window = tk.Toplevel(self.root)
+        diag_window.title("诊断输出")
+        diag_window.geometry("700x450")
+
+        dump = (self.ui_queue.format_stats() + "\n" + task_executor.format_stats() + "\n\n"
+                + (raw_output.dump(500) or "暂无原始输出"))
+
+        text_widget = tk.Text(diag_window, wrap='none', font=('Consolas', 9))
+        text_widget.pack(fill='both', expand=True, padx=10, pady=10)
+        text_widget.insert('1.0', dump)
+        text_widget.see('end')
+        text_widget.config(state='disabled')
+
+        def copy_dump():
+            self.root.clipboard_clear()
+            self.root.clipboard_append(dump)
+
+        button_frame = ttk.Frame(diag_window)
+        button_frame.pack(pady=10)
+        ttk.Button(button_frame, text="复制", command=copy_dump).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="关闭", command=diag_window.destroy).pack(side='left', padx=5)
+
     def show_about(self):
         """显示关于对话框"""
         about_text = """DNS 解析分析工具 v2.0
@@ -452,61 +544,45 @@ class DNSAnalyzerApp:
         try:
             # 停止所有正在进行的操作
             self.stop_all_operations()
-            
-            # 等待所有线程结束
-            self.wait_for_threads_to_finish()
-            
-            # 销毁窗口
-            self.root.destroy()
-            
-            # 强制退出程序，确保所有进程都结束
-            import sys
-            import os
-            
-            # 获取当前进程ID
-            current_pid = os.getpid()
-            
-            # 在Windows上强制终止进程
-            if platform.system() == "Windows":
-                import subprocess
-                try:
-                    subprocess.run(['taskkill', '/F', '/PID', str(current_pid)], 
-                                 check=False, capture_output=True)
-                except:
-                    pass
-            else:
-                # Unix-like系统
-                os._exit(0)
+
+            # 停止监控调度器（不等待在途查询）
+            self.monitor_scheduler.stop()
+            if NEXTTRACE_IMPORTED:
+                nexttrace_pool.shutdown()
+
+            # 取消全部后台任务（令牌终止子进程），在限定时间内等待执行中的任务结束；
+            # 超时仍未结束的任务在守护线程中，不会阻止进程退出
+            self.wait_for_tasks(task_executor.shutdown(timeout=0), timeout=3.0)
+
+            # 停止界面更新队列，丢弃尚未执行的更新
+            self.ui_queue.stop()
+
+            # 关闭DNS长连接
+            transport_pool.close_all()
             
         except Exception as e:
-            print(f"关闭窗口时出错: {e}")
-            # 强制退出
-            try:
-                import sys
-                sys.exit(0)
-            except:
-                import os
-                os._exit(0)
+            logger.error("关闭窗口时出错: %s", e)
+        finally:
+            # 销毁窗口后主循环返回，程序正常退出（缓存等在退出时保存）
+            self.root.destroy()
 
     def stop_all_operations(self):
         """停止所有正在进行的操作"""
         try:
             # 停止监控
-            if self.is_monitoring and self.monitor_thread:
+            if self.is_monitoring:
                 self.is_monitoring = False
+                self.monitor_scheduler.clear()
                 if hasattr(self, 'monitor_button'):
                     self.monitor_button.config(text="开始监控", state='normal')
                 if hasattr(self, 'monitor_progress'):
                     self.monitor_progress.stop()
 
-            # 停止路由跟踪
+            # 停止路由跟踪（取消任务时令牌会终止跟踪子进程）
             if hasattr(self, 'is_tracing') and self.is_tracing:
                 self.is_tracing = False
-                if hasattr(self, 'trace_process') and self.trace_process:
-                    try:
-                        self.trace_process.terminate()
-                    except:
-                        pass
+                if self.trace_task:
+                    self.trace_task.cancel("停止所有操作")
                 if hasattr(self, 'trace_button'):
                     self.trace_button.config(state='normal')
                 if hasattr(self, 'cancel_trace_button'):
@@ -517,117 +593,88 @@ class DNSAnalyzerApp:
             # 停止批量测试
             if hasattr(self, 'is_batch_testing') and self.is_batch_testing:
                 self.is_batch_testing = False
+                if self.batch_task:
+                    self.batch_task.cancel("停止所有操作")
                 if hasattr(self, 'batch_test_button'):
                     self.batch_test_button.config(text="开始批量测试", state='normal')
                 if hasattr(self, 'batch_progress'):
                     self.batch_progress.stop()
 
         except Exception as e:
-            print(f"停止操作时出错: {e}")
+            logger.error("停止操作时出错: %s", e)
 
-    def wait_for_threads_to_finish(self):
-        """等待所有线程结束"""
-        try:
-            # 等待监控线程结束
-            if hasattr(self, 'monitor_thread') and self.monitor_thread and self.monitor_thread.is_alive():
-                self.monitor_thread.join(timeout=1.0)  # 减少等待时间
-
-            # 等待路由跟踪线程结束
-            if hasattr(self, 'trace_thread') and self.trace_thread and self.trace_thread.is_alive():
-                self.trace_thread.join(timeout=1.0)
-
-            # 等待其他线程结束
-            for thread in self.running_threads:
-                if thread.is_alive():
-                    thread.join(timeout=0.5)  # 更短的等待时间
-
-        except Exception as e:
-            print(f"等待线程结束时出错: {e}")
+    def wait_for_tasks(self, tasks, timeout=3.0):
+        """等待任务结束
 
-    def add_running_thread(self, thread):
-        """添加正在运行的线程到列表"""
-        if thread not in self.running_threads:
-            self.running_threads.append(thread)
+        等待期间继续处理界面事件：工作线程中的root.after调用要由界面线程执行，
+        界面线程阻塞等待会使这些任务卡住直到超时
 
-    def remove_running_thread(self, thread):
-        """从列表中移除已结束的线程"""
-        if thread in self.running_threads:
-            self.running_threads.remove(thread)
+        :param tasks: 要等待的任务
+        :param timeout: 最长等待时间（秒）
+        :return: 超时仍未结束的任务
+        """
+        deadline = time.monotonic() + timeout
+        while tasks and time.monotonic() < deadline:
+            self.root.update()
+            wait([task.future for task in tasks], timeout=0.05)
+            tasks = [task for task in tasks if not task.done()]
+        if tasks:
+            logger.warning("关闭时仍有 %d 个任务未结束: %s", len(tasks), tasks)
+        return tasks
 
 
     def setup_traceroute_chart(self):
-        """设置路由图"""
-        plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
-        plt.rcParams['axes.unicode_minus'] = False
+        """设置路由图（路由图标签页第一次显示时调用）"""
+        from .chart_utils import HopBarChart
 
-        self.fig_trace, self.ax_trace = plt.subplots(figsize=(10, 6))
+        self.fig_trace, self.ax_trace, self.canvas_trace = self.create_figure(self.trace_chart_frame, figsize=(10, 6))
         self.ax_trace.set_title('路由跟踪可视化图')
         self.ax_trace.set_xlabel('延迟 (ms)')
         self.ax_trace.set_ylabel('网络跳数')
         self.ax_trace.grid(True, alpha=0.3)
 
-        self.canvas_trace = FigureCanvasTkAgg(self.fig_trace, self.trace_chart_frame)
-        self.canvas_trace.get_tk_widget().pack(fill='both', expand=True)
+        # 条形和标签是持久对象，逐跳追加时只blit，坐标轴变化时才完整重绘
+        self.trace_chart = HopBarChart(self.ax_trace, self.canvas_trace)
 
-        self.trace_data = []
+        # 补画图表创建之前已有的跳点
+        if self.trace_chart_points:
+            self.trace_chart.set_hops(self.trace_chart_points, final=not self.is_tracing)
+            self.trace_chart.refresh()
+
+    @staticmethod
+    def _trace_chart_point(r):
+        """把一条跟踪结果转换为图表数据(跳数, 延迟, 位置)，无效时返回None"""
+        if len(r) < 4:
+            return None
+        try:
+            hop = int(r[0]) if isinstance(r[0], (str, int, float)) else 0
+            delay = float(r[2]) if isinstance(r[2], (str, int, float)) else 0
+            location = str(r[3]) if len(r) > 3 else ""
+        except (ValueError, TypeError):
+            return None
+        # 只处理有效跳数
+        return (hop, delay, location) if hop > 0 else None
 
     def update_traceroute_chart(self, results):
-        """更新路由图"""
+        """更新路由图（跟踪结束时用完整结果同步实时追加的条形）"""
         if not results:
             return
 
-        self.ax_trace.clear()
-
         # 提取数据并进行类型转换
-        valid_results = []
-        for r in results:
-            if len(r) >= 4:
-                try:
-                    hop = int(r[0]) if isinstance(r[0], (str, int, float)) else 0
-                    delay = float(r[2]) if isinstance(r[2], (str, int, float)) else 0
-                    location = str(r[3]) if len(r) > 3 else ""
-                    if hop > 0:  # 只处理有效跳数
-                        valid_results.append((hop, delay, location))
-                except (ValueError, TypeError):
-                    continue
-        
+        valid_results = [point for point in map(self._trace_chart_point, results) if point]
         if not valid_results:
             return
-        
-        hops = [r[0] for r in valid_results]
-        delays = [r[1] for r in valid_results]
-        locations = [r[2] for r in valid_results]
-
-        if hops and delays:
-            # 创建水平条形图
-            y_pos = range(len(hops))
-            bars = self.ax_trace.barh(y_pos, delays, color='lightblue', alpha=0.7)
-
-            # 设置标题和标签
-            self.ax_trace.set_title('路由跟踪可视化图')
-            self.ax_trace.set_xlabel('延迟 (ms)')
-            self.ax_trace.set_ylabel('网络跳数')
-
-            # 设置Y轴标签为跳数
-            self.ax_trace.set_yticks(y_pos)
-            self.ax_trace.set_yticklabels([f'跳点 {h}' for h in hops])
-
-            # 在条形图上添加延迟值
-            for bar, delay in zip(bars, delays):
-                width = bar.get_width()
-                self.ax_trace.text(width + 0.1, bar.get_y() + bar.get_height() / 2,
-                                   f'{delay:.1f}ms', ha='left', va='center', fontsize=8)
-
-            # 添加地理位置注释（每3个跳点显示一个）
-            for i, (y, location) in enumerate(zip(y_pos, locations)):
-                if i % 3 == 0:  # 每3个跳点显示一个位置信息
-                    self.ax_trace.text(0.1, y, location,
-                                       ha='left', va='center', fontsize=7,
-                                       bbox=dict(boxstyle="round,pad=0.3", facecolor="yellow", alpha=0.7))
-
-            self.ax_trace.grid(True, alpha=0.3)
-            self.fig_trace.tight_layout()
-            self.canvas_trace.draw()
+
+        self.trace_chart_points = valid_results
+        if self.trace_chart is not None:
+            self.trace_chart.set_hops(valid_results, final=True)
+            self.trace_chart.refresh()
+
+    def clear_trace_chart(self):
+        """清除路由图数据（图表尚未创建时只清除数据）"""
+        self.trace_chart_points = []
+        if self.trace_chart is not None:
+            self.trace_chart.clear()
 
     def start_traceroute(self):
         """开始路由跟踪"""
@@ -645,16 +692,46 @@ class DNSAnalyzerApp:
             messagebox.showerror("错误", "请输入有效的域名或IP地址")
             return
 
-        # 如果输入的是域名，先进行DNS解析并让用户选择IP
-        if not self._is_ip_address(hostname):
-            selected_ip = self._show_ip_selection_dialog(hostname)
-            if selected_ip is None:  # 用户取消了选择
-                return
-            # 将选择的IP显示在输入框中
-            self.trace_host_entry.delete(0, 'end')
-            self.trace_host_entry.insert(0, selected_ip)
-            hostname = selected_ip  # 使用选择的IP进行跟踪
+        if self._is_ip_address(hostname):
+            self._begin_traceroute(hostname)
+            return
+
+        # 输入的是域名：在后台任务中解析（缓存未命中时需要等待DNS查询），解析完成后在界面线程中让用户选择IP
+        # 系统traceroute的输出解析只支持IPv4
+        include_ipv6 = self.trace_method.get() == "nexttrace"
+        self.trace_button.config(state='disabled')
+        self.trace_status.config(text=f"正在解析: {hostname}")
 
+        def resolve_target(task):
+            try:
+                candidates = target_resolver.resolve(hostname, include_ipv6)
+            except Exception as e:
+                logger.error("解析跟踪目标失败: %s", e)
+                candidates = []
+            if not task.cancelled:
+                self.ui_queue.post(self._on_trace_target_resolved, hostname, include_ipv6, candidates)
+
+        task_executor.submit('trace', resolve_target, name='resolve_target')
+
+    def _on_trace_target_resolved(self, hostname, include_ipv6, candidates):
+        """跟踪目标解析完成（界面线程）：让用户选择IP后开始跟踪"""
+        self.trace_button.config(state='normal')
+        self.trace_status.config(text="")
+        if self.is_tracing:
+            return
+        self._show_ip_selection_dialog(hostname, candidates, self._on_trace_target_selected, include_ipv6)
+
+    def _on_trace_target_selected(self, selected_ip):
+        """用户选定跟踪目标的IP（用户取消选择时不会调用）"""
+        if self.is_tracing:
+            return
+        # 将选择的IP显示在输入框中
+        self.trace_host_entry.delete(0, 'end')
+        self.trace_host_entry.insert(0, selected_ip)
+        self._begin_traceroute(selected_ip)
+
+    def _begin_traceroute(self, hostname):
+        """以确定的目标开始路由跟踪（界面线程）"""
         max_hops = int(self.max_hops_entry.get())
         # 获取超时时间，保持毫秒单位传递给NextTrace
         timeout_ms = int(self.timeout_entry.get())
@@ -671,6 +748,7 @@ class DNSAnalyzerApp:
         # 清空之前的结果
         self.trace_tree.delete(*self.trace_tree.get_children())
         self.trace_data = []
+        self.clear_trace_chart()
         self.stats_text.config(state='normal')
         self.stats_text.delete('1.0', 'end')
         self.stats_text.config(state='disabled')
@@ -678,91 +756,117 @@ class DNSAnalyzerApp:
         # 更新状态
         self.trace_status.config(text=f"开始路由跟踪到: {hostname} (最大跳数: {max_hops})")
 
-        # 在新线程中执行traceroute
-        self.trace_thread = threading.Thread(
-            target=self.run_traceroute,
-            args=(hostname, max_hops, timeout, timeout_ms)
-        )
-        self.trace_thread.daemon = True
-        self.add_running_thread(self.trace_thread)
-        self.trace_thread.start()
+        # 在后台任务中执行traceroute
+        self.trace_task = task_executor.submit('trace', self.run_traceroute,
+                                               hostname, max_hops, timeout, timeout_ms, name='traceroute')
 
     def _is_ip_address(self, hostname):
         """检查输入是否是IP地址"""
-        try:
-            socket.inet_aton(hostname)
-            return True
-        except socket.error:
-            return False
+        return target_resolver.is_ip_address(hostname)
 
-    def _show_ip_selection_dialog(self, hostname):
-        """显示IP选择对话框"""
-        try:
-            # 执行DNS查询获取所有IP地址
-            import dns.resolver
-            answers = dns.resolver.resolve(hostname, 'A')
-            ip_list = [str(answer) for answer in answers]
-            
-            # 如果只有一个IP，直接返回
-            if len(ip_list) == 1:
-                return ip_list[0]
-            
-            # 创建IP选择对话框
-            dialog = tk.Toplevel(self.root)
-            dialog.title("选择IP地址")
-            dialog.geometry("400x300")
-            dialog.resizable(False, False)
-            dialog.transient(self.root)
-            dialog.grab_set()  # 模态对话框
-            
-            # 居中显示
-            dialog.update_idletasks()
-            x = (dialog.winfo_screenwidth() // 2) - (dialog.winfo_width() // 2)
-            y = (dialog.winfo_screenheight() // 2) - (dialog.winfo_height() // 2)
-            dialog.geometry(f"+{x}+{y}")
-            
-            selected_ip = tk.StringVar(value=ip_list[0])
-            
-            # 标题
-            title_label = ttk.Label(dialog, text=f"域名 '{hostname}' 解析到多个IP地址：", 
-                                   font=("Arial", 10, "bold"))
-            title_label.pack(pady=10)
-            
-            # IP选择框架
-            ip_frame = ttk.Frame(dialog)
-            ip_frame.pack(fill="both", expand=True, padx=20, pady=10)
-            
-            # 创建单选按钮
-            for i, ip in enumerate(ip_list):
-                rb = ttk.Radiobutton(ip_frame, text=ip, variable=selected_ip, value=ip)
-                rb.pack(anchor="w", pady=2)
-            
-            # 按钮框架
-            button_frame = ttk.Frame(dialog)
-            button_frame.pack(pady=10)
-            
-            def on_ok():
-                dialog.destroy()
-            
-            def on_cancel():
-                selected_ip.set(None)
-                dialog.destroy()
-            
-            ok_button = ttk.Button(button_frame, text="确定", command=on_ok)
-            ok_button.pack(side="left", padx=5)
-            
-            cancel_button = ttk.Button(button_frame, text="取消", command=on_cancel)
-            cancel_button.pack(side="left", padx=5)
-            
-            # 等待对话框关闭
-            dialog.wait_window()
-            
-            return selected_ip.get()
-            
-        except Exception as e:
+    def _show_ip_selection_dialog(self, hostname, candidates, on_selected, include_ipv6=True):
+        """显示IP选择对话框（非阻塞，在界面更新队列的回调中打开，不能等待对话框关闭）
+
+        对话框打开后在后台并行探测各地址的延迟，探测完成后通过界面更新队列显示延迟，
+        并预选延迟最低的地址（用户已手动选择时不覆盖）
+
+        :param candidates: 后台任务中由target_resolver解析得到的候选地址
+        :param on_selected: 确定选择后以选中的IP调用，用户取消时不调用
+        """
+        if not candidates:
             # DNS查询失败，直接使用原始hostname
-            messagebox.showwarning("DNS查询失败", f"无法解析域名 '{hostname}': {str(e)}\n将直接使用域名进行跟踪。")
-            return hostname
+            messagebox.showwarning("DNS查询失败", f"无法解析域名 '{hostname}'\n将直接使用域名进行跟踪。")
+            on_selected(hostname)
+            return
+
+        # 如果只有一个IP，直接使用
+        if len(candidates) == 1:
+            on_selected(candidates[0]['ip'])
+            return
+
+        # 创建IP选择对话框
+        dialog = tk.Toplevel(self.root)
+        dialog.title("选择IP地址")
+        dialog.geometry("420x320")
+        dialog.resizable(False, False)
+        dialog.transient(self.root)
+        dialog.grab_set()  # 模态对话框
+
+        # 居中显示
+        dialog.update_idletasks()
+        x = (dialog.winfo_screenwidth() // 2) - (dialog.winfo_width() // 2)
+        y = (dialog.winfo_screenheight() // 2) - (dialog.winfo_height() // 2)
+        dialog.geometry(f"+{x}+{y}")
+
+        selected_ip = tk.StringVar(value=candidates[0]['ip'])
+        result = {'user_selected': False}
+
+        # 标题
+        title_label = ttk.Label(dialog, text=f"域名 '{hostname}' 解析到多个IP地址：",
+                               font=("Arial", 10, "bold"))
+        title_label.pack(pady=10)
+
+        # IP选择框架
+        ip_frame = ttk.Frame(dialog)
+        ip_frame.pack(fill="both", expand=True, padx=20, pady=10)
+
+        def on_user_select():
+            result['user_selected'] = True
+
+        # 创建单选按钮
+        buttons = {}
+        for candidate in candidates:
+            rb = ttk.Radiobutton(ip_frame, text=f"{candidate['ip']}  (测速中...)", variable=selected_ip,
+                                 value=candidate['ip'], command=on_user_select)
+            rb.pack(anchor="w", pady=2)
+            buttons[candidate['ip']] = rb
+
+        probe_label = ttk.Label(dialog, text="正在探测各地址延迟...")
+        probe_label.pack()
+
+        def apply_ranking(ranked):
+            if not dialog.winfo_exists():
+                return
+            for candidate in ranked:
+                rb = buttons.get(candidate['ip'])
+                if rb is None:
+                    continue
+                if candidate['rtt'] is not None:
+                    rb.config(text=f"{candidate['ip']}  ({candidate['rtt']:.1f} ms, {candidate['method'].upper()})")
+                else:
+                    rb.config(text=f"{candidate['ip']}  (无响应)")
+            if ranked and not result['user_selected']:
+                selected_ip.set(ranked[0]['ip'])
+            probe_label.config(text="已预选延迟最低的地址")
+
+        def probe_candidates(task):
+            ranked = target_resolver.rank(hostname, include_ipv6)
+            if not task.cancelled:
+                self.ui_queue.post(apply_ranking, ranked)
+
+        probe_task = task_executor.submit('trace', probe_candidates, name='probe_candidates')
+
+        # 按钮框架
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(pady=10)
+
+        def on_ok():
+            ip = selected_ip.get()
+            dialog.destroy()
+            on_selected(ip)
+
+        def on_cancel():
+            dialog.destroy()
+
+        ok_button = ttk.Button(button_frame, text="确定", command=on_ok)
+        ok_button.pack(side="left", padx=5)
+
+        cancel_button = ttk.Button(button_frame, text="取消", command=on_cancel)
+        cancel_button.pack(side="left", padx=5)
+
+        # 对话框关闭后不再需要探测结果
+        dialog.protocol("WM_DELETE_WINDOW", on_cancel)
+        dialog.bind("<Destroy>", lambda event: event.widget is dialog and probe_task.cancel())
 
     def is_valid_hostname(self, hostname):
         """验证主机名或IP地址是否有效 - 简化版本"""
@@ -772,11 +876,8 @@ class DNSAnalyzerApp:
         hostname = hostname.strip()
 
         # 检查是否是有效的IP地址
-        try:
-            socket.inet_aton(hostname)
+        if target_resolver.is_ip_address(hostname):
             return True
-        except socket.error:
-            pass
 
         # 简单的主机名格式检查
         if len(hostname) > 253:
@@ -804,12 +905,14 @@ class DNSAnalyzerApp:
             return False
 
     def update_trace_result(self, result):
-        """实时更新路由跟踪结果到界面"""
-        if len(result) == 4:
-            hop, ip, delay, location = result
-            isp = "未知"
-        else:
-            hop, ip, delay, location, isp = result
+        """实时更新路由跟踪结果到界面
+
+        :param result: (hop, ip, delay, location[, isp[, (lat, lng)]])，NextTrace的JSON结果带经纬度
+        """
+        hop, ip, delay, location = result[:4]
+        isp = result[4] if len(result) > 4 else "未知"
+        # 跟踪过程中即保存（含经纬度和ASN），跟踪结束后由finalize_traceroute_results替换为完整结果
+        self.trace_data.append(result)
         
         # 确定状态和延迟文本
         if delay == -1:
@@ -830,14 +933,43 @@ class DNSAnalyzerApp:
             status
         ))
         
-        # 使用保存的item_id滚动到最新添加的项
+        # 滚动到最新添加的项（同一帧内插入多行时只滚动一次）
         if item_id:
-            self.trace_tree.see(item_id)
+            self.ui_queue.post_latest('trace_see', self.trace_tree.see, item_id)
+
+        # 实时追加到路由图（超时的跳点不画），同一帧内的多个跳点只重绘一次
+        point = self._trace_chart_point(result)
+        if point and point[1] > 0:
+            self.trace_chart_points.append(point)
+            if self.trace_chart is not None:
+                self.trace_chart.append(*point)
+                self.ui_queue.post_latest('trace_chart', self.trace_chart.refresh)
+
+        # 地理位置仍在后台查询时，查询完成后再更新该行（与跟踪过程中发起的查询合并）
+        if item_id and location == LOCATION_PENDING:
+            network_utils.get_ip_location_async(
+                ip, lambda addr, info, item=item_id: self.ui_queue.post(
+                    self._apply_trace_location, item, network_utils.format_location_string(info)))
+
+        # 在后台补充主机名（PTR解析），完成后再更新该行
+        if item_id and self.resolve_ptr_var.get():
+            network_utils.resolve_hostname_async(
+                ip, lambda addr, name, item=item_id: self.ui_queue.post(self._apply_trace_hostname, item, name))
         
         # 更新进度
         progress = int((hop / int(self.max_hops_entry.get())) * 100)
-        self.root.after(0, lambda: self.progress_label.config(text=f"{progress}%"))
+        self.ui_queue.post_latest('trace_progress', lambda: self.progress_label.config(text=f"{progress}%"))
     
+    def _apply_trace_location(self, item_id, location):
+        """将后台查询得到的地理位置填入路由跟踪结果行"""
+        if self.trace_tree.exists(item_id):
+            self.trace_tree.set(item_id, "地理位置", location)
+
+    def _apply_trace_hostname(self, item_id, hostname):
+        """将后台解析得到的主机名填入路由跟踪结果行"""
+        if hostname and self.trace_tree.exists(item_id):
+            self.trace_tree.set(item_id, "主机名", hostname)
+
     def reset_trace_ui(self):
         """重置路由跟踪UI状态"""
         self.is_tracing = False
@@ -846,633 +978,141 @@ class DNSAnalyzerApp:
         self.trace_progress.stop()
         self.progress_label.config(text="100%")
     
-    def _run_nexttrace_with_process(self, process, cmd, callback, max_hops, timeout, ip_selection_callback=None):
-        """使用预创建的进程运行NextTrace实时回调模式
-        
-        :param process: 预创建的子进程
-        :param cmd: NextTrace命令列表
-        :param callback: 回调函数
-        :param max_hops: 最大跳数
-        :param timeout: 超时时间
-        :param ip_selection_callback: IP选择回调函数
-        :return: 最终结果字典，包含MapTrace URL
+    def run_traceroute(self, task, hostname, max_hops, timeout, timeout_ms):
+        """执行路由跟踪 - 根据选择的方法调用network_utils中对应的方法
+
+        在trace任务中执行；跟踪子进程登记到任务的取消令牌，取消任务时终止子进程
         """
-        import re
-        import time
-        
-        hops = []
-        current_hop = None
-        line_buffer = ""
-        processed_hops = set()  # 跟踪已处理的跳数，避免重复回调
-        ip_selection_mode = False  # 标记是否处于IP选择模式
-        ip_options = []  # 存储IP选项
-        waiting_for_selection = False  # 标记是否正在等待用户选择
-        ip_selection_timeout = 5  # IP选择超时时间（秒）
-        ip_selection_start_time = None  # IP选择开始时间
-        maptrace_url = None  # 存储MapTrace URL
-        
+        self.root.after(0, lambda: self.trace_status.config(text="路由跟踪进行中..."))
+
+        # 清空之前的数据
+        self.trace_data = []
+        method = self.trace_method.get()
+
         try:
-            # 逐行读取输出
-            for line in process.stdout:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                print(f"NextTrace输出: {line}")  # 调试输出
-                
-                # 检测IP选择界面
-                if 'Please Choose the IP You Want To TraceRoute' in line:
-                    ip_selection_mode = True
-                    ip_options = []
-                    waiting_for_selection = True
-                    ip_selection_start_time = time.time()
-                    print("检测到IP选择界面，正在收集IP选项...")
-                    continue
-                
-                # 处理IP选择选项
-                if ip_selection_mode and waiting_for_selection and line:
-                    # 解析IP选项行
-                    if line[0].isdigit() and ('.' in line or ':' in line):
-                        # 格式可能是: "0. 180.101.51.73" 或 "0) 180.101.49.11 (IPv4)"
-                        parts = re.split(r'[.)]\s*', line, 1)
-                        if len(parts) >= 2:
-                            try:
-                                index = int(parts[0].strip())
-                                ip_info = parts[1].strip()
-                                
-                                # 提取IP地址和类型
-                                ip_type = "IPv4" if '.' in ip_info else "IPv6"
-                                # 移除可能的类型标识
-                                ip_address = ip_info.split()[0] if ip_info.split() else ip_info
-                                
-                                ip_options.append({
-                                    "index": index,
-                                    "ip": ip_address,
-                                    "type": ip_type,
-                                    "location": "未知"
-                                })
-                                
-                                print(f"发现IP选项 {index}: {ip_address} ({ip_type})")
-                                
-                                # 如果收集到4个IP选项，立即触发选择
-                                if len(ip_options) >= 4:
-                                    print("已收集到4个IP选项，立即触发选择...")
-                                    waiting_for_selection = False
-                                    
-                                    # 立即处理IP选择
-                                    if ip_selection_callback:
-                                        # 调用IP选择回调
-                                        try:
-                                            selected_ip, selected_index = ip_selection_callback(ip_options)
-                                            
-                                            if selected_ip and selected_index is not None:
-                                                # 发送用户选择到NextTrace
-                                                try:
-                                                    process.stdin.write(f'{selected_index}\n')
-                                                    process.stdin.flush()
-                                                    print(f"用户选择IP: {selected_ip} (索引: {selected_index})")
-                                                    ip_selection_mode = False
-                                                except Exception as e:
-                                                    print(f"发送IP选择失败: {e}")
-                                                    # 如果无法发送选择，取消进程
-                                                    process.terminate()
-                                                    raise RuntimeError("无法发送IP选择到NextTrace")
-                                            else:
-                                                # 用户取消选择
-                                                print("用户取消了IP选择")
-                                                process.terminate()
-                                                raise RuntimeError("用户取消了IP选择")
-                                                
-                                        except Exception as e:
-                                            print(f"IP选择回调出错: {e}")
-                                            process.terminate()
-                                            raise RuntimeError(f"IP选择失败: {e}")
-                                    else:
-                                        # 如果没有提供回调，自动选择第一个IPv4地址
-                                        auto_selected = None
-                                        for ip_option in ip_options:
-                                            if ip_option["type"] == "IPv4":
-                                                auto_selected = ip_option
-                                                break
-                                        
-                                        if not auto_selected:
-                                            auto_selected = ip_options[0]  # 如果没有IPv4，选择第一个
-                                        
-                                        try:
-                                            process.stdin.write(f'{auto_selected["index"]}\n')
-                                            process.stdin.flush()
-                                            print(f"自动选择IP: {auto_selected['ip']} (索引: {auto_selected['index']})")
-                                            ip_selection_mode = False
-                                        except Exception as e:
-                                            print(f"发送自动IP选择失败: {e}")
-                                            process.terminate()
-                                            raise RuntimeError("无法发送IP选择到NextTrace")
-                                    
-                                    continue  # 跳过当前行的其余处理
-                                
-                            except (ValueError, IndexError) as e:
-                                print(f"解析IP选项失败: {e}")
-                    
-                    # 检查是否收集完所有IP选项
-                    # 如果已经收集到IP选项且下一行不是IP选项，或者已经收集了4个选项（通常NextTrace最多显示4个），则认为收集完成
-                    elif ip_options and (len(ip_options) >= 4 or not (line[0].isdigit() and ('.' in line or ':' in line))):
-                        waiting_for_selection = False
-                        
-                        if ip_selection_callback:
-                            # 调用IP选择回调
-                            try:
-                                selected_ip, selected_index = ip_selection_callback(ip_options)
-                                
-                                if selected_ip and selected_index is not None:
-                                    # 发送用户选择到NextTrace
-                                    try:
-                                        process.stdin.write(f'{selected_index}\n')
-                                        process.stdin.flush()
-                                        print(f"用户选择IP: {selected_ip} (索引: {selected_index})")
-                                        ip_selection_mode = False
-                                    except Exception as e:
-                                        print(f"发送IP选择失败: {e}")
-                                        # 如果无法发送选择，取消进程
-                                        process.terminate()
-                                        raise RuntimeError("无法发送IP选择到NextTrace")
-                                else:
-                                    # 用户取消选择
-                                    print("用户取消了IP选择")
-                                    process.terminate()
-                                    raise RuntimeError("用户取消了IP选择")
-                                    
-                            except Exception as e:
-                                print(f"IP选择回调出错: {e}")
-                                process.terminate()
-                                raise RuntimeError(f"IP选择失败: {e}")
-                        else:
-                            # 如果没有提供回调，自动选择第一个IPv4地址
-                            auto_selected = None
-                            for ip_option in ip_options:
-                                if ip_option["type"] == "IPv4":
-                                    auto_selected = ip_option
-                                    break
-                            
-                            if not auto_selected:
-                                auto_selected = ip_options[0]  # 如果没有IPv4，选择第一个
-                            
-                            try:
-                                process.stdin.write(f'{auto_selected["index"]}\n')
-                                process.stdin.flush()
-                                print(f"自动选择IP: {auto_selected['ip']} (索引: {auto_selected['index']})")
-                                ip_selection_mode = False
-                            except Exception as e:
-                                print(f"发送自动IP选择失败: {e}")
-                                process.terminate()
-                                raise RuntimeError("无法发送IP选择到NextTrace")
-                        
-                        continue
-                
-                # 检查IP选择超时
-                if ip_selection_mode and waiting_for_selection and ip_selection_start_time:
-                    if time.time() - ip_selection_start_time > ip_selection_timeout:
-                        print("IP选择超时，强制进行选择...")
-                        waiting_for_selection = False
-                        
-                        if ip_options:
-                            if ip_selection_callback:
-                                # 超时时调用回调
-                                try:
-                                    selected_ip, selected_index = ip_selection_callback(ip_options)
-                                    
-                                    if selected_ip and selected_index is not None:
-                                        process.stdin.write(f'{selected_index}\n')
-                                        process.stdin.flush()
-                                        print(f"超时后用户选择IP: {selected_ip} (索引: {selected_index})")
-                                        ip_selection_mode = False
-                                    else:
-                                        # 超时自动选择第一个IPv4
-                                        auto_selected = None
-                                        for ip_option in ip_options:
-                                            if ip_option["type"] == "IPv4":
-                                                auto_selected = ip_option
-                                                break
-                                        
-                                        if not auto_selected:
-                                            auto_selected = ip_options[0]
-                                        
-                                        process.stdin.write(f'{auto_selected["index"]}\n')
-                                        process.stdin.flush()
-                                        print(f"超时自动选择IP: {auto_selected['ip']} (索引: {auto_selected['index']})")
-                                        ip_selection_mode = False
-                                except Exception as e:
-                                    print(f"超时IP选择回调出错: {e}")
-                                    process.terminate()
-                                    raise RuntimeError(f"超时IP选择失败: {e}")
-                            else:
-                                # 超时自动选择第一个IPv4
-                                auto_selected = None
-                                for ip_option in ip_options:
-                                    if ip_option["type"] == "IPv4":
-                                        auto_selected = ip_option
-                                        break
-                                
-                                if not auto_selected:
-                                    auto_selected = ip_options[0]
-                                
-                                try:
-                                    process.stdin.write(f'{auto_selected["index"]}\n')
-                                    process.stdin.flush()
-                                    print(f"超时自动选择IP: {auto_selected['ip']} (索引: {auto_selected['index']})")
-                                    ip_selection_mode = False
-                                except Exception as e:
-                                    print(f"超时发送自动IP选择失败: {e}")
-                                    process.terminate()
-                                    raise RuntimeError("无法发送IP选择到NextTrace")
-                        else:
-                            print("没有收集到IP选项，终止进程")
-                            process.terminate()
-                            raise RuntimeError("没有收集到IP选项")
-                
-                # 如果正在等待IP选择，跳过其他处理
-                if waiting_for_selection:
-                    continue
-                
-                # 检查并捕获MapTrace URL
-                if line.startswith('MapTrace URL:'):
-                    maptrace_url = line.replace('MapTrace URL:', '').strip()
-                    print(f"捕获到MapTrace URL: {maptrace_url}")
-                    continue
-                
-                # 跳过无关行
-                if (line.startswith('NextTrace') or 'NextTrace API' in line or
-                    line.startswith('traceroute to') or
-                    line.startswith('Please Choose the IP') or
-                    any(x in line for x in ['Sponsored by', 'Copyright', 'Founder', 'Developer', 'Usage:', 'Flags:', 'Examples:', 'Output trace results as', 'Start from the first_ttl hop', 'Disable Print Trace Map', 'Disable MPLS', 'Print version info and exit', 'Use source address', 'Use the following Network Devices', 'Set how many [milliseconds]', 'The number of [milliseconds]', 'Set the payload size', 'Choose the language', 'Read IP Address', 'Disable Colorful Output'])):
-                    continue
-                
-                # 尝试解析路由跳数行
+            results = cache_results = []
+            protocol = self._trace_protocol(method)
+
+            if self.path_verify_var.get():
+                cached_results = self._verify_cached_path(hostname, method, protocol, timeout)
+                if cached_results:
+                    self.ui_queue.post(self.finalize_traceroute_results, cached_results, hostname, method, None, True)
+                    return
+
+            self.root.after(0, lambda: self.trace_status.config(text=f"使用 {method.upper()} 方法进行路由跟踪..."))
+
+            # 根据选择的方法调用对应的traceroute函数
+            if method == "nexttrace" and self.nexttrace_available:
+                # 使用NextTrace进行路由追踪
+                # 使用实时回调函数更新结果
+                def nexttrace_callback(hop, ip, delay, location, isp, coords=None):
+                    # 在主线程中更新UI，JSON输出解出的经纬度随结果一起传递
+                    result = (hop, ip, delay, location, isp, coords)
+                    self.ui_queue.post(self.update_trace_result, result)
+
+                # 通过共享工作池运行，与其他并发跟踪共享探测预算；界面发起的跟踪优先
+                # 使用JSON输出（带经纬度和ASN）和数字模式探测，主机名由update_trace_result中的PTR解析补充
+                future = nexttrace_pool.submit(hostname, priority=0, max_hops=max_hops,
+                                               timeout=timeout_ms,
+                                               callback=nexttrace_callback,
+                                               process_callback=task.token.attach_process,
+                                               format='json', no_rdns=True)
+                # 仍在排队时取消任务，直接从工作池中撤回
+                handle = task.token.register(future.cancel)
                 try:
-                    parts = line.split()
-                    if not parts:
-                        continue
-                    
-                    # 检查是否是新的路由跳数行（第一个部分是数字）
-                    if parts[0].isdigit():
-                        # 如果有上一个跳数，先保存并调用回调（如果还未调用过）
-                        if current_hop and current_hop["hop"] not in processed_hops:
-                            hops.append(current_hop)
-                            self._call_callback_for_hop(current_hop, callback)
-                            processed_hops.add(current_hop["hop"])
-                        
-                        # 开始新的跳数
-                        hop_num = int(parts[0])
-                        
-                        # 跳过超时的跳数
-                        if len(parts) > 1 and parts[1] == '*':
-                            current_hop = {
-                                "hop": hop_num,
-                                "ip": "*",
-                                "delay": [-1],  # 使用-1表示超时
-                                "geo": {"country": "超时", "region": "", "city": ""},
-                                "asn": {}
-                            }
-                            # 立即调用回调处理超时
-                            hops.append(current_hop)
-                            self._call_callback_for_hop(current_hop, callback)
-                            processed_hops.add(hop_num)
-                            current_hop = None
-                            continue
-                        
-                        # 解析IP地址
-                        if len(parts) > 1:
-                            ip = parts[1]
-                            
-                            # 解析地理位置信息
-                            geo = {"country": "未知", "region": "未知", "city": "未知"}
-                            asn = {}
-                            
-                            # 查找ASN信息（AS开头）
-                            for part in parts[2:]:
-                                if part.startswith('AS'):
-                                    asn["as"] = part
-                                    break
-                            
-                            # 查找地理位置信息（跳过ASN和IP相关部分）
-                            location_parts = []
-                            for part in parts[2:]:
-                                if part.startswith('AS'):
-                                    continue
-                                # 跳过主机名和域名（包含点但没有中文字符）
-                                if '.' in part and not any(char in part for char in '中文美国新加坡日本韩国香港台湾'):
-                                    continue
-                                # 跳过技术术语
-                                if part in ['-', 'LLC', 'Gbps', 'about.google', 'Equinix', 'Singapore']:
-                                    continue
-                                location_parts.append(part)
-                            
-                            # 过滤出地理位置信息
-                            geo_location = []
-                            for part in location_parts:
-                                if any(char in part for char in '中文美国新加坡日本韩国香港台湾') or len(part) <= 10:
-                                    geo_location.append(part)
-                            
-                            if geo_location:
-                                if len(geo_location) >= 1:
-                                    geo["country"] = geo_location[0]
-                                if len(geo_location) >= 2:
-                                    geo["region"] = geo_location[1]
-                                if len(geo_location) >= 3:
-                                    geo["city"] = geo_location[2]
-                            
-                            current_hop = {
-                                "hop": hop_num,
-                                "ip": ip,
-                                "delay": [0],  # 延迟将在下一行解析
-                                "geo": geo,
-                                "asn": asn
-                            }
-                            # 不要立即调用回调，等待延迟信息
-                        else:
-                            current_hop = None
-                    
-                    # 如果不是新的跳数行，可能是当前跳数的延迟信息
-                    elif current_hop and not parts[0].isdigit():
-                        # 检查是否包含延迟信息（延迟信息通常在单独一行）
-                        if 'ms' in line:
-                            # 解析各种延迟格式
-                            delays = []
-                            # 使用正则表达式更准确地提取延迟值
-                            import re
-                            # 匹配延迟模式：数字.数字 ms 或 数字 ms
-                            delay_matches = re.findall(r'(\d+\.?\d*)\s*ms', line)
-                            
-                            for match in delay_matches:
-                                try:
-                                    delay_value = float(match)
-                                    if delay_value > 0:
-                                        delays.append(delay_value)
-                                except:
-                                    pass
-                            
-                            # 如果正则表达式没有匹配到，尝试原始方法
-                            if not delays:
-                                parts = line.split()
-                                has_timeout = False
-                                for part in parts:
-                                    if 'ms' in part:
-                                        try:
-                                            # 处理 "* ms" 格式 - 表示超时
-                                            if part.strip() == '*':
-                                                has_timeout = True
-                                                continue
-                                            # 提取数字部分
-                                            delay_str = ''.join(c for c in part if c.isdigit() or c == '.')
-                                            if delay_str:
-                                                delay_value = float(delay_str)
-                                                if delay_value > 0:
-                                                    delays.append(delay_value)
-                                        except:
-                                            pass
-                                
-                                # 如果检测到超时但没有有效延迟，设置为超时
-                                if has_timeout and not delays:
-                                    current_hop["delay"] = [-1]
-                                    # 调用回调以更新超时状态
-                                    self._call_callback_for_hop(current_hop, callback)
-                                    # 确保标记为已处理
-                                    processed_hops.add(current_hop["hop"])
-                                    # 将完整的跳数信息添加到结果数组
-                                    hops.append(current_hop.copy())
-                                    continue
-                            
-                            # 如果找到有效延迟，使用平均值或第一个值
-                            if delays:
-                                avg_delay = sum(delays) / len(delays)
-                                current_hop["delay"] = [avg_delay]
-                                # 调用回调以更新延迟（无论是否已经处理过）
-                                self._call_callback_for_hop(current_hop, callback)
-                                # 确保标记为已处理
-                                processed_hops.add(current_hop["hop"])
-                                # 将完整的跳数信息添加到结果数组
-                                hops.append(current_hop.copy())
-                        
-                        # 检查是否包含地理位置信息（用于补充）
-                        elif any(word in line for word in ['中国', '美国', '新加坡', '日本', '韩国', '香港', '台湾']):
-                            # 更新地理位置信息
-                            location_words = []
-                            for part in parts:
-                                if not part.startswith('AS') and 'ms' not in part and not part.replace('.', '').isdigit():
-                                    location_words.append(part)
-                            
-                            if location_words:
-                                if len(location_words) >= 1 and current_hop["geo"]["country"] == "未知":
-                                    current_hop["geo"]["country"] = location_words[0]
-                                if len(location_words) >= 2 and current_hop["geo"]["region"] == "未知":
-                                    current_hop["geo"]["region"] = location_words[1]
-                                if len(location_words) >= 3 and current_hop["geo"]["city"] == "未知":
-                                    current_hop["geo"]["city"] = location_words[2]
-                            
-                            # 只有在还未处理过时才调用回调（避免覆盖延迟信息）
-                            if current_hop["hop"] not in processed_hops:
-                                self._call_callback_for_hop(current_hop, callback)
-                                processed_hops.add(current_hop["hop"])
-                                # 将完整的跳数信息添加到结果数组
-                                hops.append(current_hop.copy())
-                
-                except Exception as e:
-                    print(f"解析NextTrace输出行时出错: {e}")
-                    continue
-                
-            # 等待进程完成
-            process.wait(timeout=max_hops * (timeout / 1000) + 30)
-            
-            # 保存最后一个跳数（如果还未处理过）
-            if current_hop and current_hop["hop"] not in processed_hops:
-                hops.append(current_hop)
-                self._call_callback_for_hop(current_hop, callback)
-            
-            return {"hops": hops, "raw_output": "", "maptrace_url": maptrace_url}
-            
-        except subprocess.TimeoutExpired:
-            process.kill()
-            raise RuntimeError(f"NextTrace执行超时")
-        except Exception as e:
-            process.kill()
-            raise RuntimeError(f"NextTrace执行出错: {e}")
+                    nexttrace_result = future.result()
+                finally:
+                    task.token.unregister(handle)
+                # 提取路由数据和MapTrace URL
+                if isinstance(nexttrace_result, dict) and "hops" in nexttrace_result:
+                    # 路径缓存保存原始跳数记录（含超时跳点），界面结果转换为带经纬度的
+                    # (hop, ip, delay, location, isp, (lat, lng))，供地图和导出使用
+                    cache_results = nexttrace_result["hops"]
+                    results = nexttrace_integration.convert_nexttrace_result_to_dns_tool_format(nexttrace_result)
+                    # 存储MapTrace URL到实例变量
+                    self.maptrace_url = nexttrace_result.get("maptrace_url")
+                    if self.maptrace_url:
+                        logger.info("存储MapTrace URL: %s", self.maptrace_url)
+                else:
+                    results = cache_results = nexttrace_result
+            else:
+                # system方法（以及NextTrace不可用时的默认方法）使用系统命令，通过回调函数实时更新结果
+                def trace_callback(result):
+                    # 在主线程中更新UI
+                    self.ui_queue.post(self.update_trace_result, result)
+
+                results = network_utils.traceroute(
+                    hostname,
+                    max_hops=max_hops,
+                    timeout=timeout,
+                    callback=trace_callback,
+                    process_callback=task.token.attach_process
+                )
+                cache_results = results
+                # 保存结果但不在此处重置UI，让finalize_traceroute_results统一处理
+
+            # 保存路径并与上次的缓存路径比较（被取消的跟踪结果不完整，不保存）
+            path_diff = path_cache.store(hostname, method, protocol, cache_results) if not task.cancelled else None
+
+            # 更新UI（经由更新队列，保证在已排队的跳点之后执行）
+            self.ui_queue.post(self.finalize_traceroute_results, results, hostname, method, path_diff)
 
-    def _call_callback_for_hop(self, hop_data, callback):
-        """为单个跳数调用回调函数
-        
-        :param hop_data: 跳数数据字典
-        :param callback: 回调函数
-        """
-        try:
-            hop = hop_data.get("hop", 0)
-            ip = hop_data.get("ip", "")
-            delay = hop_data.get("delay", [0])[0]
-            
-            # 构建位置信息
-            geo = hop_data.get("geo", {})
-            location_parts = []
-            if geo.get("country"):
-                location_parts.append(geo["country"])
-            if geo.get("region") and geo["region"] != geo["country"]:
-                location_parts.append(geo["region"])
-            if geo.get("city") and geo["city"] not in location_parts:
-                location_parts.append(geo["city"])
-            
-            location = " ".join(location_parts) if location_parts else "未知"
-            
-            # 获取ISP信息
-            asn = hop_data.get("asn", {})
-            isp = ""
-            if asn.get("as"):
-                isp = asn["as"]
-            
-            # 调用回调函数
-            if callback:
-                callback(hop, ip, delay, location, isp)
-                
         except Exception as e:
-            print(f"调用回调函数时出错: {e}")
+            if task.cancelled:
+                # 取消时界面已由cancel_traceroute复位
+                return
+            error_msg = f"{method.upper()} 路由跟踪失败: {str(e)}"
+            # 提供更友好的错误提示和建议
+            if method == "nexttrace":
+                error_msg += "。请确保NextTrace可执行文件已正确安装并在系统PATH中。"
+            self.root.after(0, lambda: self.trace_status.config(text=error_msg))
 
-    def run_traceroute(self, hostname, max_hops, timeout, timeout_ms):
-        """执行路由跟踪 - 根据选择的方法调用network_utils中对应的方法"""
-        self.root.after(0, lambda: self.trace_status.config(text="路由跟踪进行中..."))
+    def _trace_protocol(self, method):
+        """返回跟踪方法实际使用的探测协议，用作路径缓存键的一部分"""
+        # 系统traceroute在Linux/macOS上默认使用UDP探测，其余均为ICMP
+        if method == "system" and platform.system().lower() != 'windows':
+            return 'udp'
+        return 'icmp'
 
-        try:
-            # 清空之前的数据
-            self.trace_data = []
+    def _verify_cached_path(self, hostname, method, protocol, timeout):
+        """抽样探测缓存路径中的少量TTL，路径未变化时返回缓存结果
 
-            def execute_traceroute():
-                try:
-                    results = []
-                    method = self.trace_method.get()
+        :return: 路径未变化时返回缓存的结果列表，否则返回None
+        """
+        cached = path_cache.get(hostname, method, protocol)
+        if not cached:
+            return None
 
-                    self.root.after(0, lambda: self.trace_status.config(text=f"使用 {method.upper()} 方法进行路由跟踪..."))
+        self.root.after(0, lambda: self.trace_status.config(text="正在抽样验证缓存路径..."))
+        unchanged, mismatches = path_cache.verify(
+            hostname, method, protocol,
+            # 使用与缓存路径相同的探测协议，否则按协议分流的负载均衡会造成误报的路径变化
+            lambda ttl: network_utils.probe_ttl(hostname, ttl, timeout=max(1, timeout), protocol=protocol)
+        )
+        if not unchanged:
+            detail = ", ".join(f"跳点{m['hop']}" for m in mismatches)
+            self.root.after(0, lambda: self.trace_status.config(
+                text=f"缓存路径验证未通过({detail})，执行完整跟踪..."))
+            return None
 
-                    # 根据选择的方法调用对应的traceroute函数
-                    if method == "system":
-                        # 对于system方法，使用回调函数实时更新结果
-                        def trace_callback(result):
-                            # 在主线程中更新UI
-                            self.root.after(0, self.update_trace_result, result)
-                        
-                        # 添加进程回调函数来保存进程引用
-                        def process_callback(process):
-                            # 保存进程引用以便取消功能使用
-                            self.trace_process = process
-                        
-                        results = network_utils.traceroute(
-                            hostname, 
-                            max_hops=max_hops, 
-                            timeout=timeout, 
-                            callback=trace_callback,
-                            process_callback=process_callback
-                        )
-                        # 清理进程引用
-                        self.trace_process = None
-                        # 保存结果但不在此处重置UI，让finalize_traceroute_results统一处理
-                    elif method == "nexttrace" and NEXTTRACE_AVAILABLE:
-                        # 使用NextTrace进行路由追踪
-                        nexttrace = NextTraceIntegration()
-                        # 使用实时回调函数更新结果
-                        def nexttrace_callback(hop, ip, delay, location, isp):
-                            # 在主线程中更新UI
-                            result = (hop, ip, delay, location, isp)
-                            self.root.after(0, self.update_trace_result, result)
-                        # NextTrace需要毫秒单位的超时值
-                        # 创建一个包装器来保存进程引用
-                        original_run_with_realtime_callback = nexttrace._run_with_realtime_callback
-                        def wrapped_run_with_realtime_callback(cmd, callback, max_hops, timeout, ip_selection_callback=None):
-                            # 调用原始方法并保存进程引用
-                            process = subprocess.Popen(
-                                cmd,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT,
-                                stdin=subprocess.PIPE,
-                                encoding='utf-8',
-                                errors='replace',
-                                universal_newlines=True,
-                                bufsize=1,
-                                env={**os.environ, 'PYTHONIOENCODING': 'utf-8'},
-                                creationflags=0x08000000 if os.name == 'nt' else 0
-                            )
-                            # 保存进程引用以便取消功能使用
-                            self.trace_process = process
-                            
-                            # 使用try-except确保进程引用被正确管理
-                            try:
-                                # 调用原始逻辑，但使用我们创建的进程
-                                return self._run_nexttrace_with_process(process, cmd, callback, max_hops, timeout, ip_selection_callback)
-                            except Exception as e:
-                                # 如果发生错误，清理进程引用
-                                self.trace_process = None
-                                raise e
-                        
-                        # 替换方法
-                        nexttrace._run_with_realtime_callback = wrapped_run_with_realtime_callback
-                        
-                        try:
-                            nexttrace_result = nexttrace.run_traceroute(hostname, max_hops=max_hops, timeout=timeout_ms, callback=nexttrace_callback)
-                            # 提取路由数据和MapTrace URL
-                            if isinstance(nexttrace_result, dict) and "hops" in nexttrace_result:
-                                results = nexttrace_result["hops"]
-                                # 存储MapTrace URL到实例变量
-                                self.maptrace_url = nexttrace_result.get("maptrace_url")
-                                if self.maptrace_url:
-                                    print(f"存储MapTrace URL: {self.maptrace_url}")
-                            else:
-                                results = nexttrace_result
-                        finally:
-                            # 清理进程引用
-                            self.trace_process = None
-                    else:
-                        # 默认使用系统命令方法
-                        def trace_callback(result):
-                            # 在主线程中更新UI
-                            self.root.after(0, self.update_trace_result, result)
-                        
-                        # 添加进程回调函数来保存进程引用
-                        def process_callback(process):
-                            # 保存进程引用以便取消功能使用
-                            self.trace_process = process
-                        
-                        results = network_utils.traceroute(
-                            hostname, 
-                            max_hops=max_hops, 
-                            timeout=timeout, 
-                            callback=trace_callback,
-                            process_callback=process_callback
-                        )
-                        # 清理进程引用
-                        self.trace_process = None
-
-                    # 更新UI
-                    self.root.after(0, self.finalize_traceroute_results, results, hostname, method)
-
-                except Exception as e:
-                    # 清理进程引用
-                    self.trace_process = None
-                    error_msg = f"{method.upper()} 路由跟踪失败: {str(e)}"
-                    # 提供更友好的错误提示和建议
-                    if method == "nexttrace":
-                        error_msg += "。请确保NextTrace可执行文件已正确安装并在系统PATH中。"
-                    self.root.after(0, lambda: self.trace_status.config(text=error_msg))
-                finally:
-                    # 线程结束时从运行线程列表中移除
-                    current_thread = threading.current_thread()
-                    self.remove_running_thread(current_thread)
+        results = [(h['hop'], h['ip'], h['delay'], h['location'], h['isp']) for h in cached['hops']]
+        for result in results:
+            self.ui_queue.post(self.update_trace_result, result)
+        return results
 
-            # 在后台线程中执行
-            thread = threading.Thread(target=execute_traceroute)
-            thread.daemon = True
-            self.add_running_thread(thread)
-            thread.start()
+    def _show_trace_stats(self, text):
+        """在统计信息标签页中显示文本"""
+        self.stats_text.config(state='normal')
+        self.stats_text.delete('1.0', 'end')
+        self.stats_text.insert('end', text)
+        self.stats_text.config(state='disabled')
 
-        except Exception as e:
-            # 清理进程引用
-            self.trace_process = None
-            self.root.after(0, lambda: self.trace_status.config(text=f"路由跟踪失败: {str(e)}"))
+    def finalize_traceroute_results(self, results, hostname, method, path_diff=None, from_cache=False):
+        """完成路由跟踪后的最终处理
 
-    def finalize_traceroute_results(self, results, hostname, method):
-        """完成路由跟踪后的最终处理"""
+        :param path_diff: 与缓存路径相比的变化列表，None表示未比较
+        :param from_cache: 结果是否来自通过快速验证的缓存路径
+        """
         # 重置UI状态
         self.is_tracing = False
         self.trace_button.config(state='normal')
@@ -1568,6 +1208,18 @@ class DNSAnalyzerApp:
         else:
             status_text = f"{method.upper()}跟踪完成: 无法到达目标 {hostname}"
 
+        # 路径缓存信息
+        if from_cache:
+            cached = path_cache.get(hostname, method, self._trace_protocol(method)) or {}
+            status_text += " (缓存路径已验证)"
+            last_seen = cached.get('last_seen')
+            seen_text = datetime.fromtimestamp(last_seen).strftime('%Y-%m-%d %H:%M:%S') if last_seen else "未知"
+            self._show_trace_stats(f"抽样验证通过，使用缓存路径\n完整跟踪时间: {seen_text}")
+        elif path_diff is not None:
+            if path_diff:
+                status_text += f" (路径变化: {len(path_diff)} 跳)"
+            self._show_trace_stats(path_cache.format_diff(path_diff))
+
         # 启用生成地图按钮（如果traceMap可用且有有效的路由数据）
         if TRACEMAP_AVAILABLE and valid_hops > 0:
             self.generate_map_button.config(state='normal')
@@ -1709,42 +1361,40 @@ class DNSAnalyzerApp:
             messagebox.showerror("错误", "请输入目标域名或IP地址")
             return
 
-        thread = threading.Thread(target=self.run_ping_test, args=(hostname,))
-        thread.daemon = True
-        self.add_running_thread(thread)
-        thread.start()
+        task_executor.submit('trace', self.run_ping_test, hostname, name='ping_test')
 
-    def run_ping_test(self, hostname):
+    def run_ping_test(self, task, hostname):
         """执行Ping测试"""
         self.root.after(0, lambda: self.trace_status.config(text="Ping测试进行中..."))
 
         try:
-            result = network_utils.ping_test(hostname, count=4)
+            # 取消任务时终止ping进程
+            result = network_utils.ping_test(hostname, count=4, process_callback=task.token.attach_process)
+            if not task.cancelled:
+                self.root.after(0, self.show_ping_result, hostname, result)
 
-            # 显示Ping结果
-            ping_window = tk.Toplevel(self.root)
-            ping_window.title(f"Ping测试结果 - {hostname}")
-            ping_window.geometry("600x400")
+        except Exception as e:
+            message = f"Ping测试失败: {str(e)}"
+            self.root.after(0, lambda: self.trace_status.config(text=message))
 
-            text_widget = tk.Text(ping_window, wrap='word')
-            text_widget.pack(fill='both', expand=True, padx=10, pady=10)
-            text_widget.insert('1.0', result)
-            text_widget.config(state='disabled')
+    def show_ping_result(self, hostname, result):
+        """显示Ping结果（界面线程）"""
+        ping_window = tk.Toplevel(self.root)
+        ping_window.title(f"Ping测试结果 - {hostname}")
+        ping_window.geometry("600x400")
 
-            scrollbar = ttk.Scrollbar(ping_window, orient="vertical", command=text_widget.yview)
-            scrollbar.pack(side='right', fill='y')
-            text_widget.configure(yscrollcommand=scrollbar.set)
+        text_widget = tk.Text(ping_window, wrap='word')
+        text_widget.pack(fill='both', expand=True, padx=10, pady=10)
+        text_widget.insert('1.0', result)
+        text_widget.config(state='disabled')
 
-            ttk.Button(ping_window, text="关闭", command=ping_window.destroy).pack(pady=10)
+        scrollbar = ttk.Scrollbar(ping_window, orient="vertical", command=text_widget.yview)
+        scrollbar.pack(side='right', fill='y')
+        text_widget.configure(yscrollcommand=scrollbar.set)
 
-            self.root.after(0, lambda: self.trace_status.config(text="Ping测试完成"))
+        ttk.Button(ping_window, text="关闭", command=ping_window.destroy).pack(pady=10)
 
-        except Exception as e:
-            self.root.after(0, lambda: self.trace_status.config(text=f"Ping测试失败: {str(e)}"))
-        finally:
-            # 移除当前线程
-            current_thread = threading.current_thread()
-            self.root.after(0, lambda: self.remove_running_thread(current_thread))
+        self.trace_status.config(text="Ping测试完成")
 
     def clear_traceroute_results(self):
         """清除路由跟踪结果"""
@@ -1756,12 +1406,7 @@ class DNSAnalyzerApp:
         self.trace_data = []
 
         # 清除图表
-        self.ax_trace.clear()
-        self.ax_trace.set_title('路由跟踪可视化图')
-        self.ax_trace.set_xlabel('延迟 (ms)')
-        self.ax_trace.set_ylabel('网络跳数')
-        self.ax_trace.grid(True, alpha=0.3)
-        self.canvas_trace.draw()
+        self.clear_trace_chart()
 
         # 清除统计信息
         self.stats_text.config(state='normal')
@@ -1799,9 +1444,10 @@ class DNSAnalyzerApp:
                     writer = csv.writer(f)
                     writer.writerow(["跳数", "IP地址", "延迟(ms)", "地理位置", "运营商"])
 
-                    for hop, ip, delay, location in self.trace_data:
-                        isp = "未知"
-                        if '(' in location and ')' in location:
+                    for row in self.trace_data:
+                        hop, ip, delay, location = row[:4]
+                        isp = row[4] if len(row) > 4 and row[4] else "未知"
+                        if isp == "未知" and '(' in location and ')' in location:
                             isp_start = location.find('(') + 1
                             isp_end = location.find(')')
                             if isp_end > isp_start:
@@ -1827,17 +1473,14 @@ class DNSAnalyzerApp:
         
         hostname = self.trace_host_entry.get().strip()
         
-        # 在新线程中生成地图，避免UI卡顿
-        thread = threading.Thread(target=self.run_generate_tracemap, args=(hostname,))
-        thread.daemon = True
-        self.add_running_thread(thread)
-        thread.start()
+        # 在后台任务中生成地图，避免UI卡顿
+        task_executor.submit('render', self.run_generate_tracemap, hostname, name='tracemap')
         
         # 显示生成中的提示
         self.trace_status.config(text="正在生成地图可视化...")
     
-    def run_generate_tracemap(self, hostname):
-        """在后台线程中执行地图生成"""
+    def run_generate_tracemap(self, task, hostname):
+        """在后台任务中执行地图生成"""
         try:
             # 检查是否有MapTrace URL（NextTrace生成的）
             if hasattr(self, 'maptrace_url') and self.maptrace_url:
@@ -1870,9 +1513,6 @@ class DNSAnalyzerApp:
             # 确保按钮状态正确恢复
             if hasattr(self, 'generate_map_button'):
                 self.root.after(0, lambda: self.generate_map_button.config(state=tk.NORMAL))
-            # 线程结束时从运行线程列表中移除
-            current_thread = threading.current_thread()
-            self.remove_running_thread(current_thread)
 
     def setup_quick_test_tab(self, notebook):
         """快速测试标签页"""
@@ -1897,7 +1537,7 @@ class DNSAnalyzerApp:
         self.dns_combo.grid(row=0, column=3, padx=5, pady=5)
 
         ttk.Label(input_frame, text="记录类型:").grid(row=1, column=0, sticky='w', padx=5, pady=5)
-        self.record_combo = ttk.Combobox(input_frame, width=15, values=["A", "AAAA", "MX", "NS", "CNAME"])
+        self.record_combo = ttk.Combobox(input_frame, width=15, values=["A", "AAAA", "MX", "NS", "CNAME", "TXT"])
         self.record_combo.set("A")
         self.record_combo.grid(row=1, column=1, padx=5, pady=5)
 
@@ -1906,6 +1546,33 @@ class DNSAnalyzerApp:
         self.iterations_entry.set("3")
         self.iterations_entry.grid(row=1, column=3, padx=5, pady=5)
 
+        ttk.Label(input_frame, text="传输协议:").grid(row=1, column=4, sticky='w', padx=5, pady=5)
+        self.transport_combo = ttk.Combobox(input_frame, width=8, values=list(TRANSPORTS), state='readonly')
+        self.transport_combo.set("UDP")
+        self.transport_combo.grid(row=1, column=5, padx=5, pady=5)
+
+        # 多记录类型并行测试：所选类型（以及DNS服务器框中用逗号分隔的多个服务器）每轮同时查询
+        self.multi_type_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="多类型并行:", variable=self.multi_type_var).grid(
+            row=2, column=0, sticky='w', padx=5, pady=5)
+        record_type_frame = ttk.Frame(input_frame)
+        record_type_frame.grid(row=2, column=1, columnspan=5, sticky='w', padx=5, pady=5)
+        self.record_type_vars = {}
+        for record_type in ("A", "AAAA", "CNAME", "MX", "NS", "TXT"):
+            var = tk.BooleanVar(value=record_type in ("A", "AAAA"))
+            ttk.Checkbutton(record_type_frame, text=record_type, variable=var).pack(side='left', padx=3)
+            self.record_type_vars[record_type] = var
+        ttk.Label(record_type_frame, text="（多个DNS服务器用逗号分隔）").pack(side='left', padx=5)
+
+        # 冷/热缓存分离：随机标签查询测缓存未命中延迟，与重复查询同一名称的缓存命中延迟分开统计
+        self.cache_mode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="冷/热缓存分离", variable=self.cache_mode_var).grid(
+            row=3, column=0, sticky='w', padx=5, pady=5)
+        ttk.Label(input_frame, text="泛解析区域:").grid(row=3, column=2, sticky='w', padx=5, pady=5)
+        self.cold_zone_entry = ttk.Entry(input_frame, width=25)
+        self.cold_zone_entry.grid(row=3, column=3, padx=5, pady=5)
+        ttk.Label(input_frame, text="（留空则使用测试域名）").grid(row=3, column=4, columnspan=2, sticky='w', padx=5, pady=5)
+
         # 按钮区域
         button_frame = ttk.Frame(quick_frame)
         button_frame.pack(fill='x', padx=5, pady=5)
@@ -1966,15 +1633,30 @@ stackoverflow.com"""
         batch_button_frame = ttk.Frame(batch_frame)
         batch_button_frame.pack(fill='x', padx=5, pady=5)
 
-        ttk.Button(batch_button_frame, text="开始批量测试", command=self.start_batch_test).pack(side='left', padx=5)
+        self.batch_test_button = ttk.Button(batch_button_frame, text="开始批量测试", command=self.toggle_batch_test)
+        self.batch_test_button.pack(side='left', padx=5)
         ttk.Button(batch_button_frame, text="导入域名列表", command=self.import_domains).pack(side='left', padx=5)
+        ttk.Button(batch_button_frame, text="从文件流式测试", command=self.start_bulk_test).pack(side='left', padx=5)
         ttk.Button(batch_button_frame, text="清空列表", command=self.clear_domains).pack(side='left', padx=5)
 
+        ttk.Label(batch_button_frame, text="并发数:").pack(side='left', padx=(15, 2))
+        self.batch_workers_entry = ttk.Spinbox(batch_button_frame, from_=1, to=128, width=5)
+        self.batch_workers_entry.set("16")
+        self.batch_workers_entry.pack(side='left')
+
+        ttk.Label(batch_button_frame, text="QPS上限:").pack(side='left', padx=(10, 2))
+        self.batch_qps_entry = ttk.Spinbox(batch_button_frame, from_=0, to=5000, width=6)
+        self.batch_qps_entry.set("50")
+        self.batch_qps_entry.pack(side='left')
+
+        self.batch_status_label = ttk.Label(batch_button_frame, text="就绪")
+        self.batch_status_label.pack(side='left', padx=10)
+
         # 批量测试结果
         batch_result_frame = ttk.LabelFrame(batch_frame, text="批量测试结果", padding=10)
         batch_result_frame.pack(fill='both', expand=True, padx=5, pady=5)
 
-        batch_columns = ("域名", "DNS服务器", "平均时间(ms)", "最快(ms)", "最慢(ms)", "成功率")
+        batch_columns = ("域名", "DNS服务器", "平均时间(ms)", "最快(ms)", "最慢(ms)", "成功率", "P90(ms)", "P99(ms)")
         self.batch_tree = ttk.Treeview(batch_result_frame, columns=batch_columns, show='headings', height=10)
 
         for col in batch_columns:
@@ -2020,8 +1702,12 @@ stackoverflow.com"""
         self.chart_frame = ttk.LabelFrame(monitor_frame, text="实时监控图表", padding=10)
         self.chart_frame.pack(fill='both', expand=True, padx=5, pady=5)
 
-        # 初始化图表
-        self.setup_chart()
+        # 监控数据：固定容量的原始样本、降采样的绘图序列和去重的解析结果
+        self.monitor_series = MonitorSeries()
+
+        # 图表在该标签页第一次显示时才创建
+        self.monitor_chart = None
+        self.defer_until_shown(self.chart_frame, self.setup_chart)
 
         # 监控状态
         self.monitor_status = ttk.Label(monitor_frame, text="监控未启动")
@@ -2051,6 +1737,16 @@ stackoverflow.com"""
         self.compare_record_type.set("A")
         self.compare_record_type.grid(row=0, column=5, padx=5, pady=5)
 
+        ttk.Label(compare_input_frame, text="传输协议:").grid(row=0, column=6, sticky='w', padx=5, pady=5)
+        self.compare_transport = ttk.Combobox(compare_input_frame, width=8, state='readonly',
+                                              values=list(TRANSPORTS) + ["全部"])
+        self.compare_transport.set("UDP")
+        self.compare_transport.grid(row=0, column=7, padx=5, pady=5)
+
+        self.compare_cache_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(compare_input_frame, text="测量冷/热缓存延迟", variable=self.compare_cache_var).grid(
+            row=1, column=0, columnspan=2, sticky='w', padx=5, pady=5)
+
         # DNS 服务器选择
         dns_select_frame = ttk.LabelFrame(compare_frame, text="选择 DNS 服务器", padding=10)
         dns_select_frame.pack(fill='x', padx=5, pady=5)
@@ -2119,12 +1815,14 @@ stackoverflow.com"""
         table_frame = ttk.Frame(result_notebook)
         result_notebook.add(table_frame, text="表格数据")
 
-        columns = ("排名", "DNS服务器", "提供商", "平均解析(ms)", "最快(ms)", "最慢(ms)",
-                   "访问时延(ms)", "成功率", "解析结果")
+        columns = ("排名", "DNS服务器", "提供商", "协议", "平均解析(ms)", "最快(ms)", "最慢(ms)", "P90(ms)", "P99(ms)",
+                   "冷缓存(ms)", "热缓存(ms)", "握手(ms)", "摊销(ms)", "访问时延(ms)", "成功率", "解析结果")
         self.compare_tree = ttk.Treeview(table_frame, columns=columns, show='headings', height=15)
 
-        column_widths = {"排名": 60, "DNS服务器": 120, "提供商": 100, "平均解析(ms)": 100,
-                         "最快(ms)": 80, "最慢(ms)": 80, "访问时延(ms)": 100, "成功率": 80, "解析结果": 150}
+        column_widths = {"排名": 50, "DNS服务器": 110, "提供商": 90, "协议": 50, "平均解析(ms)": 90,
+                         "最快(ms)": 70, "最慢(ms)": 70, "P90(ms)": 70, "P99(ms)": 70,
+                         "冷缓存(ms)": 80, "热缓存(ms)": 80, "握手(ms)": 70, "摊销(ms)": 70,
+                         "访问时延(ms)": 90, "成功率": 60, "解析结果": 150}
 
         for col in columns:
             self.compare_tree.heading(col, text=col)
@@ -2136,8 +1834,9 @@ stackoverflow.com"""
         self.chart_frame_compare = ttk.Frame(result_notebook)
         result_notebook.add(self.chart_frame_compare, text="性能图表")
 
-        # 初始化比较图表
-        self.setup_comparison_chart()
+        # 比较图表在该标签页第一次显示时才创建
+        self.fig_compare = None
+        self.defer_until_shown(self.chart_frame_compare, self.setup_comparison_chart)
 
         # 状态显示
         self.compare_status = ttk.Label(compare_frame, text="就绪")
@@ -2169,27 +1868,27 @@ stackoverflow.com"""
         self.report_text.configure(yscrollcommand=scrollbar.set)
 
     def setup_chart(self):
-        """设置监控图表"""
-        self.fig, self.ax = plt.subplots(figsize=(8, 4))
+        """设置监控图表（监控标签页第一次显示时调用）"""
+        from .chart_utils import LiveLineChart
+
+        self.fig, self.ax, self.canvas = self.create_figure(self.chart_frame, figsize=(8, 4))
 
         # 使用字体工具设置中文
         set_plot_chinese_font(self.ax,
                               title='RouteTracer Pro 路由追踪时间实时监控',
-                              xlabel='时间',
+                              xlabel='时间 (分钟)',
                               ylabel='解析时间 (ms)')
 
         self.ax.grid(True, alpha=0.3)
 
-        self.canvas = FigureCanvasTkAgg(self.fig, self.chart_frame)
-        self.canvas.get_tk_widget().pack(fill='both', expand=True)
-
-        self.monitor_times = []
-        self.monitor_timestamps = []
-        self.monitor_results = []  # 用于保存解析的IP结果
+        # 持久的曲线和解析结果文本，新样本只更新数据并blit，超出坐标范围时才完整重绘
+        self.monitor_chart = LiveLineChart(self.ax, self.canvas, color='b', linestyle='-', marker='o', markersize=3)
+        self.update_chart()
 
     def setup_comparison_chart(self):
-        """设置比较图表"""
-        self.fig_compare, (self.ax1, self.ax2) = plt.subplots(1, 2, figsize=(12, 5))
+        """设置比较图表（性能图表标签页第一次显示时调用）"""
+        self.fig_compare, (self.ax1, self.ax2), self.canvas_compare = self.create_figure(
+            self.chart_frame_compare, figsize=(12, 5), ncols=2)
 
         # 使用字体工具设置中文
         set_plot_chinese_font(self.ax1,
@@ -2203,121 +1902,220 @@ stackoverflow.com"""
         self.ax1.grid(True, alpha=0.3)
         self.ax2.grid(True, alpha=0.3)
 
-        self.canvas_compare = FigureCanvasTkAgg(self.fig_compare, self.chart_frame_compare)
-        self.canvas_compare.get_tk_widget().pack(fill='both', expand=True)
-
-        self.comparison_data = []
-
-    def test_dns_resolution(self, hostname, dns_server, record_type):
-        """测试DNS解析"""
-        resolver = dns.resolver.Resolver()
-        resolver.timeout = 5
-        resolver.lifetime = 5
-
-        if dns_server != "系统默认":
-            resolver.nameservers = [dns_server]
-
-        try:
-            start_time = time.time()
-            answers = resolver.resolve(hostname, record_type)
-            end_time = time.time()
-
-            resolution_time = (end_time - start_time) * 1000
-            results = [str(rdata) for rdata in answers]
-
-            return {
-                'success': True,
-                'time_ms': resolution_time,
-                'results': ', '.join(results[:3]),  # 只显示前3个结果
-                'error': None
-            }
-
-        except Exception as e:
-            return {
-                'success': False,
-                'time_ms': None,
-                'results': '',
-                'error': str(e)
-            }
+        # 补画图表创建之前已有的比较结果
+        if self.comparison_data:
+            self.update_comparison_chart(self.comparison_data)
+
+    def test_dns_resolution(self, hostname, dns_server, record_type, transport='UDP'):
+        """测试DNS解析（UDP使用共享解析器池，TCP/DoT/DoH复用长连接，计时只包含报文往返）"""
+        result = BatchDNSEngine(qps=0, transport=transport).query(hostname, dns_server, record_type)
+        return self.format_dns_result(result)
+
+    def format_dns_result(self, result):
+        """把查询引擎的结果转换为界面显示使用的格式"""
+        return {
+            'success': result['success'],
+            'time_ms': result['time_ms'],
+            'results': ', '.join(result['answers'][:3]),  # 只显示前3个结果
+            'error': result['error'],
+            'overhead_ms': result.get('overhead_ms'),
+            'handshake_ms': result.get('handshake_ms', 0.0)
+        }
 
     def start_quick_test(self):
         """开始快速测试"""
         domain = self.domain_entry.get().strip()
         dns_server = self.dns_combo.get()
         record_type = self.record_combo.get()
+        transport = self.transport_combo.get()
 
         if not domain:
             messagebox.showerror("错误", "请输入域名")
             return
 
-        # 在新线程中执行测试
-        thread = threading.Thread(target=self.run_quick_test, args=(domain, dns_server, record_type))
-        thread.daemon = True
-        self.add_running_thread(thread)
-        thread.start()
+        if self.multi_type_var.get():
+            record_types = [name for name, var in self.record_type_vars.items() if var.get()]
+            servers = [server.strip() for server in dns_server.replace('，', ',').split(',') if server.strip()]
+            if not record_types or not servers:
+                messagebox.showerror("错误", "请至少选择一种记录类型和一个DNS服务器")
+                return
+            target, args = self.run_multi_type_test, (domain, servers, record_types, transport)
+        elif self.cache_mode_var.get():
+            zone = self.cold_zone_entry.get().strip() or None
+            target, args = self.run_cache_test, (domain, dns_server, record_type, transport, zone)
+        else:
+            target, args = self.run_quick_test, (domain, dns_server, record_type, transport)
+
+        # 在后台任务中执行测试
+        task_executor.submit('dns', target, *args)
 
-    def run_quick_test(self, domain, dns_server, record_type):
+    def run_quick_test(self, task, domain, dns_server, record_type, transport='UDP'):
         """执行快速测试"""
         try:
             iterations = int(self.iterations_entry.get())
-            times = []
+            histogram = LatencyHistogram()
 
             for i in range(iterations):
-                result = self.test_dns_resolution(domain, dns_server, record_type)
+                result = self.test_dns_resolution(domain, dns_server, record_type, transport)
 
                 # 在UI线程中更新结果
-                self.root.after(0, self.update_result_tree, i + 1, domain, dns_server, record_type, result)
+                self.ui_queue.post(self.update_result_tree, i + 1, domain, dns_server, record_type, result)
 
-                if result['success']:
-                    times.append(result['time_ms'])
+                histogram.record_result(result)
 
-                time.sleep(0.5)  # 短暂延迟
+                # 短暂延迟，任务取消时立即结束
+                if task.token.wait(0.5):
+                    break
 
             # 更新统计信息
-            if times:
-                avg_time = sum(times) / len(times)
-                min_time = min(times)
-                max_time = max(times)
-                success_rate = len(times) / iterations
-
-                stats_text = f"平均: {avg_time:.2f}ms, 最快: {min_time:.2f}ms, 最慢: {max_time:.2f}ms, 成功率: {success_rate:.1%}"
-                self.root.after(0, lambda: self.stats_label.config(text=stats_text))
+            if histogram.count:
+                stats_text = (f"平均: {histogram.mean:.2f}ms, 最快: {histogram.min:.2f}ms, 最慢: {histogram.max:.2f}ms, "
+                              f"{format_percentiles(histogram)}, 成功率: {histogram.success_rate:.1%}")
+                overhead = dns_resolver_pool.overhead_stats()
+                if overhead['count']:
+                    stats_text += f", 本地开销: {overhead['mean']:.3f}ms (P95 {overhead['p95']:.3f}ms)"
+                self.ui_queue.post_latest('stats_label', lambda: self.stats_label.config(text=stats_text))
         except Exception as e:
             error_msg = f"快速测试失败: {str(e)}"
             self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
-        finally:
-            # 线程结束时移除自己
-            current_thread = threading.current_thread()
-            self.remove_running_thread(current_thread)
 
-    def update_result_tree(self, index, domain, dns_server, record_type, result):
-        """更新结果树形视图"""
+    def run_multi_type_test(self, task, domain, servers, record_types, transport='UDP'):
+        """执行多记录类型并行测试：每轮所有(服务器, 记录类型)同时查询，结果按记录类型分组显示"""
+        try:
+            iterations = int(self.iterations_entry.get())
+            histograms = {record_type: LatencyHistogram() for record_type in record_types}
+            round_times = []
+
+            def on_round(done, results, elapsed_ms):
+                round_times.append(elapsed_ms)
+                for record_type in record_types:
+                    for server in servers:
+                        result = self.format_dns_result(results[(server, record_type)])
+                        histograms[record_type].record_result(result)
+                        self.ui_queue.post(self.update_result_tree, done, domain, server, record_type, result)
+                status_text = f"第 {done}/{iterations} 轮: {len(results)} 个查询并发完成，耗时 {elapsed_ms:.2f}ms"
+                self.ui_queue.post_latest('stats_label', lambda: self.stats_label.config(text=status_text))
+
+            engine = BatchDNSEngine(qps=0, transport=transport)
+            engine.resolve_types(domain, servers, record_types, iterations, on_round=on_round,
+                                 should_continue=lambda: not task.cancelled)
+
+            # 每种记录类型的统计（合并所有服务器）
+            parts = []
+            for record_type, histogram in histograms.items():
+                if histogram.count:
+                    p90 = histogram.percentile(90)
+                    parts.append(f"{record_type}: 平均 {histogram.mean:.2f}ms, P90 {p90:.2f}ms, "
+                                 f"成功率 {histogram.success_rate:.0%}")
+                else:
+                    parts.append(f"{record_type}: 全部失败")
+            if round_times:
+                parts.append(f"每轮耗时 {sum(round_times) / len(round_times):.2f}ms")
+            stats_text = "; ".join(parts)
+            self.ui_queue.post_latest('stats_label', lambda: self.stats_label.config(text=stats_text))
+        except Exception as e:
+            error_msg = f"多类型测试失败: {str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+
+    def run_cache_test(self, task, domain, dns_server, record_type, transport='UDP', zone=None):
+        """执行冷/热缓存分离测试：冷查询使用随机标签名称（必然缓存未命中），热查询重复查询测试域名"""
+        try:
+            iterations = int(self.iterations_entry.get())
+            probe = CacheProbe(dns_server, transport=transport)
+            counter = [0]
+
+            def on_sample(kind, name, result):
+                counter[0] += 1
+                row = self.format_dns_result(result)
+                note = "冷缓存" if kind == 'cold' else "热缓存"
+                if result.get('rcode') not in (None, 'NOERROR'):
+                    note += f", {result['rcode']}"
+                self.ui_queue.post(self.update_result_tree, counter[0], name, dns_server, record_type, row, note)
+
+            summary = probe.measure(domain, iterations, record_type, zone, on_sample=on_sample,
+                                    should_continue=lambda: not task.cancelled)
+
+            parts = []
+            for kind, label in (('cold', "冷缓存"), ('warm', "热缓存")):
+                histogram = summary[kind]
+                if histogram.count:
+                    parts.append(f"{label}: 平均 {histogram.mean:.2f}ms, {format_percentiles(histogram, (50, 90))}")
+                else:
+                    parts.append(f"{label}: 全部失败")
+            if summary['cache_miss_ms'] is not None:
+                parts.append(f"缓存未命中额外耗时约 {summary['cache_miss_ms']:.2f}ms")
+            stats_text = "; ".join(parts)
+            self.ui_queue.post_latest('stats_label', lambda: self.stats_label.config(text=stats_text))
+        except Exception as e:
+            error_msg = f"冷/热缓存测试失败: {str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+
+    def update_result_tree(self, index, domain, dns_server, record_type, result, note=None):
+        """更新结果树形视图
+
+        地理位置在后台查询，先插入带占位文本的行，查询完成后再更新该行
+
+        :param note: 附加在状态后的说明（如冷/热缓存）
+        """
+        ips = []
         if result['success']:
             status = "成功"
+            if result.get('handshake_ms'):
+                status += f" (建立连接 {result['handshake_ms']:.2f}ms)"
+            if note:
+                status += f" ({note})"
             time_ms = f"{result['time_ms']:.2f}"
             results = result['results']
 
-            # 获取IP位置信息
-            ip_locations = []
-            for ip in result['results'].split(', '):
-                if ip and ip != 'N/A':
-                    location_info = network_utils.get_ip_location(ip.strip())
-                    location_str = network_utils.format_location_string(location_info)
-                    ip_locations.append(f"{ip} [{location_str}]")
-
-            if ip_locations:
-                results = ', '.join(ip_locations)
-            else:
-                results = result['results']
+            # 只有A/AAAA记录的结果是IP地址
+            if record_type in ('A', 'AAAA'):
+                ips = [ip.strip() for ip in result['results'].split(', ') if ip.strip() and ip != 'N/A']
+            if ips:
+                results = ', '.join(f"{ip} [查询中...]" for ip in ips)
 
         else:
             status = f"失败: {result['error']}"
+            if note:
+                status += f" ({note})"
             time_ms = "N/A"
             results = "N/A"
 
-        self.result_tree.insert("", "end", values=(
+        item = self.result_tree.insert("", "end", values=(
             index, domain, dns_server, record_type, results, time_ms, status
         ))
+        if ips:
+            self.enrich_result_locations(item, ips)
+
+    def enrich_result_locations(self, item, ips):
+        """在后台查询结果行中各IP的地理位置，每完成一个就更新该行的解析结果列"""
+        locations = {}
+
+        def on_location(ip, location_info):
+            # 缓存命中时在界面线程中调用，否则在工作线程中调用
+            locations[ip] = network_utils.format_location_string(location_info)
+            if not self.is_closing:
+                self.ui_queue.post_latest(('result_locations', item), self.patch_result_locations, item, ips, locations)
+
+        for ip in ips:
+            network_utils.get_ip_location_async(ip, on_location)
+
+    def patch_result_locations(self, item, ips, locations):
+        """更新结果行的地理位置文本（行已被清除时忽略）"""
+        if not self.result_tree.exists(item):
+            return
+        text = ', '.join(f"{ip} [{locations.get(ip, '查询中...')}]" for ip in ips)
+        self.result_tree.set(item, "解析结果", text)
+
+    def toggle_batch_test(self):
+        """切换批量测试状态"""
+        if self.is_batch_testing:
+            self.is_batch_testing = False
+            if self.batch_task:
+                self.batch_task.cancel("用户停止")
+            self.batch_test_button.config(state='disabled')
+            self.batch_status_label.config(text="正在停止...")
+        else:
+            self.start_batch_test()
 
     def start_batch_test(self):
         """开始批量测试"""
@@ -2328,54 +2126,160 @@ stackoverflow.com"""
 
         domains = [domain.strip() for domain in domains_text.split('\n') if domain.strip()]
         dns_server = self.dns_combo.get()
+        transport = self.transport_combo.get()
 
-        # 在新线程中执行批量测试
-        thread = threading.Thread(target=self.run_batch_test, args=(domains, dns_server))
-        thread.daemon = True
-        self.add_running_thread(thread)
-        thread.start()
-
-    def run_batch_test(self, domains, dns_server):
-        """执行批量测试"""
         try:
-            # 清空之前的结果
-            self.root.after(0, lambda: self.batch_tree.delete(*self.batch_tree.get_children()))
-
-            for domain in domains:
-                times = []
-                successes = 0
-                iterations = 3  # 每个域名测试3次
-
-                for i in range(iterations):
-                    result = self.test_dns_resolution(domain, dns_server, 'A')
-                    if result['success']:
-                        times.append(result['time_ms'])
-                        successes += 1
-                    time.sleep(0.5)
-
-                if times:
-                    avg_time = sum(times) / len(times)
-                    min_time = min(times)
-                    max_time = max(times)
-                    success_rate = successes / iterations
-                else:
-                    avg_time = min_time = max_time = 0
-                    success_rate = 0
+            max_workers = int(self.batch_workers_entry.get())
+            qps = float(self.batch_qps_entry.get())
+        except ValueError:
+            messagebox.showerror("错误", "并发数和QPS上限必须是数字")
+            return
 
-                # 更新UI
-                self.root.after(0, self.update_batch_tree, domain, dns_server, avg_time, min_time, max_time, success_rate)
+        self.is_batch_testing = True
+        self.batch_test_button.config(text="停止批量测试")
+        self.batch_tree.delete(*self.batch_tree.get_children())
+        self.batch_histogram = LatencyHistogram()
+
+        # 在后台任务中执行批量测试
+        self.batch_task = task_executor.submit('dns', self.run_batch_test,
+                                               domains, dns_server, max_workers, qps, transport)
+
+    def run_batch_test(self, task, domains, dns_server, max_workers=16, qps=50, transport='UDP'):
+        """执行批量测试（并发执行，结果完成一条显示一条）"""
+        total = len(domains)
+        completed = [0]
+        progress_lock = threading.Lock()
+
+        def on_result(summary):
+            # 在工作线程中调用
+            with progress_lock:
+                completed[0] += 1
+                done = completed[0]
+            task.report_progress(done, total)
+            self.batch_histogram.merge(summary['histogram'])
+            self.ui_queue.post(self.update_batch_tree, summary['domain'], summary['server'],
+                               summary['avg_time'], summary['min_time'], summary['max_time'], summary['success_rate'],
+                               summary['p90_time'], summary['p99_time'])
+            self.ui_queue.post_latest('batch_status', lambda: self.batch_status_label.config(text=f"进度: {done}/{total}"))
+
+        try:
+            engine = BatchDNSEngine(max_workers=max_workers, qps=qps, transport=transport)
+            start_time = time.time()
+            engine.run(domains, [dns_server], 'A', iterations=3, on_result=on_result,
+                       should_continue=lambda: not task.cancelled)
+            elapsed = time.time() - start_time
+            status = "已停止" if task.cancelled else "已完成"
+            status_text = f"{status}: {completed[0]}/{total}，耗时 {elapsed:.1f}秒"
+            if self.batch_histogram.count:
+                status_text += f"，{format_percentiles(self.batch_histogram)}"
+            self.ui_queue.post_latest('batch_status', lambda: self.batch_status_label.config(text=status_text))
         except Exception as e:
             error_msg = f"批量测试失败: {str(e)}"
             self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
         finally:
-            # 线程结束时移除自己
-            current_thread = threading.current_thread()
-            self.remove_running_thread(current_thread)
+            self.is_batch_testing = False
+            if not self.is_closing:
+                self.root.after(0, lambda: self.batch_test_button.config(text="开始批量测试", state='normal'))
+
+    def start_bulk_test(self, source=None):
+        """从文件流式批量测试：域名按块从磁盘读取，结果增量写入文件，支持断点续传"""
+        if self.is_batch_testing:
+            messagebox.showinfo("提示", "批量测试正在进行中")
+            return
+
+        source = source or filedialog.askopenfilename(
+            title="选择域名列表文件",
+            filetypes=[("Text files", "*.txt"), ("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if not source:
+            return
+        output = filedialog.asksaveasfilename(
+            title="保存测试结果",
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("JSON Lines", "*.jsonl"), ("All files", "*.*")]
+        )
+        if not output:
+            return
+
+        resume = False
+        checkpoint = load_checkpoint(output)
+        if checkpoint:
+            answer = messagebox.askyesnocancel(
+                "断点续传", f"发现未完成的测试（已处理 {checkpoint['position']} 个域名，{checkpoint['updated']}）。\n"
+                            f"是否从断点继续？选择“否”将重新开始。")
+            if answer is None:
+                return
+            resume = answer
+
+        try:
+            max_workers = int(self.batch_workers_entry.get())
+            qps = float(self.batch_qps_entry.get())
+        except ValueError:
+            messagebox.showerror("错误", "并发数和QPS上限必须是数字")
+            return
 
-    def update_batch_tree(self, domain, dns_server, avg_time, min_time, max_time, success_rate):
+        self.is_batch_testing = True
+        self.batch_test_button.config(text="停止批量测试")
+        self.batch_tree.delete(*self.batch_tree.get_children())
+        self.batch_status_label.config(text="正在统计域名数...")
+
+        self.batch_task = task_executor.submit('dns', self.run_bulk_test,
+                                               source, output, resume, self.dns_combo.get(), max_workers, qps,
+                                               self.transport_combo.get())
+
+    def run_bulk_test(self, task, source, output, resume, dns_server, max_workers=16, qps=50, transport='UDP'):
+        """执行文件流式批量测试，界面只显示最近的结果和汇总统计（最多每0.5秒刷新一次）"""
+        try:
+            total = count_domains(source)
+            # 只测试一个服务器，在途上限与并发数一致
+            engine = BatchDNSEngine(max_workers=max_workers, qps=qps, per_server=max_workers, transport=transport)
+            runner = BulkRunner([dns_server], 'A', 3, engine)
+            last_update = [0.0]
+
+            def on_result(summary):
+                # 在工作线程中调用，限制界面刷新频率
+                task.report_progress(runner.completed, total)
+                now = time.monotonic()
+                if now - last_update[0] >= 0.5:
+                    last_update[0] = now
+                    self.ui_queue.post_latest('bulk_view', self.update_bulk_view, runner,
+                                              f"进度: {runner.completed}/{total}")
+
+            start_time = time.time()
+            result = runner.run(source, output, resume, on_result=on_result,
+                                should_continue=lambda: not task.cancelled)
+            elapsed = time.time() - start_time
+            if result['status'] == 'completed':
+                status_text = f"已完成: {result['position']} 个域名，耗时 {elapsed:.1f}秒，结果已写入 {output}"
+            else:
+                status_text = f"已停止: 已保存断点（{result['position']}/{total}），可重新选择该结果文件继续"
+            self.ui_queue.post_latest('bulk_view', self.update_bulk_view, runner, status_text)
+        except Exception as e:
+            error_msg = f"流式批量测试失败: {str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+        finally:
+            self.is_batch_testing = False
+            if not self.is_closing:
+                self.root.after(0, lambda: self.batch_test_button.config(text="开始批量测试", state='normal'))
+
+    def update_bulk_view(self, runner, status_text):
+        """刷新流式批量测试的显示：最近的结果窗口和汇总分位数"""
+        self.batch_tree.delete(*self.batch_tree.get_children())
+        for summary in runner.recent():
+            self.update_batch_tree(summary['domain'], summary['server'], summary['avg_time'], summary['min_time'],
+                                   summary['max_time'], summary['success_rate'], summary['p90_time'],
+                                   summary['p99_time'])
+        self.batch_histogram = runner.histogram
+        if runner.histogram.count:
+            status_text += f"，{format_percentiles(runner.histogram)}"
+        self.batch_status_label.config(text=status_text)
+
+    def update_batch_tree(self, domain, dns_server, avg_time, min_time, max_time, success_rate,
+                          p90_time=0, p99_time=0):
         """更新批量测试结果树形视图"""
         self.batch_tree.insert("", "end", values=(
-            domain, dns_server, f"{avg_time:.2f}", f"{min_time:.2f}", f"{max_time:.2f}", f"{success_rate:.1%}"
+            domain, dns_server, f"{avg_time:.2f}", f"{min_time:.2f}", f"{max_time:.2f}", f"{success_rate:.1%}",
+            f"{p90_time:.2f}", f"{p99_time:.2f}"
         ))
 
     def toggle_monitoring(self):
@@ -2400,122 +2304,59 @@ stackoverflow.com"""
         self.monitor_status.config(text="监控进行中...")
 
         # 清空监控数据
-        self.monitor_times.clear()
-        self.monitor_timestamps.clear()
-        self.monitor_results.clear()  # 清空解析结果
+        self.monitor_series.clear()
 
-        # 在新线程中执行监控
-        self.monitor_thread = threading.Thread(target=self.run_monitoring, args=(domain, interval, duration))
-        self.monitor_thread.daemon = True
-        self.add_running_thread(self.monitor_thread)
-        self.monitor_thread.start()
+        # 添加到监控调度器，立即执行第一次查询，持续时间到后自动停止
+        dns_server = self.dns_combo.get()
+        self.monitor_key = self.monitor_scheduler.add(domain, dns_server, interval, 'A',
+                                                      series=self.monitor_series, start_delay=0)
+        self.monitor_scheduler.start()
+        self.monitor_stop_timer = self.root.after(duration * 1000, self.stop_monitoring)
 
     def stop_monitoring(self):
         """停止监控"""
         self.is_monitoring = False
+        if self.monitor_key is not None:
+            self.monitor_scheduler.remove(self.monitor_key)
+            self.monitor_key = None
+        if self.monitor_stop_timer is not None:
+            self.root.after_cancel(self.monitor_stop_timer)
+            self.monitor_stop_timer = None
         self.monitor_button.config(text="开始监控")
         self.monitor_status.config(text="监控已停止")
 
-    def run_monitoring(self, domain, interval, duration):
-        """执行监控"""
-        try:
-            dns_server = self.dns_combo.get()
-            start_time = time.time()
-            end_time = start_time + duration
-
-            while self.is_monitoring and time.time() < end_time:
-                result = self.test_dns_resolution(domain, dns_server, 'A')
-
-                current_time = time.time()
-                if result['success']:
-                    self.monitor_times.append(result['time_ms'])
-                    self.monitor_timestamps.append(current_time)
-                    self.monitor_results.append(result['results'])  # 保存解析结果
-
-                    # 更新图表
-                    self.root.after(0, self.update_chart)
-
-                    status_text = f"最后解析: {result['time_ms']:.2f}ms - {time.strftime('%H:%M:%S')}"
-                else:
-                    status_text = f"解析失败 - {time.strftime('%H:%M:%S')}"
-
-                self.root.after(0, lambda: self.monitor_status.config(text=status_text))
-
-                # 等待间隔时间，但允许及时停止
-                for i in range(interval * 10):
-                    if not self.is_monitoring:
-                        break
-                    time.sleep(0.1)
-
-            self.root.after(0, self.stop_monitoring)
-        except Exception as e:
-            error_msg = f"监控失败: {str(e)}"
-            self.root.after(0, lambda: self.monitor_status.config(text=error_msg))
-            self.root.after(0, self.stop_monitoring)
-        finally:
-            # 线程结束时移除自己
-            current_thread = threading.current_thread()
-            self.remove_running_thread(current_thread)
+    def on_monitor_sample(self, key, result):
+        """监控查询完成回调（在调度器的工作线程中调用）"""
+        if self.is_closing or key != self.monitor_key:
+            return
+        if result['success']:
+            status_text = f"最后解析: {result['time_ms']:.2f}ms - {time.strftime('%H:%M:%S')}"
+            # 更新图表（多个样本在同一帧内到达时只重绘一次）
+            self.ui_queue.post_latest('monitor_chart', self.update_chart)
+        else:
+            status_text = f"解析失败 - {time.strftime('%H:%M:%S')}"
+        self.ui_queue.post_latest('monitor_status', lambda: self.monitor_status.config(text=status_text))
 
     def update_chart(self):
         """更新监控图表"""
-        if not self.monitor_times:
+        if self.monitor_chart is None or not len(self.monitor_series):
             return
 
-        self.ax.clear()
-
-        # 转换为相对时间（分钟）
-        if self.monitor_timestamps:
-            start_time = self.monitor_timestamps[0]
-            relative_times = [(t - start_time) / 60 for t in self.monitor_timestamps]
-
-            # 绘制解析时间曲线
-            self.ax.plot(relative_times, self.monitor_times, 'b-', marker='o', markersize=3)
-
-            # 在图表左侧显示所有IP信息，每行一个
-            if self.monitor_results:
-                # 获取唯一的IP列表（去重）
-                unique_ips = []
-                seen = set()
-                for result in reversed(self.monitor_results):
-                    if result and result not in seen:
-                        seen.add(result)
-                        unique_ips.insert(0, result)
-                        # 限制显示的IP数量，避免占用太多空间
-                        if len(unique_ips) >= 5:
-                            break
-                
-                # 将IP列表转换为多行文本
-                if unique_ips:
-                    ip_text = '\n'.join([f'IP: {ip}' for ip in unique_ips])
-                    # 在图表左上角显示IP信息
-                    self.ax.text(0.02, 0.98, ip_text, 
-                                transform=self.ax.transAxes, ha='left', va='top',
-                                fontsize=8, bbox=dict(facecolor='white', alpha=0.8))
-
-            # 重新设置标题和标签（确保中文显示）
-            set_plot_chinese_font(self.ax,
-                                  title='RouteTracer Pro 路由追踪时间实时监控',
-                                  xlabel='时间 (分钟)',
-                                  ylabel='解析时间 (ms)')
-
-            self.ax.grid(True, alpha=0.3)
-
-            self.canvas.draw()
+        # 降采样后的序列（相对时间，分钟），点数与监控时长无关
+        relative_times, resolution_times = self.monitor_series.plot_data()
+        if relative_times:
+            # 在图表左侧显示最近出现的不同解析结果，每行一个（限制数量，避免占用太多空间）
+            unique_ips = self.monitor_series.recent_answers(5)
+            ip_text = '\n'.join([f'IP: {ip}' for ip in unique_ips])
+            self.monitor_chart.update(relative_times, resolution_times, ip_text)
 
     def clear_chart(self):
         """清除图表"""
-        self.ax.clear()
-        self.ax.set_title('RouteTracer Pro 路由追踪时间实时监控')
-        self.ax.set_xlabel('时间')
-        self.ax.set_ylabel('解析时间 (ms)')
-        self.ax.grid(True, alpha=0.3)
-        self.canvas.draw()
+        if self.monitor_chart is not None:
+            self.monitor_chart.clear()
         
         # 清空数据
-        self.monitor_times.clear()
-        self.monitor_timestamps.clear()
-        self.monitor_results.clear()
+        self.monitor_series.clear()
 
     def select_all_dns(self):
         """全选 DNS 服务器"""
@@ -2540,53 +2381,78 @@ stackoverflow.com"""
             messagebox.showerror("错误", "请至少选择一个 DNS 服务器")
             return
 
-        # 在新线程中执行比较测试
-        thread = threading.Thread(
-            target=self.run_dns_comparison,
-            args=(domain, selected_dns, int(self.compare_iterations.get()))
-        )
-        thread.daemon = True
-        self.add_running_thread(thread)
-        thread.start()
+        transport = self.compare_transport.get()
+        transports = list(TRANSPORTS) if transport == "全部" else [transport]
+
+        # 在后台任务中执行比较测试
+        task_executor.submit('dns', self.run_dns_comparison,
+                             domain, selected_dns, int(self.compare_iterations.get()), transports,
+                             self.compare_cache_var.get())
+
+    def run_dns_comparison(self, task, domain, dns_servers, iterations, transports=('UDP',), measure_cache=False):
+        """执行 DNS 服务器比较测试（所有服务器和传输方式并发、按轮交错查询）
 
-    def run_dns_comparison(self, domain, dns_servers, iterations):
-        """执行 DNS 服务器比较测试"""
+        measure_cache为True时，另外对每个服务器分别测量冷缓存（随机标签）和热缓存延迟
+        """
         try:
             self.root.after(0, lambda: self.compare_status.config(text="测试进行中..."))
             self.root.after(0, lambda: self.compare_tree.delete(*self.compare_tree.get_children()))
 
-            results = []
-
-            for dns_ip in dns_servers:
-                self.root.after(0, lambda ip=dns_ip: self.compare_status.config(text=f"正在测试 {ip}..."))
-
-                # DNS 解析测试
-                resolution_times = []
-                resolved_ips = set()
-                success_count = 0
-
-                for i in range(iterations):
-                    result = self.test_dns_resolution(domain, dns_ip, self.compare_record_type.get())
-                    if result['success']:
-                        resolution_times.append(result['time_ms'])
-                        resolved_ips.update(result['results'].split(', '))
-                        success_count += 1
-                    time.sleep(0.5)  # 避免请求过快
+            def on_round(done, total):
+                self.root.after(0, lambda: self.compare_status.config(
+                    text=f"正在测试 {len(dns_servers)} 个服务器: 第 {done}/{total} 轮"))
+
+            # 关闭这些服务器已有的长连接，每次比较都重新握手，握手耗时和摊销延迟反映本次测试
+            transport_pool.close_servers(dns_servers)
+            engine = BatchDNSEngine(qps=0)
+            samples = engine.compare(domain, dns_servers, self.compare_record_type.get(), iterations,
+                                     on_round=on_round, should_continue=lambda: not task.cancelled,
+                                     transports=list(transports))
+
+            resolved = {}
+            for (dns_ip, transport), server_samples in samples.items():
+                resolved_ips = resolved.setdefault(dns_ip, [])
+                for result in server_samples:
+                    for ip in result['answers']:
+                        if ip not in resolved_ips:
+                            resolved_ips.append(ip)
+
+            # 访问时延测试（如果解析成功），各服务器解析出的地址在probe工作池中并发测试
+            self.root.after(0, lambda: self.compare_status.config(text="正在测试访问时延..."))
+            latency_futures = {
+                dns_ip: task_executor.call('probe', self.test_access_latency, ips[0], task.token)
+                for dns_ip, ips in resolved.items() if ips
+            }
+            latencies = {dns_ip: future.result() for dns_ip, future in latency_futures.items()}
+
+            # 冷/热缓存延迟，各(服务器, 传输方式)并发测量
+            cache_profiles = {}
+            if measure_cache:
+                self.root.after(0, lambda: self.compare_status.config(text="正在测量冷/热缓存延迟..."))
+                record_type = self.compare_record_type.get()
+                cache_futures = {
+                    target: task_executor.call('probe', CacheProbe(target[0], transport=target[1]).measure, domain,
+                                               iterations, record_type, should_continue=lambda: not task.cancelled)
+                    for target in samples
+                }
+                cache_profiles = {target: future.result() for target, future in cache_futures.items()}
 
-                # 访问时延测试（如果解析成功）
-                latency = None
-                if resolved_ips:
-                    latency = self.test_access_latency(list(resolved_ips)[0])
+            results = []
+            for (dns_ip, transport), server_samples in samples.items():
+                histogram = LatencyHistogram()
+                for result in server_samples:
+                    histogram.record_result(result)
+                handshakes = [r['handshake_ms'] for r in server_samples if r.get('handshake_ms')]
 
                 # 计算统计信息
-                if resolution_times:
-                    avg_resolution = sum(resolution_times) / len(resolution_times)
-                    min_resolution = min(resolution_times)
-                    max_resolution = max(resolution_times)
-                    success_rate = success_count / iterations
+                stats = histogram.summary()
+                if histogram.count:
+                    avg_resolution, min_resolution, max_resolution = stats['mean'], stats['min'], stats['max']
+                    # 摊销延迟：握手耗时平摊到每次成功查询
+                    amortized = (histogram.total + sum(handshakes)) / histogram.count
                 else:
-                    avg_resolution = min_resolution = max_resolution = 0
-                    success_rate = 0
+                    avg_resolution = min_resolution = max_resolution = amortized = 0
+                success_rate = histogram.success_rate
 
                 # 获取 DNS 提供商名称
                 provider = self.get_dns_provider_name(dns_ip)
@@ -2594,18 +2460,26 @@ stackoverflow.com"""
                 result_data = {
                     'dns_ip': dns_ip,
                     'provider': provider,
+                    'transport': transport,
                     'avg_resolution': avg_resolution,
                     'min_resolution': min_resolution,
                     'max_resolution': max_resolution,
-                    'latency': latency or 0,
+                    'p50_resolution': stats['p50'] or 0,
+                    'p90_resolution': stats['p90'] or 0,
+                    'p99_resolution': stats['p99'] or 0,
+                    'cold_p50': cache_profiles.get((dns_ip, transport), {}).get('cold_p50'),
+                    'warm_p50': cache_profiles.get((dns_ip, transport), {}).get('warm_p50'),
+                    'handshake': sum(handshakes) / len(handshakes) if handshakes else 0,
+                    'amortized': amortized,
+                    'latency': latencies.get(dns_ip) or 0,
                     'success_rate': success_rate,
-                    'resolved_ips': ', '.join(list(resolved_ips)[:2])  # 只显示前2个IP
+                    'resolved_ips': ', '.join(resolved[dns_ip][:2])  # 只显示前2个IP
                 }
 
                 results.append(result_data)
 
-            # 按平均解析时间排序
-            results.sort(key=lambda x: x['avg_resolution'])
+            # 按摊销延迟排序（UDP与平均解析时间相同），全部失败的排在最后
+            results.sort(key=lambda x: (x['success_rate'] == 0, x['amortized']))
 
             # 更新UI
             self.root.after(0, self.update_comparison_results, results)
@@ -2613,16 +2487,18 @@ stackoverflow.com"""
             error_msg = f"DNS比较测试失败: {str(e)}"
             self.root.after(0, lambda: self.compare_status.config(text=error_msg))
             self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
-        finally:
-            # 线程结束时移除自己
-            current_thread = threading.current_thread()
-            self.remove_running_thread(current_thread)
 
-    def test_access_latency(self, ip_address):
-        """测试访问时延 (TCP 连接时间)"""
+    def test_access_latency(self, ip_address, token=None):
+        """测试访问时延 (TCP 连接时间)
+
+        :param token: 任务的取消令牌，取消时关闭套接字，正在进行的连接立即返回
+        """
+        handle = None
         try:
             start_time = time.time()
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if token is not None:
+                handle = token.attach_socket(sock)
             sock.settimeout(5)
             sock.connect((ip_address, 80))  # 测试 HTTP 端口
             end_time = time.time()
@@ -2631,6 +2507,9 @@ stackoverflow.com"""
             return (end_time - start_time) * 1000  # 转换为毫秒
         except:
             return None
+        finally:
+            if token is not None:
+                token.unregister(handle)
 
     def get_dns_provider_name(self, dns_ip):
         """获取 DNS 提供商名称"""
@@ -2663,9 +2542,16 @@ stackoverflow.com"""
                 i,
                 result['dns_ip'],
                 result['provider'],
+                result.get('transport', 'UDP'),
                 f"{result['avg_resolution']:.2f}",
                 f"{result['min_resolution']:.2f}",
                 f"{result['max_resolution']:.2f}",
+                f"{result.get('p90_resolution', 0):.2f}",
+                f"{result.get('p99_resolution', 0):.2f}",
+                f"{result['cold_p50']:.2f}" if result.get('cold_p50') is not None else "-",
+                f"{result['warm_p50']:.2f}" if result.get('warm_p50') is not None else "-",
+                f"{result.get('handshake', 0):.2f}",
+                f"{result.get('amortized', result['avg_resolution']):.2f}",
                 f"{result['latency']:.2f}" if result['latency'] else "超时",
                 f"{result['success_rate']:.1%}",
                 result['resolved_ips']
@@ -2677,12 +2563,13 @@ stackoverflow.com"""
         # 更新状态
         best_dns = results[0] if results else None
         if best_dns:
-            status_text = f"测试完成！推荐 DNS: {best_dns['provider']} ({best_dns['dns_ip']}) - 平均 {best_dns['avg_resolution']:.2f}ms"
+            status_text = (f"测试完成！推荐 DNS: {best_dns['provider']} ({best_dns['dns_ip']}, "
+                           f"{best_dns.get('transport', 'UDP')}) - 平均 {best_dns['avg_resolution']:.2f}ms")
             self.compare_status.config(text=status_text)
 
     def update_comparison_chart(self, results):
         """更新比较图表"""
-        if not results:
+        if not results or self.fig_compare is None:
             return
 
         # 清空图表
@@ -2690,12 +2577,20 @@ stackoverflow.com"""
         self.ax2.clear()
 
         # 准备数据
-        providers = [f"{r['provider']}\n({r['dns_ip']})" for r in results]
+        multi_transport = len({r.get('transport', 'UDP') for r in results}) > 1
+        providers = [f"{r['provider']}\n({r['dns_ip']})" + (f"\n{r['transport']}" if multi_transport else "")
+                     for r in results]
         resolution_times = [r['avg_resolution'] for r in results]
+        amortized_times = [r.get('amortized', r['avg_resolution']) for r in results]
         latencies = [r['latency'] if r['latency'] else 0 for r in results]
 
         # 解析时间图表
-        bars1 = self.ax1.bar(providers, resolution_times, color='skyblue', alpha=0.7)
+        bars1 = self.ax1.bar(providers, resolution_times, color='skyblue', alpha=0.7, label='单次查询')
+        # 含握手开销的摊销延迟（与单次查询不同时才标出）
+        if any(abs(a - r) > 0.01 for a, r in zip(amortized_times, resolution_times)):
+            self.ax1.scatter(providers, amortized_times, color='darkorange', marker='D', s=20, zorder=3,
+                             label='摊销(含握手)')
+            self.ax1.legend(fontsize=8)
 
         # 设置中文标题和标签
         set_plot_chinese_font(self.ax1,
@@ -2746,42 +2641,36 @@ stackoverflow.com"""
             messagebox.showerror("错误", "无法解析域名")
             return
 
-        # 在新线程中执行时延测试
-        thread = threading.Thread(target=self.run_latency_test, args=(ip,))
-        thread.daemon = True
-        self.add_running_thread(thread)
-        thread.start()
+        # 在后台任务中执行时延测试
+        task_executor.submit('dns', self.run_latency_test, ip)
 
-    def run_latency_test(self, ip):
+    def run_latency_test(self, task, ip):
         """执行访问时延测试"""
-        try:
-            self.root.after(0, lambda: self.compare_status.config(text="测试访问时延..."))
+        self.root.after(0, lambda: self.compare_status.config(text="测试访问时延..."))
+
+        latencies = []
+        iterations = 10
+
+        for i in range(iterations):
+            latency = self.test_access_latency(ip, task.token)
+            if latency is not None:
+                latencies.append(latency)
+                status = f"测试进度: {i + 1}/{iterations}, 当前时延: {latency:.2f}ms"
+                self.root.after(0, lambda s=status: self.compare_status.config(text=s))
+            # 任务取消时立即结束
+            if task.token.wait(1):
+                return
 
-            latencies = []
-            iterations = 10
+        if latencies:
+            avg_latency = sum(latencies) / len(latencies)
+            min_latency = min(latencies)
+            max_latency = max(latencies)
 
-            for i in range(iterations):
-                latency = self.test_access_latency(ip)
-                if latency is not None:
-                    latencies.append(latency)
-                    status = f"测试进度: {i + 1}/{iterations}, 当前时延: {latency:.2f}ms"
-                    self.root.after(0, lambda s=status: self.compare_status.config(text=s))
-                time.sleep(1)
-
-            if latencies:
-                avg_latency = sum(latencies) / len(latencies)
-                min_latency = min(latencies)
-                max_latency = max(latencies)
-
-                result_text = (f"访问时延测试完成: 平均 {avg_latency:.2f}ms, "
-                               f"最快 {min_latency:.2f}ms, 最慢 {max_latency:.2f}ms")
-                self.root.after(0, lambda: self.compare_status.config(text=result_text))
-            else:
-                self.root.after(0, lambda: self.compare_status.config(text="访问时延测试失败"))
-        finally:
-            # 线程结束时从运行线程列表中移除
-            current_thread = threading.current_thread()
-            self.remove_running_thread(current_thread)
+            result_text = (f"访问时延测试完成: 平均 {avg_latency:.2f}ms, "
+                           f"最快 {min_latency:.2f}ms, 最慢 {max_latency:.2f}ms")
+            self.root.after(0, lambda: self.compare_status.config(text=result_text))
+        else:
+            self.root.after(0, lambda: self.compare_status.config(text="访问时延测试失败"))
 
     def export_comparison_results(self):
         """导出比较结果"""
@@ -2797,6 +2686,8 @@ stackoverflow.com"""
         
         if filename:
             try:
+                # pandas只在导出时使用，第一次导出时才导入
+                import pandas as pd
                 df = pd.DataFrame(self.comparison_data)
                 
                 if filename.endswith('.xlsx'):
@@ -2846,29 +2737,28 @@ stackoverflow.com"""
         # 原有的报告内容...
         # 收集所有测试结果
         total_tests = len(self.result_tree.get_children())
-        successful_tests = 0
-        total_time = 0
+        histogram = LatencyHistogram()
         dns_servers_used = set()
         
         for item in self.result_tree.get_children():
             values = self.result_tree.item(item)['values']
-            if len(values) >= 7 and values[6] == "成功" and values[5] != "N/A":
-                successful_tests += 1
+            if len(values) >= 7 and str(values[6]).startswith("成功") and values[5] != "N/A":
                 try:
-                    total_time += float(values[5])
+                    histogram.record(float(values[5]))
                 except ValueError:
-                    pass
+                    histogram.record_failure()
+            else:
+                histogram.record_failure()
             if len(values) >= 3:
-                dns_servers_used.add(values[2])
+                dns_servers_used.add(str(values[2]))
         
         if total_tests > 0:
-            success_rate = successful_tests / total_tests
-            avg_time = total_time / successful_tests if successful_tests > 0 else 0
-            
             report += f"总测试次数: {total_tests}\n"
-            report += f"成功次数: {successful_tests}\n"
-            report += f"成功率: {success_rate:.1%}\n"
-            report += f"平均解析时间: {avg_time:.2f}ms\n"
+            report += f"成功次数: {histogram.count}\n"
+            report += f"成功率: {histogram.success_rate:.1%}\n"
+            report += f"平均解析时间: {histogram.mean or 0:.2f}ms\n"
+            if histogram.count:
+                report += f"延迟分位数: {format_percentiles(histogram, (50, 90, 99, 99.9))}\n"
             report += f"使用的DNS服务器: {', '.join(dns_servers_used)}\n\n"
         else:
             report += "没有测试数据\n\n"
@@ -2895,7 +2785,11 @@ stackoverflow.com"""
             
             report += f"最快解析: {fastest['domain']} - {fastest['avg_time']:.2f}ms\n"
             report += f"最慢解析: {slowest['domain']} - {slowest['avg_time']:.2f}ms\n"
-            report += f"平均解析时间: {avg_batch_time:.2f}ms\n\n"
+            report += f"平均解析时间: {avg_batch_time:.2f}ms\n"
+            if self.batch_histogram.count:
+                # 基于全部单次查询，而不是每个域名的平均值
+                report += f"全部查询延迟分位数: {format_percentiles(self.batch_histogram, (50, 90, 99, 99.9))}\n"
+            report += "\n"
         
         # DNS比较结果
         if self.comparison_data:
@@ -2903,15 +2797,15 @@ stackoverflow.com"""
             report += "-" * 30 + "\n"
             for i, dns in enumerate(self.comparison_data[:3], 1):  # 前3名
                 report += (f"{i}. {dns['provider']} ({dns['dns_ip']}): "
-                          f"{dns['avg_resolution']:.2f}ms, 成功率: {dns['success_rate']:.1%}\n")
+                          f"{dns['avg_resolution']:.2f}ms, P99: {dns.get('p99_resolution', 0):.2f}ms, "
+                          f"成功率: {dns['success_rate']:.1%}\n")
         
         self.report_text.delete('1.0', 'end')
         self.report_text.insert('1.0', report)
 
     def compare_dns_servers(self):
         """比较DNS服务器性能"""
-        # 收集所有测试结果
-        all_dns_servers = set()
+        # 收集所有测试结果，每个DNS服务器一个延迟直方图（失败也计入，用于成功率）
         dns_performance = {}
 
         for item in self.result_tree.get_children():
@@ -2921,16 +2815,19 @@ stackoverflow.com"""
                 time_str = values[5]  # 时间列
                 status = values[6]  # 状态列
 
-                if dns_server != "系统默认" and status == "成功" and time_str != "N/A":
-                    try:
-                        time_ms = float(time_str)
-                        all_dns_servers.add(dns_server)
+                if dns_server == "系统默认":
+                    continue
+                histogram = dns_performance.setdefault(dns_server, LatencyHistogram())
+                try:
+                    if str(status).startswith("成功") and time_str != "N/A":
+                        histogram.record(float(time_str))
+                    else:
+                        histogram.record_failure()
+                except ValueError:
+                    histogram.record_failure()
 
-                        if dns_server not in dns_performance:
-                            dns_performance[dns_server] = []
-                        dns_performance[dns_server].append(time_ms)
-                    except ValueError:
-                        continue
+        # 只比较至少有一次成功的服务器
+        dns_performance = {server: histogram for server, histogram in dns_performance.items() if histogram.count}
 
         # 生成分析报告
         report = "DNS 服务器性能分析报告\n"
@@ -2940,23 +2837,18 @@ stackoverflow.com"""
         if dns_performance:
             # 计算每个DNS服务器的统计信息
             performance_stats = []
-            for dns_server, times in dns_performance.items():
-                avg_time = sum(times) / len(times)
-                min_time = min(times)
-                max_time = max(times)
-
-                # 计算成功率
-                total_attempts = len([item for item in self.result_tree.get_children()
-                                      if self.result_tree.item(item)['values'][2] == dns_server])
-                success_rate = len(times) / total_attempts if total_attempts > 0 else 0
-
+            for dns_server, histogram in dns_performance.items():
+                stats = histogram.summary()
                 performance_stats.append({
                     'dns_server': dns_server,
-                    'avg_time': avg_time,
-                    'min_time': min_time,
-                    'max_time': max_time,
-                    'success_rate': success_rate,
-                    'test_count': len(times)
+                    'avg_time': stats['mean'],
+                    'min_time': stats['min'],
+                    'max_time': stats['max'],
+                    'p50_time': stats['p50'],
+                    'p90_time': stats['p90'],
+                    'p99_time': stats['p99'],
+                    'success_rate': stats['success_rate'],
+                    'test_count': stats['count']
                 })
 
             # 按平均时间排序
@@ -2967,6 +2859,7 @@ stackoverflow.com"""
             for i, stats in enumerate(performance_stats, 1):
                 report += (f"{i}. {stats['dns_server']}: {stats['avg_time']:.2f}ms "
                            f"(最快{stats['min_time']:.2f}ms, 最慢{stats['max_time']:.2f}ms, "
+                           f"P50 {stats['p50_time']:.2f}ms, P90 {stats['p90_time']:.2f}ms, P99 {stats['p99_time']:.2f}ms, "
                            f"成功率{stats['success_rate']:.1%})\n")
 
             # 最佳推荐
@@ -2999,6 +2892,11 @@ stackoverflow.com"""
         )
 
         if filename:
+            # 大文件整体载入文本框会使界面卡顿，建议改用文件流式测试
+            if os.path.getsize(filename) > LARGE_DOMAIN_FILE_BYTES and messagebox.askyesno(
+                    "文件较大", "域名列表文件较大，载入文本框会使界面卡顿。\n是否改用文件流式批量测试（结果直接写入文件）？"):
+                self.start_bulk_test(filename)
+                return
             try:
                 with open(filename, 'r', encoding='utf-8') as f:
                     domains = f.read()
@@ -3017,6 +2915,8 @@ stackoverflow.com"""
 
         if filename:
             try:
+                import pandas as pd
+
                 # 收集所有结果
                 all_results = []
                 for item in self.result_tree.get_children():
@@ -0,0 +1,212 @@
+# -- coding: utf-8 --
+"""监控数据缓冲模块
+
+长时间实时监控的数据结构，内存占用和图表绘制开销都与监控时长无关：
+    - RingBuffer：固定容量的环形缓冲区，只保留最近的原始样本
+    - MinMaxDownsampler：增量降采样，每个时间桶保留最小值和最大值两个点，
+      桶数超过上限时相邻桶两两合并，绘图点数始终有上限，且不会抹掉延迟尖峰
+    - RecentUniqueSet：增量维护的去重解析结果，按最近出现顺序排列
+    - 监控开始以来的延迟分布记录在LatencyHistogram中，分位数覆盖全部样本而不只是环形缓冲区内的
+"""
+
+import threading
+from collections import deque, OrderedDict
+from typing import List, Tuple, Optional, Any, Iterator
+
+from .latency_histogram import LatencyHistogram
+
+
+class RingBuffer:
+    """固定容量环形缓冲区，满后覆盖最早的元素"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.items = deque(maxlen=self.capacity)
+
+    def append(self, item: Any):
+        self.items.append(item)
+
+    def clear(self):
+        self.items.clear()
+
+    def last(self, default: Any = None) -> Any:
+        return self.items[-1] if self.items else default
+
+    def values(self) -> List[Any]:
+        return list(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.items)
+
+
+class MinMaxDownsampler:
+    """保留极值的增量降采样器
+
+    样本按到达顺序每bucket_size个归入一个桶，每个桶记录最小值点和最大值点。
+    完整桶数超过max_points/2时相邻桶两两合并、桶宽加倍，因此每个样本的处理是均摊O(1)，
+    输出点数不超过max_points + 2
+    """
+
+    def __init__(self, max_points: int = 2000):
+        """
+        :param max_points: 输出的最大点数（每个桶最多输出2个点）
+        """
+        self.max_buckets = max(2, max_points // 2)
+        self.clear()
+
+    def clear(self):
+        self.bucket_size = 1
+        self.buckets = []       # 完整的桶：[(最小值点), (最大值点)]，点为(x, y)
+        self.current = None     # 正在填充的桶
+        self.current_count = 0
+        self.count = 0
+
+    @staticmethod
+    def _merge(first, second):
+        low = first[0] if first[0][1] <= second[0][1] else second[0]
+        high = first[1] if first[1][1] >= second[1][1] else second[1]
+        return low, high
+
+    def append(self, x: float, y: float):
+        """加入一个样本"""
+        point = (x, y)
+        self.count += 1
+        if self.current is None:
+            self.current = (point, point)
+        else:
+            self.current = self._merge(self.current, (point, point))
+        self.current_count += 1
+
+        if self.current_count >= self.bucket_size:
+            self.buckets.append(self.current)
+            self.current = None
+            self.current_count = 0
+            if len(self.buckets) > self.max_buckets:
+                self.buckets = [self._merge(self.buckets[i], self.buckets[i + 1]) if i + 1 < len(self.buckets)
+                                else self.buckets[i] for i in range(0, len(self.buckets), 2)]
+                self.bucket_size *= 2
+
+    def points(self) -> Tuple[List[float], List[float]]:
+        """降采样后的点序列，按x排序
+
+        :return: (x列表, y列表)
+        """
+        xs, ys = [], []
+        buckets = self.buckets + ([self.current] if self.current is not None else [])
+        for low, high in buckets:
+            for x, y in sorted({low, high}):
+                xs.append(x)
+                ys.append(y)
+        return xs, ys
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class RecentUniqueSet:
+    """按最近出现顺序维护的去重集合，容量有上限（淘汰最久未出现的元素）"""
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = max(1, capacity)
+        self.items = OrderedDict()
+
+    def add(self, item: Any):
+        if item in self.items:
+            self.items.move_to_end(item)
+            self.items[item] += 1
+        else:
+            self.items[item] = 1
+            if len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+
+    def recent(self, count: int) -> List[Any]:
+        """最近出现的count个不同元素，较早出现的在前"""
+        result = []
+        for item in reversed(self.items):
+            if len(result) >= count:
+                break
+            result.append(item)
+        result.reverse()
+        return result
+
+    def occurrences(self, item: Any) -> int:
+        return self.items.get(item, 0)
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self.items
+
+
+class MonitorSeries:
+    """一个监控目标的数据：原始样本环形缓冲、降采样绘图序列和去重解析结果
+
+    监控线程写入、界面线程读取，所有操作都加锁
+    """
+
+    def __init__(self, capacity: int = 86400, max_points: int = 2000, unique_capacity: int = 1000):
+        """
+        :param capacity: 保留的原始样本数（默认按1秒间隔约一天）
+        :param max_points: 图表最大点数
+        :param unique_capacity: 去重解析结果的最大数量
+        """
+        self.samples = RingBuffer(capacity)
+        self.downsampler = MinMaxDownsampler(max_points)
+        self.answers = RecentUniqueSet(unique_capacity)
+        self.histogram = LatencyHistogram()
+        self.start_time = None
+        self.lock = threading.Lock()
+
+    def append(self, timestamp: float, value: float, answer: Optional[str] = None):
+        """记录一个成功的样本
+
+        :param timestamp: 时间戳（秒）
+        :param value: 解析时间（毫秒）
+        :param answer: 解析结果文本
+        """
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = timestamp
+            self.samples.append((timestamp, value, answer))
+            # 绘图序列以监控开始后的分钟数为横坐标
+            self.downsampler.append((timestamp - self.start_time) / 60, value)
+            self.histogram.record(value)
+            if answer:
+                self.answers.add(answer)
+
+    def plot_data(self) -> Tuple[List[float], List[float]]:
+        """绘图用的降采样序列：(相对时间(分钟), 解析时间(ms))"""
+        with self.lock:
+            return self.downsampler.points()
+
+    def values(self) -> List[float]:
+        """环形缓冲区中保留的解析时间（毫秒），按时间顺序"""
+        with self.lock:
+            return [value for _, value, _ in self.samples]
+
+    def recent_answers(self, count: int = 5) -> List[str]:
+        with self.lock:
+            return self.answers.recent(count)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.downsampler.clear()
+            self.answers.clear()
+            self.histogram.clear()
+            self.start_time = None
+
+    @property
+    def total(self) -> int:
+        """监控开始以来的样本总数（含已被环形缓冲区覆盖的）"""
+        return len(self.downsampler)
+
+    def __len__(self) -> int:
+        return len(self.samples)
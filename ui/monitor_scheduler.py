@@ -0,0 +1,361 @@
+# -- coding: utf-8 --
+"""多目标DNS监控调度模块
+
+大量(域名, DNS服务器, 间隔)监控任务共用一个调度线程，查询提交到应用任务执行器的query工作池：
+    - 调度线程用最小堆按下次执行时间取任务，空闲时阻塞等待到最早的到期时间，不做轮询
+    - 每次执行时间带随机抖动，批量添加的任务在一个间隔内均匀错开，避免同一时刻集中发出查询
+    - 同一任务上一次查询未结束时跳过本次（计入skipped），慢服务器不会堆积任务
+    - 同时在途的查询数不超过max_workers，达到上限时调度线程等待查询结束再继续派发
+    - 每个任务有独立的有界历史（MonitorSeries），内存与监控时长无关
+
+线程数与任务数无关，每个任务每次调度的开销为O(log n)的堆操作
+
+命令行用法：
+    python -m ui.monitor_scheduler google.com baidu.com -s 8.8.8.8 1.1.1.1 -i 30 --duration 600
+    python -m ui.monitor_scheduler --domains-file domains.txt -s 8.8.8.8 223.5.5.5 -i 60 -w 16
+"""
+
+import time
+import heapq
+import random
+import argparse
+import itertools
+import threading
+from concurrent.futures import wait as wait_futures
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+from .dns_engine import BatchDNSEngine, TokenBucket
+from .monitor_buffers import MonitorSeries
+from .task_executor import task_executor
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class MonitorJob:
+    """一个监控任务：固定间隔查询一个(域名, 服务器, 记录类型, 传输方式)"""
+
+    def __init__(self, domain: str, server: str, interval: float, record_type: str = 'A',
+                 transport: str = 'UDP', series: Optional[MonitorSeries] = None):
+        self.domain = domain
+        self.server = server
+        self.interval = max(0.1, float(interval))
+        self.record_type = record_type
+        self.transport = transport
+        self.series = series
+        self.key = (domain, server, record_type, transport)
+
+        self.base_time = 0.0    # 不含抖动的计划时间，按间隔累加，抖动不会累积
+        self.active = True
+        self.running = False
+        self.samples = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_result = None
+
+    def summary(self) -> Dict[str, Any]:
+        """任务统计，延迟统计基于监控开始以来的全部样本"""
+        stats = self.series.histogram.summary() if self.series is not None else {}
+        last = self.last_result or {}
+        return {
+            'domain': self.domain,
+            'server': self.server,
+            'record_type': self.record_type,
+            'transport': self.transport,
+            'interval': self.interval,
+            'samples': self.samples,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'last_ms': last.get('time_ms') if last.get('success') else None,
+            'avg_ms': stats.get('mean'),
+            'min_ms': stats.get('min'),
+            'max_ms': stats.get('max'),
+            'p50_ms': stats.get('p50'),
+            'p99_ms': stats.get('p99'),
+            'p999_ms': stats.get('p999'),
+            'last_error': last.get('error')
+        }
+
+
+class MonitorScheduler:
+    """基于最小堆的监控调度器"""
+
+    def __init__(self, engine=None, max_workers: int = 8, jitter: float = 0.1, qps: float = 0,
+                 history: int = 1440, max_points: int = 500,
+                 on_sample: Optional[Callable[[Tuple, Dict[str, Any]], None]] = None):
+        """初始化调度器
+
+        :param engine: 执行查询的BatchDNSEngine，默认新建一个不限速的引擎
+        :param max_workers: 同时在途的查询数上限
+        :param jitter: 抖动幅度，占间隔的比例（0.1表示±10%）
+        :param qps: 所有任务合计的每秒查询数上限，<=0表示不限速
+        :param history: 每个任务自动创建的历史保留的样本数
+        :param max_points: 每个任务自动创建的历史的绘图点数上限
+        :param on_sample: 每次查询完成时在工作线程中调用，参数为(任务键, 查询结果)
+        """
+        self.engine = engine or BatchDNSEngine(qps=0)
+        self.max_workers = max(1, max_workers)
+        self.jitter = max(0.0, min(jitter, 0.5))
+        self.limiter = TokenBucket(qps)
+        self.history = history
+        self.max_points = max_points
+        self.on_sample = on_sample
+
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._futures = set()
+        self._in_flight = 0
+
+    def add(self, domain: str, server: str, interval: float, record_type: str = 'A', transport: str = 'UDP',
+            series: Optional[MonitorSeries] = None, start_delay: Optional[float] = None) -> Tuple:
+        """添加监控任务，已存在的任务只更新间隔
+
+        :param series: 保存历史的MonitorSeries，默认按调度器设置新建
+        :param start_delay: 首次执行前的延迟（秒），默认在一个间隔内随机选取
+        :return: 任务键(域名, 服务器, 记录类型, 传输方式)
+        """
+        job = MonitorJob(domain, server, interval, record_type, transport,
+                         series or MonitorSeries(self.history, self.max_points, unique_capacity=100))
+        with self._condition:
+            existing = self._jobs.get(job.key)
+            if existing is not None:
+                existing.interval = job.interval
+                return job.key
+            if start_delay is None:
+                start_delay = random.uniform(0, job.interval)
+            job.base_time = time.monotonic() + start_delay
+            self._jobs[job.key] = job
+            self._push(job, job.base_time)
+            self._condition.notify_all()
+        return job.key
+
+    def add_many(self, domains: List[str], servers: List[str], interval: float, record_type: str = 'A',
+                 transport: str = 'UDP') -> List[Tuple]:
+        """按域名×服务器批量添加任务，首次执行时间在一个间隔内均匀错开"""
+        pairs = [(domain, server) for domain in domains for server in servers]
+        return [self.add(domain, server, interval, record_type, transport,
+                         start_delay=interval * index / len(pairs))
+                for index, (domain, server) in enumerate(pairs)]
+
+    def remove(self, key: Tuple) -> bool:
+        """移除任务（堆中的条目在到期时丢弃）"""
+        with self._condition:
+            job = self._jobs.pop(key, None)
+            if job is None:
+                return False
+            job.active = False
+            self._condition.notify_all()
+        return True
+
+    def clear(self):
+        """移除所有任务"""
+        with self._condition:
+            for job in self._jobs.values():
+                job.active = False
+            self._jobs.clear()
+            self._heap.clear()
+            self._condition.notify_all()
+
+    def get_job(self, key: Tuple) -> Optional[MonitorJob]:
+        return self._jobs.get(key)
+
+    def series(self, key: Tuple) -> Optional[MonitorSeries]:
+        job = self._jobs.get(key)
+        return job.series if job else None
+
+    def jobs(self) -> List[MonitorJob]:
+        with self._condition:
+            return list(self._jobs.values())
+
+    def start(self):
+        """启动调度线程（重复调用无副作用）"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._dispatch_loop, daemon=True, name="MonitorScheduler")
+            self._thread.start()
+
+    def stop(self, wait: bool = False):
+        """停止调度，任务保留，可再次start
+
+        :param wait: 是否等待在途查询结束
+        """
+        with self._condition:
+            if not self._running:
+                return
+            self._running = False
+            thread = self._thread
+            self._thread = None
+            pending = list(self._futures)
+            self._condition.notify_all()
+        # 取消尚未开始的查询，执行中的查询在限速等待时得知停止
+        for future in pending:
+            future.cancel()
+        if wait:
+            wait_futures(pending)
+            if thread is not threading.current_thread():
+                thread.join()
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def stats(self) -> Dict[str, int]:
+        """调度器当前状态"""
+        with self._condition:
+            return {
+                'jobs': len(self._jobs),
+                'in_flight': self._in_flight,
+                'workers': self.max_workers,
+                'samples': sum(job.samples for job in self._jobs.values()),
+                'failures': sum(job.failures for job in self._jobs.values()),
+                'skipped': sum(job.skipped for job in self._jobs.values())
+            }
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """所有任务的统计"""
+        return [job.summary() for job in self.jobs()]
+
+    def _push(self, job: MonitorJob, run_at: float):
+        heapq.heappush(self._heap, (run_at, next(self._counter), job))
+
+    def _reschedule(self, job: MonitorJob, now: float):
+        """计算任务的下次执行时间（需持有锁）
+
+        计划时间按间隔累加；落后超过一个间隔时（例如系统休眠后）从当前时间重新开始，不补发错过的查询
+        """
+        job.base_time += job.interval
+        if job.base_time < now:
+            job.base_time = now + job.interval
+        offset = random.uniform(-self.jitter, self.jitter) * job.interval if self.jitter else 0.0
+        self._push(job, max(now, job.base_time + offset))
+
+    def _dispatch_loop(self):
+        with self._condition:
+            while self._running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                run_at, _, job = self._heap[0]
+                if not job.active:
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.monotonic()
+                if run_at > now:
+                    self._condition.wait(run_at - now)
+                    continue
+
+                if self._in_flight >= self.max_workers:
+                    # 在途查询已达上限，等待有查询结束（_release会唤醒）
+                    self._condition.wait()
+                    continue
+
+                heapq.heappop(self._heap)
+                self._reschedule(job, now)
+                if job.running:
+                    job.skipped += 1
+                    continue
+                job.running = True
+                self._in_flight += 1
+                try:
+                    future = task_executor.call('query', self._run_job, job)
+                except RuntimeError:
+                    # 任务执行器已关闭
+                    job.running = False
+                    self._in_flight -= 1
+                    continue
+                self._futures.add(future)
+                future.add_done_callback(lambda f, job=job: self._on_future_done(f, job))
+
+    def _on_future_done(self, future, job: MonitorJob):
+        with self._condition:
+            self._futures.discard(future)
+        # 停止时被取消的任务不会执行_run_job，在这里释放
+        if future.cancelled():
+            self._release(job)
+
+    def _release(self, job: MonitorJob):
+        with self._condition:
+            job.running = False
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _run_job(self, job: MonitorJob):
+        result = None
+        try:
+            if not self.limiter.acquire(lambda: self._running and job.active):
+                return
+            try:
+                result = self.engine.query(job.domain, job.server, job.record_type, job.transport)
+            except Exception as e:
+                result = {'success': False, 'time_ms': None, 'answers': [], 'error': str(e)}
+
+            with self._condition:
+                job.last_result = result
+                if result['success']:
+                    job.samples += 1
+                else:
+                    job.failures += 1
+            if result['success']:
+                job.series.append(time.time(), result['time_ms'], ', '.join(result['answers'][:3]))
+            else:
+                job.series.histogram.record_failure()
+        finally:
+            self._release(job)
+
+        if self.on_sample and job.active:
+            try:
+                self.on_sample(job.key, result)
+            except Exception as e:
+                logger.error("监控回调出错: %s", e)
+
+
+def _format_ms(value: Optional[float]) -> str:
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多域名、多DNS服务器持续监控")
+    parser.add_argument('domains', nargs='*', help="监控的域名")
+    parser.add_argument('--domains-file', help="域名列表文件，每行一个")
+    parser.add_argument('-s', '--servers', nargs='+', required=True, help="DNS服务器IP")
+    parser.add_argument('-t', '--type', default='A', help="记录类型")
+    parser.add_argument('-i', '--interval', type=float, default=60, help="每个任务的查询间隔（秒）")
+    parser.add_argument('-w', '--workers', type=int, default=8, help="工作线程数")
+    parser.add_argument('--qps', type=float, default=0, help="合计每秒查询数上限，0表示不限")
+    parser.add_argument('--duration', type=float, default=0, help="运行时长（秒），0表示一直运行")
+    parser.add_argument('--report', type=float, default=60, help="输出统计的间隔（秒）")
+    args = parser.parse_args(argv)
+
+    domains = list(args.domains)
+    if args.domains_file:
+        with open(args.domains_file, 'r', encoding='utf-8') as f:
+            domains.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    if not domains:
+        parser.error("需要指定域名或--domains-file")
+
+    scheduler = MonitorScheduler(max_workers=args.workers, qps=args.qps)
+    scheduler.add_many(domains, args.servers, args.interval, args.type)
+    scheduler.start()
+    deadline = time.monotonic() + args.duration if args.duration > 0 else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(max(0.0, min(args.report, deadline - time.monotonic())) if deadline else args.report)
+            print(f"--- {time.strftime('%H:%M:%S')} {scheduler.stats()}")
+            for item in scheduler.summary():
+                print(f"{item['domain']:<30} {item['server']:<16} avg={_format_ms(item['avg_ms'])} "
+                      f"p99={_format_ms(item['p99_ms'])} last={_format_ms(item['last_ms'])} "
+                      f"ok={item['samples']} fail={item['failures']}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+
+
+if __name__ == '__main__':
+    main()
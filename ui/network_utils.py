@@ -1,17 +1,27 @@
 import socket
-import requests
 import json
+import atexit
 from datetime import datetime
 import subprocess
 import platform
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
 import csv
 import os
 import struct
 import select
 import re
+from typing import Optional
+
+from .log_utils import get_logger, raw_output
+from .task_executor import task_executor
+
+logger = get_logger(__name__)
+
+# 后台地理位置查询尚未完成时的位置占位文本
+LOCATION_PENDING = "查询中..."
+# 跟踪结束后等待各跳地理位置查询的最长时间（秒）
+GEOIP_WAIT_TIMEOUT = 10
 
 
 def get_subprocess_kwargs():
@@ -30,12 +40,28 @@ def get_subprocess_kwargs():
 
 
 class NetworkUtils:
-    def __init__(self):
+    def __init__(self, cache_file: Optional[str] = "geoip_cache.json", system: Optional[str] = None):
+        """
+        :param cache_file: 地理位置缓存文件路径，None表示不加载也不保存缓存（离线回放等场景）
+        :param system: 解析traceroute输出时按此系统类型（如'linux'、'windows'），默认为当前系统；
+                       回放其他系统上录制的输出时使用
+        """
         self.geoip_cache = {}
-        self.executor = ThreadPoolExecutor(max_workers=5)
         self.lock = threading.Lock()
-        self.cache_file = "geoip_cache.json"
-        self.load_cache()
+        self.cache_file = cache_file
+        self.system = system
+        # 正在后台查询地理位置的IP -> 等待结果的回调列表，同一IP只查询一次
+        self.geoip_pending = {}
+        # 反向DNS(PTR)缓存，值为None表示该IP没有PTR记录
+        self.ptr_cache = {}
+        self.ptr_lock = threading.Lock()
+        self._ptr_resolver = None
+        # 子进程工厂，默认为subprocess.Popen，可替换为session_replay中的录制/回放工厂
+        self.process_factory = subprocess.Popen
+        if self.cache_file:
+            self.load_cache()
+            # 在解释器清理模块之前保存缓存（析构函数在退出时执行得太晚，内置函数可能已不可用）
+            atexit.register(self.save_cache)
 
     def load_cache(self):
         """加载地理位置缓存"""
@@ -43,17 +69,24 @@ class NetworkUtils:
             if os.path.exists(self.cache_file):
                 with open(self.cache_file, 'r', encoding='utf-8') as f:
                     self.geoip_cache = json.load(f)
-                print(f"已加载 {len(self.geoip_cache)} 条地理位置缓存")
+                logger.info("已加载 %d 条地理位置缓存", len(self.geoip_cache))
         except Exception as e:
-            print(f"加载缓存失败: {e}")
+            logger.warning("加载缓存失败: %s", e)
 
     def save_cache(self):
         """保存地理位置缓存"""
+        if not self.cache_file:
+            return
         try:
+            # 复制后再写入，后台查询可能仍在更新缓存
+            data = dict(self.geoip_cache)
+            # 没有查询过地理位置的进程（如离线回放工具）不创建空的缓存文件
+            if not data and not os.path.exists(self.cache_file):
+                return
             with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.geoip_cache, f, ensure_ascii=False, indent=2)
+                json.dump(data, f, ensure_ascii=False, indent=2)
         except Exception as e:
-            print(f"保存缓存失败: {e}")
+            logger.warning("保存缓存失败: %s", e)
 
     def get_ip_location(self, ip_address):
         """获取IP地址的地理位置信息 - 增强版本"""
@@ -553,6 +586,8 @@ class NetworkUtils:
         """使用ipapi.co API获取地理位置信息"""
         try:
             url = f"http://ipapi.co/{ip_address}/json/"
+            # requests只用于地理位置查询，第一次查询时才导入
+            import requests
             response = requests.get(url, timeout=3)
             if response.status_code == 200:
                 data = response.json()
@@ -574,6 +609,7 @@ class NetworkUtils:
         """使用ip-api.com API获取地理位置信息"""
         try:
             url = f"http://ip-api.com/json/{ip_address}"
+            import requests
             response = requests.get(url, timeout=3)
             if response.status_code == 200:
                 data = response.json()
@@ -596,9 +632,12 @@ class NetworkUtils:
         """使用ipinfo.io API获取地理位置信息"""
         try:
             url = f"http://ipinfo.io/{ip_address}/json"
+            import requests
             response = requests.get(url, timeout=3)
             if response.status_code == 200:
                 data = response.json()
+                # ipinfo.io的经纬度为"lat,lon"格式的loc字段
+                lat, _, lon = data.get('loc', '').partition(',')
                 return {
                     'country': data.get('country', '未知'),
                     'region': data.get('region', '未知'),
@@ -606,8 +645,8 @@ class NetworkUtils:
                     'isp': data.get('org', '未知'),
                     'country_code': data.get('country', 'XX'),
                     'timezone': data.get('timezone', '未知'),
-                    'lat': data.get('lat', ''),
-                    'lon': data.get('lon', '')
+                    'lat': lat,
+                    'lon': lon
                 }
         except:
             pass
@@ -656,7 +695,7 @@ class NetworkUtils:
                     clean_part = third_part.replace('ms', '').replace('毫秒', '').replace('<', '').replace('>', '').strip()
                     if clean_part and clean_part.replace('.', '', 1).isdigit():
                         delay = float(clean_part)
-                        print(f"Found delay at position 3: {delay}")
+                        logger.debug("Found delay at position 3: %s", delay)
             
             # 2. 检查位置4的延迟值（备用位置）
             if delay == -1 and len(parts) > 4:
@@ -665,7 +704,7 @@ class NetworkUtils:
                     clean_part = fourth_part.replace('ms', '').replace('毫秒', '').replace('<', '').replace('>', '').strip()
                     if clean_part and clean_part.replace('.', '', 1).isdigit():
                         delay = float(clean_part)
-                        print(f"Found delay at position 4: {delay}")
+                        logger.debug("Found delay at position 4: %s", delay)
             
             # 3. 检查位置5的延迟值（另一个备用位置）
             if delay == -1 and len(parts) > 5:
@@ -674,7 +713,7 @@ class NetworkUtils:
                     clean_part = fifth_part.replace('ms', '').replace('毫秒', '').replace('<', '').replace('>', '').strip()
                     if clean_part and clean_part.replace('.', '', 1).isdigit():
                         delay = float(clean_part)
-                        print(f"Found delay at position 5: {delay}")
+                        logger.debug("Found delay at position 5: %s", delay)
             
             # 4. 检查位置2的延迟值（备用）
             if delay == -1 and len(parts) > 2:
@@ -682,7 +721,7 @@ class NetworkUtils:
                 clean_part = second_part.replace('ms', '').replace('毫秒', '').replace('<', '').replace('*', '').strip()
                 if clean_part and clean_part.replace('.', '', 1).isdigit():
                     delay = float(clean_part)
-                    print(f"Found delay at position 2: {delay}")
+                    logger.debug("Found delay at position 2: %s", delay)
             
             # 提取IP地址（通常在倒数第二或第三位置）
             ip = "*"
@@ -714,9 +753,117 @@ class NetworkUtils:
         except Exception:
             return None
 
+    def _get_ptr_resolver(self):
+        """获取共享的反向DNS解析器（首次使用时创建）"""
+        with self.ptr_lock:
+            if self._ptr_resolver is None:
+                try:
+                    import dns.resolver
+                    resolver = dns.resolver.Resolver()
+                    resolver.timeout = 2
+                    resolver.lifetime = 2
+                    self._ptr_resolver = resolver
+                except Exception:
+                    # dnspython不可用时退回到系统的gethostbyaddr
+                    self._ptr_resolver = False
+            return self._ptr_resolver
+
+    def resolve_hostname(self, ip_address):
+        """反向解析IP地址的主机名（带缓存）
+
+        :param ip_address: IP地址
+        :return: 主机名，无法解析时返回None
+        """
+        if not self.is_valid_ip(ip_address):
+            return None
+
+        with self.ptr_lock:
+            if ip_address in self.ptr_cache:
+                return self.ptr_cache[ip_address]
+
+        hostname = None
+        resolver = self._get_ptr_resolver()
+        try:
+            if resolver:
+                answers = resolver.resolve_address(ip_address)
+                if answers:
+                    hostname = str(answers[0]).rstrip('.')
+            else:
+                hostname = socket.gethostbyaddr(ip_address)[0]
+        except Exception:
+            hostname = None
+
+        with self.ptr_lock:
+            self.ptr_cache[ip_address] = hostname
+        return hostname
+
+    def resolve_hostname_async(self, ip_address, callback):
+        """在后台线程池中反向解析主机名，解析完成后调用回调
+
+        :param ip_address: IP地址
+        :param callback: 回调函数，接收(ip_address, hostname)参数，hostname可能为None
+        """
+        if not self.is_valid_ip(ip_address):
+            return None
+
+        # 命中缓存时直接回调，避免占用线程池
+        with self.ptr_lock:
+            if ip_address in self.ptr_cache:
+                callback(ip_address, self.ptr_cache[ip_address])
+                return None
+
+        def task():
+            hostname = self.resolve_hostname(ip_address)
+            try:
+                callback(ip_address, hostname)
+            except Exception as e:
+                logger.warning("主机名回调出错: %s", e)
+
+        return task_executor.call('geoip', task)
+
+    def get_ip_location_async(self, ip_address, callback):
+        """在后台线程池中查询IP地理位置，完成后调用回调
+
+        命中缓存时在当前线程直接回调；同一IP的并发请求合并为一次查询
+
+        :param ip_address: IP地址
+        :param callback: 回调函数，接收(ip_address, location_info)参数，未命中缓存时在工作线程中调用
+        """
+        if ip_address in self.geoip_cache:
+            callback(ip_address, self.geoip_cache[ip_address])
+            return None
+
+        with self.lock:
+            waiting = self.geoip_pending.get(ip_address)
+            if waiting is not None:
+                waiting.append(callback)
+                return None
+            self.geoip_pending[ip_address] = [callback]
+
+        def task():
+            try:
+                location_info = self.get_ip_location(ip_address)
+            except Exception as e:
+                logger.warning("地理位置查询出错 %s: %s", ip_address, e)
+                location_info = self._get_fallback_location(ip_address)
+            with self.lock:
+                callbacks = self.geoip_pending.pop(ip_address, [])
+            for waiting_callback in callbacks:
+                try:
+                    waiting_callback(ip_address, location_info)
+                except Exception as e:
+                    logger.warning("地理位置回调出错: %s", e)
+
+        return task_executor.call('geoip', task)
+
     def traceroute(self, hostname, max_hops=64, timeout=1, callback=None, process_callback=None):
         """系统traceroute命令，支持实时回调
-        
+
+        探测始终使用数字模式（tracert -d / traceroute -n），不在探测过程中做反向DNS解析，
+        主机名由调用方通过resolve_hostname_async在后台补充。
+        Unix/Linux下各跳的地理位置在后台查询：实时回调中未命中缓存的跳点位置为LOCATION_PENDING，
+        调用方可用get_ip_location_async补充（与正在进行的查询合并）；返回的结果列表在查询完成后生成。
+
         :param hostname: 目标主机名或IP
         :param max_hops: 最大跳数
         :param timeout: 超时时间（秒）
@@ -724,7 +871,7 @@ class NetworkUtils:
         :param process_callback: 进程回调函数，用于传递进程引用以便取消操作
         :return: 路由跟踪结果列表
         """
-        system = platform.system().lower()
+        system = self.system or platform.system().lower()
         results = []
 
         try:
@@ -736,9 +883,9 @@ class NetworkUtils:
                 timeout_ms = max(1, min(timeout_ms, 65535))
                 cmd = ['tracert', '-d', '-w', str(timeout_ms), '-h', str(max_hops), hostname]
             else:
-                cmd = ['traceroute', '-m', str(max_hops), '-w', str(timeout), '-q', '1', hostname]
+                cmd = ['traceroute', '-n', '-m', str(max_hops), '-w', str(timeout), '-q', '1', hostname]
 
-            process = subprocess.Popen(
+            process = self.process_factory(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
@@ -752,19 +899,50 @@ class NetworkUtils:
             if process_callback:
                 process_callback(process)
 
+            hops = []           # 实时解析出的(跳数, IP, 延迟)
+            locations = {}      # IP -> 位置字符串
+            located = {}        # IP -> 位置查询完成事件
+
+            def request_location(ip):
+                # 地理位置在后台查询，不阻塞探测输出的读取；超时的跳点不查询，相同IP只查询一次
+                if ip in located or not self.is_valid_ip(ip):
+                    return
+                done = located[ip] = threading.Event()
+
+                def on_location(addr, location_info):
+                    locations[addr] = self.format_location_string(location_info)
+                    done.set()
+
+                self.get_ip_location_async(ip, on_location)
+
             lines = []
             for line in iter(process.stdout.readline, ''):
                 stripped_line = line.strip()
                 lines.append(stripped_line)
-                # 添加实时输出调试信息
-                print(f"Traceroute output: {stripped_line}")
+                # 原始输出进入诊断缓冲区，调试级别才输出到日志
+                raw_output.append('traceroute', stripped_line)
+                logger.debug("Traceroute output: %s", stripped_line)
                 
+                if not stripped_line or not stripped_line[0].isdigit():
+                    continue
+
                 # 实时处理Windows tracert输出行
-                if system == 'windows' and callback and stripped_line and stripped_line[0].isdigit():
+                if system == 'windows':
                     # 立即解析并通过回调函数返回结果
                     hop_result = self.parse_windows_traceroute_line(stripped_line)
-                    if hop_result:
+                    if hop_result and callback:
                         callback(hop_result)
+                else:
+                    # 实时处理Unix/Linux traceroute输出行
+                    hop_info = self.parse_traceroute_output(stripped_line, system)
+                    if hop_info:
+                        hops.append(hop_info)
+                        hop, ip, delay = hop_info
+                        request_location(ip)
+                        if callback:
+                            # 命中缓存时位置已在request_location中同步得到
+                            location = locations.get(ip, LOCATION_PENDING) if ip in located else "未知"
+                            callback((hop, ip, delay, location))
 
             process.wait()
 
@@ -790,21 +968,13 @@ class NetworkUtils:
                 for hop in sorted(parsed_hops.keys()):
                     results.append(parsed_hops[hop])
             else:
-                # 解析Unix/Linux输出格式
-                for line in lines:
-                    if not line:
-                        continue
-
-                    # 解析不同系统的输出格式
-                    hop_info = self.parse_traceroute_output(line, system)
-                    if hop_info:
-                        hop, ip, delay = hop_info
+                # 等待后台的地理位置查询（并发进行，总耗时约为最慢的一次查询）
+                deadline = time.monotonic() + GEOIP_WAIT_TIMEOUT
+                for done in located.values():
+                    done.wait(max(0, deadline - time.monotonic()))
 
-                        # 获取地理位置
-                        location_info = self.get_ip_location(ip)
-                        location_str = self.format_location_string(location_info)
-
-                        results.append((hop, ip, delay, location_str))
+                for hop, ip, delay in hops:
+                    results.append((hop, ip, delay, locations.get(ip, "未知")))
 
                 # 如果没有解析到任何结果，尝试另一种解析方式
                 if not results:
@@ -860,9 +1030,13 @@ class NetworkUtils:
                         if ip.startswith('(') and ip.endswith(')'):
                             ip = ip[1:-1]
 
+                        # 整跳超时（如 "4  *"），使用-1表示超时
+                        if ip == '*':
+                            return hop, '*', -1
+
                         if not self.is_valid_ip(ip):
-                            # 查找行中是否有有效的IP地址
-                            for part in parts:
+                            # 查找行中是否有有效的IP地址（跳过跳数本身）
+                            for part in parts[1:]:
                                 if self.is_valid_ip(part):
                                     ip = part
                                     break
@@ -870,10 +1044,11 @@ class NetworkUtils:
                                 return None
 
                         delay = 0
-                        for part in parts:
+                        for i, part in enumerate(parts):
                             if part.endswith('ms'):
                                 try:
-                                    delay_str = part.replace('ms', '')
+                                    # 兼容 "1.234ms" 和 "1.234 ms" 两种写法
+                                    delay_str = part.replace('ms', '') or parts[i - 1]
                                     delay = float(delay_str)
                                     break
                                 except:
@@ -933,8 +1108,14 @@ class NetworkUtils:
         except:
             return False
 
-    def ping_test(self, hostname, count=4):
-        """执行ping测试"""
+    def ping_test(self, hostname, count=4, process_callback=None):
+        """执行ping测试
+
+        :param hostname: 目标主机名或IP
+        :param count: 发送的探测包数
+        :param process_callback: 进程回调函数，用于传递进程引用以便取消操作
+        :return: ping命令的输出
+        """
         system = platform.system().lower()
 
         try:
@@ -950,6 +1131,8 @@ class NetworkUtils:
                 text=True,
                 **get_subprocess_kwargs()
             )
+            if process_callback:
+                process_callback(process)
             stdout, stderr = process.communicate()
 
             return stdout
@@ -957,6 +1140,77 @@ class NetworkUtils:
         except Exception as e:
             return f"Ping测试失败: {str(e)}"
 
+    def probe_ttl(self, hostname, ttl, timeout=1, protocol='icmp'):
+        """发送单个指定TTL的探测，返回应答该TTL的路由器IP
+
+        用于路径缓存的快速验证，只探测一个跳点而不是完整跟踪。
+        探测协议需与缓存路径的协议一致：负载均衡按协议和端口分流，ICMP和UDP探测可能经过不同的路径
+
+        :param hostname: 目标主机名或IP
+        :param ttl: 探测使用的TTL
+        :param timeout: 超时时间（秒）
+        :param protocol: 'icmp'使用ping，'udp'使用系统traceroute（Linux/macOS默认的UDP探测）只探测该TTL
+        :return: 应答的IP地址，无应答返回None
+        """
+        system = platform.system().lower()
+
+        if protocol == 'udp' and system != 'windows':
+            return self._probe_ttl_udp(hostname, ttl, timeout, system)
+
+        if system == 'windows':
+            cmd = ['ping', '-n', '1', '-i', str(ttl), '-w', str(int(timeout * 1000)), hostname]
+        elif system == 'darwin':
+            cmd = ['ping', '-n', '-c', '1', '-m', str(ttl), '-t', str(max(1, int(timeout))), hostname]
+        else:
+            cmd = ['ping', '-n', '-c', '1', '-t', str(ttl), '-W', str(max(1, int(timeout))), hostname]
+
+        try:
+            result = subprocess.run(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=timeout + 2,
+                **get_subprocess_kwargs()
+            )
+        except Exception:
+            return None
+
+        for line in result.stdout.splitlines():
+            stripped = line.strip()
+            # 跳过命令回显的目标地址和统计信息
+            if not stripped or stripped.startswith(('PING', 'Pinging', '正在 Ping', '---')):
+                continue
+            lower = stripped.lower()
+            if 'from' not in lower and '来自' not in stripped:
+                continue
+            match = re.search(r'(\d{1,3}(?:\.\d{1,3}){3})', stripped)
+            if match and self.is_valid_ip(match.group(1)):
+                return match.group(1)
+        return None
+
+    def _probe_ttl_udp(self, hostname, ttl, timeout, system):
+        """用系统traceroute（-f/-m限定为单个TTL）发送一个UDP探测，返回应答该TTL的路由器IP"""
+        wait = max(1, int(timeout))
+        cmd = ['traceroute', '-n', '-q', '1', '-f', str(ttl), '-m', str(ttl), '-w', str(wait), hostname]
+        try:
+            result = subprocess.run(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=wait + 2,
+                **get_subprocess_kwargs()
+            )
+        except Exception:
+            return None
+
+        for line in result.stdout.splitlines():
+            parsed = self.parse_traceroute_output(line.strip(), system)
+            if parsed and parsed[0] == ttl and parsed[1] != '*':
+                return parsed[1]
+        return None
+
     def debug_traceroute(self, hostname, max_hops=64, timeout=2):
         """调试traceroute输出"""
         system = platform.system().lower()
@@ -965,9 +1219,9 @@ class NetworkUtils:
 
         try:
             if system == 'windows':
-                cmd = ['tracert', '-h', str(max_hops), '-w', str(timeout * 1000), hostname]
+                cmd = ['tracert', '-d', '-h', str(max_hops), '-w', str(timeout * 1000), hostname]
             else:
-                cmd = ['traceroute', '-m', str(max_hops), '-w', str(timeout), '-q', '1', hostname]
+                cmd = ['traceroute', '-n', '-m', str(max_hops), '-w', str(timeout), '-q', '1', hostname]
 
             print(f"执行命令: {' '.join(cmd)}")
 
@@ -993,14 +1247,6 @@ class NetworkUtils:
             print(f"执行异常: {e}")
             return None, str(e)
 
-    def __del__(self):
-        """析构函数，保存缓存"""
-        try:
-            self.executor.shutdown(wait=False)
-            self.save_cache()
-        except:
-            pass
-
 
 # 创建全局实例
 network_utils = NetworkUtils()
\ No newline at end of file
@@ -10,8 +10,10 @@ import json
 import subprocess
 import datetime
 import platform
-import time
 import re
+import codecs
+import shutil
+import threading
 from pathlib import Path
 from typing import List, Dict, Tuple, Any, Optional
 
@@ -19,70 +21,221 @@ from typing import List, Dict, Tuple, Any, Optional
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(base_dir)
 
+from ui.log_utils import get_logger, raw_output
+
+logger = get_logger(__name__)
+
+
+class NextTraceJsonStream:
+    """NextTrace JSON输出（-j）的增量解码器
+
+    NextTrace的JSON结果形如 {"Hops": [[探测1, 探测2, ...], ...], "TraceMapUrl": "..."}，
+    解码器在数据到达时逐个解出Hops数组中的元素，不需要等待整个文档输出完成
+    """
+
+    _HOPS_START = re.compile(r'"Hops"\s*:\s*\[')
+    # 旧版本NextTrace不认识-j参数时的错误输出
+    UNSUPPORTED = re.compile(r'unknown (shorthand )?(flag|argument)|flag provided but not defined', re.IGNORECASE)
+    _MAP_URL = re.compile(r'"TraceMapUrl"\s*:\s*"([^"]*)"')
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_hops = False
+        self.finished = False
+        self.hop_index = 0
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, data: str) -> List[List[Dict[str, Any]]]:
+        """输入一段输出数据，返回本次新解出的跳数元素列表
+
+        :param data: 新到达的输出文本
+        :return: 已完整接收的跳数元素（每个元素为该跳所有探测结果的列表）
+        """
+        self.buffer += data
+        hops = []
+
+        if not self.in_hops:
+            match = self._HOPS_START.search(self.buffer)
+            if not match:
+                return hops
+            self.buffer = self.buffer[match.end():]
+            self.in_hops = True
+
+        while not self.finished:
+            pos = 0
+            while pos < len(self.buffer) and self.buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(self.buffer):
+                self.buffer = ""
+                break
+            if self.buffer[pos] == ']':
+                self.finished = True
+                self.buffer = self.buffer[pos + 1:]
+                break
+            try:
+                element, end = self._decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                # 元素尚未完整到达，等待更多数据
+                self.buffer = self.buffer[pos:]
+                break
+            self.buffer = self.buffer[end:]
+            hops.append(element if isinstance(element, list) else [element])
+            self.hop_index += 1
+
+        return hops
+
+    def maptrace_url(self) -> Optional[str]:
+        """从Hops之后的剩余数据中提取TraceMapUrl"""
+        match = self._MAP_URL.search(self.buffer)
+        return match.group(1) if match and match.group(1) else None
+
+    @staticmethod
+    def to_hop_record(attempts: List[Dict[str, Any]], index: int) -> Dict[str, Any]:
+        """将一跳的JSON探测结果转换为跳数记录
+
+        :param attempts: 该跳所有探测的结果
+        :param index: 该跳在Hops数组中的序号（从0开始），缺少TTL字段时使用
+        :return: 与文本解析结果兼容的跳数字典，额外包含全部探测RTT和经纬度
+        """
+        hop = index + 1
+        for attempt in attempts:
+            if isinstance(attempt, dict) and attempt.get("TTL"):
+                hop = int(attempt["TTL"])
+                break
+
+        replies = [a for a in attempts
+                   if isinstance(a, dict) and a.get("Success") and (a.get("Address") or {}).get("IP")]
+        if not replies:
+            return {
+                "hop": hop,
+                "ip": "",
+                "hostname": "",
+                "delay": [-1],  # 使用-1表示超时
+                "rtts": [],
+                "geo": {"country": "超时", "region": "", "city": ""},
+                "asn": {}
+            }
+
+        first = replies[0]
+        # Go的time.Duration以纳秒序列化
+        rtts = [round(a["RTT"] / 1e6, 3) for a in replies if a.get("RTT")]
+        geo = first.get("Geo") or {}
+        lat, lng = geo.get("lat"), geo.get("lng")
+        has_coords = isinstance(lat, (int, float)) and isinstance(lng, (int, float)) and (lat or lng)
+        asnumber = str(geo.get("asnumber") or "").strip()
+
+        return {
+            "hop": hop,
+            "ip": first["Address"]["IP"],
+            "hostname": first.get("Hostname", "") or "",
+            "delay": [round(sum(rtts) / len(rtts), 3)] if rtts else [-1],
+            "rtts": rtts,
+            "geo": {
+                "country": geo.get("country", "") or "",
+                "region": geo.get("prov", "") or "",
+                "city": geo.get("city", "") or "",
+                "lat": lat if has_coords else None,
+                "lng": lng if has_coords else None
+            },
+            "asn": {
+                "as": f"AS{asnumber}" if asnumber else "",
+                "owner": geo.get("owner", "") or "",
+                "isp": geo.get("isp", "") or ""
+            }
+        }
+
 
 class NextTraceIntegration:
     """NextTrace集成类，提供调用NextTrace工具的接口"""
     
-    def __init__(self):
-        """初始化NextTrace集成"""
-        self.nexttrace_path = self._find_nexttrace()
-        self.available = self.nexttrace_path is not None
+    def __init__(self, cache_file: str = "nexttrace_cache.json"):
+        """初始化NextTrace集成
+
+        可执行文件的查找延迟到第一次使用时进行，结果在实例内记忆
+
+        :param cache_file: 版本信息缓存文件路径，按可执行文件路径和修改时间失效
+        """
+        self.cache_file = cache_file
+        self._nexttrace_path = None
+        self._discovered = False
+        self._version = None
+        self._lock = threading.Lock()
+        
+        # 子进程工厂，默认为subprocess.Popen，可替换为session_replay中的录制/回放工厂
+        self.process_factory = subprocess.Popen
         
         # 支持的输出格式
         self.supported_formats = ['json', 'plain', 'table']
+        # 当前可执行文件是否支持JSON输出，旧版本失败一次后改用文本输出
+        self.json_supported = True
         
         # 默认参数
         self.default_timeout = 200  # 默认超时时间200ms
         self.default_max_hops = 64  # 默认最大跳数64
-        
-        if not self.available:
-            print("警告: 未找到NextTrace工具，请先安装NextTrace")
-            print("安装方法: 从 https://github.com/nxtrace/NTrace-core/releases 下载对应平台的可执行文件")
-            print("推荐: 将nexttrace可执行文件放置在项目的tools目录下")
-            print("或: 将nexttrace可执行文件放置在PATH环境变量包含的目录中，或放置在项目根目录下")
+    
+    @property
+    def nexttrace_path(self) -> Optional[str]:
+        """NextTrace可执行文件路径，首次访问时查找"""
+        if not self._discovered:
+            with self._lock:
+                if not self._discovered:
+                    self._nexttrace_path = self._find_nexttrace()
+                    self._discovered = True
+                    if self._nexttrace_path is None:
+                        logger.warning(
+                            "未找到NextTrace工具，请先安装NextTrace\n"
+                            "安装方法: 从 https://github.com/nxtrace/NTrace-core/releases 下载对应平台的可执行文件\n"
+                            "推荐: 将nexttrace可执行文件放置在项目的tools目录下\n"
+                            "或: 将nexttrace可执行文件放置在PATH环境变量包含的目录中，或放置在项目根目录下")
+        return self._nexttrace_path
+    
+    @nexttrace_path.setter
+    def nexttrace_path(self, path: Optional[str]):
+        """指定NextTrace可执行文件路径，跳过自动查找"""
+        with self._lock:
+            self._nexttrace_path = path
+            self._discovered = True
+            self._version = None
+    
+    @property
+    def available(self) -> bool:
+        """NextTrace是否可用"""
+        return self.nexttrace_path is not None
     
     def _find_nexttrace(self) -> Optional[str]:
         """查找NextTrace可执行文件
         
+        只检查文件是否存在和PATH，不启动子进程
+        
         :return: NextTrace可执行文件路径，如果未找到则返回None
         """
-        # 检查tools文件夹（推荐位置）
-        tools_path = os.path.join(base_dir, 'tools', 'nexttrace')
-        if platform.system() == 'Windows':
-            tools_path += '.exe'
-            if os.path.exists(tools_path):
-                return tools_path
-        else:
-            if os.path.exists(tools_path):
-                return tools_path
-        
-        # 检查项目根目录
-        project_path = os.path.join(base_dir, 'nexttrace')
-        if platform.system() == 'Windows':
-            project_path += '.exe'
-            if os.path.exists(project_path):
-                return project_path
-        else:
-            if os.path.exists(project_path):
-                return project_path
+        exe_name = 'nexttrace.exe' if platform.system() == 'Windows' else 'nexttrace'
+        
+        # 检查tools文件夹（推荐位置），再检查项目根目录
+        for candidate in (os.path.join(base_dir, 'tools', exe_name), os.path.join(base_dir, exe_name)):
+            if os.path.exists(candidate):
+                return candidate
         
         # 在PATH环境变量中查找
+        return shutil.which('nexttrace')
+    
+    def _load_version_cache(self) -> Dict[str, Any]:
+        """加载版本信息缓存"""
         try:
-            if platform.system() == 'Windows':
-                # Windows下使用where命令
-                result = subprocess.run(['where', 'nexttrace'], capture_output=True, text=True, check=False, **self._get_subprocess_kwargs())
-                if result.returncode == 0:
-                    # 返回第一个找到的路径
-                    return result.stdout.strip().split('\n')[0]
-            else:
-                # Linux/macOS下使用which命令
-                result = subprocess.run(['which', 'nexttrace'], capture_output=True, text=True, check=False, **self._get_subprocess_kwargs())
-                if result.returncode == 0:
-                    return result.stdout.strip()
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
         except Exception as e:
-            print(f"查找NextTrace时出错: {e}")
-        
-        return None
+            logger.warning("加载NextTrace缓存失败: %s", e)
+        return {}
+    
+    def _save_version_cache(self, cache: Dict[str, Any]):
+        """保存版本信息缓存"""
+        try:
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning("保存NextTrace缓存失败: %s", e)
     
     def is_available(self) -> bool:
         """检查NextTrace是否可用
@@ -105,16 +258,23 @@ class NextTraceIntegration:
         
         return kwargs
     
-    def run_traceroute(self, hostname: str, callback=None, ip_selection_callback=None, **kwargs) -> Dict[str, Any]:
+    def run_traceroute(self, hostname: str, callback=None, ip_selection_callback=None, process_callback=None,
+                       **kwargs) -> Dict[str, Any]:
         """运行NextTrace路由追踪
         
         :param hostname: 目标主机名或IP地址
-        :param callback: 实时回调函数，接收(hop, ip, delay, location, isp)参数
-        :param ip_selection_callback: IP选择回调函数，当遇到多个IP时调用
+        :param callback: 实时回调函数，接收(hop, ip, delay, location, isp, coords)参数，
+            coords为NextTrace提供的(纬度, 经度)，没有时为None
+        :param ip_selection_callback: IP选择回调函数，目标解析到多个地址时调用，
+            接收按延迟排序的候选列表，返回(选择的IP, 索引)；未提供时自动选择延迟最低的地址
+        :param process_callback: 进程回调函数，子进程启动后接收Popen对象（用于取消）
         :param kwargs: 其他参数
+            - pre_resolve: 启动前自行解析域名并对选定IP进行跟踪，默认True
+            - include_ipv6: 预解析时是否包含IPv6地址，默认True
             - max_hops: 最大跳数，默认30
             - timeout: 超时时间（毫秒），默认5000ms (5秒)
-            - format: 输出格式，默认'text'
+            - format: 输出格式，'json'使用-j输出并流式解码（带经纬度和ASN），'text'解析文本输出，
+              默认'json'；旧版本NextTrace不支持-j时自动改用文本输出
             - lang: 语言，'en'或'cn'，默认'cn'
             - dns_query: 是否进行DNS查询，默认True
             - queries: 每跳探测次数，默认3
@@ -137,7 +297,9 @@ class NextTraceIntegration:
         # 参数处理
         max_hops = kwargs.get('max_hops', 64)
         timeout = kwargs.get('timeout', 200)  # NextTrace使用毫秒为单位，修改为200ms
-        output_format = kwargs.get('format', 'text')  # 默认为文本格式
+        output_format = kwargs.get('format', 'json')
+        if output_format == 'json' and not self.json_supported:
+            output_format = 'text'
         lang = kwargs.get('lang', 'cn')  # 修正：使用'cn'而不是'zh'
         dns_query = kwargs.get('dns_query', True)
         queries = kwargs.get('queries', 3)
@@ -151,6 +313,10 @@ class NextTraceIntegration:
         data_provider = kwargs.get('data_provider', None)
         disable_map = kwargs.get('disable_map', False)
         
+        # 预解析域名并直接对选定IP跟踪，NextTrace不会再进入交互式IP选择
+        if kwargs.get('pre_resolve', True):
+            hostname = self._select_target_ip(hostname, ip_selection_callback, kwargs.get('include_ipv6', True))
+        
         # 构建命令参数
         cmd = [
             self.nexttrace_path,
@@ -187,18 +353,32 @@ class NextTraceIntegration:
         if disable_map:
             cmd.append('-M')  # 禁用地图显示
         
+        if output_format == 'json':
+            cmd.append('-j')  # JSON输出
+        
         try:
-            print(f"执行NextTrace命令: {' '.join(cmd)}")
+            logger.info("执行NextTrace命令: %s", ' '.join(cmd))
+            
+            # JSON模式始终流式解码，有回调时每解出一跳即回调
+            if output_format == 'json':
+                result = self._run_json_stream(cmd, callback, max_hops, timeout, process_callback)
+                if result is not None:
+                    return result
+                logger.warning("当前NextTrace版本不支持JSON输出(-j)，改用文本输出")
+                self.json_supported = False
+                cmd = [arg for arg in cmd if arg != '-j']
+                output_format = 'text'
             
             # 如果提供了回调函数，使用实时处理模式
             if callback:
-                return self._run_with_realtime_callback(cmd, callback, max_hops, timeout, ip_selection_callback)
+                return self._run_with_realtime_callback(cmd, callback, max_hops, timeout, process_callback)
             else:
                 # 执行命令，使用正确的编码处理
                 subprocess_kwargs = self._get_subprocess_kwargs()
                 result = subprocess.run(
                     cmd,
                     capture_output=True,
+                    stdin=subprocess.DEVNULL,
                     encoding='utf-8',  # 修改为UTF-8编码
                     errors='replace',  # 处理无法解码的字符
                     check=True,
@@ -207,8 +387,7 @@ class NextTraceIntegration:
                 )
                 
                 # 解析文本输出
-                if output_format == 'text' or output_format == 'json':
-                    # 无论请求什么格式，我们都解析文本输出
+                if output_format == 'text':
                     return self._parse_text_output(result.stdout)
                 else:
                     # 对于其他格式，返回原始输出
@@ -221,14 +400,99 @@ class NextTraceIntegration:
         except Exception as e:
             raise RuntimeError(f"NextTrace执行出错: {e}")
     
-    def _run_with_realtime_callback(self, cmd, callback, max_hops, timeout, ip_selection_callback=None):
+    def _select_target_ip(self, hostname: str, ip_selection_callback=None, include_ipv6: bool = True) -> str:
+        """解析目标域名并按探测延迟选择跟踪使用的IP
+
+        :param hostname: 目标主机名或IP地址
+        :param ip_selection_callback: IP选择回调函数
+        :param include_ipv6: 是否包含IPv6地址
+        :return: 选定的IP；无法解析时返回原始主机名，交由NextTrace处理
+        :raises RuntimeError: 用户取消了IP选择
+        """
+        from ui.target_resolver import target_resolver
+        
+        if target_resolver.is_ip_address(hostname):
+            return hostname
+        
+        candidates = target_resolver.rank(hostname, include_ipv6)
+        if not candidates:
+            return hostname
+        if len(candidates) == 1 or not ip_selection_callback:
+            return candidates[0]['ip']
+        
+        selected_ip, selected_index = ip_selection_callback(candidates)
+        if not selected_ip:
+            raise RuntimeError("用户取消了IP选择")
+        return selected_ip
+
+    def _run_json_stream(self, cmd, callback, max_hops, timeout, process_callback=None):
+        """执行JSON输出模式的NextTrace命令，并在输出到达时增量解码
+
+        :param cmd: NextTrace命令列表（已包含-j）
+        :param callback: 回调函数，可为None
+        :param max_hops: 最大跳数
+        :param timeout: 超时时间（毫秒）
+        :param process_callback: 进程回调函数
+        :return: 最终结果字典，包含MapTrace URL；NextTrace不支持-j参数时返回None
+        """
+        try:
+            process = self.process_factory(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                **self._get_subprocess_kwargs()
+            )
+        except Exception as e:
+            raise RuntimeError(f"启动NextTrace进程失败: {e}")
+
+        if process_callback:
+            process_callback(process)
+
+        stream = NextTraceJsonStream()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        hops = []
+
+        try:
+            while True:
+                # read1只等待已到达的数据，不需要等到换行或EOF
+                chunk = process.stdout.read1(65536)
+                text = decoder.decode(chunk, final=not chunk)
+                if text:
+                    raw_output.append('nexttrace', text)
+                start_index = stream.hop_index
+                for offset, element in enumerate(stream.feed(text)):
+                    record = NextTraceJsonStream.to_hop_record(element, start_index + offset)
+                    hops.append(record)
+                    if callback:
+                        self._call_callback_for_hop(record, callback)
+                if not chunk:
+                    break
+
+            process.wait(timeout=max_hops * (timeout / 1000) + 30)
+            stderr = process.stderr.read().decode('utf-8', errors='replace')
+        except subprocess.TimeoutExpired:
+            process.kill()
+            raise RuntimeError(f"NextTrace执行超时")
+        except Exception as e:
+            process.kill()
+            raise RuntimeError(f"NextTrace执行出错: {e}")
+
+        if not stream.in_hops and process.returncode:
+            if NextTraceJsonStream.UNSUPPORTED.search(stderr):
+                return None
+            raise RuntimeError(f"NextTrace执行失败: {stderr.strip()}")
+
+        return {"hops": hops, "raw_output": "", "maptrace_url": stream.maptrace_url()}
+
+    def _run_with_realtime_callback(self, cmd, callback, max_hops, timeout, process_callback=None):
         """使用实时回调模式执行NextTrace命令
         
         :param cmd: NextTrace命令列表
         :param callback: 回调函数
         :param max_hops: 最大跳数
         :param timeout: 超时时间
-        :param ip_selection_callback: IP选择回调函数
+        :param process_callback: 进程回调函数
         :return: 最终结果字典，包含MapTrace URL
         """
         import re
@@ -237,11 +501,11 @@ class NextTraceIntegration:
         try:
             # 启动进程，使用实时输出
             subprocess_kwargs = self._get_subprocess_kwargs()
-            process = subprocess.Popen(
+            process = self.process_factory(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                stdin=subprocess.PIPE,  # 添加标准输入支持
+                stdin=subprocess.DEVNULL,  # 目标已预解析为IP，不需要交互输入
                 universal_newlines=True,
                 encoding='utf-8',
                 errors='replace',
@@ -251,15 +515,12 @@ class NextTraceIntegration:
         except Exception as e:
             raise RuntimeError(f"启动NextTrace进程失败: {e}")
         
+        if process_callback:
+            process_callback(process)
+        
         hops = []
         current_hop = None
-        line_buffer = ""
         processed_hops = set()  # 跟踪已处理的跳数，避免重复回调
-        ip_selection_mode = False  # 标记是否处于IP选择模式
-        ip_options = []  # 存储IP选项
-        waiting_for_selection = False  # 标记是否正在等待用户选择
-        ip_selection_timeout = 5  # IP选择超时时间（秒）
-        ip_selection_start_time = None  # IP选择开始时间
         maptrace_url = None  # 存储MapTrace URL
         
         try:
@@ -269,225 +530,14 @@ class NextTraceIntegration:
                 if not line:
                     continue
                 
-                print(f"NextTrace输出: {line}")  # 调试输出
-                
-                # 检测IP选择界面
-                if 'Please Choose the IP You Want To TraceRoute' in line:
-                    ip_selection_mode = True
-                    ip_options = []
-                    waiting_for_selection = True
-                    ip_selection_start_time = time.time()
-                    print("检测到IP选择界面，正在收集IP选项...")
-                    continue
-                
-                # 处理IP选择选项
-                if ip_selection_mode and waiting_for_selection and line:
-                    # 解析IP选项行
-                    if line[0].isdigit() and ('.' in line or ':' in line):
-                        # 格式可能是: "0. 180.101.51.73" 或 "0) 180.101.49.11 (IPv4)"
-                        parts = re.split(r'[.)]\s*', line, 1)
-                        if len(parts) >= 2:
-                            try:
-                                index = int(parts[0].strip())
-                                ip_info = parts[1].strip()
-                                
-                                # 提取IP地址和类型
-                                ip_type = "IPv4" if '.' in ip_info else "IPv6"
-                                # 移除可能的类型标识
-                                ip_address = ip_info.split()[0] if ip_info.split() else ip_info
-                                
-                                ip_options.append({
-                                    "index": index,
-                                    "ip": ip_address,
-                                    "type": ip_type,
-                                    "location": "未知"
-                                })
-                                
-                                print(f"发现IP选项 {index}: {ip_address} ({ip_type})")
-                                
-                                # 如果收集到4个IP选项，立即触发选择
-                                if len(ip_options) >= 4:
-                                    print("已收集到4个IP选项，立即触发选择...")
-                                    waiting_for_selection = False
-                                    
-                                    # 立即处理IP选择
-                                    if ip_selection_callback:
-                                        # 调用IP选择回调
-                                        try:
-                                            selected_ip, selected_index = ip_selection_callback(ip_options)
-                                            
-                                            if selected_ip and selected_index is not None:
-                                                # 发送用户选择到NextTrace
-                                                try:
-                                                    process.stdin.write(f'{selected_index}\n')
-                                                    process.stdin.flush()
-                                                    print(f"用户选择IP: {selected_ip} (索引: {selected_index})")
-                                                    ip_selection_mode = False
-                                                except Exception as e:
-                                                    print(f"发送IP选择失败: {e}")
-                                                    # 如果无法发送选择，取消进程
-                                                    process.terminate()
-                                                    raise RuntimeError("无法发送IP选择到NextTrace")
-                                            else:
-                                                # 用户取消选择
-                                                print("用户取消了IP选择")
-                                                process.terminate()
-                                                raise RuntimeError("用户取消了IP选择")
-                                                
-                                        except Exception as e:
-                                            print(f"IP选择回调出错: {e}")
-                                            process.terminate()
-                                            raise RuntimeError(f"IP选择失败: {e}")
-                                    else:
-                                        # 如果没有提供回调，自动选择第一个IPv4地址
-                                        auto_selected = None
-                                        for ip_option in ip_options:
-                                            if ip_option["type"] == "IPv4":
-                                                auto_selected = ip_option
-                                                break
-                                        
-                                        if not auto_selected:
-                                            auto_selected = ip_options[0]  # 如果没有IPv4，选择第一个
-                                        
-                                        try:
-                                            process.stdin.write(f'{auto_selected["index"]}\n')
-                                            process.stdin.flush()
-                                            print(f"自动选择IP: {auto_selected['ip']} (索引: {auto_selected['index']})")
-                                            ip_selection_mode = False
-                                        except Exception as e:
-                                            print(f"发送自动IP选择失败: {e}")
-                                            process.terminate()
-                                            raise RuntimeError("无法发送IP选择到NextTrace")
-                                    
-                                    continue  # 跳过当前行的其余处理
-                                
-                            except (ValueError, IndexError) as e:
-                                print(f"解析IP选项失败: {e}")
-                    
-                    # 检查是否收集完所有IP选项
-                    # 如果已经收集到IP选项且下一行不是IP选项，或者已经收集了4个选项（通常NextTrace最多显示4个），则认为收集完成
-                    elif ip_options and (len(ip_options) >= 4 or not (line[0].isdigit() and ('.' in line or ':' in line))):
-                        waiting_for_selection = False
-                        
-                        if ip_selection_callback:
-                            # 调用IP选择回调
-                            try:
-                                selected_ip, selected_index = ip_selection_callback(ip_options)
-                                
-                                if selected_ip and selected_index is not None:
-                                    # 发送用户选择到NextTrace
-                                    try:
-                                        process.stdin.write(f'{selected_index}\n')
-                                        process.stdin.flush()
-                                        print(f"用户选择IP: {selected_ip} (索引: {selected_index})")
-                                        ip_selection_mode = False
-                                    except Exception as e:
-                                        print(f"发送IP选择失败: {e}")
-                                        # 如果无法发送选择，取消进程
-                                        process.terminate()
-                                        raise RuntimeError("无法发送IP选择到NextTrace")
-                                else:
-                                    # 用户取消选择
-                                    print("用户取消了IP选择")
-                                    process.terminate()
-                                    raise RuntimeError("用户取消了IP选择")
-                                    
-                            except Exception as e:
-                                print(f"IP选择回调出错: {e}")
-                                process.terminate()
-                                raise RuntimeError(f"IP选择失败: {e}")
-                        else:
-                            # 如果没有提供回调，自动选择第一个IPv4地址
-                            auto_selected = None
-                            for ip_option in ip_options:
-                                if ip_option["type"] == "IPv4":
-                                    auto_selected = ip_option
-                                    break
-                            
-                            if not auto_selected:
-                                auto_selected = ip_options[0]  # 如果没有IPv4，选择第一个
-                            
-                            try:
-                                process.stdin.write(f'{auto_selected["index"]}\n')
-                                process.stdin.flush()
-                                print(f"自动选择IP: {auto_selected['ip']} (索引: {auto_selected['index']})")
-                                ip_selection_mode = False
-                            except Exception as e:
-                                print(f"发送自动IP选择失败: {e}")
-                                process.terminate()
-                                raise RuntimeError("无法发送IP选择到NextTrace")
-                        
-                        continue
-                
-                # 检查IP选择超时
-                if ip_selection_mode and waiting_for_selection and ip_selection_start_time:
-                    if time.time() - ip_selection_start_time > ip_selection_timeout:
-                        print("IP选择超时，强制进行选择...")
-                        waiting_for_selection = False
-                        
-                        if ip_options:
-                            if ip_selection_callback:
-                                # 超时时调用回调
-                                try:
-                                    selected_ip, selected_index = ip_selection_callback(ip_options)
-                                    
-                                    if selected_ip and selected_index is not None:
-                                        process.stdin.write(f'{selected_index}\n')
-                                        process.stdin.flush()
-                                        print(f"超时后用户选择IP: {selected_ip} (索引: {selected_index})")
-                                        ip_selection_mode = False
-                                    else:
-                                        # 超时自动选择第一个IPv4
-                                        auto_selected = None
-                                        for ip_option in ip_options:
-                                            if ip_option["type"] == "IPv4":
-                                                auto_selected = ip_option
-                                                break
-                                        
-                                        if not auto_selected:
-                                            auto_selected = ip_options[0]
-                                        
-                                        process.stdin.write(f'{auto_selected["index"]}\n')
-                                        process.stdin.flush()
-                                        print(f"超时自动选择IP: {auto_selected['ip']} (索引: {auto_selected['index']})")
-                                        ip_selection_mode = False
-                                except Exception as e:
-                                    print(f"超时IP选择回调出错: {e}")
-                                    process.terminate()
-                                    raise RuntimeError(f"超时IP选择失败: {e}")
-                            else:
-                                # 超时自动选择第一个IPv4
-                                auto_selected = None
-                                for ip_option in ip_options:
-                                    if ip_option["type"] == "IPv4":
-                                        auto_selected = ip_option
-                                        break
-                                
-                                if not auto_selected:
-                                    auto_selected = ip_options[0]
-                                
-                                try:
-                                    process.stdin.write(f'{auto_selected["index"]}\n')
-                                    process.stdin.flush()
-                                    print(f"超时自动选择IP: {auto_selected['ip']} (索引: {auto_selected['index']})")
-                                    ip_selection_mode = False
-                                except Exception as e:
-                                    print(f"超时发送自动IP选择失败: {e}")
-                                    process.terminate()
-                                    raise RuntimeError("无法发送IP选择到NextTrace")
-                        else:
-                            print("没有收集到IP选项，终止进程")
-                            process.terminate()
-                            raise RuntimeError("没有收集到IP选项")
-                
-                # 如果正在等待IP选择，跳过其他处理
-                if waiting_for_selection:
-                    continue
+                # 原始输出进入诊断缓冲区，调试级别才输出到日志
+                raw_output.append('nexttrace', line)
+                logger.debug("NextTrace输出: %s", line)
                 
                 # 检查并捕获MapTrace URL
                 if line.startswith('MapTrace URL:'):
                     maptrace_url = line.replace('MapTrace URL:', '').strip()
-                    print(f"捕获到MapTrace URL: {maptrace_url}")
+                    logger.info("捕获到MapTrace URL: %s", maptrace_url)
                     continue
                 
                 # 跳过无关行
@@ -667,7 +717,7 @@ class NextTraceIntegration:
                                 hops.append(current_hop.copy())
                 
                 except Exception as e:
-                    print(f"解析NextTrace输出行时出错: {e}")
+                    logger.warning("解析NextTrace输出行时出错: %s", e)
                     continue
                 
             # 等待进程完成
@@ -710,19 +760,27 @@ class NextTraceIntegration:
             
             location = " ".join(location_parts) if location_parts else "未知"
             
-            # 获取ISP信息
-            asn = hop_data.get("asn", {})
-            isp = ""
-            if asn.get("as"):
-                isp = asn["as"]
+            # ISP信息：AS号和所有者
+            isp = self.format_asn(hop_data.get("asn", {}))
+            
+            # JSON输出带有经纬度，文本输出没有
+            coords = None
+            if geo.get("lat") is not None and geo.get("lng") is not None:
+                coords = (geo["lat"], geo["lng"])
             
             # 调用回调函数
             if callback:
-                callback(hop, ip, delay, location, isp)
+                callback(hop, ip, delay, location, isp, coords)
                 
         except Exception as e:
-            print(f"调用回调函数时出错: {e}")
+            logger.warning("调用回调函数时出错: %s", e)
     
+    @staticmethod
+    def format_asn(asn: Dict[str, Any]) -> str:
+        """将跳数记录中的ASN信息格式化为"AS号 所有者"文本"""
+        asn = asn or {}
+        return " ".join(v for v in (asn.get("as", ""), asn.get("owner") or asn.get("isp", "")) if v)
+
     def _parse_text_output(self, output: str) -> Dict[str, Any]:
         """解析NextTrace的文本输出
         
@@ -952,14 +1010,9 @@ class NextTraceIntegration:
                         except:
                             pass
                 
-                # 为IP生成伪随机的经纬度（中国范围内）
-                import hashlib
-                hash_obj = hashlib.md5(ip.encode())
-                hash_val = int(hash_obj.hexdigest()[:8], 16)
-                
-                # 生成中国范围内的经纬度 (经度 73-135, 纬度 18-53)
-                lat = 18.0 + (hash_val % 3500) / 100.0
-                lon = 73.0 + (hash_val % 6200) / 100.0
+                # 从地理位置缓存和地名索引解析经纬度
+                from ui.coordinate_resolver import coordinate_resolver
+                lat, lng = coordinate_resolver.resolve(ip)
                 
                 # 创建简化的路由数据
                 hop_data = (
@@ -968,7 +1021,7 @@ class NextTraceIntegration:
                     delay,        # 延迟
                     "未知",       # 城市
                     "未知ISP",    # ISP
-                    (lon, lat)    # 经纬度
+                    (lat, lng)    # 经纬度
                 )
                 hops.append(hop_data)
         
@@ -1003,7 +1056,10 @@ class NextTraceIntegration:
 
     :return: RouteTracer Pro需要的路由追踪结果列表，格式为[(hop, ip, delay, location, isp, (lat, lng)), ...]
         """
+        from ui.coordinate_resolver import coordinate_resolver
+
         result = []
+        path = []   # 与result对应的(ip, 位置, 地理信息)，所有跳点收集后统一解析坐标
         
         try:
             # 解析NextTrace的JSON输出
@@ -1052,26 +1108,22 @@ class NextTraceIntegration:
                 asn = hop_data.get('asn', {})
                 if asn:
                     isp = asn.get('isp', '')
-                    if isp and not location_parts[-1].startswith('('):
+                    if isp and location_parts and not location_parts[-1].startswith('('):
                         location_parts.append(f"({isp})")
                         location = ' '.join(location_parts)
                 
-                # 生成伪随机但固定的经纬度（基于IP地址）
-                # 这样相同的IP会映射到相同的地理位置
-                lat = 30.0 + (hash(ip) % 20) - 10  # 大致范围在20-40度之间
-                lng = 100.0 + (hash(ip) % 60) - 30  # 大致范围在70-130度之间
-                
-                # 确保经纬度在有效范围内
-                lat = max(-90, min(90, lat))
-                lng = max(-180, min(180, lng))
-                
-                # 添加到结果列表，返回格式: (hop, ip, delay, location, isp, (lat, lng))
-                result.append((hop, ip, delay, location, isp, (lat, lng)))
+                path.append((ip, location, geo))
+                result.append((hop, ip, delay, location, self.format_asn(asn) or isp))
                 
         except Exception as e:
-            print(f"转换NextTrace结果时出错: {e}")
-            
-        return result
+            logger.warning("转换NextTrace结果时出错: %s", e)
+        
+        # JSON模式提供的真实经纬度优先，其次是地理位置缓存和地名索引；
+        # 无法定位的跳点（如内网地址）锚定到相邻的已定位跳点
+        coords = coordinate_resolver.resolve_path(path)
+        # 确保经纬度在有效范围内，返回格式: (hop, ip, delay, location, isp, (lat, lng))
+        return [row + ((max(-90, min(90, lat)), max(-180, min(180, lng))),)
+                for row, (lat, lng) in zip(result, coords)]
     
     def traceroute_and_convert(self, hostname: str, **kwargs) -> List[Tuple[int, str, float, str]]:
         """执行路由追踪并转换结果格式
@@ -1089,26 +1141,48 @@ class NextTraceIntegration:
     def get_nexttrace_version(self) -> str:
         """获取NextTrace版本信息
         
+        结果在内存中记忆，并按可执行文件路径和修改时间缓存到磁盘
+        
         :return: 版本信息字符串
         :raises RuntimeError: 如果NextTrace不可用或执行失败
         """
         if not self.available:
             raise RuntimeError("NextTrace不可用")
         
+        if self._version is not None:
+            return self._version
+        
+        path = self.nexttrace_path
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        
+        cache = self._load_version_cache()
+        entry = cache.get(path)
+        if entry and mtime is not None and entry.get('mtime') == mtime:
+            self._version = entry.get('version', '')
+            return self._version
+        
         try:
             result = subprocess.run(
-                [self.nexttrace_path, '-V'],
+                [path, '-V'],
                 capture_output=True,
                 encoding='utf-8',
                 check=True,
                 **self._get_subprocess_kwargs()
             )
-            return result.stdout.strip()
         except Exception as e:
             raise RuntimeError(f"获取NextTrace版本失败: {e}")
+        
+        self._version = result.stdout.strip()
+        if mtime is not None:
+            cache[path] = {'mtime': mtime, 'version': self._version}
+            self._save_version_cache(cache)
+        return self._version
 
 
-# 创建全局NextTrace集成实例
+# 创建全局NextTrace集成实例（可执行文件在首次使用时查找）
 nexttrace_integration = NextTraceIntegration()
 
 
@@ -1162,9 +1236,10 @@ def integrate_with_tracemap(hostname: str, **kwargs) -> Optional[str]:
         kwargs.setdefault('max_hops', 15)
         kwargs.setdefault('timeout', 200)  # 200ms
         kwargs.setdefault('lang', 'cn')  # 确保使用正确的语言参数
+        kwargs.setdefault('format', 'json')  # JSON输出带有真实经纬度
         
         # 执行NextTrace路由追踪
-        print(f"使用NextTrace执行路由追踪: {hostname}")
+        logger.info("使用NextTrace执行路由追踪: %s", hostname)
         trace_data = run_nexttrace_traceroute(hostname, **kwargs)
         
         # 检查数据有效性，如果数据无效则尝试备用方案
@@ -1177,27 +1252,28 @@ def integrate_with_tracemap(hostname: str, **kwargs) -> Optional[str]:
                     break
         
         if not valid_data:
-            print("未获取到有效路由数据，尝试备用解析方法")
+            logger.info("未获取到有效路由数据，尝试备用解析方法")
             
-            # 创建集成实例
-            integration = NextTraceIntegration()
+            # 使用共享的集成实例
+            integration = nexttrace_integration
             if not integration.is_available():
                 return None
                 
             # 直接执行命令获取原始输出
             cmd = [
                 integration.nexttrace_path,
-                hostname,
+                integration._select_target_ip(hostname),
                 '-m', str(kwargs.get('max_hops', 15)),
                 '--timeout', str(kwargs.get('timeout', 10000)),  # 使用毫秒
                 '-C',  # 禁用彩色输出
                 '-g', 'cn'  # 使用正确的语言参数
             ]
             
-            print(f"执行NextTrace命令: {' '.join(cmd)}")
+            logger.info("执行NextTrace命令: %s", ' '.join(cmd))
             result = subprocess.run(
                 cmd,
                 capture_output=True,
+                stdin=subprocess.DEVNULL,
                 encoding='utf-8',
                 timeout=(kwargs.get('max_hops', 15) * kwargs.get('timeout', 10000) / 1000) + 30,  # 转换为秒
                 **integration._get_subprocess_kwargs()
@@ -1207,33 +1283,31 @@ def integrate_with_tracemap(hostname: str, **kwargs) -> Optional[str]:
             output = result.stdout + result.stderr
             if hasattr(integration, '_extract_simplified_hops'):
                 trace_data = integration._extract_simplified_hops(output)
-                print(f"备用方法提取到 {len(trace_data)} 个路由节点")
+                logger.info("备用方法提取到 %d 个路由节点", len(trace_data))
             else:
-                print("备用方法不可用")
+                logger.warning("备用方法不可用")
                 return None
         
         if not trace_data:
-            print("仍未获取到有效路由数据")
+            logger.warning("仍未获取到有效路由数据")
             return None
         
-        print(f"获取到 {len(trace_data)} 个路由节点")
+        logger.info("获取到 %d 个路由节点", len(trace_data))
         
         # 尝试导入tracemap模块
         from ui.tracemap_integration import generate_and_open_tracemap
         
         # 生成地图并在浏览器中打开
         html_path = generate_and_open_tracemap(trace_data, hostname)
-        print(f"使用NextTrace数据生成的地图: {html_path}")
+        logger.info("使用NextTrace数据生成的地图: %s", html_path)
         
         return html_path
         
     except ImportError:
-        print("无法导入tracemap模块")
+        logger.error("无法导入tracemap模块")
         return None
     except Exception as e:
-        print(f"集成NextTrace和tracemap时出错: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("集成NextTrace和tracemap时出错: %s", e)
         return None
 
 
@@ -0,0 +1,153 @@
+# -- coding: utf-8 --
+"""NextTrace进程池模块
+
+管理并发的NextTrace运行：所有运行共享一个全局并发探测预算（--parallel-requests之和），
+每次运行分到预算中的一份，超出的任务按优先级排队，避免多个跟踪同时抢占上行带宽和ICMP限速导致RTT失真
+
+工作线程不使用应用任务执行器的工作池：界面的trace任务会在trace工作池中等待本池的结果，
+工作者若也占用trace工作池，跟踪较多时会互相等待而死锁；工作者还要在持锁状态下等待探测预算，
+不适合作为普通任务排队。因此本池自带工作线程，数量按排队任务按需创建、不超过max_workers，
+均为守护线程，shutdown后处理完剩余任务（或取消排队任务）即退出，界面关闭时调用shutdown
+"""
+
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, List
+
+from .nexttrace_integration import nexttrace_integration
+
+
+class NextTracePool:
+    """NextTrace工作池，带全局探测预算和优先级队列"""
+
+    def __init__(self, integration=None, max_workers: int = 4, probe_budget: int = 36,
+                 min_share: int = 4, default_options: Optional[Dict[str, Any]] = None):
+        """初始化工作池
+
+        :param integration: NextTraceIntegration实例，默认使用共享的全局实例（复用已查找的可执行文件）
+        :param max_workers: 最大同时运行的NextTrace进程数
+        :param probe_budget: 所有运行共享的并发探测总数
+        :param min_share: 单次运行最少分到的并发探测数
+        :param default_options: 每次运行默认传给run_traceroute的参数
+        """
+        self.integration = integration or nexttrace_integration
+        self.max_workers = max(1, max_workers)
+        self.probe_budget = max(1, probe_budget)
+        self.min_share = max(1, min(min_share, self.probe_budget))
+        self.default_options = dict(default_options or {})
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._available = self.probe_budget
+        self._running = 0
+        self._completed = 0
+        self._workers = []
+        self._shutdown = False
+
+    def _ensure_workers(self):
+        """按需启动工作线程（需持有锁），线程数不超过排队和运行中的任务数，也不超过max_workers"""
+        needed = min(self.max_workers, self._running + len(self._queue))
+        while len(self._workers) < needed:
+            worker = threading.Thread(target=self._worker_loop, daemon=True,
+                                      name=f"NextTracePool-{len(self._workers)}")
+            self._workers.append(worker)
+            worker.start()
+
+    def submit(self, hostname: str, priority: int = 10, callback=None, **kwargs) -> Future:
+        """提交一次路由跟踪
+
+        :param hostname: 目标主机名或IP
+        :param priority: 优先级，数值越小越先执行（界面发起的跟踪建议使用0）
+        :param callback: 实时回调函数，同run_traceroute
+        :param kwargs: 其他run_traceroute参数；parallel_requests作为本次运行的期望并发上限
+        :return: Future，结果为run_traceroute的返回值
+        """
+        future = Future()
+        options = {**self.default_options, **kwargs}
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("NextTrace工作池已关闭")
+            heapq.heappush(self._queue, (priority, next(self._counter), hostname, callback, options, future))
+            self._ensure_workers()
+            self._condition.notify_all()
+        return future
+
+    def trace_many(self, hostnames: List[str], priority: int = 10, **kwargs) -> Dict[str, Future]:
+        """批量提交路由跟踪
+
+        :return: 目标到Future的字典
+        """
+        return {hostname: self.submit(hostname, priority, **kwargs) for hostname in hostnames}
+
+    def _share_for(self, requested: int) -> int:
+        """计算下一次运行应分到的探测预算（需持有锁）
+
+        按当前运行数和排队数平均分配，使后续任务不必等待先启动的任务结束
+        """
+        contenders = min(self.max_workers, self._running + len(self._queue) + 1)
+        fair_share = self.probe_budget // max(1, contenders)
+        return max(self.min_share, min(requested, fair_share))
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._shutdown and not self._queue:
+                        return
+                    if self._queue:
+                        requested = self._queue[0][4].get('parallel_requests', 18)
+                        share = self._share_for(requested)
+                        if self._available >= share:
+                            break
+                    self._condition.wait()
+
+                priority, _, hostname, callback, options, future = heapq.heappop(self._queue)
+                if not future.set_running_or_notify_cancel():
+                    self._condition.notify_all()
+                    continue
+                self._available -= share
+                self._running += 1
+
+            try:
+                options['parallel_requests'] = share
+                result = self.integration.run_traceroute(hostname, callback=callback, **options)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._available += share
+                    self._running -= 1
+                    self._completed += 1
+                    self._condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        """返回工作池当前状态"""
+        with self._condition:
+            return {
+                'running': self._running,
+                'queued': len(self._queue),
+                'available_budget': self._available,
+                'probe_budget': self.probe_budget,
+                'completed': self._completed
+            }
+
+    def shutdown(self, cancel_pending: bool = True):
+        """关闭工作池
+
+        :param cancel_pending: 是否取消尚未开始的任务
+        """
+        with self._condition:
+            self._shutdown = True
+            if cancel_pending:
+                for item in self._queue:
+                    item[5].cancel()
+                self._queue.clear()
+            self._condition.notify_all()
+
+
+# 创建全局实例
+nexttrace_pool = NextTracePool()
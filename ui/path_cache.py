@@ -0,0 +1,241 @@
+# -- coding: utf-8 --
+"""路由路径缓存模块
+
+按(目标, 跟踪引擎, 协议)缓存最近一次的路由路径，支持抽样TTL快速验证和路径变化检测
+"""
+
+import os
+import json
+import time
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+from .log_utils import get_logger
+from .task_executor import task_executor
+
+logger = get_logger(__name__)
+
+
+class PathCache:
+    """路由路径缓存，保存每个目标最近一次的完整路径及时间戳"""
+
+    def __init__(self, cache_file: str = "path_cache.json"):
+        """初始化路径缓存
+
+        :param cache_file: 缓存文件路径
+        """
+        self.cache_file = cache_file
+        self.paths = {}
+        self.lock = threading.Lock()
+        self.load_cache()
+
+    def load_cache(self):
+        """加载路径缓存"""
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    self.paths = json.load(f)
+        except Exception as e:
+            logger.warning("加载路径缓存失败: %s", e)
+
+    def save_cache(self):
+        """保存路径缓存"""
+        try:
+            with self.lock:
+                data = dict(self.paths)
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning("保存路径缓存失败: %s", e)
+
+    @staticmethod
+    def make_key(target: str, engine: str, protocol: str = 'icmp') -> str:
+        """生成缓存键
+
+        :param target: 目标主机名或IP
+        :param engine: 跟踪引擎（system/nexttrace）
+        :param protocol: 探测协议（icmp/tcp/udp）
+        :return: 缓存键字符串
+        """
+        return f"{target.strip().lower()}|{engine}|{protocol}"
+
+    @staticmethod
+    def normalize_hops(results: List[Any]) -> List[Dict[str, Any]]:
+        """将不同引擎的跳数记录统一为字典格式
+
+        :param results: 路由跟踪结果，元组(hop, ip, delay, location[, isp])或NextTrace跳数字典
+        :return: 按跳数排序的跳数字典列表
+        """
+        hops = {}
+        for item in results or []:
+            try:
+                if isinstance(item, dict):
+                    hop = int(item.get('hop', 0))
+                    ip = item.get('ip', '') or '*'
+                    delay = item.get('delay', -1)
+                    if isinstance(delay, list):
+                        delay = delay[0] if delay else -1
+                    geo = item.get('geo', {}) or {}
+                    location = ' '.join(v for v in (geo.get('country'), geo.get('region'), geo.get('city')) if v)
+                    isp = (item.get('asn', {}) or {}).get('as', '')
+                elif isinstance(item, (list, tuple)) and len(item) >= 3:
+                    hop = int(item[0])
+                    ip = item[1] or '*'
+                    delay = item[2]
+                    location = item[3] if len(item) > 3 else ''
+                    isp = item[4] if len(item) > 4 else ''
+                else:
+                    continue
+            except (ValueError, TypeError):
+                continue
+
+            if hop <= 0:
+                continue
+            hops[hop] = {
+                'hop': hop,
+                'ip': ip,
+                'delay': float(delay) if isinstance(delay, (int, float)) else -1,
+                'location': location or '',
+                'isp': isp or ''
+            }
+        return [hops[h] for h in sorted(hops)]
+
+    @staticmethod
+    def diff_paths(old_hops: List[Dict[str, Any]], new_hops: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """比较两条路径，返回发生变化的跳点
+
+        超时跳点（*）视为未知，不算作变化；路径长度变化时多出或缺少的跳点会被报告
+
+        :param old_hops: 旧路径
+        :param new_hops: 新路径
+        :return: 变化列表，每项为{'hop', 'old_ip', 'new_ip'}
+        """
+        old_map = {h['hop']: h['ip'] for h in old_hops}
+        new_map = {h['hop']: h['ip'] for h in new_hops}
+        changes = []
+        for hop in sorted(set(old_map) | set(new_map)):
+            old_ip = old_map.get(hop)
+            new_ip = new_map.get(hop)
+            if old_ip == '*' or new_ip == '*':
+                continue
+            if old_ip != new_ip:
+                changes.append({'hop': hop, 'old_ip': old_ip or '-', 'new_ip': new_ip or '-'})
+        return changes
+
+    @staticmethod
+    def format_diff(changes: List[Dict[str, Any]]) -> str:
+        """格式化路径变化报告
+
+        :param changes: diff_paths返回的变化列表
+        :return: 报告文本
+        """
+        if not changes:
+            return "路径未发生变化"
+        lines = [f"路径发生变化，共 {len(changes)} 个跳点不同:"]
+        for change in changes:
+            lines.append(f"  跳点 {change['hop']}: {change['old_ip']} -> {change['new_ip']}")
+        return '\n'.join(lines)
+
+    def get(self, target: str, engine: str, protocol: str = 'icmp') -> Optional[Dict[str, Any]]:
+        """获取缓存的路径记录
+
+        :return: 路径记录字典，不存在时返回None
+        """
+        with self.lock:
+            entry = self.paths.get(self.make_key(target, engine, protocol))
+            return dict(entry) if entry else None
+
+    def store(self, target: str, engine: str, protocol: str, results: List[Any]) -> List[Dict[str, Any]]:
+        """保存一次完整跟踪的路径，并返回与上一次路径的差异
+
+        :param target: 目标主机名或IP
+        :param engine: 跟踪引擎
+        :param protocol: 探测协议
+        :param results: 路由跟踪结果
+        :return: 与缓存路径相比的变化列表，首次跟踪时为空
+        """
+        hops = self.normalize_hops(results)
+        if not hops:
+            return []
+
+        now = time.time()
+        key = self.make_key(target, engine, protocol)
+        with self.lock:
+            previous = self.paths.get(key)
+            changes = self.diff_paths(previous['hops'], hops) if previous else []
+            self.paths[key] = {
+                'target': target,
+                'engine': engine,
+                'protocol': protocol,
+                'hops': hops,
+                'first_seen': previous['first_seen'] if previous and not changes else now,
+                'last_seen': now,
+                'last_verified': now,
+                'changed_at': now if changes else (previous or {}).get('changed_at')
+            }
+        self.save_cache()
+        return changes
+
+    def mark_verified(self, target: str, engine: str, protocol: str = 'icmp'):
+        """记录一次成功的快速验证"""
+        with self.lock:
+            entry = self.paths.get(self.make_key(target, engine, protocol))
+            if entry:
+                entry['last_verified'] = time.time()
+        self.save_cache()
+
+    @staticmethod
+    def sample_ttls(hops: List[Dict[str, Any]], samples: int = 3) -> List[int]:
+        """从缓存路径中抽取用于快速验证的TTL
+
+        只选择有应答的跳点，均匀分布并总是包含最后一个有应答的跳点
+
+        :param hops: 缓存的路径
+        :param samples: 抽样数量
+        :return: TTL列表
+        """
+        responsive = [h['hop'] for h in hops if h['ip'] != '*']
+        if len(responsive) <= samples:
+            return responsive
+        step = len(responsive) / samples
+        picked = {responsive[min(len(responsive) - 1, int((i + 1) * step) - 1)] for i in range(samples)}
+        picked.add(responsive[-1])
+        return sorted(picked)
+
+    def verify(self, target: str, engine: str, protocol: str, probe_func: Callable[[int], Optional[str]],
+               samples: int = 3) -> Tuple[bool, List[Dict[str, Any]]]:
+        """只探测少量抽样TTL来确认缓存路径是否仍然有效
+
+        :param target: 目标主机名或IP
+        :param engine: 跟踪引擎
+        :param protocol: 探测协议
+        :param probe_func: 单TTL探测函数，接收ttl返回应答的IP（无应答返回None），在probe工作池中并发调用
+        :param samples: 抽样数量
+        :return: (路径是否未变化, 不一致的跳点列表)；没有缓存时返回(False, [])
+        """
+        entry = self.get(target, engine, protocol)
+        if not entry:
+            return False, []
+
+        ttls = self.sample_ttls(entry['hops'], samples)
+        if not ttls:
+            return False, []
+
+        expected = {h['hop']: h['ip'] for h in entry['hops']}
+        futures = [task_executor.call('probe', probe_func, ttl) for ttl in ttls]
+        observed = dict(zip(ttls, (future.result() for future in futures)))
+
+        mismatches = []
+        for ttl in ttls:
+            ip = observed.get(ttl)
+            # 抽样点无应答无法确认路径，按不一致处理以触发完整跟踪
+            if ip != expected.get(ttl):
+                mismatches.append({'hop': ttl, 'old_ip': expected.get(ttl), 'new_ip': ip or '*'})
+
+        if not mismatches:
+            self.mark_verified(target, engine, protocol)
+        return not mismatches, mismatches
+
+
+# 创建全局实例
+path_cache = PathCache()
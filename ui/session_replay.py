@@ -0,0 +1,478 @@
+# -- coding: utf-8 --
+"""路由跟踪会话录制与回放模块
+
+录制NextTrace/系统traceroute子进程的原始输出（带每行时间戳），并可按原始速度或最快速度回放，
+用于在无网络环境下确定性地测试和基准测试输出解析器。
+
+录制文件为JSON Lines格式：
+    第一行为头部 {"version": 1, "cmd": [...], "system": "linux", "text": true}
+    之后每行为一个输出事件 [相对时间(秒), "o"或"e", 数据]
+    最后一行为 {"returncode": 0}
+
+用法:
+    python -m ui.session_replay record session.jsonl -- nexttrace -n 8.8.8.8
+    python -m ui.session_replay play session.jsonl [--speed 0]
+    python -m ui.session_replay bench session.jsonl --engine nexttrace [--speed 0]
+
+play子命令可作为假的可执行文件使用（忽略其余参数），例如写一个包装脚本作为nexttrace_path：
+    #!/bin/sh
+    exec python -m ui.session_replay play /path/to/session.jsonl "$@"
+"""
+
+import os
+import sys
+import json
+import time
+import codecs
+import platform
+import argparse
+import threading
+import subprocess
+from typing import List, Dict, Any, Optional
+
+RECORDING_VERSION = 1
+
+
+def _is_text_mode(popen_kwargs: Dict[str, Any]) -> bool:
+    """根据Popen参数判断调用方期望文本还是字节输出"""
+    return bool(popen_kwargs.get('text') or popen_kwargs.get('universal_newlines') or popen_kwargs.get('encoding'))
+
+
+class SessionRecording:
+    """一次子进程会话的录制数据"""
+
+    def __init__(self, cmd: Optional[List[str]] = None, events: Optional[List[list]] = None,
+                 returncode: int = 0, system: Optional[str] = None, text: bool = True):
+        self.cmd = list(cmd or [])
+        self.events = events if events is not None else []
+        self.returncode = returncode
+        self.system = system or platform.system().lower()
+        self.text = text
+
+    @classmethod
+    def load(cls, path: str) -> 'SessionRecording':
+        """从文件加载录制数据"""
+        recording = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                if isinstance(item, list):
+                    recording.events.append(item)
+                elif 'returncode' in item:
+                    recording.returncode = item['returncode']
+                else:
+                    recording.cmd = item.get('cmd', [])
+                    recording.system = item.get('system', recording.system)
+                    recording.text = item.get('text', True)
+        return recording
+
+    def save(self, path: str):
+        """保存录制数据，时间戳保留到微秒"""
+        with open(path, 'w', encoding='utf-8') as f:
+            header = {'version': RECORDING_VERSION, 'cmd': self.cmd, 'system': self.system, 'text': self.text}
+            f.write(json.dumps(header, ensure_ascii=False) + '\n')
+            for offset, stream, data in self.events:
+                f.write(json.dumps([round(offset, 6), stream, data], ensure_ascii=False) + '\n')
+            f.write(json.dumps({'returncode': self.returncode}) + '\n')
+
+    def output(self, stream: str = 'o') -> str:
+        """返回指定流的完整输出文本"""
+        return ''.join(data for _, s, data in self.events if s == stream)
+
+    @property
+    def duration(self) -> float:
+        """录制时长（秒）"""
+        return self.events[-1][0] if self.events else 0.0
+
+
+class _TeeStream:
+    """包装真实子进程的输出流，在读取的同时记录数据和时间戳"""
+
+    def __init__(self, stream, recorder: 'RecordingProcess', stream_key: str, text: bool):
+        self._stream = stream
+        self._recorder = recorder
+        self._key = stream_key
+        self._text = text
+        self._decoder = None if text else codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def _record(self, data):
+        if data:
+            text = data if self._text else self._decoder.decode(data)
+            if text:
+                self._recorder.add_event(self._key, text)
+        return data
+
+    def readline(self, *args):
+        return self._record(self._stream.readline(*args))
+
+    def read1(self, *args):
+        return self._record(self._stream.read1(*args))
+
+    def read(self, *args):
+        return self._record(self._stream.read(*args))
+
+    def __iter__(self):
+        return iter(self.readline, '' if self._text else b'')
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class RecordingProcess:
+    """真实子进程的包装，输出被读取时同步录制，进程结束时写入录制文件"""
+
+    def __init__(self, path: str, cmd, **popen_kwargs):
+        self.path = path
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._saved = False
+        self._process = subprocess.Popen(cmd, **popen_kwargs)
+        text = _is_text_mode(popen_kwargs)
+        self.recording = SessionRecording(cmd=[str(c) for c in cmd], text=text)
+        self.stdout = _TeeStream(self._process.stdout, self, 'o', text) if self._process.stdout else None
+        self.stderr = _TeeStream(self._process.stderr, self, 'e', text) if self._process.stderr else None
+        self.stdin = self._process.stdin
+
+    def add_event(self, stream_key: str, data: str):
+        """记录一段输出"""
+        with self._lock:
+            self.recording.events.append([time.perf_counter() - self._start, stream_key, data])
+
+    def _finish(self, returncode):
+        if returncode is not None and not self._saved:
+            self._saved = True
+            self.recording.returncode = returncode
+            self.recording.save(self.path)
+        return returncode
+
+    def wait(self, timeout=None):
+        return self._finish(self._process.wait(timeout=timeout))
+
+    def poll(self):
+        return self._finish(self._process.poll())
+
+    def communicate(self, *args, **kwargs):
+        stdout, stderr = self._process.communicate(*args, **kwargs)
+        if stdout:
+            self.stdout._record(stdout)
+        if stderr:
+            self.stderr._record(stderr)
+        self._finish(self._process.returncode)
+        return stdout, stderr
+
+    def __getattr__(self, name):
+        return getattr(self._process, name)
+
+
+class RecordingProcessFactory:
+    """可注入的进程工厂：启动真实子进程并录制到文件
+
+    每次调用生成一个录制文件，文件名为 prefix_序号.jsonl
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: 录制文件路径；多次调用时在扩展名前追加序号
+        """
+        self.path = path
+        self.count = 0
+        self.processes = []
+
+    def __call__(self, cmd, **popen_kwargs):
+        root, ext = os.path.splitext(self.path)
+        path = self.path if self.count == 0 else f"{root}_{self.count}{ext or '.jsonl'}"
+        self.count += 1
+        process = RecordingProcess(path, cmd, **popen_kwargs)
+        self.processes.append(process)
+        return process
+
+
+class _NullInput:
+    """回放进程的标准输入，写入内容被丢弃"""
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _ReplayStream:
+    """回放输出流，支持按行迭代、readline、read1和read"""
+
+    def __init__(self, process: 'ReplayProcess', stream_key: str, text: bool):
+        self._process = process
+        self._events = [e for e in process.recording.events if e[1] == stream_key]
+        self._index = 0
+        self._text = text
+        self._buffer = ''
+        self.last_emit = None  # 最近一次交付数据的时刻（perf_counter）
+
+    def _next_piece(self) -> Optional[str]:
+        if self._process.terminated or self._index >= len(self._events):
+            return None
+        offset, _, data = self._events[self._index]
+        self._index += 1
+        self._process.sleep_until(offset)
+        self.last_emit = time.perf_counter()
+        return data
+
+    def _out(self, data: str):
+        return data if self._text else data.encode('utf-8')
+
+    @property
+    def exhausted(self) -> bool:
+        return not self._buffer and (self._index >= len(self._events) or self._process.terminated)
+
+    def readline(self, *args):
+        while '\n' not in self._buffer:
+            piece = self._next_piece()
+            if piece is None:
+                break
+            self._buffer += piece
+        pos = self._buffer.find('\n')
+        end = pos + 1 if pos >= 0 else len(self._buffer)
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+        return self._out(line)
+
+    def read1(self, size=-1):
+        if not self._buffer:
+            piece = self._next_piece()
+            if piece is None:
+                return self._out('')
+            self._buffer = piece
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return self._out(data)
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        self._buffer = ''
+        while True:
+            piece = self._next_piece()
+            if piece is None:
+                break
+            chunks.append(piece)
+        return self._out(''.join(chunks))
+
+    def __iter__(self):
+        return iter(self.readline, self._out(''))
+
+    def close(self):
+        pass
+
+
+class ReplayProcess:
+    """回放录制会话的类Popen对象
+
+    speed为1时按原始时间间隔输出，为2时两倍速，小于等于0时不等待、尽快输出
+    """
+
+    def __init__(self, recording: SessionRecording, speed: float = 1.0, text: bool = True, args=None):
+        self.recording = recording
+        self.speed = speed
+        self.args = args if args is not None else recording.cmd
+        self.pid = 0
+        self.returncode = None
+        self.terminated = False
+        self.start_time = time.perf_counter()
+        self.stdout = _ReplayStream(self, 'o', text)
+        self.stderr = _ReplayStream(self, 'e', text)
+        self.stdin = _NullInput()
+
+    def sleep_until(self, offset: float):
+        """等待到录制中相对时间offset对应的回放时刻"""
+        if self.speed and self.speed > 0:
+            delay = self.start_time + offset / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def poll(self):
+        if self.returncode is None and self.stdout.exhausted and self.stderr.exhausted:
+            self.returncode = self.recording.returncode
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self.returncode is None:
+            if not self.terminated:
+                self.sleep_until(self.recording.duration)
+            self.returncode = -15 if self.terminated else self.recording.returncode
+        return self.returncode
+
+    def communicate(self, input=None, timeout=None):
+        stdout = self.stdout.read()
+        stderr = self.stderr.read()
+        self.wait()
+        return stdout, stderr
+
+    def terminate(self):
+        self.terminated = True
+        if self.returncode is None:
+            self.returncode = -15
+
+    def kill(self):
+        self.terminate()
+
+
+class ReplayProcessFactory:
+    """可注入的进程工厂：忽略命令，回放录制文件
+
+    可注入到NetworkUtils.process_factory或NextTraceIntegration.process_factory
+    """
+
+    def __init__(self, recording, speed: float = 1.0):
+        """
+        :param recording: 录制文件路径或SessionRecording对象
+        :param speed: 回放速度倍数，小于等于0表示尽快回放
+        """
+        self.recording = SessionRecording.load(recording) if isinstance(recording, str) else recording
+        self.speed = speed
+        self.processes = []
+
+    def __call__(self, cmd, **popen_kwargs):
+        process = ReplayProcess(self.recording, self.speed, _is_text_mode(popen_kwargs), args=cmd)
+        self.processes.append(process)
+        return process
+
+
+def play(recording: SessionRecording, speed: float = 1.0) -> int:
+    """作为假的可执行文件回放录制输出到标准输出/标准错误
+
+    :return: 录制的退出码
+    """
+    process = ReplayProcess(recording, speed)
+    try:
+        for offset, stream, data in recording.events:
+            process.sleep_until(offset)
+            target = sys.stdout if stream == 'o' else sys.stderr
+            target.write(data)
+            target.flush()
+    except BrokenPipeError:
+        # 读取方提前退出（例如被取消的跟踪），与真实进程一样直接结束
+        pass
+    return recording.returncode
+
+
+def benchmark(recording: SessionRecording, engine: str = 'nexttrace', speed: float = 0, repeat: int = 1) -> Dict[str, Any]:
+    """离线回放录制会话，测量解析吞吐量和每跳端到端延迟
+
+    每跳延迟为解析器回调时刻与最近一次输出数据交付时刻之差，只统计解析开销。
+    离线测试不进行地理位置查询和目标预解析。
+
+    :param recording: 录制数据
+    :param engine: nexttrace（文本实时模式）、nexttrace-json、nexttrace-parse（_parse_text_output）或system
+    :param speed: 回放速度，0表示尽快回放
+    :param repeat: 重复次数
+    :return: 统计信息字典
+    """
+    from .nexttrace_integration import NextTraceIntegration
+    from .network_utils import NetworkUtils
+
+    line_count = sum(data.count('\n') for _, s, data in recording.events if s == 'o') or 1
+    durations = []
+    hop_latencies = []
+    hop_count = 0
+    utils = None
+    if engine == 'system':
+        # 所有重复共用一个实例：不读写地理位置缓存文件（不在当前目录留下geoip_cache.json），
+        # 并按录制时的系统解析输出，而不是回放所在的系统
+        utils = NetworkUtils(cache_file=None, system=recording.system)
+        # 离线基准测试不查询地理位置
+        utils.get_ip_location = lambda ip: {}
+
+    for _ in range(repeat):
+        factory = ReplayProcessFactory(recording, speed)
+        latencies = []
+
+        def on_hop(*args):
+            process = factory.processes[-1] if factory.processes else None
+            if process and process.stdout.last_emit is not None:
+                latencies.append((time.perf_counter() - process.stdout.last_emit) * 1000)
+
+        start = time.perf_counter()
+        if engine == 'nexttrace-parse':
+            result = NextTraceIntegration()._parse_text_output(recording.output())
+            hops = result['hops']
+        elif engine.startswith('nexttrace'):
+            integration = NextTraceIntegration()
+            integration.nexttrace_path = 'replay'
+            integration.process_factory = factory
+            output_format = 'json' if engine == 'nexttrace-json' else 'text'
+            result = integration.run_traceroute('replay', callback=on_hop, format=output_format, pre_resolve=False)
+            hops = result['hops']
+        elif engine == 'system':
+            utils.process_factory = factory
+            hops = utils.traceroute('replay', callback=on_hop)
+        else:
+            raise ValueError(f"未知的引擎: {engine}")
+        durations.append(time.perf_counter() - start)
+        hop_latencies.extend(latencies)
+        hop_count = len(hops)
+
+    best = min(durations)
+    hop_latencies.sort()
+    stats = {
+        'engine': engine,
+        'hops': hop_count,
+        'lines': line_count,
+        'best_seconds': best,
+        'lines_per_second': line_count / best if best > 0 else float('inf'),
+    }
+    if hop_latencies:
+        stats['hop_latency_ms_p50'] = hop_latencies[len(hop_latencies) // 2]
+        stats['hop_latency_ms_max'] = hop_latencies[-1]
+    return stats
+
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="路由跟踪会话录制与回放")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = sub.add_parser('record', help="运行命令并录制输出")
+    record_parser.add_argument('output', help="录制文件路径")
+    record_parser.add_argument('cmd', nargs=argparse.REMAINDER, help="要录制的命令（以--分隔）")
+
+    play_parser = sub.add_parser('play', help="回放录制输出（可作为假的可执行文件）")
+    play_parser.add_argument('recording', help="录制文件路径")
+    play_parser.add_argument('--speed', type=float, default=1.0, help="回放速度倍数，0表示尽快回放")
+
+    bench_parser = sub.add_parser('bench', help="离线基准测试解析器")
+    bench_parser.add_argument('recording', help="录制文件路径")
+    bench_parser.add_argument('--engine', default='nexttrace',
+                              choices=['nexttrace', 'nexttrace-json', 'nexttrace-parse', 'system'])
+    bench_parser.add_argument('--speed', type=float, default=0, help="回放速度倍数，0表示尽快回放")
+    bench_parser.add_argument('--repeat', type=int, default=5, help="重复次数")
+
+    args, _ = parser.parse_known_args(argv)
+
+    if args.command == 'record':
+        # 只去掉分隔用的第一个--，被录制命令自身的--参数原样保留
+        cmd = args.cmd[1:] if args.cmd and args.cmd[0] == '--' else args.cmd
+        if not cmd:
+            parser.error("缺少要录制的命令")
+        process = RecordingProcess(args.output, cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL, text=True, encoding='utf-8', errors='replace')
+        for line in process.stdout:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        return process.wait()
+
+    if args.command == 'play':
+        return play(SessionRecording.load(args.recording), args.speed)
+
+    stats = benchmark(SessionRecording.load(args.recording), args.engine, args.speed, args.repeat)
+    for key, value in stats.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# -- coding: utf-8 --
+"""启动耗时分析模块
+
+测量从进程启动到主窗口第一次显示（time-to-first-window）的耗时，并给出类似python -X importtime的导入耗时明细，
+打包后的可执行文件（不能使用-X选项）同样适用：
+    - mark：记录启动过程中的阶段（导入界面模块、创建Tk、构建界面、首次显示窗口）
+    - trace_imports：开始记录之后每个模块首次导入的自身耗时和累计耗时（包含其导入的子模块）
+    - report：输出阶段耗时和最慢的导入；超过预算时返回非零退出码，用于发现启动时间回归
+时间从导入本模块开始计算（main.py最先导入本模块），不含解释器自身和打包程序解压的时间
+
+用法：
+    python main.py --startup-report
+    python main.py --startup-report --startup-budget 1500
+    python main.py --startup-report startup.txt    （写入文件；无控制台的打包程序默认写入程序目录下的startup_report.txt）
+"""
+
+import sys
+import time
+import builtins
+import importlib.util
+from typing import List, Dict, Any, Optional
+
+# 启动时间预算（毫秒），--startup-budget未指定时使用
+DEFAULT_BUDGET_MS = 2000
+
+
+class StartupProfile:
+    """启动阶段和导入耗时记录器"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []        # (阶段名, 距启动的毫秒数)
+        self.imports = []       # {'name', 'self_ms', 'cumulative_ms', 'depth'}，按导入完成的顺序
+        self.stack = []         # 正在导入的模块的子模块耗时累加
+        self.original_import = None
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def mark(self, phase: str):
+        """记录一个阶段完成的时间点"""
+        self.phases.append((phase, self.elapsed_ms()))
+
+    def trace_imports(self):
+        """开始记录模块导入耗时（替换builtins.__import__，只对尚未导入的模块计时）"""
+        if self.original_import is not None:
+            return
+        self.original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def stop_tracing(self):
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self.original_import
+        if level and name:
+            try:
+                package = (globals or {}).get('__package__') or ''
+                full_name = importlib.util.resolve_name('.' * level + name, package)
+            except (ImportError, ValueError):
+                full_name = None
+        else:
+            full_name = name or None
+        if full_name is None or full_name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        self.stack.append(0.0)
+        begin = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = (time.perf_counter() - begin) * 1000
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += cumulative
+            self.imports.append({
+                'name': full_name,
+                'self_ms': cumulative - children,
+                'cumulative_ms': cumulative,
+                'depth': len(self.stack)
+            })
+
+    def time_to_first_window(self) -> Optional[float]:
+        for phase, elapsed in self.phases:
+            if phase == 'first_window':
+                return elapsed
+        return None
+
+    def slowest_imports(self, count: int = 15, key: str = 'cumulative_ms') -> List[Dict[str, Any]]:
+        return sorted(self.imports, key=lambda item: item[key], reverse=True)[:count]
+
+    def report(self, budget_ms: Optional[float] = None, count: int = 15) -> str:
+        """生成启动耗时报告
+
+        :param budget_ms: 启动时间预算（毫秒），超出时在报告末尾标明
+        :param count: 列出的最慢导入数
+        """
+        lines = ["启动阶段:"]
+        previous = 0.0
+        for phase, elapsed in self.phases:
+            lines.append(f"  {phase:<20} {elapsed:9.1f}ms  (+{elapsed - previous:.1f}ms)")
+            previous = elapsed
+
+        if self.imports:
+            lines.append(f"\n最慢的导入（共 {len(self.imports)} 个模块）:")
+            lines.append(f"  {'自身(ms)':>10} | {'累计(ms)':>10} | 模块")
+            for item in self.slowest_imports(count):
+                lines.append(f"  {item['self_ms']:10.1f} | {item['cumulative_ms']:10.1f} | "
+                             f"{'  ' * item['depth']}{item['name']}")
+
+        first_window = self.time_to_first_window()
+        if first_window is not None and budget_ms is not None:
+            verdict = "未超出" if first_window <= budget_ms else "超出"
+            lines.append(f"\n首次显示窗口: {first_window:.1f}ms，预算 {budget_ms:.0f}ms，{verdict}预算")
+        return "\n".join(lines)
+
+    def within_budget(self, budget_ms: float) -> bool:
+        first_window = self.time_to_first_window()
+        return first_window is not None and first_window <= budget_ms
+
+
+# 创建全局实例
+startup_profile = StartupProfile()
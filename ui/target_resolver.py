@@ -0,0 +1,203 @@
+# -- coding: utf-8 --
+"""目标地址预解析模块
+
+在启动路由跟踪前自行解析目标域名的A/AAAA记录，并行探测各候选地址的延迟，
+按延迟排序后直接对最优IP发起跟踪，避免NextTrace的交互式IP选择
+"""
+
+import re
+import time
+import socket
+import platform
+import threading
+import subprocess
+from typing import List, Dict, Any, Optional
+
+from .network_utils import get_subprocess_kwargs
+from .task_executor import task_executor
+
+
+class TargetResolver:
+    """目标地址解析与延迟排序"""
+
+    def __init__(self, cache_ttl: int = 300, probe_timeout: float = 1.0, probe_ports=(443, 80)):
+        """初始化目标解析器
+
+        :param cache_ttl: 解析结果最长缓存时间（秒），实际取记录TTL与该值的较小者
+        :param probe_timeout: 单次探测超时时间（秒）
+        :param probe_ports: TCP探测使用的端口，按顺序尝试
+        """
+        self.cache_ttl = cache_ttl
+        self.probe_timeout = probe_timeout
+        self.probe_ports = tuple(probe_ports)
+        self.cache = {}
+        self.lock = threading.Lock()
+        self._resolver = None
+
+    @staticmethod
+    def is_ip_address(target: str) -> bool:
+        """检查目标是否已经是IPv4或IPv6地址"""
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                socket.inet_pton(family, target)
+                return True
+            except (socket.error, OSError, ValueError):
+                continue
+        return False
+
+    def _get_resolver(self):
+        """获取共享的DNS解析器，dnspython不可用时返回False"""
+        if self._resolver is None:
+            try:
+                import dns.resolver
+                resolver = dns.resolver.Resolver()
+                resolver.timeout = 2
+                resolver.lifetime = 3
+                self._resolver = resolver
+            except Exception:
+                self._resolver = False
+        return self._resolver
+
+    def _query(self, hostname: str, rdtype: str, use_system: bool = False):
+        """查询单一记录类型，返回(地址列表, TTL)
+
+        :param use_system: 使用系统解析器（可读取hosts文件），dnspython不可用时总是使用
+        """
+        resolver = self._get_resolver()
+        if resolver and not use_system:
+            try:
+                answer = resolver.resolve(hostname, rdtype)
+                return [str(r) for r in answer], answer.rrset.ttl
+            except Exception:
+                return [], self.cache_ttl
+
+        family = socket.AF_INET if rdtype == 'A' else socket.AF_INET6
+        try:
+            infos = socket.getaddrinfo(hostname, None, family, socket.SOCK_STREAM)
+        except socket.gaierror:
+            return [], self.cache_ttl
+        addresses = []
+        for info in infos:
+            if info[4][0] not in addresses:
+                addresses.append(info[4][0])
+        return addresses, self.cache_ttl
+
+    def resolve(self, hostname: str, include_ipv6: bool = True) -> List[Dict[str, str]]:
+        """解析目标域名的A和AAAA记录（带缓存）
+
+        :param hostname: 目标域名
+        :param include_ipv6: 是否包含IPv6地址
+        :return: 候选地址列表，每项为{'ip', 'type'}
+        """
+        hostname = hostname.strip().lower()
+        if self.is_ip_address(hostname):
+            return [{'ip': hostname, 'type': 'IPv6' if ':' in hostname else 'IPv4'}]
+
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(hostname)
+        if cached and cached['expires'] > now:
+            candidates = cached['candidates']
+        else:
+            a_future = task_executor.call('probe', self._query, hostname, 'A')
+            aaaa_future = task_executor.call('probe', self._query, hostname, 'AAAA')
+            ipv4, ttl4 = a_future.result()
+            ipv6, ttl6 = aaaa_future.result()
+            if not ipv4 and not ipv6:
+                # DNS无结果时回退到系统解析器，以支持hosts文件中的名称
+                ipv4, ttl4 = self._query(hostname, 'A', use_system=True)
+                ipv6, ttl6 = self._query(hostname, 'AAAA', use_system=True)
+            candidates = [{'ip': ip, 'type': 'IPv4'} for ip in ipv4] + [{'ip': ip, 'type': 'IPv6'} for ip in ipv6]
+            ttl = min(self.cache_ttl, ttl4 if ipv4 else self.cache_ttl, ttl6 if ipv6 else self.cache_ttl)
+            if candidates:
+                with self.lock:
+                    self.cache[hostname] = {'candidates': candidates, 'expires': now + max(ttl, 1)}
+
+        if not include_ipv6:
+            candidates = [c for c in candidates if c['type'] == 'IPv4']
+        return [dict(c) for c in candidates]
+
+    def _tcp_probe(self, ip: str) -> Optional[float]:
+        """TCP连接探测，返回握手耗时（毫秒）
+
+        连接被拒绝同样说明主机可达，RST的往返时间也计入
+        """
+        family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+        for port in self.probe_ports:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.probe_timeout)
+            start = time.perf_counter()
+            try:
+                sock.connect((ip, port))
+                return (time.perf_counter() - start) * 1000
+            except ConnectionRefusedError:
+                return (time.perf_counter() - start) * 1000
+            except OSError:
+                continue
+            finally:
+                sock.close()
+        return None
+
+    def _icmp_probe(self, ip: str) -> Optional[float]:
+        """ICMP探测（单个ping包），返回往返时间（毫秒）"""
+        system = platform.system().lower()
+        if system == 'windows':
+            cmd = ['ping', '-n', '1', '-w', str(int(self.probe_timeout * 1000)), ip]
+        elif system == 'darwin':
+            cmd = ['ping', '-n', '-c', '1', '-t', str(max(1, int(self.probe_timeout))), ip]
+        else:
+            cmd = ['ping', '-n', '-c', '1', '-W', str(max(1, int(self.probe_timeout))), ip]
+        if ':' in ip and system != 'windows':
+            cmd.insert(1, '-6')
+
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.probe_timeout + 2,
+                                    **get_subprocess_kwargs())
+        except Exception:
+            return None
+
+        match = re.search(r'(?:time|时间)\s*[=<]\s*([\d.]+)\s*ms', result.stdout)
+        return float(match.group(1)) if match else None
+
+    def probe(self, ip: str) -> Dict[str, Any]:
+        """探测单个候选地址，优先TCP，失败时回退ICMP
+
+        :return: {'rtt': 毫秒或None, 'method': 'tcp'/'icmp'/None}
+        """
+        rtt = self._tcp_probe(ip)
+        if rtt is not None:
+            return {'rtt': rtt, 'method': 'tcp'}
+        rtt = self._icmp_probe(ip)
+        if rtt is not None:
+            return {'rtt': rtt, 'method': 'icmp'}
+        return {'rtt': None, 'method': None}
+
+    def rank(self, hostname: str, include_ipv6: bool = True) -> List[Dict[str, Any]]:
+        """解析并并行探测所有候选地址，按延迟从低到高排序
+
+        无法探测到的地址排在最后，保持解析顺序
+
+        :return: 候选列表，每项为{'index', 'ip', 'type', 'rtt', 'method'}
+        """
+        candidates = self.resolve(hostname, include_ipv6)
+        if len(candidates) > 1:
+            futures = [task_executor.call('probe', self.probe, c['ip']) for c in candidates]
+            for candidate, future in zip(candidates, futures):
+                candidate.update(future.result())
+        for candidate in candidates:
+            candidate.setdefault('rtt', None)
+            candidate.setdefault('method', None)
+
+        candidates.sort(key=lambda c: (c['rtt'] is None, c['rtt'] or 0))
+        for index, candidate in enumerate(candidates):
+            candidate['index'] = index
+        return candidates
+
+    def best_address(self, hostname: str, include_ipv6: bool = True) -> Optional[str]:
+        """返回延迟最低的地址，无法解析时返回None"""
+        ranked = self.rank(hostname, include_ipv6)
+        return ranked[0]['ip'] if ranked else None
+
+
+# 创建全局实例
+target_resolver = TargetResolver()
@@ -0,0 +1,359 @@
+# -- coding: utf-8 --
+"""应用级任务执行器模块
+
+界面的后台工作不再各自创建threading.Thread，而是提交到按工作负载分类的有界工作池：
+    - trace：路由跟踪、Ping和目标地址探测
+    - dns：DNS测试、批量测试、服务器比较和访问时延测试
+    - geoip：地理位置和PTR查询
+    - render：地图可视化等生成工作
+    - probe：其他任务内部并发发起的短时探测（比较测试的访问时延和缓存测量、目标地址的解析和探测），
+      这类子任务自身不再等待其他任务，上层任务在自己的工作池中等待它们不会因嵌套占满同一工作池而死锁
+    - query：批量测试和监控调度的DNS查询工作者，同样是只执行查询、不等待其他任务的叶子任务
+每类工作池的线程数有上限，线程按需创建，超出的任务排队等待，线程数不会随任务数膨胀。
+
+每个任务带一个CancellationToken：
+    - 取消时执行注册的清理回调（终止子进程、关闭套接字），阻塞中的任务因此尽快返回
+    - 任务函数通过token.cancelled检查取消，用token.wait代替time.sleep实现可中断的等待
+    - 任务可以报告进度(已完成数, 总数, 说明)
+关闭时取消全部任务，并在限定时间内等待正在执行的任务结束；工作线程是守护线程，
+超时仍未结束的任务不会阻止进程正常退出，因此不需要os._exit
+"""
+
+import time
+import queue
+import threading
+import itertools
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# 各类工作池的默认线程数上限
+DEFAULT_POOL_SIZES = {
+    'trace': 4,
+    'dns': 4,
+    'geoip': 5,
+    'render': 2,
+    'probe': 8,
+    'query': 32
+}
+
+
+class TaskCancelled(Exception):
+    """任务已取消"""
+
+
+class CancellationToken:
+    """取消令牌：可在任意线程中检查和取消，取消时执行注册的清理回调"""
+
+    def __init__(self, parent: Optional['CancellationToken'] = None):
+        """
+        :param parent: 父令牌，父令牌取消时本令牌随之取消
+        """
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._ids = itertools.count()
+        self.reason = None
+        if parent is not None:
+            parent.register(lambda: self.cancel(parent.reason))
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: Optional[str] = None):
+        """取消并执行全部清理回调（重复调用无效）"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    @staticmethod
+    def _run_callback(callback: Callable[[], Any]):
+        try:
+            callback()
+        except Exception as e:
+            logger.debug("取消回调出错: %s", e)
+
+    def register(self, callback: Callable[[], Any]) -> Optional[int]:
+        """注册取消时执行的回调，已取消时立即执行
+
+        :return: 用于unregister的编号，已取消时返回None
+        """
+        with self._lock:
+            if not self._event.is_set():
+                handle = next(self._ids)
+                self._callbacks[handle] = callback
+                return handle
+        self._run_callback(callback)
+        return None
+
+    def unregister(self, handle: Optional[int]):
+        """注销回调（资源已正常释放时调用）"""
+        if handle is not None:
+            with self._lock:
+                self._callbacks.pop(handle, None)
+
+    def attach_process(self, process) -> Optional[int]:
+        """取消时终止子进程"""
+        def terminate():
+            if process.poll() is None:
+                process.terminate()
+        return self.register(terminate)
+
+    def attach_socket(self, sock) -> Optional[int]:
+        """取消时关闭套接字，阻塞在该套接字上的调用会立即出错返回"""
+        return self.register(sock.close)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待取消或超时（可中断的sleep）
+
+        :return: 已取消时返回True
+        """
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TaskCancelled(self.reason or "任务已取消")
+
+    def child(self) -> 'CancellationToken':
+        """创建子令牌，可单独取消，也随本令牌取消"""
+        return CancellationToken(self)
+
+
+class Task:
+    """提交到执行器的任务"""
+
+    def __init__(self, kind: str, name: str, token: CancellationToken):
+        self.kind = kind
+        self.name = name
+        self.token = token
+        self.future = Future()
+        self.progress = (0, None, None)     # (已完成数, 总数, 说明)
+        self.on_progress = None             # 进度回调，在任务线程中以(task, done, total, text)调用
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.token.cancelled
+
+    def cancel(self, reason: Optional[str] = None):
+        """取消任务：排队中的任务不再执行，执行中的任务通过令牌得知取消"""
+        self.token.cancel(reason)
+        self.future.cancel()
+
+    def report_progress(self, done: int, total: Optional[int] = None, text: Optional[str] = None):
+        """报告进度（在任务线程中调用）"""
+        self.progress = (done, total, text)
+        callback = self.on_progress
+        if callback:
+            callback(self, done, total, text)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        return self.future.result(timeout)
+
+    def __repr__(self) -> str:
+        state = 'done' if self.done() else 'running' if self.started else 'queued'
+        return f"<Task {self.kind}/{self.name} {state}>"
+
+
+class WorkerPool:
+    """线程数有上限、按需创建守护线程的工作池"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.queue = queue.SimpleQueue()
+        self.threads = []
+        self.idle = 0
+        self.pending = 0        # 已入队、尚未被工作线程取走的任务数
+        self.completed = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def submit(self, task: Task, func: Callable, args: tuple, kwargs: dict):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError(f"工作池 {self.name} 已关闭")
+            self.queue.put((task, func, args, kwargs))
+            self.pending += 1
+            # 排队任务多于空闲线程时补充线程，连续提交的任务不会都排在同一个空闲线程后面
+            if self.pending > self.idle and len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker, daemon=True,
+                                          name=f"{self.name}-{len(self.threads) + 1}")
+                self.threads.append(thread)
+                thread.start()
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+            item = self.queue.get()
+            with self.lock:
+                self.idle -= 1
+                if item is not None:
+                    self.pending -= 1
+            if item is None:
+                return
+            self._run(*item)
+
+    def _run(self, task: Task, func: Callable, args: tuple, kwargs: dict):
+        # 排队期间已取消的任务不再执行
+        if not task.future.set_running_or_notify_cancel():
+            return
+        task.started = time.monotonic()
+        try:
+            result = func(task, *args, **kwargs)
+        except BaseException as e:
+            if not isinstance(e, TaskCancelled):
+                logger.error("任务 %s 出错: %s", task.name, e)
+            task.future.set_exception(e)
+        else:
+            task.future.set_result(result)
+        finally:
+            task.finished = time.monotonic()
+            with self.lock:
+                self.completed += 1
+
+    def shutdown(self):
+        """不再接受新任务，取消排队中的任务，工作线程执行完当前任务后退出"""
+        with self.lock:
+            self.closed = True
+            thread_count = len(self.threads)
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                with self.lock:
+                    self.pending -= 1
+                item[0].cancel("工作池已关闭")
+        for _ in range(thread_count):
+            self.queue.put(None)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'max_workers': self.max_workers,
+                'threads': len(self.threads),
+                'idle': self.idle,
+                'queued': self.pending,
+                'completed': self.completed
+            }
+
+
+class TaskExecutor:
+    """按工作负载分类的应用级任务执行器"""
+
+    def __init__(self, pool_sizes: Optional[Dict[str, int]] = None):
+        """
+        :param pool_sizes: 各类工作池的线程数上限，未指定的类别使用DEFAULT_POOL_SIZES
+        """
+        sizes = dict(DEFAULT_POOL_SIZES, **(pool_sizes or {}))
+        self.pools = {kind: WorkerPool(kind, size) for kind, size in sizes.items()}
+        self.tasks = set()
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def submit(self, kind: str, func: Callable, *args, name: Optional[str] = None,
+               token: Optional[CancellationToken] = None,
+               on_done: Optional[Callable[[Task], None]] = None, **kwargs) -> Task:
+        """提交任务
+
+        :param kind: 工作负载类别（trace/dns/geoip/render/probe/query）
+        :param func: 任务函数，以func(task, *args, **kwargs)调用，通过task.token检查取消
+        :param name: 任务名（用于日志和诊断），默认为函数名
+        :param token: 取消令牌，默认新建
+        :param on_done: 任务结束（完成、出错或取消）后在工作线程中调用
+        :return: Task
+        """
+        pool = self.pools.get(kind)
+        if pool is None:
+            raise ValueError(f"未知的任务类别: {kind}")
+        task = Task(kind, name or getattr(func, '__name__', 'task'), token or CancellationToken())
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("任务执行器已关闭")
+            self.tasks.add(task)
+        try:
+            pool.submit(task, func, args, kwargs)
+        except RuntimeError:
+            # 工作池已关闭（执行器正在关闭），任务不会执行，不能留在任务集合中
+            self._forget(task)
+            raise
+        task.future.add_done_callback(lambda _: self._forget(task))
+        if on_done:
+            task.future.add_done_callback(lambda _: on_done(task))
+        return task
+
+    def call(self, kind: str, func: Callable, *args, **kwargs) -> Future:
+        """提交不需要令牌的普通函数，以func(*args, **kwargs)调用，用法同ThreadPoolExecutor.submit"""
+        return self.submit(kind, lambda task: func(*args, **kwargs),
+                           name=getattr(func, '__name__', None)).future
+
+    def _forget(self, task: Task):
+        with self.lock:
+            self.tasks.discard(task)
+
+    def active(self, kind: Optional[str] = None) -> List[Task]:
+        """排队中和执行中的任务"""
+        with self.lock:
+            return [task for task in self.tasks if kind is None or task.kind == kind]
+
+    def cancel_all(self, kind: Optional[str] = None, reason: Optional[str] = None):
+        for task in self.active(kind):
+            task.cancel(reason)
+
+    def shutdown(self, timeout: float = 5.0) -> List[Task]:
+        """取消全部任务，等待执行中的任务结束
+
+        :param timeout: 最长等待时间（秒）
+        :return: 超时仍未结束的任务
+        """
+        with self.lock:
+            self.closed = True
+            tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel("程序关闭")
+        for pool in self.pools.values():
+            pool.shutdown()
+        wait([task.future for task in tasks], timeout=timeout)
+        remaining = [task for task in tasks if not task.done()]
+        if remaining:
+            logger.warning("关闭时仍有 %d 个任务未结束: %s", len(remaining), remaining)
+        return remaining
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """各类工作池的状态"""
+        active = self.active()
+        stats = {}
+        for kind, pool in self.pools.items():
+            stats[kind] = pool.stats()
+            stats[kind]['active'] = sum(1 for task in active if task.kind == kind)
+        return stats
+
+    def format_stats(self) -> str:
+        """格式化状态，用于诊断输出"""
+        lines = ["任务执行器:"]
+        for kind, stats in self.stats().items():
+            lines.append(f"  {kind:<7} 线程 {stats['threads']}/{stats['max_workers']}, 空闲 {stats['idle']}, "
+                         f"排队 {stats['queued']}, 未结束任务 {stats['active']}, 已完成 {stats['completed']}")
+        return "\n".join(lines)
+
+
+# 创建全局实例
+task_executor = TaskExecutor()
@@ -8,6 +8,9 @@ import os
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 from .config import TraceMapConfig
+from ..log_utils import get_logger
+
+logger = get_logger(__name__)
 
 
 class TemplateRenderer:
@@ -134,7 +137,7 @@ class TemplateRenderer:
                 with open(template_path, 'r', encoding='utf-8') as f:
                     return f.read()
             except Exception as e:
-                print(f"加载模板文件失败: {e}，使用默认模板")
+                logger.warning("加载模板文件失败: %s，使用默认模板", e)
         
         return self._default_template
     
@@ -9,6 +9,10 @@ import webbrowser
 from typing import List, Tuple, Any
 from .svg_generator import SVGTraceMapGenerator
 from .config import TraceMapConfig
+from ..coordinate_resolver import coordinate_resolver
+from ..log_utils import get_logger
+
+logger = get_logger(__name__)
 
 
 def convert_traceroute_data_for_tracemap(trace_data: List[Tuple[Any]]) -> List[List[Any]]:
@@ -20,6 +24,7 @@ def convert_traceroute_data_for_tracemap(trace_data: List[Tuple[Any]]) -> List[L
     :return: traceMap需要的经纬度信息列表，格式为[[lat, lng, city, owner, asnumber, ip, whois, ttl, rtt, hostname], ...]
     """
     result = []
+    path = []   # 与result对应的(ip, 位置)，所有跳点收集后统一解析坐标
     
     # 处理每个路由跳点
     for idx, item in enumerate(trace_data):
@@ -51,22 +56,14 @@ def convert_traceroute_data_for_tracemap(trace_data: List[Tuple[Any]]) -> List[L
                     city = location[:isp_start-1].strip()
                     owner = isp
         except Exception as e:
-            print(f"处理路由节点时出错: {e}")
+            logger.warning("处理路由节点时出错: %s", e)
             continue
         
-        # 简单的经纬度估算（实际应用中应该使用更准确的地理位置数据库）
-        # 从ip地址生成一些伪随机但固定的经纬度
-        lat = 30.0 + (hash(ip) % 20) - 10  # 大致范围在20-40度之间
-        lng = 100.0 + (hash(ip) % 60) - 30  # 大致范围在70-130度之间
-        
-        # 确保经纬度在有效范围内
-        lat = max(-90, min(90, lat))
-        lng = max(-180, min(180, lng))
-        
-        # 添加到结果列表
+        # 添加到结果列表，经纬度在所有跳点收集后填入
+        path.append((ip, city))
         result.append([
-            lat,                      # 纬度
-            lng,                      # 经度
+            None,                     # 纬度
+            None,                     # 经度
             city,                     # 城市
             owner,                    # 所有者
             "",                       # AS号（如果有）
@@ -77,6 +74,12 @@ def convert_traceroute_data_for_tracemap(trace_data: List[Tuple[Any]]) -> List[L
             ""                        # 主机名
         ])
     
+    # 从地理位置缓存和地名索引解析整条路径的坐标，无法定位的跳点（如内网地址）锚定到相邻的已定位跳点
+    for row, (lat, lng) in zip(result, coordinate_resolver.resolve_path(path)):
+        # 确保经纬度在有效范围内
+        row[0] = max(-90, min(90, lat))
+        row[1] = max(-180, min(180, lng))
+    
     return result
 
 def generate_tracemap(trace_data: List[Tuple[Any]], hostname: str, output_dir: str = None, config: TraceMapConfig = None) -> str:
@@ -112,7 +115,7 @@ def generate_tracemap(trace_data: List[Tuple[Any]], hostname: str, output_dir: s
     generator = SVGTraceMapGenerator(config)
     html_path = generator.generate(converted_data, hostname)
     
-    print(f"traceMap已生成: {html_path}")
+    logger.info("traceMap已生成: %s", html_path)
     return html_path
 
 def generate_and_open_tracemap(trace_data: List[Tuple[Any]], hostname: str, output_dir: str = None, config: TraceMapConfig = None) -> str:
@@ -132,7 +135,7 @@ def generate_and_open_tracemap(trace_data: List[Tuple[Any]], hostname: str, outp
     try:
         webbrowser.open(f"file://{os.path.abspath(html_path)}")
     except Exception as e:
-        print(f"无法在浏览器中打开地图: {str(e)}")
+        logger.warning("无法在浏览器中打开地图: %s", e)
     
     return html_path
 
@@ -12,6 +12,11 @@ from pathlib import Path
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(base_dir)
 
+from ui.coordinate_resolver import coordinate_resolver
+from ui.log_utils import get_logger
+
+logger = get_logger(__name__)
+
 # 简单检查tracemap目录是否存在
 # tracemap目录在ui目录下
 tracemap_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracemap')
@@ -22,11 +27,11 @@ try:
     if TRACEMAP_AVAILABLE:
         # 导入必要的函数（这里暂时用模拟函数，后续根据实际需要修改）
         # 实际使用时需要导入tracemap模块中的draw函数
-        print("traceMap模块准备就绪")
+        logger.debug("traceMap模块准备就绪")
     else:
-        print(f"tracemap模块不可用，目录不存在或缺少必要文件: {tracemap_dir}")
+        logger.warning("tracemap模块不可用，目录不存在或缺少必要文件: %s", tracemap_dir)
 except Exception as e:
-    print(f"初始化traceMap模块时出错: {e}")
+    logger.warning("初始化traceMap模块时出错: %s", e)
     TRACEMAP_AVAILABLE = False
 
 
@@ -40,6 +45,7 @@ def convert_traceroute_data_for_tracemap(trace_data):
     :return: traceMap需要的经纬度信息列表，格式为[[lat, lng, city, owner, asnumber, ip, whois, ttl, rtt, hostname], ...]
     """
     result = []
+    path = []   # 与result对应的(ip, 位置, 地理信息)，所有跳点收集后统一解析坐标
     
     # 确保目录存在
     output_dir = Path('./html')
@@ -60,7 +66,7 @@ def convert_traceroute_data_for_tracemap(trace_data):
                 # 检查是否是NextTrace格式（包含经纬度信息）
                 if len(item) >= 6 and isinstance(item[5], (tuple, list)) and len(item[5]) >= 2:
                     # 使用NextTrace提供的经纬度信息
-                    lat, lng = item[5]
+                    geo = {'lat': item[5][0], 'lng': item[5][1]}
                     # 设置城市信息 - 从location字段获取，或者设置默认值
                     city = location if location else "未知城市"
                     # 如果有ISP信息
@@ -80,14 +86,8 @@ def convert_traceroute_data_for_tracemap(trace_data):
                             isp = location[isp_start:isp_end]
                             city = location[:isp_start-1].strip()
                     
-                    # 简单的经纬度估算（当没有NextTrace经纬度信息时使用）
-                    # 从ip地址生成一些伪随机但固定的经纬度
-                    lat = 30.0 + (hash(ip) % 20) - 10  # 大致范围在20-40度之间
-                    lng = 100.0 + (hash(ip) % 60) - 30  # 大致范围在70-130度之间
-                    
-                    # 确保经纬度在有效范围内
-                    lat = max(-90, min(90, lat))
-                    lng = max(-180, min(180, lng))
+                    # 没有NextTrace经纬度信息时，从地理位置缓存和地名索引解析
+                    geo = None
             else:
                 continue
             
@@ -97,13 +97,14 @@ def convert_traceroute_data_for_tracemap(trace_data):
             # 设置所有者为ISP
             owner = isp
         except Exception as e:
-            print(f"处理路由节点时出错: {e}")
+            logger.warning("处理路由节点时出错: %s", e)
             continue
         
-        # 添加到结果列表
+        # 添加到结果列表，经纬度在所有跳点收集后填入
+        path.append((ip, city, geo))
         result.append([
-            lat,                      # 纬度
-            lng,                      # 经度
+            None,                     # 纬度
+            None,                     # 经度
             city,                     # 城市
             owner,                    # 所有者
             "",                       # AS号（如果有）
@@ -114,6 +115,12 @@ def convert_traceroute_data_for_tracemap(trace_data):
             ""                        # 主机名
         ])
     
+    # 统一解析整条路径的坐标，无法定位的跳点（如内网地址）锚定到相邻的已定位跳点
+    for row, (lat, lng) in zip(result, coordinate_resolver.resolve_path(path)):
+        # 确保经纬度在有效范围内
+        row[0] = max(-90, min(90, lat))
+        row[1] = max(-180, min(180, lng))
+    
     return result
 
 
@@ -153,7 +160,7 @@ def generate_tracemap(trace_data, hostname, output_dir=None):
     # 生成模拟的HTML文件（不依赖tracemap模块）
     try:
         generate_mock_tracemap_html(converted_data, hostname, html_path)
-        print(f"模拟traceMap HTML已生成: {html_path}")
+        logger.info("模拟traceMap HTML已生成: %s", html_path)
         return html_path
     except Exception as e:
         raise RuntimeError(f"生成traceMap失败: {str(e)}")
@@ -345,7 +352,7 @@ def generate_and_open_tracemap(trace_data, hostname):
     try:
         webbrowser.open(f"file://{os.path.abspath(html_path)}")
     except Exception as e:
-        print(f"无法在浏览器中打开地图: {str(e)}")
+        logger.warning("无法在浏览器中打开地图: %s", e)
     
     return html_path
 
@@ -0,0 +1,154 @@
+# -- coding: utf-8 --
+"""界面更新队列模块
+
+工作线程产生的结果不再各自通过root.after(0, ...)投递到Tk事件队列，而是放入本队列，
+由界面线程中的一个定时泵以固定帧率（默认30帧/秒）统一取出执行：
+    - post：按顺序执行的更新（插入结果行等），入队只是一次deque追加，生产者从不阻塞，也不接触Tk
+    - post_latest：可合并的更新（进度、状态标签、滚动到最新行、重绘图表等），同一键在一帧内只执行最后一次
+    - 每帧的执行时间有预算，超出时剩余的更新留到下一帧，界面在结果洪峰期间仍能响应
+    - 记录每个更新从入队到执行的延迟（界面延迟）和每帧耗时，用于诊断
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Hashable
+
+from .latency_histogram import LatencyHistogram, format_percentiles
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class UIUpdateQueue:
+    """由界面线程定时批量执行的线程安全更新队列"""
+
+    def __init__(self, root, fps: int = 30, frame_budget: float = 0.5):
+        """初始化队列
+
+        :param root: Tk根窗口
+        :param fps: 每秒执行的帧数
+        :param frame_budget: 每帧最多占用帧间隔的比例，超出后剩余更新留到下一帧
+        """
+        self.root = root
+        self.interval_ms = max(1, int(1000 / max(1, fps)))
+        self.budget = self.interval_ms * frame_budget / 1000
+        self.queue = deque()
+        self.latest = {}        # 键 -> (首次入队时间, 函数, 参数)
+        self.lock = threading.Lock()
+        self.after_id = None
+        self.running = False
+
+        # 统计
+        self.lag = LatencyHistogram()
+        self.frame_times = LatencyHistogram()
+        self.applied = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_pending = 0
+
+    def post(self, func: Callable, *args: Any):
+        """投递一个按顺序执行的更新（可在任意线程中调用）"""
+        self.queue.append((time.perf_counter(), func, args))
+
+    def post_latest(self, key: Hashable, func: Callable, *args: Any):
+        """投递一个可合并的更新：执行前同一键的新更新替换旧更新（可在任意线程中调用）
+
+        界面延迟从该键首次入队时算起，避免持续替换掩盖真实延迟
+        """
+        with self.lock:
+            previous = self.latest.get(key)
+            if previous is not None:
+                self.coalesced += 1
+            enqueued = previous[0] if previous is not None else time.perf_counter()
+            self.latest[key] = (enqueued, func, args)
+
+    def start(self):
+        """开始定时执行（在界面线程中调用）"""
+        if self.running:
+            return
+        self.running = True
+        self.after_id = self.root.after(self.interval_ms, self._pump)
+
+    def stop(self):
+        """停止执行并丢弃未执行的更新"""
+        self.running = False
+        if self.after_id is not None:
+            try:
+                self.root.after_cancel(self.after_id)
+            except Exception:
+                pass
+            self.after_id = None
+        self.queue.clear()
+        with self.lock:
+            self.latest.clear()
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.queue) + len(self.latest)
+
+    def _apply(self, enqueued: float, func: Callable, args: tuple):
+        try:
+            func(*args)
+        except Exception as e:
+            # 单个更新失败（如控件已销毁）不影响后续更新
+            self.errors += 1
+            logger.warning("界面更新失败: %s", e)
+        self.applied += 1
+        self.lag.record((time.perf_counter() - enqueued) * 1000)
+
+    def _pump(self):
+        """执行一帧：先按顺序执行队列中的更新，再执行合并后的更新"""
+        self.after_id = None
+        if not self.running:
+            return
+        start = time.perf_counter()
+        deadline = start + self.budget
+        self.max_pending = max(self.max_pending, len(self.queue))
+
+        while self.queue:
+            self._apply(*self.queue.popleft())
+            if time.perf_counter() >= deadline:
+                break
+
+        # 合并的更新放在最后执行，可以引用本帧刚插入的行
+        with self.lock:
+            latest, self.latest = self.latest, {}
+        for enqueued, func, args in latest.values():
+            self._apply(enqueued, func, args)
+
+        self.frame_times.record((time.perf_counter() - start) * 1000)
+        if self.running:
+            self.after_id = self.root.after(self.interval_ms, self._pump)
+
+    def stats(self) -> Dict[str, Any]:
+        """统计信息
+
+        :return: {'pending', 'max_pending', 'applied', 'coalesced', 'errors', 'frames',
+                  'lag'（界面延迟摘要）, 'frame'（每帧耗时摘要）}
+        """
+        return {
+            'pending': self.pending(),
+            'max_pending': self.max_pending,
+            'applied': self.applied,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'frames': self.frame_times.count,
+            'lag': self.lag.summary(),
+            'frame': self.frame_times.summary()
+        }
+
+    def format_stats(self) -> str:
+        """格式化统计信息，用于诊断输出"""
+        stats = self.stats()
+        lines = [
+            f"界面更新队列: {1000 // self.interval_ms}帧/秒, 已执行 {stats['applied']} 个更新, "
+            f"合并 {stats['coalesced']} 个, 失败 {stats['errors']} 个, "
+            f"待执行 {stats['pending']} 个 (峰值 {stats['max_pending']})"
+        ]
+        if self.lag.count:
+            lines.append(f"界面延迟: {format_percentiles(self.lag, (50, 90, 99))}, 最大 {self.lag.max:.2f}ms")
+        if self.frame_times.count:
+            lines.append(f"每帧耗时: {format_percentiles(self.frame_times, (50, 99))}, "
+                         f"最大 {self.frame_times.max:.2f}ms, 共 {stats['frames']} 帧")
+        return "\n".join(lines)